@@ -22,27 +22,17 @@
 
 import os
 import sys
+from wsgiref.handlers import CGIHandler
 
 
-def http_write(sOut):
-   bytesOut = bytes(sOut, encoding = 'utf-8')
-   sHeader = 'Content-Type: text/plain; charset=utf-8\r\nContent-Length: {}\r\n\r\n'.format(
-      len(bytesOut)
-   )
-   sys.stdout.buffer.write(bytes(sHeader, encoding = 'utf-8'))
-   sys.stdout.buffer.write(bytesOut)
-
-s = ''
-
-s += 'Environment:\r\n'
-s += '\r\n'.join(['{}={}'.format(sName, sValue) for sName, sValue in os.environ.items()])
-s += '\r\n\r\n'
-s += 'stdin:\r\n'
-s += sys.stdin.read()
-
-
-sys.path.append(os.path.abspath(os.environ['QUEARL_REL_PATH']))
+# This script is only a compatibility shim for web servers that can only run Quearl as a CGI; see
+# quearl/bin/quearl_server.py for a much faster, long-running alternative.
+sQuearlBinDir = os.path.abspath(os.environ['QUEARL_REL_PATH'])
+sys.path.append(sQuearlBinDir)
 from modules.quearl.core import Application
 
-http_write(s)
-
+app = Application.Application(os.path.normpath(os.path.join(sQuearlBinDir, '..')))
+try:
+   CGIHandler().run(app)
+finally:
+   app.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Helpers shared by the benchmark scripts."""
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+
+# Directory containing the Quearl maintenance scripts, i.e. the parent of this script’s directory.
+BIN_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Quearl installation subdirectory.
+QUEARL_DIR = os.path.normpath(os.path.join(BIN_DIR, '..'))
+
+# Make quearl_inst and the Quearl Python modules importable.
+if BIN_DIR not in sys.path:
+	sys.path.append(BIN_DIR)
+
+
+
+####################################################################################################
+# TempInstallation
+
+class TempInstallation(object):
+	"""Scratch Quearl installation, sharing code and modules with the real one but with its own
+	configuration and data directories, so that benchmarks never touch the real installation’s data.
+	Use as a context manager.
+	"""
+
+	def __init__(self, dictConf = None):
+		"""Constructor.
+
+		[dict(str: object) dictConf]
+			Bootstrap configuration entries to override.
+		"""
+
+		self._m_dictConf = dictConf or {}
+		self._m_sRootDir = None
+
+
+	def __enter__(self):
+		self._m_sRootDir = tempfile.mkdtemp(prefix = 'quearl-bench-')
+		# Share code with the real installation.
+		for sName in 'bin', 'module':
+			os.symlink(os.path.join(QUEARL_DIR, sName), os.path.join(self._m_sRootDir, sName))
+		# Use the real bootstrap configuration if available, or the example otherwise.
+		os.makedirs(os.path.join(self._m_sRootDir, 'config', 'core'))
+		sConfFileName = os.path.join(QUEARL_DIR, 'config', 'core', 'bootstrap.conf')
+		if not os.path.isfile(sConfFileName):
+			sConfFileName += '.example'
+		with open(sConfFileName, 'r', encoding = 'utf-8') as fileConf:
+			sConf = fileConf.read()
+		for sName, oValue in self._m_dictConf.items():
+			# Remove any existing entry, then append the new one.
+			sConf = re.sub(r'^' + re.escape(sName) + r':.*$\n?', '', sConf, flags = re.MULTILINE)
+			sConf += '\n{}: {}\n'.format(sName, oValue)
+		with open(
+			os.path.join(self._m_sRootDir, 'config', 'core', 'bootstrap.conf'), 'w', encoding = 'utf-8'
+		) as fileConf:
+			fileConf.write(sConf)
+		for sName in 'data.ro', 'data.rw/core/log':
+			os.makedirs(os.path.join(self._m_sRootDir, sName))
+		return self
+
+
+	def __exit__(self, excType, exc, tb):
+		shutil.rmtree(self._m_sRootDir)
+		return False
+
+
+	def root_dir(self):
+		"""Returns the root directory of the scratch installation.
+
+		str return
+			Directory.
+		"""
+
+		return self._m_sRootDir
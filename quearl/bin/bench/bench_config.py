@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Measures the cost of reading application data from the shared configuration snapshot, compared
+with parsing the configuration file again and with QlApplication’s lock-and-reload cycle; then
+measures reads/second with many processes reading while new generations are being published.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+import zlib
+
+import bench_common
+from modules.quearl.core import Application
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats, cCalls):
+	"""Returns the best time taken by a function call over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	int cCalls
+		Number of calls to fn in each run.
+	float return
+		Best time per call, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		for j in range(cCalls):
+			fn()
+		fElapsed = (time.perf_counter() - fStart) / cCalls
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+def lock_and_reload(sFileName, sLockFileName):
+	"""Emulates QlApplication::lock() followed by QlApplication::unlock() with no changes: takes the
+	lock, reads and deserializes the application data, and checks its CRC.
+
+	str sFileName
+		Path to the serialized application data.
+	str sLockFileName
+		Path to the lock file.
+	dict(str: object) return
+		Application data.
+	"""
+
+	with open(sLockFileName, 'a') as fileLock:
+		fcntl.flock(fileLock, fcntl.LOCK_EX)
+		with open(sFileName, 'rb') as fileApp:
+			bytesApp = fileApp.read()
+		dictApp = json.loads(bytesApp.decode('utf-8'))
+		zlib.crc32(bytesApp)
+		fcntl.flock(fileLock, fcntl.LOCK_UN)
+	return dictApp
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument('--processes', type = int, default = 8, help = 'Reader processes')
+	argparser.add_argument(
+		'--duration', type = float, default = 2.0, help = 'Seconds the readers run for'
+	)
+	argparser.add_argument(
+		'--publish-interval', type = float, default = 0.01,
+		help = 'Seconds between generations published while the readers run'
+	)
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		app = Application.Application(tmpinst.root_dir())
+		sRWDataDir = os.path.join(tmpinst.root_dir(), 'data.rw', 'core')
+		# Serialized application data, as QlApplication would store it in app.dat.
+		sAppFileName = os.path.join(sRWDataDir, 'app.dat')
+		with open(sAppFileName, 'w', encoding = 'utf-8') as fileApp:
+			json.dump({'core': dict(app.section('core'))}, fileApp)
+
+		for sMode, fn, cCalls in (
+			('Parse bootstrap.conf', lambda: app.load_section(
+				'core', app.bootstrap_conf_file_name()
+			)['default_locale'], 2000),
+			('Lock and reload', lambda: lock_and_reload(
+				sAppFileName, sAppFileName + '.lock'
+			)['core']['default_locale'], 2000),
+			('Shared snapshot', lambda: app.section('core')['default_locale'], 200000),
+		):
+			sys.stdout.write('{:22} {:10.3f} µs/read\n'.format(
+				sMode + ':', best_time(fn, args.repeat, cCalls) * 1000000
+			))
+
+		# Concurrent readers, while this process publishes new generations. The “done” pipe is closed
+		# when publishing is over.
+		iReadFd, iWriteFd = os.pipe()
+		iDoneReadFd, iDoneWriteFd = os.pipe()
+		listPids = []
+		for iProcess in range(args.processes):
+			iPid = os.fork()
+			if iPid == 0:
+				os.close(iReadFd)
+				os.close(iDoneWriteFd)
+				appReader = Application.Application(tmpinst.root_dir())
+				cReads = 0
+				fEnd = time.perf_counter() + args.duration
+				while time.perf_counter() < fEnd:
+					for i in range(1000):
+						appReader.section('core')['default_locale']
+					cReads += 1000
+				# Wait for the last generation to be published, then report what this process sees.
+				os.read(iDoneReadFd, 1)
+				os.write(iWriteFd, '{} {}\n'.format(
+					cReads, appReader.section('bench')['counter']
+				).encode('ascii'))
+				appReader.close()
+				os._exit(0)
+			listPids.append(iPid)
+		os.close(iWriteFd)
+		os.close(iDoneReadFd)
+		cPublished = 0
+		fEnd = time.perf_counter() + args.duration
+		while time.perf_counter() < fEnd:
+			app.publish_section('bench', {'counter': cPublished})
+			cPublished += 1
+			time.sleep(args.publish_interval)
+		os.close(iDoneWriteFd)
+		for iPid in listPids:
+			os.waitpid(iPid, 0)
+		with os.fdopen(iReadFd, 'r') as fileResults:
+			listResults = [tuple(map(int, sLine.split())) for sLine in fileResults]
+		app.close()
+
+	cReads = sum(cReads for cReads, iCounter in listResults)
+	sys.stdout.write('{} processes: {:.0f} reads/s while publishing {} generations\n'.format(
+		args.processes, cReads / args.duration, cPublished
+	))
+	if any(iCounter != cPublished - 1 for cReads, iCounter in listResults):
+		raise Exception('Some readers did not see the last generation')
+
+	sys.exit(0)
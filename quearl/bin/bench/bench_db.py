@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Compares the database access pattern of QlDb (a new connection for every request, and queries
+built by escaping values into the SQL) with Db.ConnectionPool and parameterized queries using
+prepared statements, on the SQLite stand-in driver: first the cost of a whole request, then the
+latency of a single query.
+"""
+
+import argparse
+import itertools
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Module
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats, cCalls):
+	"""Returns the best time taken by a function call over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	int cCalls
+		Number of calls to fn in each run.
+	float return
+		Best time per call, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		for j in range(cCalls):
+			fn()
+		fElapsed = (time.perf_counter() - fStart) / cCalls
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+def sql_encode(o):
+	"""Encodes a value as an SQL literal, like QlDb::sql_encode().
+
+	object o
+		Value to encode.
+	str return
+		SQL literal.
+	"""
+
+	if o is None:
+		return 'NULL'
+	elif isinstance(o, int):
+		return str(o)
+	else:
+		return '\'' + str(o).replace('\'', '\'\'') + '\''
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument('--users', type = int, default = 10000, help = 'Rows in the test table')
+	argparser.add_argument(
+		'--queries', type = int, default = 5, help = 'Queries run by each request'
+	)
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		app = Application.Application(tmpinst.root_dir())
+		pool = app.db()
+		with pool.connection() as db:
+			db.execute('''
+				CREATE TABLE users (
+					id     INTEGER PRIMARY KEY,
+					name   TEXT NOT NULL UNIQUE,
+					email  TEXT NOT NULL,
+					acclvl INTEGER NOT NULL
+				)
+			''')
+			db.begin_transaction()
+			for i in range(args.users):
+				db.execute(
+					'INSERT INTO users (name, email, acclvl) VALUES (?, ?, ?)',
+					('user{}'.format(i), 'user{}@example.com'.format(i), i % 4)
+				)
+			db.end_transaction()
+		# Driver used to connect without the pool, as QlDb does.
+		driver = Module.load_class(app.section('core')['database_driver'])(app)
+		# Names looked up by the queries, cycled through so that consecutive queries have different
+		# values.
+		iterNames = itertools.cycle(
+			'user{}'.format((i * 7919) % args.users) for i in range(args.users)
+		)
+
+		def ql_request():
+			conn = driver.connect()
+			for i in range(args.queries):
+				conn.execute(
+					'SELECT id, email, acclvl FROM users WHERE name = ' + sql_encode(next(iterNames))
+				).fetchall()
+			driver.close(conn)
+
+		def pooled_encoded_request():
+			with pool.connection() as db:
+				for i in range(args.queries):
+					db.query_row(
+						'SELECT id, email, acclvl FROM users WHERE name = ' + sql_encode(next(iterNames))
+					)
+
+		def pooled_request():
+			with pool.connection() as db:
+				for i in range(args.queries):
+					db.query_row(
+						'SELECT id, email, acclvl FROM users WHERE name = ?', (next(iterNames), )
+					)
+
+		for sMode, fn in (
+			('New connection, encoded', ql_request),
+			('Pooled, encoded', pooled_encoded_request),
+			('Pooled, parameterized', pooled_request),
+		):
+			fElapsed = best_time(fn, args.repeat, 2000)
+			sys.stdout.write('{:26} {:10.1f} µs/request {:10.2f} µs/query\n'.format(
+				sMode + ':', fElapsed * 1000000, fElapsed * 1000000 / args.queries
+			))
+		sys.stdout.write('Connections established: {}\n'.format(pool.connect_count()))
+		app.close()
+
+	sys.exit(0)
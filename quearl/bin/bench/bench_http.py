@@ -0,0 +1,366 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+
+"""Compares ql_http_get_multi()’s approach (batches of 5 requests, a new connection for each
+request, entities buffered and decompressed whole) with Http.HttpClient, fetching pages from a local
+stand-in HTTP/1.1 server that answers on several loopback addresses, one of them slow; the server
+uses gzip, raw deflate and chunked transfer encoding, and sends a few redirects. Then compares the
+memory needed to fetch and decode one large entity, and the time to the first decoded text and
+the memory needed to fetch and transcode one large HTML page.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import gzip
+import hashlib
+import http.server
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+import zlib
+
+import bench_common
+from modules.quearl.core import Http
+
+
+
+####################################################################################################
+# Functions
+
+def fetch_legacy(listUrls):
+	"""Fetches URLs like ql_http_get_multi(): in batches of 5, each request on a new connection,
+	reading and decoding each entity whole.
+
+	list(str) listUrls
+		URLs to fetch.
+	dict(str: str) return
+		SHA-1 of the decoded entity of each URL.
+	"""
+
+	def fetch(sUrl):
+		request = urllib.request.Request(sUrl, headers = {
+			'Accept-Encoding': 'gzip, deflate', 'Connection': 'close'
+		})
+		with urllib.request.urlopen(request) as response:
+			bytesBody = response.read()
+			sEncoding = response.headers.get('Content-Encoding')
+		if sEncoding == 'gzip':
+			bytesBody = gzip.decompress(bytesBody)
+		elif sEncoding == 'deflate':
+			bytesBody = zlib.decompress(bytesBody, -zlib.MAX_WBITS)
+		return hashlib.sha1(bytesBody).hexdigest()
+
+	dictHashes = {}
+	with concurrent.futures.ThreadPoolExecutor(5) as executor:
+		for i in range(0, len(listUrls), 5):
+			listBatch = listUrls[i:i + 5]
+			dictHashes.update(zip(listBatch, executor.map(fetch, listBatch)))
+	return dictHashes
+
+
+def fetch_text_legacy(sUrl):
+	"""Fetches a text entity like ql_http_get(), ql_http_detect_charset() and ql_unicode_conv():
+	reading it whole, then transcoding it in one go, deleting invalid bytes.
+
+	str sUrl
+		URL to fetch.
+	tuple(float, str) return
+		Time at which the first decoded text was available, and SHA-1 of the decoded text.
+	"""
+
+	with urllib.request.urlopen(sUrl) as response:
+		bytesBody = response.read()
+		sContentType = response.headers.get('Content-Type')
+	s = bytesBody.decode(Http.detect_charset(sContentType, bytesBody) or 'utf-8', 'ignore')
+	fFirst = time.perf_counter()
+	return fFirst, hashlib.sha1(s.encode()).hexdigest()
+
+
+async def fetch_text_client(sUrl):
+	"""Fetches a text entity with Http.HttpResponse.iter_text().
+
+	str sUrl
+		URL to fetch.
+	tuple(float, str) return
+		Time at which the first decoded text was available, and SHA-1 of the decoded text.
+	"""
+
+	client = Http.HttpClient()
+	fFirst = None
+	sha1 = hashlib.sha1()
+	async with await client.get(sUrl) as response:
+		async for s in response.iter_text():
+			if fFirst is None:
+				fFirst = time.perf_counter()
+			sha1.update(s.encode())
+	client.close()
+	return fFirst, sha1.hexdigest()
+
+
+async def fetch_client(client, listUrls, cMaxConcurrency):
+	"""Fetches URLs with Http.HttpClient.get_multi(), streaming each entity.
+
+	Http.HttpClient client
+		Client to use.
+	list(str) listUrls
+		URLs to fetch.
+	int cMaxConcurrency
+		Maximum number of requests in progress at any time.
+	dict(str: str) return
+		SHA-1 of the decoded entity of each URL.
+	"""
+
+	dictHashes = {}
+
+	async def callback(sUrl, response, x):
+		if x:
+			raise x
+		sha1 = hashlib.sha1()
+		async for bytesChunk in response:
+			sha1.update(bytesChunk)
+		dictHashes[sUrl] = sha1.hexdigest()
+
+	await client.get_multi(listUrls, callback, cMaxConcurrency)
+	return dictHashes
+
+
+
+####################################################################################################
+# Classes
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	"""Request handler for the stand-in server. Paths:
+
+	/page/<n>
+		Text page, gzip-encoded if accepted; slow on the slow host.
+	/deflate/<n>
+		Same as /page/<n>, sent as raw deflate with chunked transfer encoding.
+	/moved/<n>
+		Redirect to /page/<n>.
+	/big
+		Large entity, gzip-encoded with chunked transfer encoding.
+	/text
+		Large windows-1252 HTML page, with some invalid bytes, with chunked transfer encoding.
+	"""
+
+	protocol_version = 'HTTP/1.1'
+
+
+	def do_GET(self):
+		listPath = self.path.split('/')
+		if listPath[1] == 'moved':
+			self.send_response(302)
+			self.send_header('Location', '/page/' + listPath[2])
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		if self.server.slow_host() == self.headers['Host'].split(':')[0]:
+			time.sleep(0.25)
+		else:
+			time.sleep(0.01)
+		if listPath[1] == 'big':
+			self.send_response(200)
+			self.send_header('Content-Encoding', 'gzip')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			bytesBlock = bytes(range(256)) * 4096
+			for i in range(self.server.big_size() // len(bytesBlock)):
+				self._send_chunk(compressor.compress(bytesBlock))
+			self._send_chunk(compressor.flush())
+			self.wfile.write(b'0\r\n\r\n')
+			return
+		if listPath[1] == 'text':
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			self._send_chunk(b'<html><head><meta charset="windows-1252"></head><body>\n')
+			bytesBlock = b'<p>Caf\xe9 cr\xe8me \x80 \x81</p>\n' * 2048
+			for i in range(self.server.big_size() // len(bytesBlock)):
+				self._send_chunk(bytesBlock)
+			self._send_chunk(b'</body></html>\n')
+			self.wfile.write(b'0\r\n\r\n')
+			return
+		bytesBody = ('Page {} of the stand-in server.\n'.format(listPath[2]) * 500).encode()
+		self.send_response(200)
+		if listPath[1] == 'deflate':
+			compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+			self.send_header('Content-Encoding', 'deflate')
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.end_headers()
+			self._send_chunk(compressor.compress(bytesBody))
+			self._send_chunk(compressor.flush())
+			self.wfile.write(b'0\r\n\r\n')
+			return
+		if 'gzip' in self.headers.get('Accept-Encoding', ''):
+			bytesBody = gzip.compress(bytesBody)
+			self.send_header('Content-Encoding', 'gzip')
+		self.send_header('Content-Length', str(len(bytesBody)))
+		self.end_headers()
+		self.wfile.write(bytesBody)
+
+
+	def log_message(self, sFormat, *args):
+		pass
+
+
+	def _send_chunk(self, bytesChunk):
+		if bytesChunk:
+			self.wfile.write('{:x}\r\n'.format(len(bytesChunk)).encode() + bytesChunk + b'\r\n')
+
+
+	def setup(self):
+		super().setup()
+		self.server.count_connection()
+
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+	"""Stand-in HTTP/1.1 server; counts the connections it accepts."""
+
+	daemon_threads = True
+
+
+	def __init__(self, sSlowHost, cbBig):
+		"""Constructor.
+
+		str sSlowHost
+			Address on which the server responds slowly.
+		int cbBig
+			Size of the /big and /text entities, in bytes.
+		"""
+
+		super().__init__(('', 0), StandInHandler)
+		self._m_sSlowHost = sSlowHost
+		self._m_cbBig = cbBig
+		self._m_lock = threading.Lock()
+		self._m_cConnections = 0
+
+
+	def big_size(self):
+		return self._m_cbBig
+
+
+	def connection_count(self):
+		return self._m_cConnections
+
+
+	def count_connection(self):
+		with self._m_lock:
+			self._m_cConnections += 1
+
+
+	def slow_host(self):
+		return self._m_sSlowHost
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--urls', type = int, default = 200, help = 'URLs to fetch')
+	argparser.add_argument(
+		'--hosts', type = int, default = 4, help = 'Loopback hosts to spread them on'
+	)
+	argparser.add_argument('--concurrency', type = int, default = 10, help = 'Concurrent requests')
+	argparser.add_argument(
+		'--big', type = int, default = 64, help = 'Size of the large entity, in MiB'
+	)
+	args = argparser.parse_args()
+
+	listHosts = ['127.0.0.{}'.format(i + 1) for i in range(args.hosts)]
+	server = StandInServer(listHosts[-1], args.big * 1024 * 1024)
+	iPort = server.server_address[1]
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+
+	listUrls = []
+	for i in range(args.urls):
+		sKind = ('page', 'page', 'page', 'deflate', 'moved')[i % 5]
+		listUrls.append('http://{}:{}/{}/{}'.format(listHosts[i % len(listHosts)], iPort, sKind, i))
+
+	fStart = time.perf_counter()
+	dictLegacy = fetch_legacy(listUrls)
+	fLegacy = time.perf_counter() - fStart
+	cLegacyConnections = server.connection_count()
+	sys.stdout.write('Batches of 5, new connections: {:8.2f} s, {:5} connections\n'.format(
+		fLegacy, cLegacyConnections
+	))
+
+	client = Http.HttpClient(cMaxConnectionsPerHost = args.concurrency)
+	fStart = time.perf_counter()
+	dictClient = asyncio.run(fetch_client(client, listUrls, args.concurrency))
+	fClient = time.perf_counter() - fStart
+	sys.stdout.write('HttpClient, {:2} concurrent:     {:8.2f} s, {:5} connections\n'.format(
+		args.concurrency, fClient, server.connection_count() - cLegacyConnections
+	))
+	if dictClient != dictLegacy:
+		sys.stdout.write('Entities differ!\n')
+		sys.exit(1)
+
+	sBigUrl = 'http://{}:{}/big'.format(listHosts[0], iPort)
+	tracemalloc.start()
+	dictLegacy = fetch_legacy([sBigUrl])
+	cbLegacyPeak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	tracemalloc.start()
+	dictClient = asyncio.run(fetch_client(Http.HttpClient(), [sBigUrl], 1))
+	cbClientPeak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	sys.stdout.write('{} MiB entity, peak memory: buffered {:8} KiB, streamed {:6} KiB\n'.format(
+		args.big, cbLegacyPeak // 1024, cbClientPeak // 1024
+	))
+	if dictClient != dictLegacy:
+		sys.stdout.write('Entities differ!\n')
+		sys.exit(1)
+
+	sTextUrl = 'http://{}:{}/text'.format(listHosts[0], iPort)
+	tracemalloc.start()
+	fStart = time.perf_counter()
+	fFirst, sLegacy = fetch_text_legacy(sTextUrl)
+	fLegacyFirst = fFirst - fStart
+	cbLegacyPeak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	tracemalloc.start()
+	fStart = time.perf_counter()
+	fFirst, sClient = asyncio.run(fetch_text_client(sTextUrl))
+	fClientFirst = fFirst - fStart
+	cbClientPeak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	sys.stdout.write('{} MiB page, first text after / peak memory:\n'.format(args.big))
+	sys.stdout.write('  whole entity: {:8.2f} ms, {:8} KiB\n'.format(
+		fLegacyFirst * 1000, cbLegacyPeak // 1024
+	))
+	sys.stdout.write('  streamed:     {:8.2f} ms, {:8} KiB\n'.format(
+		fClientFirst * 1000, cbClientPeak // 1024
+	))
+	if sClient != sLegacy:
+		sys.stdout.write('Texts differ!\n')
+		sys.exit(1)
+
+	server.shutdown()
+	sys.exit(0)
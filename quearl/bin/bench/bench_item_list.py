@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Compares the cost of a page of an item list sorted in natural order, deep into a large table,
+between QlDb::query_item_list()’s approach (every row fetched and sorted client-side, then sliced),
+offset pagination with a full count (as SQL_CALC_FOUND_ROWS would do), and
+DbConnection.query_item_list()’s keyset pagination with a capped count.
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Db
+
+
+
+####################################################################################################
+# Functions
+
+def measure(fn, cRepeats):
+	"""Returns the best time taken by a function call over a number of runs, and the peak memory
+	allocated by it.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	tuple(float, int) return
+		Best time per call, in seconds, and peak memory allocated, in bytes.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		fn()
+		fElapsed = time.perf_counter() - fStart
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	tracemalloc.start()
+	fn()
+	cbPeak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return fBest, cbPeak
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument('--users', type = int, default = 100000, help = 'Rows in the test table')
+	argparser.add_argument('--page-size', type = int, default = 50, help = 'Items per page')
+	argparser.add_argument(
+		'--page', type = int, default = 1000, help = '0-based index of the page to measure'
+	)
+	argparser.add_argument(
+		'--max-count', type = int, default = 1000, help = 'Cap for the count of items in the list'
+	)
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		app = Application.Application(tmpinst.root_dir())
+		pool = app.db()
+		db = pool.acquire()
+		db.execute('''
+			CREATE TABLE users (
+				id       INTEGER PRIMARY KEY,
+				name     TEXT NOT NULL,
+				fullname TEXT NOT NULL
+			)
+		''')
+		db.begin_transaction()
+		for i in range(args.users):
+			# Insert in an order unrelated to the sort order.
+			iUser = (i * 7919) % args.users
+			db.execute(
+				'INSERT INTO users (name, fullname) VALUES (?, ?)',
+				('user{}'.format(iUser), 'User {}'.format(iUser))
+			)
+		db.end_transaction()
+		db.execute('CREATE INDEX users_name_nat ON users (name COLLATE QL_NATURAL, id)')
+		dictQ = {
+			'vlfields' : 'u.id AS ql_value, u.name AS ql_label',
+			'tables'   : 'users AS u',
+			'sort'     : [('u.name', Db.SORT_NAT_ASC)],
+			'mainalias': 'u',
+			'id'       : 'id',
+			'limit'    : args.page_size,
+		}
+		iFirst = args.page * args.page_size
+		# Continuation token for the measured page, obtained by walking through the previous ones.
+		sContinuation = None
+		for iPage in range(args.page):
+			sContinuation = db.query_item_list(dictQ, sContinuation)['continuation']
+
+		def client_sort_page():
+			listItems = db.query_all('SELECT u.id AS ql_value, u.name AS ql_label FROM users AS u')
+			listItems.sort(key = lambda tpl: Db.natural_key(tpl[1]))
+			return listItems[iFirst:iFirst + args.page_size], len(listItems)
+
+		def offset_page():
+			return db.query_all('''
+				SELECT u.id AS ql_value, u.name AS ql_label
+				FROM users AS u
+				ORDER BY u.name COLLATE QL_NATURAL, u.id
+				LIMIT ? OFFSET ?
+			''', (args.page_size, iFirst)), db.query_value('SELECT COUNT(*) FROM users')
+
+		def keyset_page():
+			dictPage = db.query_item_list(dictQ, sContinuation, args.max_count)
+			return dictPage['items'], dictPage['count']
+
+		listExpected = None
+		for sMode, fn in (
+			('Client-side sort', client_sort_page),
+			('Offset, full count', offset_page),
+			('Keyset, capped count', keyset_page),
+		):
+			listItems = fn()[0]
+			if listExpected is None:
+				listExpected = listItems
+			elif listItems != listExpected:
+				raise Exception('{} returned a different page'.format(sMode))
+			fElapsed, cbPeak = measure(fn, args.repeat)
+			sys.stdout.write('{:22} {:10.2f} ms/page {:10.0f} KiB peak\n'.format(
+				sMode + ':', fElapsed * 1000, cbPeak / 1024
+			))
+		pool.release(db)
+		app.close()
+
+	sys.exit(0)
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Compares loading a whole .l10n file with l10n_generator.parse_l10n() against opening its
+compiled, memory-mapped catalog, for catalogs of increasing size: time to load/open, and time to
+look up a few entries, as a request would.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import bench_common
+from localize import l10n_generator
+from modules.quearl.core import L10n
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats):
+	"""Returns the best time taken by a function over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	float return
+		Best time, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		fn()
+		fElapsed = time.perf_counter() - fStart
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--lookups', type = int, default = 20, help = 'Entries looked up per simulated request'
+	)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	args = argparser.parse_args()
+
+	sTempDir = tempfile.mkdtemp(prefix = 'quearl-bench-')
+	try:
+		sys.stdout.write(
+			'{:>8}  {:>12} {:>12}  {:>12} {:>12}\n'.format(
+				'entries', 'parse (ms)', 'open (ms)', 'dict (µs)', 'catalog (µs)'
+			)
+		)
+		for cEntries in 100, 1000, 10000, 100000:
+			sL10nFileName = os.path.join(sTempDir, 'en-us.l10n')
+			with open(sL10nFileName, 'w') as fileL10n:
+				for i in range(cEntries):
+					fileL10n.write('STRING_{}\tLocalized string number {}\n'.format(i, i))
+			sCatalogFileName = os.path.join(sTempDir, 'en-us.cat')
+			with open(sCatalogFileName, 'wb') as fileCatalog:
+				fileCatalog.write(L10n.L10nCatalog.build(l10n_generator.parse_l10n(sL10nFileName)))
+			listNames = ['STRING_{}'.format(random.randrange(cEntries)) for i in range(args.lookups)]
+
+			fParse = best_time(lambda: l10n_generator.parse_l10n(sL10nFileName), args.repeat)
+			fOpen = best_time(lambda: L10n.L10nCatalog(sCatalogFileName).close(), args.repeat)
+			dictEntries = l10n_generator.parse_l10n(sL10nFileName)
+			catalog = L10n.L10nCatalog(sCatalogFileName)
+			fDictLookups = best_time(lambda: [dictEntries[sName] for sName in listNames], args.repeat)
+			fCatalogLookups = best_time(lambda: [catalog[sName] for sName in listNames], args.repeat)
+			for sName in listNames:
+				if catalog[sName] != dictEntries[sName]:
+					raise Exception('Mismatch for {}'.format(sName))
+			catalog.close()
+
+			sys.stdout.write('{:8}  {:12.3f} {:12.3f}  {:12.2f} {:12.2f}\n'.format(
+				cEntries, fParse * 1000, fOpen * 1000,
+				fDictLookups * 1000000, fCatalogLookups * 1000000
+			))
+	finally:
+		shutil.rmtree(sTempDir)
+	sys.stdout.write('Lookup times are for {} entries.\n'.format(args.lookups))
+
+	sys.exit(0)
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Measures log entries/second with many processes writing to the same log concurrently, with and
+without batched writes, for both XML and compact (JSON lines) logs.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+
+
+
+####################################################################################################
+# Functions
+
+def bench_mode(dictConf, cProcesses, cEntries):
+	"""Measures the throughput of the logger with the specified configuration.
+
+	dict(str: object) dictConf
+		Bootstrap configuration entries.
+	int cProcesses
+		Number of concurrent writer processes.
+	int cEntries
+		Number of entries written by each process.
+	tuple(float, float) return
+		Entries written per second, and mean time spent in each Logger.write() call, in microseconds.
+	"""
+
+	with bench_common.TempInstallation(dictConf) as tmpinst:
+		iReadFd, iWriteFd = os.pipe()
+		fStart = time.perf_counter()
+		listPids = []
+		for iProcess in range(cProcesses):
+			iPid = os.fork()
+			if iPid == 0:
+				os.close(iReadFd)
+				app = Application.Application(tmpinst.root_dir())
+				logger = app.logger()
+				fWriteStart = time.perf_counter()
+				for i in range(cEntries):
+					logger.write(
+						'INFO', 'Entry {} from process {}'.format(i, iProcess), '<p>Details</p>'
+					)
+				fWriteTime = time.perf_counter() - fWriteStart
+				# Closing the application flushes any queued entries.
+				app.close()
+				os.write(iWriteFd, '{}\n'.format(fWriteTime).encode('ascii'))
+				os._exit(0)
+			listPids.append(iPid)
+		os.close(iWriteFd)
+		for iPid in listPids:
+			os.waitpid(iPid, 0)
+		fElapsed = time.perf_counter() - fStart
+		with os.fdopen(iReadFd, 'r') as fileTimes:
+			fWriteTime = sum(float(sLine) for sLine in fileTimes)
+		# Make sure no entries were lost.
+		sLogDir = os.path.join(tmpinst.root_dir(), 'data.rw', 'core', 'log')
+		cLogged = 0
+		for sFileName in os.listdir(sLogDir):
+			with open(os.path.join(sLogDir, sFileName), 'r', encoding = 'utf-8') as fileLog:
+				if sFileName.endswith('.log.xml'):
+					cLogged += fileLog.read().count('<entry ')
+				elif sFileName.endswith('.log.jsonl'):
+					cLogged += sum(1 for sLine in fileLog)
+		if cLogged != cProcesses * cEntries:
+			raise Exception('Expected {} entries, found {}'.format(cProcesses * cEntries, cLogged))
+	cTotal = cProcesses * cEntries
+	return cTotal / fElapsed, fWriteTime / cTotal * 1000000
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--processes', type = int, default = 8, help = 'Writer processes')
+	argparser.add_argument('--entries', type = int, default = 2000, help = 'Entries per process')
+	argparser.add_argument('--batch-size', type = int, default = 256, help = 'Batched mode size')
+	args = argparser.parse_args()
+
+	dictBatched = {'log_batch_size': args.batch_size, 'log_batch_interval': 0.05}
+	for sMode, dictConf in (
+		('XML, synchronous',     {'log_batch_size': 0}),
+		('XML, batched',         dictBatched),
+		('Compact, synchronous', {'log_batch_size': 0, 'log_format': 'jsonl'}),
+		('Compact, batched',     dict(dictBatched, log_format = 'jsonl')),
+	):
+		fRate, fWriteCost = bench_mode(dictConf, args.processes, args.entries)
+		sys.stdout.write('{:22} {:10.0f} entries/s   {:8.1f} µs/write() call\n'.format(
+			sMode + ':', fRate, fWriteCost
+		))
+
+	sys.exit(0)
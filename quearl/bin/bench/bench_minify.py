@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Compares the tokenizing JavaScript minifier with the regex-based one it replaced, reporting bytes
+saved (with and without gzip) and throughput over every JS file in every module.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+
+import bench_common
+from js_preproc import JsPreproc
+
+
+
+####################################################################################################
+# Functions
+
+def minify_regex(s):
+	"""Previous implementation of JsPreproc.minify(), based on four regex passes over the whole file.
+
+	str s
+		JavaScript source.
+	str return
+		Minified JavaScript source.
+	"""
+
+	s = re.sub(r'[ \t\f\v]*/\*.*?\*/[ \t\f\v]*', ' ', s)
+	s = re.sub(r'//.*$', '', s, flags = re.MULTILINE)
+	s = re.sub(r'^[ \t\f\v]+', '', s, flags = re.MULTILINE)
+	s = re.sub(r'[ \t\f\v]+$', '', s, flags = re.MULTILINE)
+	return s
+
+
+def bench_minifier(fnMinify, listSources, cRepeats):
+	"""Measures a minifier over a set of sources.
+
+	callable fnMinify
+		Minifier.
+	list(str) listSources
+		JavaScript sources.
+	int cRepeats
+		Number of times each source is minified; the best time is used.
+	tuple(int, int, float) return
+		Total size of the minified sources, the same after gzip compression, and the best time to
+		minify all the sources, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		listOutputs = [fnMinify(sSource) for sSource in listSources]
+		fElapsed = time.perf_counter() - fStart
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	for sSource, sOutput in zip(listSources, listOutputs):
+		if sSource.count('\n') != sOutput.count('\n'):
+			raise Exception('{} changed the number of lines'.format(fnMinify.__name__))
+		# JScript conditional compilation comments are code to Internet Explorer, so they must
+		# survive; only whitespace in them may change.
+		if [
+			_reWhitespace.sub('', sComment) for sComment in _reConditionalComment.findall(sSource)
+		] != [
+			_reWhitespace.sub('', sComment) for sComment in _reConditionalComment.findall(sOutput)
+		]:
+			raise Exception('{} altered a conditional compilation comment'.format(fnMinify.__name__))
+	cb = sum(len(sOutput.encode('utf-8')) for sOutput in listOutputs)
+	cbGzip = sum(len(gzip.compress(sOutput.encode('utf-8'))) for sOutput in listOutputs)
+	return cb, cbGzip, fBest
+
+
+# Matches a JScript conditional compilation comment.
+_reConditionalComment = re.compile(r'/\*@.*?@\*/', re.DOTALL)
+
+# Matches whitespace.
+_reWhitespace = re.compile(r'\s+')
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--repeat', type = int, default = 5, help = 'Runs per minifier; the best one is reported'
+	)
+	args = argparser.parse_args()
+
+	listSources = []
+	sModulesDir = os.path.join(bench_common.QUEARL_DIR, 'module')
+	for sModule in sorted(os.listdir(sModulesDir)):
+		sJsDir = os.path.join(sModulesDir, sModule, 'js')
+		if os.path.isdir(sJsDir):
+			for sFileName in sorted(os.listdir(sJsDir)):
+				if sFileName.endswith('.js'):
+					with open(os.path.join(sJsDir, sFileName), 'r', encoding = 'utf-8') as fileJs:
+						listSources.append(fileJs.read())
+	cbSource = sum(len(sSource.encode('utf-8')) for sSource in listSources)
+	cbSourceGzip = sum(len(gzip.compress(sSource.encode('utf-8'))) for sSource in listSources)
+	sys.stdout.write('{} files, {} lines, {} bytes ({} gzipped)\n'.format(
+		len(listSources), sum(sSource.count('\n') for sSource in listSources), cbSource, cbSourceGzip
+	))
+
+	for sMinifier, fnMinify in (
+		('Regex passes', minify_regex),
+		('Tokenizer',    JsPreproc.minify),
+	):
+		cb, cbGzip, fElapsed = bench_minifier(fnMinify, listSources, args.repeat)
+		sys.stdout.write(
+			'{:14} {:8} bytes (-{:4.1f}%), {:7} gzipped (-{:4.1f}%), {:6.3f} s, {:6.2f} MB/s\n'.format(
+				sMinifier + ':',
+				cb,     (1 - cb     / cbSource    ) * 100,
+				cbGzip, (1 - cbGzip / cbSourceGzip) * 100,
+				fElapsed, cbSource / fElapsed / 1000000
+			)
+		)
+
+	sys.exit(0)
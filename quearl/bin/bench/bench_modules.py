@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Measures the cold start time and memory usage (RSS) of a worker process, when the code of every
+module listed in “load_modules” is imported at startup after scanning the module directory, compared
+with using the module manifest and importing module code only when a request is routed to it. Uses
+the core module and a number of synthetic modules, each importing some of the standard library.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+import bench_common
+import quearl_inst
+
+
+# Main PHP file of each synthetic module.
+MAIN_PHP = '''<?php
+class Ql{abbr}Module extends QlModule {{
+	public function abbr() {{
+		return '{abbr}';
+	}}
+}}
+?>
+'''
+
+# Python class of each synthetic module.
+MODULE_PY = '''{imports}
+from modules.quearl.core import Module
+
+# Stands in for the data a real module builds at import time.
+_TABLE = {{i: str(i) * 4 for i in range(20000)}}
+
+class {classname}(Module.Module):
+	URL_PREFIXES = ('/{abbr}/',)
+'''
+
+# Standard library modules imported by the synthetic modules.
+STD_MODULES = [
+	'argparse', 'asyncio', 'csv', 'decimal', 'difflib', 'email.mime.multipart', 'ftplib',
+	'html.parser', 'http.client', 'logging.handlers', 'pydoc', 'smtplib', 'sqlite3', 'tarfile',
+	'unittest', 'urllib.request', 'xml.dom.minidom', 'xmlrpc.client', 'zipfile',
+]
+
+# Worker process: creates an Application like Server.PreforkServer does for each worker, then
+# reports the time taken and its RSS.
+WORKER_PY = '''
+import os, sys, time
+fInit = time.perf_counter()
+sRootDir, sMode = sys.argv[1:3]
+sys.path.insert(0, os.path.join(sRootDir, 'bin'))
+from modules.quearl.core import Application
+app = Application.Application(sRootDir)
+if sMode == 'eager':
+	for sAbbr in app.section('core')['load_modules']:
+		app.module(sAbbr)
+fInit = time.perf_counter() - fInit
+with open('/proc/self/status', 'r') as fileStatus:
+	cKiBRss = next(int(s.split()[1]) for s in fileStatus if s.startswith('VmRSS:'))
+app.close()
+sys.stdout.write('{} {} {}\\n'.format(time.process_time(), fInit, cKiBRss))
+'''
+
+
+
+####################################################################################################
+# Functions
+
+def make_installation(sRootDir, listAbbrs):
+	"""Turns a scratch installation into one with the core module and a number of synthetic modules,
+	with code of their own (bin/modules/quearl/<abbr>/) but sharing the core module’s code.
+
+	str sRootDir
+		Root directory of the scratch installation.
+	list(str) listAbbrs
+		Abbreviations of the synthetic modules.
+	"""
+
+	# Replace the “bin” and “module” symlinks with directories where the synthetic modules can be
+	# added.
+	for sName in 'bin', 'module':
+		os.remove(os.path.join(sRootDir, sName))
+	os.makedirs(os.path.join(sRootDir, 'bin', 'modules', 'quearl'))
+	for sName in os.listdir(bench_common.BIN_DIR):
+		if sName != 'modules':
+			os.symlink(
+				os.path.join(bench_common.BIN_DIR, sName), os.path.join(sRootDir, 'bin', sName)
+			)
+	os.symlink(
+		os.path.join(bench_common.BIN_DIR, 'modules', 'quearl', 'core'),
+		os.path.join(sRootDir, 'bin', 'modules', 'quearl', 'core')
+	)
+	os.makedirs(os.path.join(sRootDir, 'module'))
+	os.symlink(
+		os.path.join(bench_common.QUEARL_DIR, 'module', 'core'),
+		os.path.join(sRootDir, 'module', 'core')
+	)
+
+	for i, sAbbr in enumerate(listAbbrs):
+		os.makedirs(os.path.join(sRootDir, 'module', sAbbr))
+		with open(
+			os.path.join(sRootDir, 'module', sAbbr, 'main.php'), 'w', encoding = 'utf-8'
+		) as filePhp:
+			filePhp.write(MAIN_PHP.format(abbr = sAbbr))
+		sPackageDir = os.path.join(sRootDir, 'bin', 'modules', 'quearl', sAbbr)
+		os.makedirs(sPackageDir)
+		sClassName = 'Bench{}Module'.format(i)
+		with open(os.path.join(sPackageDir, sClassName + '.py'), 'w', encoding = 'utf-8') as filePy:
+			filePy.write(MODULE_PY.format(
+				abbr      = sAbbr,
+				classname = sClassName,
+				imports   = ''.join('import {}\n'.format(sModule) for sModule in (
+					STD_MODULES[(i * 3 + j) % len(STD_MODULES)] for j in range(3)
+				)),
+			))
+
+
+def measure(sRootDir, sMode, cRepeats):
+	"""Starts a number of worker processes, each creating an Application.
+
+	str sRootDir
+		Root directory of the installation.
+	str sMode
+		“eager” to instantiate every module in “load_modules”, or “lazy” to let the module registry
+		import them as needed.
+	int cRepeats
+		Number of processes to start.
+	tuple(float, float, int) return
+		Median CPU time used by each process (including starting Python) and median time taken to
+		create the application, in seconds, and median RSS after that, in KiB.
+	"""
+
+	listStartup, listInit, listRss = [], [], []
+	for i in range(cRepeats):
+		sOutput = subprocess.check_output(
+			[sys.executable, '-c', WORKER_PY, sRootDir, sMode], universal_newlines = True
+		)
+		fStartup, fInit, cKiBRss = sOutput.split()
+		listStartup.append(float(fStartup))
+		listInit.append(float(fInit))
+		listRss.append(int(cKiBRss))
+	return (
+		statistics.median(listStartup), statistics.median(listInit), statistics.median(listRss)
+	)
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 7, help = 'Workers started per mode')
+	argparser.add_argument('--modules', type = int, default = 20, help = 'Synthetic modules')
+	args = argparser.parse_args()
+
+	listAbbrs = ['bench{}'.format(i) for i in range(args.modules)]
+	with bench_common.TempInstallation({
+		'load_modules': ', '.join(['core'] + listAbbrs),
+	}) as tmpinst:
+		sRootDir = tmpinst.root_dir()
+		make_installation(sRootDir, listAbbrs)
+		# Let the synthetic modules be imported by ModuleIndexer.
+		sys.path.append(os.path.join(sRootDir, 'bin'))
+		qinst = quearl_inst.QuearlInst(sRootDir)
+
+		sys.stdout.write('{} modules\n{:34} {:>12} {:>12} {:>10}\n'.format(
+			len(listAbbrs) + 1, 'mode', 'CPU (ms)', 'init (ms)', 'RSS (KiB)'
+		))
+		for sMode, sDescription, bManifest in (
+			('eager', 'scan + import all (before)', False),
+			('lazy',  'manifest + lazy import (after)', True),
+		):
+			sManifestFileName = os.path.join(qinst.rodata_dir(), 'modules.json')
+			if bManifest:
+				quearl_inst.ModuleIndexer.write_manifest(sRootDir, qinst.rodata_dir())
+			elif os.path.exists(sManifestFileName):
+				os.remove(sManifestFileName)
+			fCpu, fInit, cKiBRss = measure(sRootDir, sMode, args.repeat)
+			sys.stdout.write('{:34} {:12.1f} {:12.1f} {:10}\n'.format(
+				sDescription, fCpu * 1000, fInit * 1000, cKiBRss
+			))
+
+	sys.exit(0)
+
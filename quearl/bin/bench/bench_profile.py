@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Measures the overhead of profiling (see Profile.Profiler) on a minimal request executing one
+database query, with profiling disabled and with different sample rates; then checks that the
+histograms written by the server processes can be merged.
+"""
+
+import argparse
+import io
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Profile
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats, cCalls):
+	"""Returns the best time taken by a function call over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	int cCalls
+		Number of calls to fn in each run.
+	float return
+		Best time per call, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		for j in range(cCalls):
+			fn()
+		fElapsed = (time.perf_counter() - fStart) / cCalls
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument('--requests', type = int, default = 5000, help = 'Requests per run')
+	args = argparser.parse_args()
+
+	dictEnv = {
+		'REQUEST_METHOD' : 'GET',
+		'PATH_INFO'      : '/',
+		'QUERY_STRING'   : '',
+		'SERVER_NAME'    : 'localhost',
+		'SERVER_PORT'    : '80',
+		'wsgi.input'     : io.BytesIO(),
+		'wsgi.url_scheme': 'http',
+	}
+
+	def start_response(sStatus, listHeaders):
+		pass
+
+	fBaseline = None
+	for fSampleRate in 0, 0.01, 1:
+		with bench_common.TempInstallation({'profile_sample_rate': fSampleRate}) as tmpinst:
+			app = Application.Application(tmpinst.root_dir())
+			pool = app.db()
+
+			def request():
+				iterEntity = app(dict(dictEnv), start_response)
+				with pool.connection() as db:
+					db.query_value('SELECT ? + 1', (1, ))
+				for bytesChunk in iterEntity:
+					pass
+
+			fElapsed = best_time(request, args.repeat, args.requests)
+			if fBaseline is None:
+				fBaseline = fElapsed
+			sys.stdout.write('Sample rate {:4}: {:10.2f} µs/request ({:+.2f} µs)\n'.format(
+				fSampleRate, fElapsed * 1000000, (fElapsed - fBaseline) * 1000000
+			))
+			sProfileDir = app.section('core')['profile_lpath']
+			app.close()
+			if fSampleRate:
+				dictPhases, dictQueries = Profile.load_worker_files(sProfileDir)
+				histogram = dictPhases['request']
+				sys.stdout.write('  {} requests profiled; p50 {:.1f} µs, p99 {:.1f} µs; {}\n'.format(
+					histogram.count(), histogram.percentile(50) * 1000000,
+					histogram.percentile(99) * 1000000, ', '.join(sorted(dictQueries.keys()))
+				))
+
+	sys.exit(0)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Compares requests/second of the CGI entry point and of the pre-forking worker server."""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Server
+
+
+
+####################################################################################################
+# Functions
+
+def bench_cgi(sRootDir, cRequests, cConcurrency):
+	"""Measures the throughput of cgi-bin/quearl.py, invoked as a new process for every request, as
+	a web server would.
+
+	str sRootDir
+		Quearl installation directory.
+	int cRequests
+		Number of requests to perform.
+	int cConcurrency
+		Number of requests to perform in parallel.
+	float return
+		Requests per second.
+	"""
+
+	sScript = os.path.join(bench_common.QUEARL_DIR, '..', 'cgi-bin', 'quearl.py')
+	dictEnv = dict(os.environ)
+	dictEnv.update({
+		'GATEWAY_INTERFACE': 'CGI/1.1',
+		'QUEARL_REL_PATH'  : os.path.join(sRootDir, 'bin'),
+		'REQUEST_METHOD'   : 'GET',
+		'SCRIPT_NAME'      : '/quearl/module/core/main.php',
+		'PATH_INFO'        : '/',
+		'QUERY_STRING'     : '',
+		'SERVER_NAME'      : 'localhost',
+		'SERVER_PORT'      : '80',
+		'SERVER_PROTOCOL'  : 'HTTP/1.1',
+	})
+
+	def request(i):
+		subprocess.run(
+			[sys.executable, sScript], env = dictEnv, stdin = subprocess.DEVNULL,
+			stdout = subprocess.DEVNULL, check = True
+		)
+
+	fStart = time.perf_counter()
+	with ThreadPoolExecutor(cConcurrency) as executor:
+		list(executor.map(request, range(cRequests)))
+	return cRequests / (time.perf_counter() - fStart)
+
+
+def bench_server(sRootDir, cRequests, cConcurrency, cWorkers):
+	"""Measures the throughput of the pre-forking worker server.
+
+	str sRootDir
+		Quearl installation directory.
+	int cRequests
+		Number of requests to perform.
+	int cConcurrency
+		Number of requests to perform in parallel.
+	int cWorkers
+		Number of worker processes.
+	float return
+		Requests per second.
+	"""
+
+	server = Server.PreforkServer(
+		lambda: Application.Application(sRootDir), sHost = '127.0.0.1', iPort = 0,
+		cWorkers = cWorkers
+	)
+	sHost, iPort = server.bind()
+	iPid = os.fork()
+	if iPid == 0:
+		try:
+			server.serve_forever()
+		finally:
+			os._exit(0)
+
+	try:
+		def request(i):
+			# Retry while the workers are still starting up.
+			for iAttempt in range(50):
+				conn = http.client.HTTPConnection(sHost, iPort)
+				try:
+					conn.request('GET', '/')
+					conn.getresponse().read()
+					return
+				except ConnectionError:
+					time.sleep(0.1)
+				finally:
+					conn.close()
+			raise Exception('Server not responding')
+
+		# Warm up, making sure every worker is up.
+		with ThreadPoolExecutor(cConcurrency) as executor:
+			list(executor.map(request, range(cWorkers * 2)))
+
+		fStart = time.perf_counter()
+		with ThreadPoolExecutor(cConcurrency) as executor:
+			list(executor.map(request, range(cRequests)))
+		return cRequests / (time.perf_counter() - fStart)
+	finally:
+		os.kill(iPid, signal.SIGTERM)
+		os.waitpid(iPid, 0)
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--requests', type = int, default = 200, help = 'Requests per mode')
+	argparser.add_argument('--concurrency', type = int, default = 4, help = 'Parallel clients')
+	argparser.add_argument('--workers', type = int, default = 4, help = 'Worker processes')
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		fCgi = bench_cgi(tmpinst.root_dir(), args.requests, args.concurrency)
+		fServer = bench_server(tmpinst.root_dir(), args.requests, args.concurrency, args.workers)
+	sys.stdout.write('CGI:            {:10.1f} requests/s\n'.format(fCgi))
+	sys.stdout.write('Worker server:  {:10.1f} requests/s\n'.format(fServer))
+	sys.stdout.write('Speedup:        {:10.1f}x\n'.format(fServer / fCgi))
+
+	sys.exit(0)
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Compares opening and closing a session with Session.SessionStore against QlSession’s protocol
+(UPDATE of the last hit, compare-and-swap lock retried every second, SELECT of the data, and an
+UPDATE to write it back and unlock), both on the SQLite session backend: first uncontended, then
+with concurrent requests for the same session, as made by a page issuing several AJAX requests.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats, cCalls):
+	"""Returns the best time taken by a function call over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	int cCalls
+		Number of calls to fn in each run.
+	float return
+		Best time per call, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		for j in range(cCalls):
+			fn()
+		fElapsed = (time.perf_counter() - fStart) / cCalls
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+def concurrent_requests(sRootDir, sSid, sMode, cProcesses, fHold):
+	"""Has a number of processes open the same session at the same time, each keeping it open for a
+	while, as if processing a request.
+
+	str sRootDir
+		Root directory of the installation.
+	str sSid
+		Session ID.
+	str sMode
+		“store” to use Session.SessionStore, or “ql” for QlSession’s protocol.
+	int cProcesses
+		Number of processes.
+	float fHold
+		Time each process keeps the session open, in seconds.
+	float return
+		Time until every process closed the session, in seconds.
+	"""
+
+	iReadFd, iWriteFd = os.pipe()
+	listPids = []
+	for i in range(cProcesses):
+		iPid = os.fork()
+		if iPid == 0:
+			os.close(iWriteFd)
+			app = Application.Application(sRootDir)
+			store = app.sessions()
+			# Wait for every process to be ready.
+			os.read(iReadFd, 1)
+			if sMode == 'store':
+				session = store.open(sSid)
+				time.sleep(fHold)
+				session.set('counter', session.get('counter', 0) + 1)
+				session.write_and_close()
+			else:
+				dictData = ql_load(store.backend().database(), sSid)
+				time.sleep(fHold)
+				dictData['counter'] = dictData.get('counter', 0) + 1
+				ql_write_and_close(store.backend().database(), sSid, dictData)
+			app.close()
+			os._exit(0)
+		listPids.append(iPid)
+	os.close(iReadFd)
+	fStart = time.perf_counter()
+	os.close(iWriteFd)
+	for iPid in listPids:
+		os.waitpid(iPid, 0)
+	return time.perf_counter() - fStart
+
+
+def ql_load(db, sSid):
+	"""Loads and locks a session like QlSession::load().
+
+	sqlite3.Connection db
+		Connection to the session database.
+	str sSid
+		Session ID.
+	dict(str: object) return
+		Session data.
+	"""
+
+	iTS = int(time.time())
+	db.execute('UPDATE sessions SET lasthit = ? WHERE id = ?', (iTS, sSid))
+	cRetries = 15
+	while True:
+		if db.execute(
+			'UPDATE sessions SET locked = 1 WHERE id = ? AND locked = 0', (sSid, )
+		).rowcount == 1:
+			break
+		cRetries -= 1
+		if not cRetries:
+			raise Exception('Unable to acquire session lock')
+		time.sleep(1)
+	return json.loads(
+		db.execute('SELECT data FROM sessions WHERE id = ?', (sSid, )).fetchone()[0]
+	)
+
+
+def ql_write_and_close(db, sSid, dictData):
+	"""Saves and unlocks a session like QlSession::write_and_close().
+
+	sqlite3.Connection db
+		Connection to the session database.
+	str sSid
+		Session ID.
+	dict(str: object) dictData
+		Session data.
+	"""
+
+	db.execute('''
+		UPDATE sessions
+		SET locked = 0, iduser = ?, lasthit = ?, data = ?
+		WHERE id = ? AND locked = 1
+	''', (dictData.get('ql_user_id'), int(time.time()), json.dumps(dictData), sSid))
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument(
+		'--processes', type = int, default = 4, help = 'Concurrent requests for the same session'
+	)
+	argparser.add_argument(
+		'--hold', type = float, default = 0.05,
+		help = 'Seconds each concurrent request keeps the session open'
+	)
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		app = Application.Application(tmpinst.root_dir())
+		store = app.sessions()
+		db = store.backend().database()
+		# QlSession’s lock column.
+		db.execute('ALTER TABLE sessions ADD COLUMN locked INTEGER NOT NULL DEFAULT 0')
+		# Session data similar to that of a logged in user.
+		dictData = {
+			'ql_ipaddr'         : '192.0.2.1',
+			'ql_timezone'       : 'Europe/Rome',
+			'ql_user_acclvl'    : 1,
+			'ql_user_email'     : 'user@example.com',
+			'ql_user_id'        : 1234,
+			'ql_user_name'      : 'user',
+			'ql_user_privtokens': 'a,b,c',
+			'ql_useragent'      : 'Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/24.0',
+			'history'           : ['/page/{}'.format(i) for i in range(50)],
+			'ql_prefs'          : {'items_per_page': 25, 'sort': {'by': 'date', 'desc': True}},
+		}
+		session = store.create(dictData)
+		sSid = session.id()
+		session.write_and_close()
+
+		def store_unchanged():
+			store.open(sSid, '192.0.2.1').write_and_close()
+
+		def store_changed():
+			session = store.open(sSid, '192.0.2.1')
+			session.set('ql_lastpage', str(time.perf_counter()))
+			session.set('ql_lastsearch', {'q': 'quearl', 'filters': {'type': ['doc', 'item']}})
+			session.write_and_close()
+
+		def ql_request():
+			dictData = ql_load(db, sSid)
+			ql_write_and_close(db, sSid, dictData)
+
+		for sMode, fn in (
+			('QlSession protocol', ql_request),
+			('Store, unchanged', store_unchanged),
+			('Store, changed', store_changed),
+		):
+			sys.stdout.write('{:22} {:10.1f} µs/request\n'.format(
+				sMode + ':', best_time(fn, args.repeat, 2000) * 1000000
+			))
+
+		# Nested values must survive being frozen and stored.
+		session = store.open(sSid)
+		if (
+			session.get('ql_prefs')['sort']['by'] != 'date' or
+			session.get('ql_lastsearch')['filters']['type'] != ('doc', 'item')
+		):
+			raise Exception('Nested session data not stored correctly')
+		session.write_and_close()
+
+		for sMode, sDescription in ('ql', 'QlSession protocol'), ('store', 'Store'):
+			fElapsed = concurrent_requests(
+				tmpinst.root_dir(), sSid, sMode, args.processes, args.hold
+			)
+			sys.stdout.write('{:22} {:10.3f} s for {} requests holding the session {:.3f} s\n'.format(
+				sDescription + ':', fElapsed, args.processes, args.hold
+			))
+		session = store.open(sSid)
+		if session.get('counter') != args.processes * 2:
+			raise Exception('Lost session updates: {}'.format(session.get('counter')))
+		session.write_and_close()
+		app.close()
+
+	sys.exit(0)
+
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Compares deleting expired sessions with a single unbounded DELETE, as QlSession::gc() does, with
+Session.SessionCollector’s bounded batches, measuring how long session lookups made by another
+process at the same time are stalled.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Session
+
+
+
+####################################################################################################
+# Functions
+
+def fill_sessions(db, cExpired, cLive):
+	"""Adds expired and live sessions to the session database.
+
+	sqlite3.Connection db
+		Connection to the session database.
+	int cExpired
+		Number of expired sessions to add.
+	int cLive
+		Number of live sessions to add.
+	list(str) return
+		IDs of the live sessions.
+	"""
+
+	iNow = int(time.time())
+	sData = json.dumps({'ql_user_id': None, 'history': ['/page/{}'.format(i) for i in range(20)]})
+	listLiveSids = [Session.new_id() for i in range(cLive)]
+	db.execute('BEGIN')
+	db.executemany('''
+		INSERT INTO sessions(id, firsthit, lasthit, version, data)
+		VALUES (?, ?, ?, 1, ?)
+	''', (
+		(Session.new_id(), iNow - 200000 - i, iNow - 100000 - i % 10000, sData)
+		for i in range(cExpired)
+	))
+	db.executemany('''
+		INSERT INTO sessions(id, firsthit, lasthit, version, data)
+		VALUES (?, ?, ?, 1, ?)
+	''', ((sSid, iNow, iNow, sData) for sSid in listLiveSids))
+	db.execute('COMMIT')
+	return listLiveSids
+
+
+def measure_lookups(sRootDir, listSids, fnCollect):
+	"""Runs a collection while another process keeps opening and closing live sessions.
+
+	str sRootDir
+		Root directory of the installation.
+	list(str) listSids
+		IDs of the live sessions.
+	callable fnCollect
+		Deletes the expired sessions.
+	tuple(float, float, int) return
+		Time taken by fnCollect, and longest and median time taken by a session lookup while it ran,
+		in seconds; and number of lookups.
+	"""
+
+	iReadFd, iWriteFd = os.pipe()
+	iDoneReadFd, iDoneWriteFd = os.pipe()
+	iPid = os.fork()
+	if iPid == 0:
+		os.close(iReadFd)
+		os.close(iDoneWriteFd)
+		os.set_blocking(iDoneReadFd, False)
+		app = Application.Application(sRootDir)
+		# No cache, so that every lookup reads the session data.
+		store = Session.SessionStore(app.sessions().backend(), 0)
+		listTimes = []
+		os.write(iWriteFd, b'r')
+		i = 0
+		while True:
+			try:
+				if os.read(iDoneReadFd, 1) == b'':
+					break
+			except BlockingIOError:
+				pass
+			fStart = time.perf_counter()
+			store.open(listSids[i % len(listSids)]).write_and_close()
+			listTimes.append(time.perf_counter() - fStart)
+			i += 1
+		listTimes.sort()
+		os.write(iWriteFd, '{} {} {}\n'.format(
+			listTimes[-1], listTimes[len(listTimes) // 2], len(listTimes)
+		).encode('ascii'))
+		app.close()
+		os._exit(0)
+	os.close(iWriteFd)
+	os.close(iDoneReadFd)
+	# Wait for the reader to start, then let it run for a while before starting.
+	os.read(iReadFd, 1)
+	time.sleep(0.2)
+	fStart = time.perf_counter()
+	fnCollect()
+	fElapsed = time.perf_counter() - fStart
+	os.close(iDoneWriteFd)
+	os.waitpid(iPid, 0)
+	with os.fdopen(iReadFd, 'r') as fileResults:
+		sMax, sMedian, sCount = fileResults.read().split()
+	return fElapsed, float(sMax), float(sMedian), int(sCount)
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--expired', type = int, default = 300000, help = 'Expired sessions to delete'
+	)
+	argparser.add_argument('--live', type = int, default = 1000, help = 'Live sessions')
+	argparser.add_argument(
+		'--batch-size', type = int, default = 500, help = 'Sessions deleted by each batch'
+	)
+	args = argparser.parse_args()
+
+	with bench_common.TempInstallation() as tmpinst:
+		app = Application.Application(tmpinst.root_dir())
+		backend = app.sessions().backend()
+		db = backend.database()
+		iMaxIdle = app.section('core')['session_gc_max_idle']
+
+		def unbounded():
+			db.execute(
+				'DELETE FROM sessions WHERE lasthit < ?', (int(time.time()) - iMaxIdle, )
+			)
+
+		collector = Session.SessionCollector(
+			backend, iMaxIdle, cBatchRows = args.batch_size, cMaxBatches = 1000000
+		)
+
+		sys.stdout.write('{} expired and {} live sessions\n'.format(args.expired, args.live))
+		sys.stdout.write('{:24} {:>10} {:>16} {:>16} {:>8}\n'.format(
+			'mode', 'GC (ms)', 'max lookup (ms)', 'med lookup (ms)', 'lookups'
+		))
+		for sMode, fnCollect in (
+			('unbounded DELETE', unbounded),
+			('SessionCollector', collector.collect),
+		):
+			listSids = fill_sessions(db, args.expired, args.live)
+			fElapsed, fMax, fMedian, cLookups = measure_lookups(
+				tmpinst.root_dir(), listSids, fnCollect
+			)
+			if backend.count() != args.live:
+				raise Exception('{} sessions left after GC'.format(backend.count()))
+			sys.stdout.write('{:24} {:10.1f} {:16.2f} {:16.3f} {:8}\n'.format(
+				sMode, fElapsed * 1000, fMax * 1000, fMedian * 1000, cLookups
+			))
+			db.execute('DELETE FROM sessions')
+
+		dictMetrics = collector.metrics()
+		sys.stdout.write('Collector: {} batches, latency avg {:.2f} ms, max {:.2f} ms\n'.format(
+			dictMetrics['batches'], dictMetrics['batch_latency_avg'] * 1000,
+			dictMetrics['batch_latency_max'] * 1000
+		))
+		app.close()
+
+	sys.exit(0)
+
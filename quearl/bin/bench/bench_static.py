@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+
+"""Measures the throughput of the pre-forking worker server serving a small and a large static JS
+file (see CoreModule.handle_static_request()), and revalidating them with conditional requests
+answered from the static manifest (see Application._respond_not_modified()).
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import os
+import signal
+import socket
+import sys
+import time
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Server
+from modules.quearl.core import Static
+import quearl_build
+
+
+
+####################################################################################################
+# Functions
+
+def bench_static(sHost, iPort, sUrl, cbExpected, cRequests, cConcurrency, sIfNoneMatch = None):
+	"""Measures the throughput of the server for a static file, using a client process for each
+	concurrent request, so that the clients don’t limit the throughput.
+
+	str sHost
+		Server address.
+	int iPort
+		Server port.
+	str sUrl
+		URL of the file.
+	int cbExpected
+		Size of the file.
+	int cRequests
+		Number of requests to perform.
+	int cConcurrency
+		Number of requests to perform in parallel.
+	[str sIfNoneMatch]
+		Entity tag to send in If-None-Match; if specified, every response must be a 304.
+	float return
+		Requests per second.
+	"""
+
+	fStart = time.perf_counter()
+	with ProcessPoolExecutor(cConcurrency) as executor:
+		tplArgs = (sHost, iPort, sUrl, cbExpected, cRequests // cConcurrency, sIfNoneMatch)
+		list(executor.map(request_static, [tplArgs] * cConcurrency))
+	return cRequests // cConcurrency * cConcurrency / (time.perf_counter() - fStart)
+
+
+def request_static(tplArgs):
+	"""Requests a static file repeatedly, each time on a new connection.
+
+	tuple(str, int, str, int, int, str) tplArgs
+		Server address and port, URL and size of the file, number of requests, and entity tag to
+		send in If-None-Match (or None).
+	"""
+
+	sHost, iPort, sUrl, cbExpected, cRequests, sIfNoneMatch = tplArgs
+	sRequest = 'GET {} HTTP/1.1\r\nHost: {}\r\n'.format(sUrl, sHost)
+	if sIfNoneMatch:
+		sRequest += 'If-None-Match: {}\r\n'.format(sIfNoneMatch)
+		bytesStatus = b'HTTP/1.1 304 '
+	else:
+		bytesStatus = b'HTTP/1.1 200 '
+	bytesRequest = (sRequest + '\r\n').encode()
+	bytearrayBuffer = bytearray(256 * 1024)
+	for i in range(cRequests):
+		with socket.create_connection((sHost, iPort)) as sock:
+			sock.sendall(bytesRequest)
+			cbResponse = 0
+			while True:
+				cbRead = sock.recv_into(bytearrayBuffer)
+				if not cbRead:
+					break
+				if cbResponse == 0 and not bytearrayBuffer.startswith(bytesStatus):
+					raise Exception('Unexpected response for {}'.format(sUrl))
+				cbResponse += cbRead
+		if cbResponse < (0 if sIfNoneMatch else cbExpected):
+			raise Exception('Truncated response for {}'.format(sUrl))
+
+
+def write_js_file(sFileName, cb):
+	"""Writes a JS file of the specified size, along with a gzip-compressed variant.
+
+	str sFileName
+		Path to the file.
+	int cb
+		Size of the file, in bytes.
+	"""
+
+	sLine = 'function f{0}(a, b) { return a * {0} + b; }\n'
+	listLines = []
+	cbTotal = 0
+	i = 0
+	while cbTotal < cb:
+		listLines.append(sLine.replace('{0}', str(i)))
+		cbTotal += len(listLines[-1])
+		i += 1
+	bytesContents = ''.join(listLines).encode('utf-8')[:cb]
+	os.makedirs(os.path.dirname(sFileName), exist_ok = True)
+	with open(sFileName, 'wb') as fileJs:
+		fileJs.write(bytesContents)
+	with open(sFileName + '.gz', 'wb') as fileJs:
+		fileJs.write(gzip.compress(bytesContents, 9, mtime = 0))
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--requests', type = int, default = 20000, help = 'Requests per file')
+	argparser.add_argument('--concurrency', type = int, default = 4, help = 'Parallel clients')
+	argparser.add_argument('--workers', type = int, default = 2, help = 'Worker processes')
+	args = argparser.parse_args()
+
+	listFiles = [
+		('small.js',    2 * 1024),
+		('large.js', 1024 * 1024),
+	]
+	with bench_common.TempInstallation() as tmpinst:
+		sRODataDir = os.path.join(tmpinst.root_dir(), 'data.ro')
+		# Record the files in the static manifest, as quearl_build.py would.
+		manifest = quearl_build.BuildManifest(
+			os.path.join(sRODataDir, 'build.manifest'), tmpinst.root_dir(),
+			Static.StaticManifest.file_name(sRODataDir)
+		)
+		dictETags = {}
+		for sName, cb in listFiles:
+			sFileName = os.path.join(sRODataDir, 'core', 'js', sName)
+			write_js_file(sFileName, cb)
+			dictOutputs = {
+				sOutput: quearl_build.hash_file(sOutput) for sOutput in (sFileName, sFileName + '.gz')
+			}
+			manifest.set_task(sName, '1', {}, dictOutputs)
+			dictETags[sName] = '"{}"'.format(dictOutputs[sFileName])
+		manifest.save()
+		server = Server.PreforkServer(
+			lambda: Application.Application(tmpinst.root_dir()), sHost = '127.0.0.1', iPort = 0,
+			cWorkers = args.workers
+		)
+		sHost, iPort = server.bind()
+		iPid = os.fork()
+		if iPid == 0:
+			try:
+				server.serve_forever()
+			finally:
+				os._exit(0)
+		try:
+			# Wait for the workers to start up.
+			for iAttempt in range(50):
+				try:
+					bench_static(sHost, iPort, '/.static/core/js/small.js', 2048, args.workers * 2, 1)
+					break
+				except ConnectionError:
+					time.sleep(0.1)
+			for sName, cb in listFiles:
+				sUrl = '/.static/core/js/' + sName
+				# Warm up.
+				bench_static(sHost, iPort, sUrl, cb, args.workers * 10, args.concurrency)
+				fRate = bench_static(sHost, iPort, sUrl, cb, args.requests, args.concurrency)
+				sys.stdout.write('{:8}: {:10.1f} requests/s, {:8.1f} MiB/s\n'.format(
+					sName, fRate, fRate * cb / (1024 * 1024)
+				))
+				fRate = bench_static(
+					sHost, iPort, sUrl, cb, args.requests, args.concurrency, dictETags[sName]
+				)
+				sys.stdout.write('{:8}: {:10.1f} requests/s (304 Not Modified)\n'.format(sName, fRate))
+		finally:
+			os.kill(iPid, signal.SIGTERM)
+			os.waitpid(iPid, 0)
+
+	sys.exit(0)
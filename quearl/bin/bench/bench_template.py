@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Compares rendering templates compiled by Template.CompiledTemplate with the approach of
+QlModule::template_subst(), i.e. a regex search over the whole template, then splicing each
+replacement into the string starting from the end. Uses the core module’s templates and a large
+synthetic one.
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+import bench_common
+from modules.quearl.core import Template
+
+
+
+####################################################################################################
+# Functions
+
+def best_time(fn, cRepeats, cCalls):
+	"""Returns the best time taken by a function call over a number of runs.
+
+	callable fn
+		Function to time.
+	int cRepeats
+		Number of runs.
+	int cCalls
+		Number of calls to fn in each run.
+	float return
+		Best time per call, in seconds.
+	"""
+
+	fBest = None
+	for i in range(cRepeats):
+		fStart = time.perf_counter()
+		for j in range(cCalls):
+			fn()
+		fElapsed = (time.perf_counter() - fStart) / cCalls
+		if fBest is None or fElapsed < fBest:
+			fBest = fElapsed
+	return fBest
+
+
+def template_subst_splice(s, listVars, fnConstant):
+	"""Port of QlModule::template_subst(), for comparison.
+
+	str s
+		Template contents.
+	list(dict(str: object)) listVars
+		Variable => value mappings.
+	callable fnConstant
+		Returns the value of a constant, or None.
+	str return
+		Resulting string.
+	"""
+
+	for match in reversed(list(re.finditer(
+		r'\$\$(?P<name>[_0-9A-Za-z]+?)(?::(?P<indent>\d+))?\$\$', s
+	))):
+		sName = match.group('name')
+		oRepl = None
+		if re.search(r'[a-z]', sName):
+			for dictVars in listVars:
+				oRepl = dictVars.get(sName)
+				if oRepl is not None:
+					break
+		else:
+			oRepl = fnConstant(sName)
+		if oRepl is not None:
+			sRepl = str(oRepl)
+			if match.group('indent') and int(match.group('indent')):
+				sRepl = Template.indent(int(match.group('indent')), sRepl + '\n').rstrip(
+					' \t\n\r\0\x0b'
+				)
+			s = s[:match.start()] + sRepl + s[match.end():]
+	return s
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Runs per measurement')
+	argparser.add_argument(
+		'--lines', type = int, default = 5000, help = 'Lines in the synthetic template'
+	)
+	args = argparser.parse_args()
+
+	# Templates to render, as (name, file name).
+	listTemplates = []
+	sTemplateDir = os.path.join(bench_common.QUEARL_DIR, 'module', 'core', 'template')
+	for sName in 'access_denied', 'database_unavailable':
+		listTemplates.append((sName, os.path.join(sTemplateDir, sName + '.xhtml')))
+	# Generate a large template mixing every kind of substitution.
+	sTempDir = tempfile.mkdtemp(prefix = 'quearl-bench-')
+	sSyntheticFileName = os.path.join(sTempDir, 'synthetic.xhtml')
+	with open(sSyntheticFileName, 'w', encoding = 'utf-8') as fileTemplate:
+		for i in range(args.lines):
+			fileTemplate.write(
+				'<tr><td>$$L10N_CORE_LABEL_{}$$</td>'.format(i % 50) +
+				'<td>$$rowValue{}$$</td></tr>\n'.format(i % 20)
+			)
+			if i % 100 == 0:
+				fileTemplate.write('\t<div>\n\t\t$$rowBody:2$$\n\t</div>\n')
+	listTemplates.append(('synthetic ({} lines)'.format(args.lines), sSyntheticFileName))
+
+	dictVars = {'rowValue{}'.format(i): 'Value {}'.format(i) for i in range(20)}
+	dictVars['rowBody'] = '<p>First</p>\n<p>Second</p>\n'
+	dictConstants = {}
+	cache = Template.TemplateCache(16)
+	try:
+		sys.stdout.write('{:28} {:>8} {:>12} {:>12} {:>12} {:>12}\n'.format(
+			'template', 'bytes', 'splice (µs)', 'compile (µs)', 'render (µs)', 'cached (µs)'
+		))
+		for sName, sFileName in listTemplates:
+			with open(sFileName, 'r', encoding = 'utf-8-sig') as fileTemplate:
+				sTemplate = fileTemplate.read()
+			# Provide a value for every constant, so that every substitution is performed.
+			for sConstant in re.findall(r'\$\$([_0-9A-Z]+)\$\$', sTemplate):
+				dictConstants[sConstant] = 'Value of ' + sConstant
+			listVars = [dictVars]
+			cCalls = max(1, 200000 // len(sTemplate))
+
+			template = Template.CompiledTemplate(sTemplate)
+			if template.render(listVars, dictConstants.get) != template_subst_splice(
+				sTemplate, listVars, dictConstants.get
+			):
+				raise Exception('Output mismatch for {}'.format(sName))
+			fSplice = best_time(
+				lambda: template_subst_splice(sTemplate, listVars, dictConstants.get),
+				args.repeat, cCalls
+			)
+			fCompile = best_time(lambda: Template.CompiledTemplate(sTemplate), args.repeat, cCalls)
+			fRender = best_time(
+				lambda: template.render(listVars, dictConstants.get), args.repeat, cCalls
+			)
+			# A cache hit only costs a stat() call on top of rendering.
+			fCached = best_time(
+				lambda: cache.get(sFileName).render(listVars, dictConstants.get), args.repeat, cCalls
+			)
+			sys.stdout.write('{:28} {:8} {:12.1f} {:12.1f} {:12.1f} {:12.1f}\n'.format(
+				sName, len(sTemplate.encode('utf-8')),
+				fSplice * 1000000, fCompile * 1000000, fRender * 1000000, fCached * 1000000
+			))
+	finally:
+		os.remove(sSyntheticFileName)
+		os.rmdir(sTempDir)
+
+	sys.exit(0)
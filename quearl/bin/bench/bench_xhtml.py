@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+
+
+"""Measures the time to first byte, total time, number of writes and peak memory of XHTML pages
+streamed by Response.XhtmlResponseEntity with different buffer sizes, compared to collecting the
+whole page before sending it as QlXhtmlResponseEntity does.
+"""
+
+import argparse
+import io
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+import bench_common
+from modules.quearl.core import Application
+from modules.quearl.core import Request
+from modules.quearl.core import Response
+
+
+
+####################################################################################################
+# Functions
+
+def bench_page(app, cRows, bBuffered, sink):
+	"""Generates and sends a page listing the specified number of items.
+
+	Application.Application app
+		Application.
+	int cRows
+		Number of table rows in the page.
+	bool bBuffered
+		If True, the whole page is collected before being sent.
+	ChunkSink sink
+		Destination of the response entity; None to discard it.
+	tuple(float, float, int) return
+		Time to the first byte of the <head> and to the first byte of the <body>, total time (all in
+		seconds), and number of writes.
+	"""
+
+	fStart = time.perf_counter()
+	request = Request.Request({
+		'HTTP_ACCEPT'    : 'text/html,application/xhtml+xml',
+		'HTTP_HOST'      : 'localhost',
+		'PATH_INFO'      : '/items',
+		'REQUEST_METHOD' : 'GET',
+		'wsgi.input'     : io.BytesIO(),
+		'wsgi.url_scheme': 'http',
+	}, 1024 * 1024)
+	entity = Response.XhtmlResponseEntity(app, request)
+	entity.set_title('Items')
+	entity.include_css('core/css/main.css')
+	entity.include_js('core/js/bundle.0123456789abcdef.js')
+	entity.add_body('<table>\n')
+	entity.add_body(generate_rows(cRows))
+	entity.add_body('</table>\n')
+	if bBuffered:
+		iterEntity = [b''.join(entity)]
+	else:
+		iterEntity = entity
+	fHead = fBody = None
+	cWrites = 0
+	for bytesChunk in iterEntity:
+		if fHead is None:
+			fHead = time.perf_counter() - fStart
+		elif fBody is None:
+			fBody = time.perf_counter() - fStart
+		if sink:
+			sink.write(bytesChunk)
+		cWrites += 1
+	entity.close()
+	request.close()
+	fTotal = time.perf_counter() - fStart
+	return fHead, fBody if fBody is not None else fHead, fTotal, cWrites
+
+
+def generate_rows(cRows):
+	"""Generates the rows of a table listing items, one row at a time, as a page handler streaming
+	query results would.
+
+	int cRows
+		Number of rows.
+	str yield
+		Markup of a row.
+	"""
+
+	for i in range(cRows):
+		yield (
+			'<tr><td class="id">{0}</td><td><a href="/item/{0}">Item number {0}</a></td>'
+			'<td>{1:.2f}</td></tr>\n'
+		).format(i, i * 1.5)
+
+
+def measure_peak_memory(app, cRows, bBuffered):
+	"""Measures the peak memory allocated while generating a page; see bench_page().
+
+	Application.Application app
+		Application.
+	int cRows
+		Number of table rows in the page.
+	bool bBuffered
+		If True, the whole page is collected before being sent.
+	int return
+		Peak memory, in bytes.
+	"""
+
+	tracemalloc.start()
+	try:
+		bench_page(app, cRows, bBuffered, None)
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+
+####################################################################################################
+# Classes
+
+
+class ChunkSink(object):
+	"""Sends chunks over a socket, framed as with chunked transfer encoding, to a thread that
+	discards them; this gives each write the cost of a write to a client.
+	"""
+
+	def __init__(self):
+		"""Constructor."""
+
+		self._m_sockWrite, self._m_sockRead = socket.socketpair()
+		self._m_thread = threading.Thread(target = self._drain)
+		self._m_thread.start()
+
+
+	def close(self):
+		"""Closes the socket, and waits for the draining thread to terminate."""
+
+		self._m_sockWrite.close()
+		self._m_thread.join()
+		self._m_sockRead.close()
+
+
+	def _drain(self):
+		"""Reads from the socket until it’s closed."""
+
+		bytearrayBuffer = bytearray(256 * 1024)
+		while self._m_sockRead.recv_into(bytearrayBuffer):
+			pass
+
+
+	def write(self, bytesData):
+		"""Sends a chunk.
+
+		bytes bytesData
+			Chunk contents.
+		"""
+
+		self._m_sockWrite.sendall(b'%x\r\n%b\r\n' % (len(bytesData), bytesData))
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument('--rows', type = int, default = 100000, help = 'Table rows per page')
+	argparser.add_argument('--repeat', type = int, default = 5, help = 'Pages per configuration')
+	args = argparser.parse_args()
+
+	listConfigs = [
+		('collected, one write', 16384, True),
+		('streamed, no buffer ', 1, False),
+		('streamed, 4 KiB     ', 4096, False),
+		('streamed, 16 KiB    ', 16384, False),
+		('streamed, 64 KiB    ', 65536, False),
+	]
+	for sLabel, cchBuffer, bBuffered in listConfigs:
+		with bench_common.TempInstallation({'response_buffer_size': cchBuffer}) as tmpinst:
+			app = Application.Application(tmpinst.root_dir())
+			try:
+				sink = ChunkSink()
+				try:
+					# Warm up.
+					bench_page(app, 100, bBuffered, sink)
+					listResults = [
+						bench_page(app, args.rows, bBuffered, sink) for i in range(args.repeat)
+					]
+				finally:
+					sink.close()
+				cbPeak = measure_peak_memory(app, args.rows, bBuffered)
+			finally:
+				app.close()
+		fHead, fBody, fTotal, cWrites = min(listResults, key = lambda tpl: tpl[2])
+		sys.stdout.write(
+			'{}: head {:8.2f} ms, body {:8.2f} ms, total {:8.2f} ms, {:7} writes, '
+			'peak {:8.1f} KiB\n'.format(
+				sLabel, fHead * 1000, fBody * 1000, fTotal * 1000, cWrites, cbPeak / 1024
+			)
+		)
+
+	sys.exit(0)
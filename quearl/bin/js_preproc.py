@@ -18,27 +18,54 @@
 # not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------------------------------
 
-"""JavaScript preprocessor. Minifies JS files and generates compressed copies."""
+"""JavaScript preprocessor. Minifies JS files, bundles them, and generates compressed copies."""
 
-import gzip
+import argparse
+import hashlib
+import json
 import os
 import re
 import sys
 
+import localize
+import quearl_build
+
 
 
 ####################################################################################################
 # JsPreproc
 
 class JsPreproc(object):
-	"""JavaScript preprocessor. Minifies JavaScript files and generates compressed copies."""
+	"""JavaScript preprocessor. Minifies JavaScript files, bundles them, and generates compressed
+	copies.
+
+	A module can list the JS files to bundle, in load order, in js/bundle.list. Its bundle will then
+	be generated in the module’s read-only data directory as js/bundle.HASH.js; additionally, for
+	each locale the module is localized for, js/bundle-LOCALE.HASH.js will be generated including the
+	module’s localization for that locale. HASH is derived from the contents of the bundle, so each
+	bundle can be cached forever; the current file name of each bundle is stored in a PHP file, named
+	js/bundle.php or js/bundle-LOCALE.php, which evaluates to it. Each bundle also gets a source map
+	(js/bundle….HASH.js.map) mapping each of its lines back to the minified files it was made of,
+	which in turn have the same line numbers as their sources.
+	"""
+
+	# Matches the name of a bundle or of any file generated along with it.
+	_smc_reBundleFileName = re.compile(
+		r'^(?P<name>bundle(?:-[a-z]{2}-[a-z]{2})?)\.(?P<hash>[0-9a-f]{16})\.js(?:\.[a-z]+)?$'
+	)
+	# Matches the contents of a bundle PHP file, capturing the name of the bundle it points to.
+	_smc_reBundlePhp = re.compile(r"return\s+'(?P<name>[^'/]+)'\s*;")
+	# Characters used to encode VLQs in source maps.
+	_smc_sBase64Chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
 
 	@classmethod
-	def update_module(cls, module):
-		"""Preprocesses every JS file in a given module.
+	def update_module(cls, module, engine):
+		"""Adds a task to preprocess each JS file in a given module to a build.
 
 		QuearlModule module
 			Module for which to preprocess JS files.
+		quearl_build.BuildEngine engine
+			Build to add the tasks to.
 		"""
 
 		sJsDir = os.path.join(module.base_dir(), 'js')
@@ -46,93 +73,350 @@ class JsPreproc(object):
 			# This module has no JavaScript files.
 			return
 
-		for sFileName in os.listdir(sJsDir):
+		sOutputDir = os.path.join(module.rodata_dir(), 'js')
+		for sFileName in sorted(os.listdir(sJsDir)):
 			if sFileName.endswith('.js'):
-				cls.preprocess_js_file(module, os.path.join(sJsDir, sFileName))
+				sInputFileName = os.path.join(sJsDir, sFileName)
+				sOutputFileName = os.path.join(sOutputDir, sFileName)
+				engine.add_task(
+					'Processing JS file {}'.format(sInputFileName),
+					# Changes to the preprocessor also require processing the file again.
+					[sInputFileName, os.path.abspath(__file__)],
+					[sOutputFileName] + quearl_build.compressed_file_names(sOutputFileName),
+					cls.preprocess_js_file, sInputFileName, sOutputFileName,
+					sVersion = quearl_build.compressors_version()
+				)
+
+		sBundleListFileName = os.path.join(sJsDir, 'bundle.list')
+		if not os.path.isfile(sBundleListFileName):
+			# This module has no bundle.
+			return
+		listSources = []
+		with open(sBundleListFileName, 'r') as fileBundleList:
+			for sLine in fileBundleList:
+				sLine = sLine.strip()
+				# Skip empty lines and comments.
+				if sLine and sLine[0] != '#':
+					listSources.append(os.path.join(sJsDir, sLine))
+		# Bundles to generate, as (name, .l10n file).
+		listBundles = [('bundle', None)]
+		sL10nDir = module.l10n_dir()
+		if sL10nDir is not None:
+			for sFileName in sorted(os.listdir(sL10nDir)):
+				if sFileName.endswith('.l10n'):
+					listBundles.append((
+						'bundle-' + sFileName[:-len('.l10n')], os.path.join(sL10nDir, sFileName)
+					))
+		for sName, sL10nFileName in listBundles:
+			listInputs = listSources + [
+				sBundleListFileName, os.path.abspath(__file__), os.path.abspath(localize.__file__)
+			]
+			if sL10nFileName:
+				listInputs.append(sL10nFileName)
+			engine.add_task(
+				'Bundling JS files for module {} into {}'.format(module.abbr(), sName),
+				listInputs,
+				[os.path.join(sOutputDir, sName + '.php')],
+				cls.write_bundle, module.abbr(), sOutputDir, sName, listSources, sL10nFileName,
+				sVersion = quearl_build.compressors_version()
+			)
+
+
+	@classmethod
+	def write_bundle(cls, sModuleAbbr, sOutputDir, sName, listSources, sL10nFileName):
+		"""Generates a bundle, named after a hash of its contents, with its source map and the PHP
+		file containing its name; versions of the bundle older than the one the PHP file previously
+		pointed to are deleted, so that pages already served keep working during a deploy.
+
+		str sModuleAbbr
+			Abbreviated name of the module to which the bundle belongs.
+		str sOutputDir
+			Directory where the bundle will be generated.
+		str sName
+			Name of the bundle, without hash and extension.
+		list(str) listSources
+			Full paths to the JS source files to be bundled, in load order.
+		str sL10nFileName
+			Full path to the .l10n file whose JS localization will be included at the start of the
+			bundle, or None.
+		tuple(list(str), list(str)) return
+			Report on the generated files; full paths to the bundle, its compressed variants and its
+			source map, whose names depend on the hash.
+		"""
+
+		# Parts of the bundle, as (source name, minified source). Source names are the static paths
+		# of the minified files, which have the same line numbers.
+		listParts = []
+		if sL10nFileName:
+			sLocale, dictL10nEntries = localize.l10n_generator.load_l10n(sL10nFileName)
+			listParts.append((
+				sModuleAbbr + '/l10n/js/' + sLocale + '.js',
+				localize.l10n_generator.l10n_to_js(sModuleAbbr.upper(), dictL10nEntries)
+			))
+		for sSourceFileName in listSources:
+			with open(sSourceFileName, 'r') as fileInput:
+				sJsSource = fileInput.read()
+			listParts.append((
+				sModuleAbbr + '/js/' + os.path.basename(sSourceFileName), cls.minify(sJsSource)
+			))
+
+		listBundle = []
+		listMapParts = []
+		for sSource, sMinSource in listParts:
+			if not sMinSource.endswith('\n'):
+				sMinSource += '\n'
+			# Start each file with a semicolon, so that it can’t be parsed as a continuation of the
+			# last statement of the previous file (e.g. “a = b” followed by “(function() {…})()”).
+			listBundle.append(';' + sMinSource)
+			listMapParts.append((sSource, 0, sMinSource.count('\n')))
+		sBundle = ''.join(listBundle)
+
+		sHash = hashlib.sha1(sBundle.encode('utf-8')).hexdigest()[:16]
+		sBundleFileName = '{}.{}.js'.format(sName, sHash)
+		sBundlePath = os.path.join(sOutputDir, sBundleFileName)
+		listReport = quearl_build.write_static_file(sBundlePath, sBundle)
+		quearl_build.replace_file(
+			sBundlePath + '.map', cls.line_source_map(sBundleFileName, listMapParts)
+		)
+
+		# Find out which version of the bundle the PHP file currently points to.
+		sPhpFileName = os.path.join(sOutputDir, sName + '.php')
+		sPrevHash = None
+		try:
+			with open(sPhpFileName, 'r') as filePhp:
+				match = cls._smc_reBundlePhp.search(filePhp.read())
+		except FileNotFoundError:
+			match = None
+		if match:
+			match = cls._smc_reBundleFileName.match(match.group('name'))
+			if match:
+				sPrevHash = match.group('hash')
+
+		# Point the PHP file to the new bundle.
+		quearl_build.replace_file(
+			sPhpFileName,
+			'<?php\n'
+			'# -*- coding: utf-8; mode: php; tab-width: 3 -*-\n'
+			'# AUTOMATICALLY-GENERATED FILE - do not edit!\n'
+			'\n'
+			"return '{}';\n"
+			'\n'
+			'?>'.format(sBundleFileName)
+		)
+		listReport.append('  Wrote {}'.format(sPhpFileName))
+
+		# Delete any versions of the bundle older than the previous one.
+		for sFileName in os.listdir(sOutputDir):
+			match = cls._smc_reBundleFileName.match(sFileName)
+			if match and match.group('name') == sName and match.group('hash') not in (
+				sHash, sPrevHash
+			):
+				os.remove(os.path.join(sOutputDir, sFileName))
+		return listReport, (
+			[sBundlePath] + quearl_build.compressed_file_names(sBundlePath) + [sBundlePath + '.map']
+		)
 
 
 	@classmethod
-	def preprocess_js_file(cls, module, sInputFileName):
+	def preprocess_js_file(cls, sInputFileName, sOutputFileName):
 		"""Pre-processes a JavaScript file, generating minified and minified+compressed versions.
 
-		QuearlModule module
-			Module to which the file belongs.
 		str sInputFileName
 			Full path to the source JS file.
+		str sOutputFileName
+			Full path to the minified JS file to generate; see quearl_build.write_static_file() for the
+			names of the compressed versions.
+		list(str) return
+			Report on the generated files.
 		"""
 
-		# Get the last modification time of the source JS file.
-		dtInputFile = os.path.getmtime(sInputFileName)
-
-		sOutputDir = os.path.join(module.rodata_dir(), 'js')
-		sOutputFileName = os.path.join(sOutputDir, os.path.basename(sInputFileName))
-		try:
-			# Try to get the last modification time of the output file.
-			dtOutputFile = os.path.getmtime(sOutputFileName)
-			if dtInputFile <= dtOutputFile:
-				# The file doesn’t need to be re-ore-processed.
-				return
-		except OSError:
-			# Assume that the file does not exist.
-			pass
-
 		# Read and pre-process the source JS file.
-		sys.stdout.write('Processing JS file {}\n'.format(sInputFileName))
 		with open(sInputFileName, 'r') as fileInput:
 			sJsSource = fileInput.read()
 
-		# Generate the output.
-		sys.stdout.write('  Minifying JavaScript\n')
-		sMinSource = cls.minify(sJsSource)
+		# Generate and store the output.
+		return quearl_build.write_static_file(sOutputFileName, cls.minify(sJsSource))
 
-		# Make sure the destination directory exists.
-		try:
-			os.makedirs(sOutputDir, 0o755, True)
-		except OSError:
-			# The subdirectory was already there, or couldn’t be created. In the latter case,
-			# opening the file will fail, so an exception will be raised in any case.
-			pass
-
-		# Write a gzipped version of the same file.
-		sys.stdout.write('  Writing {}.gz\n'.format(sOutputFileName))
-		with open(sOutputFileName + '.gz', 'wb') as fileOutput:
-			fileOutput.write(gzip.compress(sMinSource.encode('utf-8')))
-		# Store the generated file.
-		sys.stdout.write('  Writing {}\n'.format(sOutputFileName))
-		with open(sOutputFileName, 'w') as fileOutput:
-			fileOutput.write(sMinSource)
-
-
-	@staticmethod
-	def minify(s):
+
+	@classmethod
+	def line_source_map(cls, sFileName, listParts):
+		"""Generates a source map (version 3) that maps each line of a file to a line of one of its
+		sources; columns are not mapped.
+
+		str sFileName
+			Name of the generated file.
+		list(tuple(str, int, int)) listParts
+			Consecutive parts of the generated file, as (source name, first line of the source, number
+			of lines).
+		str return
+			JSON source map.
+		"""
+
+		def vlq(i):
+			# Encode the sign in the least significant bit, then 5 bits per base-64 digit, least
+			# significant first, with bit 5 of each digit set if more digits follow.
+			i = (-i << 1) | 1 if i < 0 else i << 1
+			s = ''
+			while True:
+				iDigit = i & 0x1f
+				i >>= 5
+				if i:
+					iDigit |= 0x20
+				s += cls._smc_sBase64Chars[iDigit]
+				if not i:
+					return s
+
+		listSources = []
+		listLines = []
+		iLastSource = 0
+		iLastLine = 0
+		for sSource, iFirstLine, cLines in listParts:
+			if sSource not in listSources:
+				listSources.append(sSource)
+			iSource = listSources.index(sSource)
+			for iLine in range(iFirstLine, iFirstLine + cLines):
+				# Each line has a single segment: generated column 0, source, source line, column 0;
+				# all fields but the first are relative to the previous segment.
+				listLines.append('A' + vlq(iSource - iLastSource) + vlq(iLine - iLastLine) + 'A')
+				iLastSource = iSource
+				iLastLine = iLine
+		return json.dumps({
+			'version' : 3,
+			'file'    : sFileName,
+			'sources' : listSources,
+			'names'   : [],
+			'mappings': ';'.join(listLines),
+		})
+
+
+	# Matches one token of JavaScript source, or a run of characters that can be copied to the output
+	# as-is (“code”: anything without whitespace, quotes or slashes).
+	_smc_reToken = re.compile(r'''
+		(?P<nl>\r\n?|[\n\u2028\u2029])|
+		(?P<ws>[^\S\r\n\u2028\u2029]+)|
+		(?P<linecomment>//[^\r\n\u2028\u2029]*)|
+		(?P<blockcomment>/\*.*?\*/)|
+		(?P<string>
+			'(?:[^'\\\r\n\u2028\u2029]|\\(?:\r\n|.))*'|
+			"(?:[^"\\\r\n\u2028\u2029]|\\(?:\r\n|.))*"|
+			`(?:[^`\\]|\\.)*`
+		)|
+		(?P<slash>/)|
+		(?P<code>[^\s'"`/]+)
+	''', re.DOTALL | re.VERBOSE)
+	# Matches a regular expression literal, after its opening slash.
+	_smc_reRegExp = re.compile(r'''
+		(?![*/])
+		(?:
+			[^/\\\[\r\n\u2028\u2029]|\\[^\r\n\u2028\u2029]|
+			\[(?:[^\]\\\r\n\u2028\u2029]|\\[^\r\n\u2028\u2029])*\]
+		)+
+		/[\w$]*
+	''', re.VERBOSE)
+	# Matches line terminators.
+	_smc_reNewLines = re.compile(r'\r\n?|[\n\u2028\u2029]')
+	# Matches a keyword at the end of a run of code, after which a slash starts a regular expression
+	# literal instead of being a division operator.
+	_smc_reKeywordBeforeRegExp = re.compile(
+		r'(?<![\w$])(?:case|delete|do|else|in|instanceof|new|return|throw|typeof|void)$'
+	)
+	# Characters that are part of an identifier, keyword or number.
+	_smc_reWordChar = re.compile(r'[\w$]')
+
+
+	@classmethod
+	def minify(cls, s):
 		"""Returns a minified version of the input JavaScript source code.
 
 		A key point of this minification is that line numbers of the input and the output must match;
 		this allows having meaningful line numbers reported back to the server whenever an error
 		(exception) occurs on the remote client.
 
+		The source is tokenized in a single pass, so that string and regular expression literals are
+		never altered; comments are removed (keeping any line terminators in multi-line ones), except
+		for JScript conditional compilation comments, and whitespace is only kept where it separates
+		two tokens that would otherwise be merged.
+
 		str s
 			JavaScript source.
 		str return
 			Minified JavaScript source.
 		"""
 
-		# Delete C-style comments that don’t extent into multiple lines. Since removing the comment
-		# could join two tokens (e.g. “a/*b*/c” => “ac”), replace them with a single space, but also
-		# make sure that the pattern captures any surrounding whitespace, to mitigate the unnecessary
-		# whitespace we’re adding.
-		# TODO: this is not string- nor regexp-safe.
-		s = re.sub(r'[ \t\f\v]*/\*.*?\*/[ \t\f\v]*', ' ', s)
-
-		# TODO: this is not string- nor regexp-safe, and can break multi-line C-style comments.
-		s = re.sub(r'//.*$', '', s, flags = re.MULTILINE)
-
-		# Trim leading whitespace on each line.
-		s = re.sub(r'^[ \t\f\v]+', '', s, flags = re.MULTILINE)
-		# Trim trailing whitespace on each line.
-		s = re.sub(r'[ \t\f\v]+$', '', s, flags = re.MULTILINE)
-
-		return s
+		reToken = cls._smc_reToken
+		reWordChar = cls._smc_reWordChar
+		listOutput = []
+		# Last character of the last token written to the output; empty at the start of a line.
+		sLastChar = ''
+		# True if a token was followed by whitespace or a comment.
+		bSpace = False
+		# True if a slash would start a regular expression literal, instead of being a division.
+		bRegExpAllowed = True
+		ich = 0
+		cch = len(s)
+		while ich < cch:
+			match = reToken.match(s, ich)
+			if not match:
+				raise SyntaxError('line {}: unterminated literal or comment'.format(
+					len(cls._smc_reNewLines.findall(s, 0, ich)) + 1
+				))
+			sKind = match.lastgroup
+			sToken = match.group()
+			ich = match.end()
+			if sKind == 'nl':
+				listOutput.append(sToken)
+				sLastChar = ''
+				bSpace = False
+				continue
+			elif sKind == 'ws' or sKind == 'linecomment':
+				bSpace = True
+				continue
+			elif sKind == 'blockcomment':
+				if not sToken.startswith('/*@'):
+					listNewLines = cls._smc_reNewLines.findall(sToken)
+					if listNewLines:
+						# The comment acts as a line terminator; keep just its line terminators.
+						listOutput.extend(listNewLines)
+						sLastChar = ''
+						bSpace = False
+					else:
+						bSpace = True
+					continue
+				# JScript conditional compilation comment (e.g. “/*@cc_on … @*/”): Internet Explorer
+				# executes its contents, so keep it as it is, line terminators included.
+			elif sKind == 'slash':
+				matchRegExp = bRegExpAllowed and cls._smc_reRegExp.match(s, ich)
+				if matchRegExp:
+					sToken += matchRegExp.group()
+					ich = matchRegExp.end()
+				# A slash after a regular expression literal is a division, and vice versa.
+				bRegExpAllowed = not matchRegExp
+			elif sKind == 'string':
+				bRegExpAllowed = False
+			else:
+				sLast = sToken[-1]
+				if reWordChar.match(sLast):
+					bRegExpAllowed = bool(cls._smc_reKeywordBeforeRegExp.search(sToken))
+				else:
+					bRegExpAllowed = sLast not in ')]'
+
+			if bSpace and sLastChar:
+				sFirstChar = sToken[0]
+				# Only keep a space if removing it would merge two tokens: two words (“var x”, “1 .x”),
+				# two increment/decrement operators (“a + +b”), or two slashes (“a / /b/”), which would
+				# start a comment.
+				if (
+					reWordChar.match(sLastChar) and (
+						reWordChar.match(sFirstChar) or sFirstChar == '.'
+					) or
+					sLastChar in '+-' and sFirstChar == sLastChar or
+					sLastChar == '/' and sFirstChar in '/*'
+				):
+					listOutput.append(' ')
+			listOutput.append(sToken)
+			sLastChar = sToken[-1]
+			bSpace = False
+		return ''.join(listOutput)
 
 
 
@@ -146,11 +430,16 @@ if __name__ == '__main__':
 	sys.path.append(sDir)
 	import quearl_inst
 
+	argparser = argparse.ArgumentParser(description = __doc__)
+	quearl_build.BuildEngine.add_arguments(argparser)
+	args = argparser.parse_args()
+
 	# Obtain the Quearl installation subdirectory and instantiate a QuearlInst for it.
 	qinst = quearl_inst.QuearlInst(os.path.normpath(os.path.join(sDir, '..')))
 	# Update all modules.
+	engine = quearl_build.BuildEngine(qinst, args.jobs)
 	for module in qinst.modules():
-		JsPreproc.update_module(module)
+		JsPreproc.update_module(module, engine)
 
-	sys.exit(0)
+	sys.exit(0 if engine.run() else 1)
 
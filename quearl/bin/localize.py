@@ -20,11 +20,14 @@
 
 """Utilities for localization files (.l10n)."""
 
-import gzip
+import argparse
 import os
 import re
 import sys
 
+import quearl_build
+from modules.quearl.core import L10n
+
 
 
 ####################################################################################################
@@ -34,11 +37,14 @@ class l10n_generator(object):
 	"""Generates localization files for all programming languages from the localized string files."""
 
 	@classmethod
-	def update_module(cls, module):
-		"""Updates every localization file in a given module.
+	def update_module(cls, module, engine):
+		"""Adds a task to update the localization files generated from each l10n file in a given
+		module to a build.
 
 		QuearlModule module
 			Module for which to update the localization.
+		quearl_build.BuildEngine engine
+			Build to add the tasks to.
 		"""
 
 		sL10nDir = module.l10n_dir()
@@ -46,77 +52,123 @@ class l10n_generator(object):
 			# This module has no localization files.
 			return
 
-		for sFileName in os.listdir(sL10nDir):
+		sDefaultL10nFileName = os.path.join(sL10nDir, engine.qinst().default_locale() + '.l10n')
+		if not os.path.isfile(sDefaultL10nFileName):
+			sDefaultL10nFileName = None
+		for sFileName in sorted(os.listdir(sL10nDir)):
 			if sFileName.endswith('.l10n'):
-				cls.update_from_l10n_file(module, os.path.join(sL10nDir, sFileName))
+				sL10nFileName = os.path.join(sL10nDir, sFileName)
+				sLocale = sFileName[:-len('.l10n')]
+				listInputs = [sL10nFileName, os.path.abspath(__file__), os.path.abspath(L10n.__file__)]
+				# Entries missing from the file are taken from the default locale.
+				if sDefaultL10nFileName and sDefaultL10nFileName != sL10nFileName:
+					sFallbackL10nFileName = sDefaultL10nFileName
+					listInputs.append(sFallbackL10nFileName)
+				else:
+					sFallbackL10nFileName = None
+				engine.add_task(
+					'Compiling l10n catalog for {}'.format(sL10nFileName),
+					listInputs,
+					[os.path.join(module.rodata_dir(), 'l10n', 'cat', sLocale + '.cat')],
+					cls.compile_catalog, module.rodata_dir(), sL10nFileName, sFallbackL10nFileName
+				)
+				listOutputs = []
+				for sType in 'php', 'js':
+					sOutputFileName = os.path.join(
+						module.rodata_dir(), 'l10n', sType, sLocale + '.' + sType
+					)
+					listOutputs.append(sOutputFileName)
+					if sType == 'js':
+						listOutputs.extend(quearl_build.compressed_file_names(sOutputFileName))
+				engine.add_task(
+					'Processing l10n file {}'.format(sL10nFileName),
+					# Changes to the generator also require processing the file again.
+					[sL10nFileName, os.path.abspath(__file__)],
+					listOutputs,
+					cls.update_from_l10n_file, module.abbr(), module.rodata_dir(), sL10nFileName,
+					sVersion = quearl_build.compressors_version()
+				)
 
 
 	@classmethod
-	def update_from_l10n_file(cls, module, sL10nFileName):
+	def update_from_l10n_file(cls, sModuleAbbr, sRODataDir, sL10nFileName):
 		"""Creates/updates the localization files generated from the specified l10n file.
 
-		QuearlModule module
-			Module to which the file belongs.
+		str sModuleAbbr
+			Abbreviated name of the module to which the file belongs.
+		str sRODataDir
+			Read-only data directory of the module.
 		str sL10nFileName
 			Full path to the .l10n file.
+		list(str) return
+			Report on the generated files.
 		"""
 
-		sModulePrefix = module.abbr().upper()
-		dictL10nEntries = None
-		# Find out the locale from the l10n file name.
-		match = re.search(
-			r'[\/](?P<locale>(?P<language>[a-z]{2})-(?P<country>[a-z]{2}))\.l10n$', sL10nFileName
-		)
-		sLocale = match.group('locale')
-		sLanguage = match.group('language')
-		sCountry = match.group('country')
-		# Get the last modification time of the .l10n file.
-		dtL10nFile = os.path.getmtime(sL10nFileName)
+		sModulePrefix = sModuleAbbr.upper()
+		sLocale, dictL10nEntries = cls.load_l10n(sL10nFileName)
 
+		listReport = []
 		for sType in 'php', 'js':
-			sOutputDir = os.path.join(module.rodata_dir(), 'l10n', sType)
-			sOutputFileName = os.path.join(sOutputDir, sLocale + '.' + sType)
-			try:
-				# Try to get the last modification time of the output file.
-				dtOutputFile = os.path.getmtime(sOutputFileName)
-				if dtL10nFile <= dtOutputFile:
-					# The file doesn’t need to be re-generated.
-					continue
-			except OSError:
-				# Assume that the file does not exist.
-				pass
-
-			# Make sure we read and processed the source .l10n file…
-			if dictL10nEntries is None:
-				# …and if we didn’t, do it now.
-				sys.stdout.write('Processing l10n file {}\n'.format(sL10nFileName))
-				dictL10nEntries = cls.parse_l10n(sL10nFileName)
-				# Add a few more constants.
-				dictL10nEntries['L10N_INCLUDED'  ] = True
-				dictL10nEntries['LANG_ISO639'    ] = sLanguage
-				dictL10nEntries['COUNTRY_ISO3166'] = sCountry
+			sOutputFileName = os.path.join(sRODataDir, 'l10n', sType, sLocale + '.' + sType)
 
 			# Generate the output.
-			sys.stdout.write('  Generating localization in {} format\n'.format(sType.upper()))
 			sFile = getattr(cls, 'l10n_to_' + sType)(sModulePrefix, dictL10nEntries)
 
-			# Make sure the destination directory exists.
-			try:
-				os.makedirs(sOutputDir, 0o755, True)
-			except OSError:
-				# The subdirectory was already there, or couldn’t be created. In the latter case,
-				# opening the file will fail, so an exception will be raised in any case.
-				pass
-
 			# Store the generated file.
 			if sType == 'js':
-				# Also write a gzipped version of the same file.
-				sys.stdout.write('  Writing {}.gz\n'.format(sOutputFileName))
-				with open(sOutputFileName + '.gz', 'wb') as fileOutput:
-					fileOutput.write(gzip.compress(sFile.encode('utf-8')))
-			sys.stdout.write('  Writing {}\n'.format(sOutputFileName))
-			with open(sOutputFileName, 'w') as fileOutput:
-				fileOutput.write(sFile)
+				# Also write compressed versions of the same file.
+				listReport.extend(quearl_build.write_static_file(sOutputFileName, sFile))
+			else:
+				quearl_build.replace_file(sOutputFileName, sFile)
+				listReport.append('  Wrote {}'.format(sOutputFileName))
+		return listReport
+
+
+	@classmethod
+	def compile_catalog(cls, sRODataDir, sL10nFileName, sFallbackL10nFileName):
+		"""Compiles a .l10n file into a binary catalog for the Python runtime; see
+		modules.quearl.core.L10n.L10nCatalog.
+
+		str sRODataDir
+			Read-only data directory of the module.
+		str sL10nFileName
+			Full path to the .l10n file.
+		str sFallbackL10nFileName
+			Full path to the .l10n file for the default locale, whose entries will be used for any
+			entries missing from sL10nFileName; None if sL10nFileName is for the default locale.
+		"""
+
+		sLocale, dictL10nEntries = cls.load_l10n(sL10nFileName)
+		if sFallbackL10nFileName:
+			sFallbackLocale, dictFallbackEntries = cls.load_l10n(sFallbackL10nFileName)
+			dictFallbackEntries.update(dictL10nEntries)
+			dictL10nEntries = dictFallbackEntries
+		sOutputFileName = os.path.join(sRODataDir, 'l10n', 'cat', sLocale + '.cat')
+		# Replace the catalog instead of overwriting it, since it may be memory-mapped by running
+		# processes.
+		quearl_build.replace_file(sOutputFileName, L10n.L10nCatalog.build(dictL10nEntries))
+
+
+	@classmethod
+	def load_l10n(cls, sL10nFileName):
+		"""Parses a .l10n file, adding the constants that are implicitly defined for every locale.
+
+		str sL10nFileName
+			Full path to the .l10n file.
+		tuple(str, dict(object)) return
+			Locale of the file, and localized constants.
+		"""
+
+		# Find out the locale from the l10n file name.
+		match = re.search(
+			r'[\/](?P<locale>(?P<language>[a-z]{2})-(?P<country>[a-z]{2}))\.l10n$', sL10nFileName
+		)
+		dictL10nEntries = cls.parse_l10n(sL10nFileName)
+		# Add a few more constants.
+		dictL10nEntries['L10N_INCLUDED'  ] = True
+		dictL10nEntries['LANG_ISO639'    ] = match.group('language')
+		dictL10nEntries['COUNTRY_ISO3166'] = match.group('country')
+		return match.group('locale'), dictL10nEntries
 
 
 	@staticmethod
@@ -239,11 +291,16 @@ if __name__ == '__main__':
 	sys.path.append(sDir)
 	import quearl_inst
 
+	argparser = argparse.ArgumentParser(description = __doc__)
+	quearl_build.BuildEngine.add_arguments(argparser)
+	args = argparser.parse_args()
+
 	# Obtain the Quearl installation subdirectory and instantiate a QuearlInst for it.
 	qinst = quearl_inst.QuearlInst(os.path.normpath(os.path.join(sDir, '..')))
 	# Update all modules.
+	engine = quearl_build.BuildEngine(qinst, args.jobs)
 	for module in qinst.modules():
-		l10n_generator.update_module(module)
+		l10n_generator.update_module(module, engine)
 
-	sys.exit(0)
+	sys.exit(0 if engine.run() else 1)
 
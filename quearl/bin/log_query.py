@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Queries the logs, reading only the entries that match, e.g.:
+
+   log_query.py --category E_USER_ERROR --date 2013-12-15 --from 14:00 --to 14:05
+"""
+
+import argparse
+import calendar
+import os
+import sys
+import time
+
+
+
+####################################################################################################
+# Functions
+
+def parse_time(sTime, sDate):
+	"""Converts a time specified on the command line into a timestamp.
+
+	str sTime
+		Time, in one of the formats “HH:MM”, “HH:MM:SS” (both UTC, on sDate) or “YYYY-MM-DDTHH:MM”,
+		“YYYY-MM-DDTHH:MM:SS” (UTC).
+	str sDate
+		Date to use if sTime doesn’t include one, as “YYYY-MM-DD”.
+	float return
+		Timestamp, or None if sTime is None.
+	"""
+
+	if sTime is None:
+		return None
+	if 'T' not in sTime:
+		sTime = sDate + 'T' + sTime
+	if sTime.count(':') == 1:
+		sTime += ':00'
+	return float(calendar.timegm(time.strptime(sTime, '%Y-%m-%dT%H:%M:%S')))
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load quearl_inst and the Quearl Python modules.
+	sys.path.append(sDir)
+	import quearl_inst
+	from modules.quearl.core import Log
+
+	argparser = argparse.ArgumentParser(
+		description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter
+	)
+	argparser.add_argument('--log', default = '', help = 'Log name (default: the default log)')
+	argparser.add_argument(
+		'--date', default = time.strftime('%Y-%m-%d', time.gmtime()),
+		help = 'Date for --from/--to times without a date, as YYYY-MM-DD (default: today, UTC)'
+	)
+	argparser.add_argument('--from', dest = 'time_from', help = 'Only entries logged at or after')
+	argparser.add_argument('--to', dest = 'time_to', help = 'Only entries logged before')
+	argparser.add_argument(
+		'--category', action = 'append', help = 'Only entries in this category (repeatable)'
+	)
+	argparser.add_argument('--offset', type = int, default = 0, help = 'Matching entries to skip')
+	argparser.add_argument('--limit', type = int, help = 'Maximum number of entries to output')
+	argparser.add_argument(
+		'--page', action = 'store_true',
+		help = 'Output a self-contained XML log document (default --limit: 100), viewable with ' +
+		       'log.xsl if saved in the logs directory'
+	)
+	argparser.add_argument(
+		'--export', action = 'store_true',
+		help = 'Like --page, but output every matching entry; this converts compact (JSON lines) ' +
+		       'logs to XML'
+	)
+	argparser.add_argument(
+		'--count', action = 'store_true', help = 'Only output the number of matching entries'
+	)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory and instantiate a QuearlInst for it.
+	qinst = quearl_inst.QuearlInst(os.path.normpath(os.path.join(sDir, '..')))
+	logreader = Log.LogReader(qinst.log_dir())
+	fFrom = parse_time(args.time_from, args.date)
+	fTo = parse_time(args.time_to, args.date)
+	if args.time_from is None and args.time_to is None:
+		# Default to the whole day.
+		fFrom = parse_time('00:00', args.date)
+		fTo = fFrom + 24 * 60 * 60
+
+	if args.count:
+		sys.stdout.write('{}\n'.format(logreader.count(args.log, fFrom, fTo, args.category)))
+	elif args.page or args.export:
+		sXslPath = os.path.relpath(
+			os.path.join(qinst.root_dir(), 'module', 'core', 'log.xsl'), qinst.log_dir()
+		).replace(os.sep, '/')
+		for s in logreader.query_page(
+			sXslPath, args.log, fFrom, fTo, args.category, args.offset,
+			args.limit if args.limit is not None or args.export else 100
+		):
+			sys.stdout.write(s)
+	else:
+		for s in logreader.query(args.log, fFrom, fTo, args.category, args.offset, args.limit):
+			sys.stdout.write(s)
+
+	sys.exit(0)
@@ -0,0 +1,840 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Definition of the application class."""
+
+from configparser import ConfigParser
+import json
+import os
+import re
+import time
+
+from modules.quearl.core import Config
+from modules.quearl.core import Db
+from modules.quearl.core import L10n
+from modules.quearl.core import Log
+from modules.quearl.core import Module
+from modules.quearl.core import Profile
+from modules.quearl.core import Request
+from modules.quearl.core import Response
+from modules.quearl.core import Session
+from modules.quearl.core import Static
+from modules.quearl.core import Template
+
+
+
+####################################################################################################
+# Classes
+
+
+class Application(object):
+   """Stores any non-session-specific data (see [DOC:8261 QlApplication]), and acts as the WSGI
+   application that processes requests.
+
+   Unlike QlApplication, an instance of this class is meant to be long-lived: it’s created once per
+   worker process (or once per CGI invocation), loading the bootstrap configuration only at that
+   time, and is then invoked for every request handled by that process.
+
+   Application data is kept in a Config.SharedConfig, so that every process sees the same data
+   without taking any locks; sections are published to it when their configuration files change.
+   """
+
+   # Matches the bundle file name returned by the PHP files generated by JsPreproc.
+   _smc_reJsBundlePhp = re.compile(r"return\s+'(?P<name>[^'/]+)'\s*;")
+   # Minimum time, in seconds, between checks of whether a template resolution index changed.
+   _smc_fTemplateIndexCheckInterval = 1.0
+
+
+   def __init__(self, sRootDir = None):
+      """Constructor.
+
+      [str sRootDir]
+         Quearl installation directory, i.e. the directory containing the “module” directory;
+         defaults to the installation this file belongs to.
+      """
+
+      fStart = time.perf_counter()
+      if sRootDir is None:
+         # Root directory of this installation; this file is bin/modules/quearl/core/Application.py.
+         sRootDir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            '..', '..', '..', '..'
+         ))
+      self._m_sRootDir = sRootDir
+      sBootstrapFileName = self.bootstrap_conf_file_name()
+      dictSection = self.load_section('core', sBootstrapFileName)
+      # Adjust the bootstrapped “core” section in the same way QlApplication does.
+      dictSection['load_modules'] = [
+         sModule for sModule in re.split(r'\s*,\s*', dictSection.get('load_modules', '')) if sModule
+      ]
+      dictSection['request_body_spool_size'] = int(
+         dictSection.get('request_body_spool_size', 1024 * 1024)
+      )
+      dictSection['response_buffer_size'] = int(dictSection.get('response_buffer_size', 16384))
+      dictSection.setdefault('default_locale', 'en-us')
+      dictSection.setdefault('static_host', '')
+      dictSection['static_file_cache_size'] = int(dictSection.get('static_file_cache_size', 256))
+      dictSection['template_cache_size'] = int(dictSection.get('template_cache_size', 256))
+      dictSection.setdefault('session_backend', 'modules.quearl.core.Session.SqliteSessionBackend')
+      dictSection['session_cache_size'] = int(dictSection.get('session_cache_size', 64))
+      dictSection['session_gc_max_idle'] = int(dictSection.get('session_gc_max_idle', 86400))
+      dictSection['session_gc_batch_size'] = int(dictSection.get('session_gc_batch_size', 500))
+      dictSection['session_gc_min_interval'] = float(dictSection.get('session_gc_min_interval', 5))
+      dictSection['session_gc_max_interval'] = float(
+         dictSection.get('session_gc_max_interval', 900)
+      )
+      dictSection.setdefault('database_driver', 'modules.quearl.core.Db.SqliteDriver')
+      dictSection.setdefault(
+         'database_lpath', os.path.join(dictSection['rwdata_lpath'], 'core', 'database.sqlite')
+      )
+      dictSection['database_pool_size'] = int(dictSection.get('database_pool_size', 4))
+      dictSection['database_max_lifetime'] = float(dictSection.get('database_max_lifetime', 3600))
+      dictSection['database_health_check_interval'] = float(
+         dictSection.get('database_health_check_interval', 30)
+      )
+      dictSection['database_statement_cache_size'] = int(
+         dictSection.get('database_statement_cache_size', 64)
+      )
+      dictSection['profile_sample_rate'] = float(dictSection.get('profile_sample_rate', 0))
+      dictSection.setdefault(
+         'profile_lpath', os.path.join(dictSection['rwdata_lpath'], 'core', 'profile')
+      )
+      dictSection['profile_flush_interval'] = float(dictSection.get('profile_flush_interval', 10))
+      # Publish the “core” section, unless it’s already been published with the same contents. The
+      # whole section is compared, rather than just the file’s modification time, since defaults
+      # for missing entries depend on the code, which might be newer than the published section.
+      self._m_config = Config.SharedConfig(os.path.join(dictSection['rwdata_lpath'], 'core'))
+      dictSection['__ql_mtime'] = os.stat(sBootstrapFileName).st_mtime_ns
+      dictApp = self._m_config.snapshot()
+      if not dictApp or Config.thaw(dictApp.get('core')) != dictSection:
+         self.publish_section('core', dictSection, True)
+      self._m_logger = Log.Logger(self)
+      # Loaded on first use.
+      self._m_staticmanifest = Static.StaticManifest(dictSection['rodata_lpath'])
+      self._m_l10ncatalogs = L10n.L10nCatalogs(
+         dictSection['rodata_lpath'], dictSection['default_locale'], self._m_staticmanifest
+      )
+      # Profiling costs nothing beyond a few checks for None if disabled.
+      if dictSection['profile_sample_rate'] > 0:
+         self._m_profiler = Profile.Profiler(
+            dictSection['profile_lpath'], dictSection['profile_sample_rate'],
+            dictSection['profile_flush_interval']
+         )
+      else:
+         self._m_profiler = None
+      self._m_templatecache = Template.TemplateCache(dictSection['template_cache_size'])
+      # File name of the JS bundle of each module, as {(module, locale): file name}, valid for the
+      # static manifest generation _m_iJsBundlesGeneration; see js_bundle_file_name().
+      self._m_dictJsBundles = {}
+      self._m_iJsBundlesGeneration = None
+      # Template resolution index of each module, as {module: (time of the next check, signature,
+      # directories, {type: {name: {locale: path}}})}; see _template_index().
+      self._m_dictTemplateIndices = {}
+      # Modules are only imported when a request is routed to them.
+      self._m_modules = Module.ModuleRegistry(self)
+      # Created by sessions() and db() on first use.
+      self._m_sessionstore = None
+      self._m_dbpool = None
+      if self._m_profiler is not None:
+         self._m_profiler.record_phase('bootstrap', time.perf_counter() - fStart)
+
+
+   def __call__(self, dictEnv, fnStartResponse):
+      """WSGI entry point; processes a request.
+
+      dict(str: object) dictEnv
+         WSGI environment.
+      callable fnStartResponse
+         WSGI start_response() callable.
+      iterable(bytes) return
+         Response entity.
+      """
+
+      profiler = self._m_profiler
+      bProfile = profiler is not None and profiler.begin_request()
+      if bProfile:
+         fStart = time.perf_counter()
+      dictCore = self.section('core')
+      request = Request.Request(
+         dictEnv, dictCore['request_body_spool_size'],
+         dictCore['static_host'], dictCore.get('static_root_rpath')
+      )
+      if request.is_url_static_file():
+         # Revalidate cached static files without initializing any module.
+         tplResponse = self._respond_not_modified(request)
+         if tplResponse is None:
+            # Static responses are handled in full by a single module; if no module can serve the
+            # file, process this as a request for a regular resource.
+            tplResponse = self._m_modules.route_static_request(request)
+      else:
+         tplResponse = None
+      if tplResponse is None:
+         tplResponse = self._m_modules.route_request(request)
+         if tplResponse is not None and isinstance(tplResponse[2], Response.XhtmlResponseEntity):
+            # Let modules add their scripts and style sheets, like QlCoreModule::handle_request().
+            self._m_modules.augment_response_head(request, tplResponse[2])
+      if bProfile:
+         profiler.record_phase('handler', time.perf_counter() - fStart)
+      if tplResponse is not None:
+         sStatus, listHeaders, iterEntity = tplResponse
+         fnStartResponse(sStatus, listHeaders)
+         if isinstance(iterEntity, Static.FileEntity):
+            return self._send_file_entity(request, iterEntity)
+         return self._send_entity(request, iterEntity)
+      # No Content-Length: the response is streamed as it’s generated, so the server will either
+      # use chunked transfer encoding or close the connection to signal the end of the entity.
+      fnStartResponse('200 OK', [
+         ('Content-Type', 'text/plain; charset=utf-8'),
+      ])
+      return self._send_entity(request, self._generate_response(request))
+
+
+   def bootstrap_conf_file_name(self):
+      """Returns the full path to the bootstrap configuration file.
+
+      str return
+         Path to core/bootstrap.conf.
+      """
+
+      return os.path.join(self._m_sRootDir, 'config', 'core', 'bootstrap.conf')
+
+
+   def close(self):
+      """Releases any resources held by the application; must be called before the process exits.
+      """
+
+      if self._m_sessionstore is not None:
+         self._m_sessionstore.close()
+      if self._m_dbpool is not None:
+         self._m_dbpool.close()
+      if self._m_profiler is not None:
+         self._m_profiler.flush()
+      self._m_l10ncatalogs.close()
+      self._m_logger.close()
+      self._m_config.close()
+
+
+   def collect_sessions(self, fnWait):
+      """Deletes expired sessions with a Session.SessionCollector, until told to stop; meant to be
+      run outside of request processing, e.g. by the server’s background process. After each pass,
+      the collector’s metrics are published as the “session_gc” section of the application data.
+
+      callable fnWait
+         Waits for the number of seconds passed as its argument; returns False if the collector
+         must stop instead of running another pass.
+      """
+
+      dictCore = self.section('core')
+      collector = Session.SessionCollector(
+         self.sessions().backend(),
+         dictCore['session_gc_max_idle'],
+         cBatchRows   = dictCore['session_gc_batch_size'],
+         fMinInterval = dictCore['session_gc_min_interval'],
+         fMaxInterval = dictCore['session_gc_max_interval']
+      )
+
+      def report(dictMetrics):
+         self.publish_section('session_gc', dictMetrics)
+         if dictMetrics['last_pass_rows']:
+            self._m_logger.write(
+               'DEBUG',
+               'Deleted {} expired sessions'.format(dictMetrics['last_pass_rows']),
+               '<context>' + ''.join(
+                  '<var name="{}">{}</var>'.format(sName, Log.Logger.enc(str(oValue)))
+                  for sName, oValue in sorted(dictMetrics.items())
+               ) + '</context>'
+            )
+
+      collector.run(fnWait, report)
+
+
+   def db(self):
+      """Returns the pool of database connections of this process, creating it (and its driver, as
+      selected by the “database_driver” setting) if necessary. Connections are established on first
+      use, so this doesn’t fail if the database is unavailable; ConnectionPool.acquire() does.
+
+      quearl.core.Db.ConnectionPool return
+         Connection pool.
+      """
+
+      if self._m_dbpool is None:
+         dictCore = self.section('core')
+         self._m_dbpool = Db.ConnectionPool(
+            Module.load_class(dictCore['database_driver'])(self),
+            cMaxIdle             = dictCore['database_pool_size'],
+            fMaxLifetime         = dictCore['database_max_lifetime'],
+            fHealthCheckInterval = dictCore['database_health_check_interval'],
+            cMaxStatements       = dictCore['database_statement_cache_size'],
+            fnObserveQuery       = (
+               self._m_profiler.record_query if self._m_profiler is not None else None
+            )
+         )
+      return self._m_dbpool
+
+
+   def _generate_response(self, request):
+      """Generates the response entity for a request.
+
+      Request request
+         Request being processed.
+      bytes yield
+         Chunk of the response entity.
+      """
+
+      yield b'Environment:\r\n'
+      for sName, oValue in request.environ().items():
+         yield '{}={}\r\n'.format(sName, oValue).encode('utf-8')
+      yield b'\r\nstdin:\r\n'
+      # Stream the request entity back, without ever holding all of it in memory.
+      for bytesChunk in request.body():
+         yield bytesChunk
+
+
+   def js_bundle_file_name(self, sModuleAbbr, sLocale):
+      """Returns the current file name of the JS bundle of a module, preferring the bundle that
+      includes the module’s localization for a locale, like
+      QlXhtmlResponseEntity::include_js_bundle(). The PHP files naming the bundles (see JsPreproc
+      in quearl/bin/js_preproc.py) are only read again after quearl_build.py rebuilds static files.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      str sLocale
+         Locale.
+      str return
+         Path to the bundle, relative to the static root, or None if the module has no bundle.
+      """
+
+      iGeneration = self._m_staticmanifest.generation()
+      if iGeneration != self._m_iJsBundlesGeneration:
+         self._m_dictJsBundles = {}
+         self._m_iJsBundlesGeneration = iGeneration
+      tplKey = (sModuleAbbr, sLocale)
+      try:
+         return self._m_dictJsBundles[tplKey]
+      except KeyError:
+         pass
+      sDir = os.path.join(self.section('core')['rodata_lpath'], sModuleAbbr, 'js')
+      sBundleFileName = None
+      for sName in 'bundle-' + sLocale, 'bundle':
+         try:
+            with open(os.path.join(sDir, sName + '.php'), 'r', encoding = 'utf-8') as filePhp:
+               match = self._smc_reJsBundlePhp.search(filePhp.read())
+         except OSError:
+            continue
+         if match:
+            sBundleFileName = sModuleAbbr + '/js/' + match.group('name')
+            break
+      self._m_dictJsBundles[tplKey] = sBundleFileName
+      return sBundleFileName
+
+
+   def l10n_catalog(self, sModuleAbbr, sLocale = None):
+      """Returns the localization catalog of a module for a locale; see L10n.L10nCatalogs.catalog().
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      [str sLocale]
+         Locale; defaults to the default locale.
+      quearl.core.L10n.L10nCatalog return
+         Catalog, or None if the module is not localized.
+      """
+
+      return self._m_l10ncatalogs.catalog(sModuleAbbr, sLocale)
+
+
+   def l10n_constant(self, sName, sLocale = None):
+      """Returns the value of a localized constant, as defined by the PHP localization files.
+
+      str sName
+         Name of the constant, as “L10N_MODULE_NAME”; MODULE is matched against the known module
+         abbreviations, longest first, since both it and NAME can contain underscores.
+      [str sLocale]
+         Locale; defaults to the default locale.
+      object return
+         Value of the constant, or None if not defined.
+      """
+
+      if not sName.startswith('L10N_'):
+         return None
+      sName = sName[len('L10N_'):]
+      for sModuleAbbr in self._m_modules.abbrs():
+         sModulePrefix = sModuleAbbr.upper() + '_'
+         if sName.startswith(sModulePrefix):
+            catalog = self._m_l10ncatalogs.catalog(sModuleAbbr, sLocale)
+            if catalog is not None:
+               oValue = catalog.get(sName[len(sModulePrefix):])
+               if oValue is not None:
+                  return oValue
+      return None
+
+
+   def load_section(self, sSection, sFileName):
+      """Loads a section from a configuration file, without merging it into the application data.
+
+      str sSection
+         Section to be loaded.
+      str sFileName
+         Path of the file to load.
+      dict(str: str) return
+         Contents of the newly-loaded section.
+      """
+
+      with open(sFileName, 'r', encoding = 'utf-8') as fileConf:
+         sConf = fileConf.read()
+      # Strip the BOM, if present.
+      if sConf.startswith('\ufeff'):
+         sConf = sConf[1:]
+      conf = ConfigParser(
+         comment_prefixes      = '#',
+         delimiters            = ':',
+         empty_lines_in_values = False,
+         interpolation         = None
+      )
+      conf.read_string('[{}]\n{}'.format(sSection, sConf))
+      dictSection = dict(conf[sSection])
+      for sEntry, sValue in dictSection.items():
+         if sEntry.endswith('_lpath'):
+            # Make entries ending in “_lpath” absolute paths.
+            dictSection[sEntry] = os.path.join(self._m_sRootDir, sValue)
+      return dictSection
+
+
+   def load_template(self, sModuleAbbr, sType, sName, oVars = None, sLocale = None):
+      """Loads a template, applying substitutions; see QlModule::load_template() and
+      Template.CompiledTemplate. Compiled templates are cached by the application.
+
+      str sModuleAbbr
+         Abbreviated name of the module the template belongs to.
+      str sType
+         Template type (same as the file name extension).
+      str sName
+         Template name.
+      [dict(str: object)|list(dict(str: object)) oVars]
+         Variable => value mapping, or list of them.
+      [str sLocale]
+         Desired locale; defaults to the default locale.
+      str return
+         Template contents, or None if the template could not be found.
+      """
+
+      sFileName = self.template_file_name(sModuleAbbr, sType, sName, sLocale)
+      if sFileName is None:
+         return None
+      if oVars is None:
+         listVars = []
+      elif isinstance(oVars, dict):
+         listVars = [oVars]
+      else:
+         listVars = oVars
+      bProfile = self._m_profiler is not None and self._m_profiler.is_sampling()
+      if bProfile:
+         fStart = time.perf_counter()
+      try:
+         template = self._m_templatecache.get(sFileName)
+      except OSError:
+         # The template resolution index is only checked for changes once in a while, so it can list
+         # a template that was just deleted; check for the files themselves, and reload the index
+         # on next use.
+         self._m_dictTemplateIndices.pop(sModuleAbbr, None)
+         sFileName = self.template_file_name(sModuleAbbr, sType, sName, sLocale, False)
+         if sFileName is None:
+            return None
+         template = self._m_templatecache.get(sFileName)
+      s = template.render(listVars, lambda sConstant: self.l10n_constant(sConstant, sLocale))
+      if bProfile:
+         self._m_profiler.record_phase('render', time.perf_counter() - fStart)
+      return s
+
+
+   def _load_template_index(self, sModuleAbbr):
+      """Loads the template resolution index of a module, generated by quearl_inst.TemplateIndexer,
+      converting the file names in it to full paths. The index is only used if it’s up to date with
+      the templates directory, i.e. if the directory and its subdirectories were not modified after
+      the index was generated.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      tuple(tuple, dict(str: int), dict(str: dict(str: dict(str: str)))) return
+         Signature of the index (see _template_index_signature()), directories listed in it, and
+         index, as {type: {name: {locale: path}}}; the latter is None if the module has no valid
+         index.
+      """
+
+      sTemplateDir = os.path.join(self._m_sRootDir, 'module', sModuleAbbr, 'template')
+      tplIndexStat = None
+      dictDirs = {}
+      try:
+         with open(
+            self._template_index_file_name(sModuleAbbr), 'r', encoding = 'utf-8'
+         ) as fileIndex:
+            # Stat the file being read, so that if it’s replaced after this, the next check will
+            # notice.
+            st = os.fstat(fileIndex.fileno())
+            tplIndexStat = (st.st_ino, st.st_size, st.st_mtime_ns)
+            dictIndex = json.load(fileIndex)
+         dictDirs = dict(dictIndex['dirs'])
+         dictTemplates = dictIndex['templates']
+         sIndexLocale = dictIndex['default_locale']
+      except (OSError, ValueError, KeyError, TypeError):
+         return (tplIndexStat, ()), dictDirs, None
+      tplMTimes = self._template_dir_mtimes(sTemplateDir, dictDirs)
+      tplSignature = (tplIndexStat, tplMTimes)
+      if sIndexLocale != self.section('core')['default_locale'] or tplMTimes != tuple(
+         dictDirs[sRelDir] for sRelDir in sorted(dictDirs)
+      ):
+         return tplSignature, dictDirs, None
+      for dictNames in dictTemplates.values():
+         for dictLocales in dictNames.values():
+            for sLocale, sFileName in dictLocales.items():
+               dictLocales[sLocale] = os.path.join(sTemplateDir, sFileName)
+      return tplSignature, dictDirs, dictTemplates
+
+
+   def logger(self):
+      """Returns the application’s logger.
+
+      quearl.core.Log.Logger return
+         Logger.
+      """
+
+      return self._m_logger
+
+
+   def module(self, sAbbr):
+      """Returns a module, importing its code if that didn’t happen yet.
+
+      str sAbbr
+         Abbreviated name of the module.
+      quearl.core.Module.Module return
+         Module, or None if the module doesn’t exist or has no Python class.
+      """
+
+      return self._m_modules.get(sAbbr)
+
+
+   def profiler(self):
+      """Returns the profiler of this process.
+
+      quearl.core.Profile.Profiler return
+         Profiler, or None if profiling is disabled.
+      """
+
+      return self._m_profiler
+
+
+   def publish_section(self, sSection, dictNewSection, bReplace = False):
+      """Publishes a new version of a section of the application data, merging it with the current
+      one in the same way as QlApplication::merge_section(): entries in dictNewSection override
+      those in the current section, and entries set to None are removed from it.
+
+      str sSection
+         Name of the section.
+      dict(str: object) dictNewSection
+         Contents of the newly-loaded section.
+      [bool bReplace]
+         If True, the section is replaced instead of merged.
+      """
+
+      def merge(dictApp):
+         if bReplace or sSection not in dictApp:
+            dictApp[sSection] = {}
+         dictCurrSection = dictApp[sSection]
+         for sEntry, oValue in dictNewSection.items():
+            if oValue is None:
+               dictCurrSection.pop(sEntry, None)
+            else:
+               dictCurrSection[sEntry] = oValue
+
+      self._m_config.update(merge)
+
+
+   def _respond_not_modified(self, request):
+      """Responds to a conditional request for a static file whose entity tag, according to the
+      static manifest, matches If-None-Match. This only needs the manifest (no module, session or
+      database), so revalidating a static file costs next to nothing.
+
+      Request request
+         Request for a static file.
+      tuple(str, list(tuple(str, str)), iterable(bytes)) return
+         304 response, or None if the request must be processed normally.
+      """
+
+      sIfNoneMatch = request.environ().get('HTTP_IF_NONE_MATCH')
+      if not sIfNoneMatch:
+         return None
+      sUrl = request.url()
+      # Only consider files of a type that would be served; the manifest also lists other files.
+      if not self._m_modules.serves_static_file(sUrl):
+         return None
+      tplETag = self._m_staticmanifest.etag(sUrl, request.accepted_encodings())
+      if tplETag is None:
+         return None
+      sETag, bVary = tplETag
+      if not Static.etag_matches(sIfNoneMatch, sETag):
+         return None
+      return '304 Not Modified', Static.not_modified_headers(sUrl, sETag, bVary), ()
+
+
+   def root_dir(self):
+      """Returns the Quearl installation directory.
+
+      str return
+         Directory.
+      """
+
+      return self._m_sRootDir
+
+
+   def section(self, sSection):
+      """Returns a section of the application data. This only costs a check of the current
+      generation of the shared application data, so there’s no need to keep the section around.
+
+      str sSection
+         Name of the section.
+      mapping(str: object) return
+         Read-only section contents.
+      """
+
+      return self._m_config.snapshot()[sSection]
+
+
+   def _send_entity(self, request, iterEntity):
+      """Yields a response entity, releasing the request once done.
+
+      Request request
+         Request being processed.
+      iterable(bytes) iterEntity
+         Response entity.
+      bytes yield
+         Chunk of the response entity.
+      """
+
+      profiler = self._m_profiler
+      bProfile = profiler is not None and profiler.is_sampling()
+      if bProfile:
+         fStart = time.perf_counter()
+      try:
+         for bytesChunk in iterEntity:
+            yield bytesChunk
+      finally:
+         if hasattr(iterEntity, 'close'):
+            iterEntity.close()
+         request.close()
+         if profiler is not None:
+            if bProfile:
+               profiler.record_phase('send', time.perf_counter() - fStart)
+            profiler.end_request()
+
+
+   def _send_file_entity(self, request, entity):
+      """Returns a file response entity to the server as is, so that the server can send it with
+      os.sendfile(); the request is released once the entity is closed. See _send_entity().
+
+      Request request
+         Request being processed.
+      Static.FileEntity entity
+         Response entity.
+      Static.FileEntity return
+         Response entity.
+      """
+
+      profiler = self._m_profiler
+      bProfile = profiler is not None and profiler.is_sampling()
+      if bProfile:
+         fStart = time.perf_counter()
+
+      def on_close():
+         request.close()
+         if profiler is not None:
+            if bProfile:
+               profiler.record_phase('send', time.perf_counter() - fStart)
+            profiler.end_request()
+
+      entity.set_close_callback(on_close)
+      return entity
+
+
+   def sessions(self):
+      """Returns the session store, creating it (and its backend, as selected by the
+      “session_backend” setting) if necessary.
+
+      quearl.core.Session.SessionStore return
+         Session store.
+      """
+
+      if self._m_sessionstore is None:
+         dictCore = self.section('core')
+         self._m_sessionstore = Session.SessionStore(
+            Module.load_class(dictCore['session_backend'])(self), dictCore['session_cache_size'],
+            self._m_profiler
+         )
+      return self._m_sessionstore
+
+
+   def static_manifest(self):
+      """Returns the manifest of the static files generated by quearl/bin/quearl_build.py.
+
+      quearl.core.Static.StaticManifest return
+         Static files manifest.
+      """
+
+      return self._m_staticmanifest
+
+
+   def template_file_name(self, sModuleAbbr, sType, sName, sLocale = None, bUseIndex = True):
+      """Returns the file name of a template, in the same way as QlModule::get_template_filename().
+      If the module has an up-to-date template resolution index, it’s used instead of checking for
+      the existence of each candidate file, so that no system calls are needed other than the
+      periodic checks of the index (see _template_index()).
+
+      str sModuleAbbr
+         Abbreviated name of the module the template belongs to.
+      str sType
+         Template type (same as the file name extension).
+      str sName
+         Template name.
+      [str sLocale]
+         Desired locale; defaults to the default locale.
+      [bool bUseIndex]
+         If False, the template resolution index is not used.
+      str return
+         Full path to the template file, or None if the template could not be found.
+      """
+
+      sDefaultLocale = self.section('core')['default_locale']
+      if sLocale is None:
+         sLocale = sDefaultLocale
+      sFileNameBase = os.path.join(self._m_sRootDir, 'module', sModuleAbbr, 'template', sName)
+      # Try, in order: the template localized for the requested locale, the one localized for the
+      # default locale, and the non-localized (locale-neutral) template.
+      listFileNames = [
+         ('sUserL10nFileName',    '{}.l10n_{}.{}'.format(sFileNameBase, sLocale, sType)),
+         ('sDefL10nFileName',     '{}.l10n_{}.{}'.format(sFileNameBase, sDefaultLocale, sType)),
+         ('sL10nNeutralFileName', '{}.{}'.format(sFileNameBase, sType)),
+      ]
+      dictIndex = self._template_index(sModuleAbbr) if bUseIndex else None
+      if dictIndex is not None:
+         # The index already applied the fallbacks, and lists every existing template.
+         dictLocales = dictIndex.get(sType, {}).get(sName)
+         if dictLocales:
+            sFileName = dictLocales.get(sLocale) or dictLocales.get('')
+            if sFileName:
+               return sFileName
+      else:
+         for sVar, sFileName in listFileNames:
+            if os.path.isfile(sFileName):
+               return sFileName
+      # Log an error, showing the file names that were checked for.
+      self._m_logger.write(
+         'E_USER_ERROR',
+         'Template not found: {} (type: {}, locale: {})'.format(sName, sType, sLocale),
+         '<context>' + ''.join(
+            '<var name="{}">{}</var>'.format(sVar, Log.Logger.enc(sFileName))
+            for sVar, sFileName in listFileNames
+         ) + '</context>'
+      )
+      return None
+
+
+   @staticmethod
+   def _template_dir_mtimes(sTemplateDir, dictDirs):
+      """Returns the current modification times of the template directories listed in a template
+      resolution index.
+
+      str sTemplateDir
+         Templates directory of the module.
+      dict(str: int) dictDirs
+         Directories listed in the index, relative to sTemplateDir.
+      tuple(int) return
+         Modification time of each directory, in the order of their sorted names; None for missing
+         directories.
+      """
+
+      listMTimes = []
+      for sRelDir in sorted(dictDirs):
+         try:
+            listMTimes.append(os.stat(os.path.join(sTemplateDir, sRelDir)).st_mtime_ns)
+         except OSError:
+            listMTimes.append(None)
+      return tuple(listMTimes)
+
+
+   def _template_index(self, sModuleAbbr):
+      """Returns the template resolution index of a module, loading it if necessary. At most once
+      per _smc_fTemplateIndexCheckInterval, the index file and the directories listed in it are
+      checked for changes, so that the index is reloaded after quearl_build.py (or quearl_watch.py)
+      updates it, and stops being used as soon as the templates change without it being updated.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      dict(str: dict(str: dict(str: str))) return
+         Index, as {type: {name: {locale: path}}}, or None if the module has no valid index.
+      """
+
+      tplEntry = self._m_dictTemplateIndices.get(sModuleAbbr)
+      fNow = time.monotonic()
+      if tplEntry is not None and fNow < tplEntry[0]:
+         return tplEntry[3]
+      if tplEntry is not None and self._template_index_signature(
+         sModuleAbbr, tplEntry[2]
+      ) == tplEntry[1]:
+         tplLoaded = tplEntry[1:]
+      else:
+         tplLoaded = self._load_template_index(sModuleAbbr)
+      tplEntry = (fNow + self._smc_fTemplateIndexCheckInterval,) + tplLoaded
+      self._m_dictTemplateIndices[sModuleAbbr] = tplEntry
+      return tplEntry[3]
+
+
+   def _template_index_file_name(self, sModuleAbbr):
+      """Returns the path to the template resolution index of a module.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      str return
+         Path to the index.
+      """
+
+      return os.path.join(
+         self.section('core')['rodata_lpath'], sModuleAbbr, 'template', 'index.json'
+      )
+
+
+   def _template_index_signature(self, sModuleAbbr, dictDirs):
+      """Returns a tuple that changes whenever the template resolution index of a module, or the
+      template directories listed in it, change.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      dict(str: int) dictDirs
+         Directories listed in the index, as last loaded.
+      tuple(tuple(int, int, int), tuple(int)) return
+         Inode number, size and modification time of the index (None if missing), and modification
+         time of each directory (see _template_dir_mtimes()).
+      """
+
+      try:
+         st = os.stat(self._template_index_file_name(sModuleAbbr))
+         tplIndexStat = (st.st_ino, st.st_size, st.st_mtime_ns)
+      except OSError:
+         tplIndexStat = None
+      return tplIndexStat, self._template_dir_mtimes(
+         os.path.join(self._m_sRootDir, 'module', sModuleAbbr, 'template'), dictDirs
+      )
+
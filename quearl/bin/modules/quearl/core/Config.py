@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Shared application configuration classes."""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import types
+
+
+
+####################################################################################################
+# Functions
+
+def freeze(o):
+   """Returns an immutable version of a configuration value: dictionaries become read-only
+   mappings, and lists become tuples.
+
+   object o
+      Value to freeze.
+   object return
+      Immutable value.
+   """
+
+   if isinstance(o, dict):
+      return types.MappingProxyType({sKey: freeze(oValue) for sKey, oValue in o.items()})
+   elif isinstance(o, list):
+      return tuple(freeze(oValue) for oValue in o)
+   else:
+      return o
+
+
+def thaw(o):
+   """Returns a mutable copy of a value returned by freeze().
+
+   object o
+      Value to copy.
+   object return
+      Mutable copy.
+   """
+
+   if isinstance(o, types.MappingProxyType):
+      return {sKey: thaw(oValue) for sKey, oValue in o.items()}
+   elif isinstance(o, tuple):
+      return [thaw(oValue) for oValue in o]
+   else:
+      return o
+
+
+
+####################################################################################################
+# Classes
+
+
+class SharedConfig(object):
+   """Application data (see [DOC:8261 QlApplication]) shared by every process of the Python
+   runtime, as a sequence of immutable snapshots, each identified by a generation number.
+
+   Unlike QlApplication, readers never take locks: the current generation number is kept in a small
+   file that every process memory-maps, so checking whether the snapshot a process is using is still
+   current only takes a memory read; the snapshot is only read again from disk after a new
+   generation is published. Writers serialize among themselves with a lock file, write the new
+   snapshot to a file of its own, and only then publish its generation number.
+
+   Files, all in the directory passed to the constructor:
+   •  app.gen: magic (4 bytes), format version (uint32), current generation (uint64), little endian;
+   •  app.<generation>.json: snapshot for each generation, as {section: {entry: value}};
+   •  app.gen.lock: lock file for writers.
+   """
+
+   # Header of the generation file.
+   _HEADER = struct.Struct('<4sIQ')
+   # Generation file magic number and format version.
+   _MAGIC = b'QLAG'
+   _VERSION = 1
+
+
+   def __init__(self, sDir):
+      """Constructor.
+
+      str sDir
+         Directory containing the configuration files.
+      """
+
+      self._m_sDir = sDir
+      self._m_sGenFileName = os.path.join(sDir, 'app.gen')
+      self._m_mm = None
+      # Generation and contents of the snapshot in use.
+      self._m_iGeneration = 0
+      self._m_dictSnapshot = None
+
+
+   def close(self):
+      """Unmaps the generation file."""
+
+      if self._m_mm is not None:
+         self._m_mm.close()
+         self._m_mm = None
+
+
+   def generation(self):
+      """Returns the current generation.
+
+      int return
+         Current generation, or 0 if no snapshot was ever published.
+      """
+
+      if self._m_mm is None and not self._map():
+         return 0
+      return self._HEADER.unpack_from(self._m_mm, 0)[2]
+
+
+   def _load(self, iGeneration):
+      """Loads a snapshot.
+
+      int iGeneration
+         Generation of the snapshot.
+      bool return
+         True if the snapshot was loaded, or False if it was not available (e.g. because it was
+         deleted by a writer after publishing two more generations).
+      """
+
+      try:
+         with open(self._snapshot_file_name(iGeneration), 'r', encoding = 'utf-8') as fileSnapshot:
+            dictSnapshot = json.load(fileSnapshot)
+      except (OSError, ValueError):
+         return False
+      self._m_iGeneration = iGeneration
+      self._m_dictSnapshot = freeze(dictSnapshot)
+      return True
+
+
+   def _map(self):
+      """Maps the generation file, if it exists.
+
+      bool return
+         True if the file is mapped, or False if it doesn’t exist yet.
+      """
+
+      try:
+         with open(self._m_sGenFileName, 'rb') as fileGen:
+            mm = mmap.mmap(fileGen.fileno(), self._HEADER.size, access = mmap.ACCESS_READ)
+      except (OSError, ValueError):
+         return False
+      sMagic, iVersion, iGeneration = self._HEADER.unpack_from(mm, 0)
+      if sMagic != self._MAGIC or iVersion != self._VERSION:
+         mm.close()
+         raise ValueError('{} is not an application generation file (version {})'.format(
+            self._m_sGenFileName, self._VERSION
+         ))
+      self._m_mm = mm
+      return True
+
+
+   def snapshot(self):
+      """Returns the current snapshot. This is meant to be called every time configuration data is
+      needed, rather than keeping a snapshot around, so that changes are picked up.
+
+      mapping(str: mapping(str: object)) return
+         Read-only application data, or None if no snapshot was ever published.
+      """
+
+      if self._m_mm is None and not self._map():
+         return None
+      iGeneration = self._HEADER.unpack_from(self._m_mm, 0)[2]
+      if iGeneration != self._m_iGeneration:
+         # If the new snapshot can’t be loaded, keep using the current one and try again next time.
+         self._load(iGeneration)
+      return self._m_dictSnapshot
+
+
+   def _snapshot_file_name(self, iGeneration):
+      """Returns the name of the file containing a snapshot.
+
+      int iGeneration
+         Generation of the snapshot.
+      str return
+         Path to the snapshot file.
+      """
+
+      return os.path.join(self._m_sDir, 'app.{}.json'.format(iGeneration))
+
+
+   def update(self, fnUpdate):
+      """Publishes a new snapshot, generated from the latest one.
+
+      callable fnUpdate
+         Receives a mutable copy of the latest snapshot (an empty dictionary if none was published
+         yet) and modifies it, or returns False to cancel the update; it’s called while holding the
+         writers’ lock, so it should be quick.
+      int return
+         Generation of the snapshot in use after the update.
+      """
+
+      with open(self._m_sGenFileName + '.lock', 'w') as fileLock:
+         fcntl.flock(fileLock, fcntl.LOCK_EX)
+         iGeneration = self.generation()
+         if iGeneration != self._m_iGeneration:
+            self._load(iGeneration)
+         dictApp = thaw(self._m_dictSnapshot) if self._m_dictSnapshot is not None else {}
+         if fnUpdate(dictApp) is False:
+            return self._m_iGeneration
+         iGeneration += 1
+
+         # Write the new snapshot under a temporary name, then rename it so that it only becomes
+         # visible once complete.
+         sSnapshotFileName = self._snapshot_file_name(iGeneration)
+         with open(sSnapshotFileName + '.tmp', 'w', encoding = 'utf-8') as fileSnapshot:
+            json.dump(dictApp, fileSnapshot, sort_keys = True)
+         os.replace(sSnapshotFileName + '.tmp', sSnapshotFileName)
+
+         # Publish the new generation; the file is only replaced (not written in place) when it’s
+         # created, so that it’s never seen incomplete.
+         bytesHeader = self._HEADER.pack(self._MAGIC, self._VERSION, iGeneration)
+         if self._m_mm is None:
+            with open(self._m_sGenFileName + '.tmp', 'wb') as fileGen:
+               fileGen.write(bytesHeader)
+            os.replace(self._m_sGenFileName + '.tmp', self._m_sGenFileName)
+            self._map()
+         else:
+            # Only overwrite the generation number, with a single aligned 8-byte write. Should a
+            # reader ever see a mix of old and new bytes, it would fail to load a snapshot for that
+            # generation, and would try again on its next access.
+            with open(self._m_sGenFileName, 'r+b') as fileGen:
+               os.pwrite(fileGen.fileno(), bytesHeader[8:], 8)
+         self._m_iGeneration = iGeneration
+         self._m_dictSnapshot = freeze(dictApp)
+
+         # Delete old snapshots, keeping the previous one for any readers that are loading it.
+         try:
+            os.remove(self._snapshot_file_name(iGeneration - 2))
+         except FileNotFoundError:
+            pass
+      return iGeneration
+
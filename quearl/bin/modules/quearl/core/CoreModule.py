@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Core module class."""
+
+
+import os
+import re
+
+from modules.quearl.core import Module
+from modules.quearl.core import Static
+
+
+
+####################################################################################################
+# Classes
+
+
+class CoreModule(Module.Module):
+   """Python side of QlCoreModule."""
+
+   # The core module serves the pre-processed static files of every module.
+   STATIC_FILE_TYPES = ('css', 'js')
+
+   # Matches URLs of pre-processed static files; see QlCoreModule::handle_static_request().
+   _smc_reStaticUrl = re.compile(r'''
+      # Match the module abbreviation.
+      [_0-9a-z]+/
+      # Match and capture “l10n/js” or other supported pre-processed static file types from a
+      # whitelist.
+      (?P<dir>l10n/js|css|js)/
+      # Match and capture the file name extension from a whitelist.
+      [^/]+\.(?P<fnext>css|js)
+   $''', re.VERBOSE)
+   # MIME types of the static files served.
+   _smc_dictMimeTypes = {
+      'css': 'text/css; charset=utf-8',
+      'js' : 'text/javascript; charset=utf-8',
+   }
+
+
+   def __init__(self, app, sAbbr, dictInfo):
+      """See Module.Module.__init__()."""
+
+      Module.Module.__init__(self, app, sAbbr, dictInfo)
+      # Open static files, by URL.
+      self._m_staticfiles = Static.StaticFileCache(
+         app.static_manifest(), app.section('core')['static_file_cache_size']
+      )
+
+
+   def augment_response_head(self, request, entity):
+      """See Module.Module.augment_response_head(). Links the core JS bundle, cached forever by the
+      client, instead of each of the core JS files.
+      """
+
+      entity.include_js_bundle('core')
+      entity.include_js('core/js/main-iefixes.js', True)
+
+
+   def handle_static_request(self, request):
+      """See Module.Module.handle_static_request(). Responds to requests for existent pre-processed
+      JavaScript, CSS or localization JS files, for any module.
+      """
+
+      sUrl = request.url()
+      # URLs of cached files have already been validated.
+      staticfile = self._m_staticfiles.get(sUrl)
+      if staticfile is None:
+         staticfile = self._open_static_file(sUrl)
+         if staticfile is None:
+            return None
+         self._m_staticfiles.add(sUrl, staticfile)
+      entity = staticfile.entity(request.accepted_encodings())
+      # Files in the static manifest are revalidated by Application before getting here; this
+      # handles the remaining ones, with the same header fields.
+      sIfNoneMatch = request.environ().get('HTTP_IF_NONE_MATCH')
+      if sIfNoneMatch and Static.etag_matches(sIfNoneMatch, entity.etag()):
+         entity.close()
+         return '304 Not Modified', Static.not_modified_headers(
+            sUrl, entity.etag(), bool(staticfile.encodings())
+         ), ()
+      listHeaders = staticfile.headers() + [
+         ('ETag', entity.etag()), ('Content-Length', str(entity.size()))
+      ]
+      if entity.encoding():
+         listHeaders.append(('Content-Encoding', entity.encoding()))
+      return '200 OK', listHeaders, entity
+
+
+   def _open_static_file(self, sUrl):
+      """Validates the URL of a static file, and opens the file.
+
+      str sUrl
+         URL of the file, relative to the static root.
+      Static.StaticFile return
+         Opened file, or None if the URL is invalid or the file can’t be served.
+      """
+
+      logger = self._m_app.logger()
+      # Validate the requested URL.
+      match = self._smc_reStaticUrl.match(sUrl)
+      if not match:
+         # Don’t know how to serve this file.
+         logger.write('E_USER_NOTICE', 'Don’t know how to serve request for “{}”'.format(sUrl))
+         return None
+      # Ensure that the file name extension is the same as the directory containing the file. This
+      # disallows explicit requests for the compressed versions of pre-processed files (which have
+      # an additional file name extension).
+      if match.group('dir') == 'l10n/js' and match.group('fnext') != 'js':
+         logger.write('E_USER_NOTICE', 'File name extension mismatch in “{}”'.format(sUrl))
+         return None
+      listHeaders = [('Content-Type', self._smc_dictMimeTypes[match.group('fnext')])]
+      sCacheControl = Static.cache_control(sUrl)
+      if sCacheControl:
+         listHeaders.append(('Cache-Control', sCacheControl))
+      sFileName = os.path.join(self._m_app.section('core')['rodata_lpath'], sUrl)
+      # Check if the file exists before assuming we can respond this request.
+      try:
+         staticfile = Static.StaticFile(
+            sFileName, listHeaders, self._m_app.static_manifest().variants(sUrl)
+         )
+      except OSError:
+         # Can’t serve this file.
+         logger.write('E_USER_NOTICE', 'Can’t serve unreadable file “{}”'.format(sFileName))
+         return None
+      return staticfile
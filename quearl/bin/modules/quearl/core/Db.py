@@ -0,0 +1,1135 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Database connection classes."""
+
+import base64
+import collections
+import contextlib
+import datetime
+import decimal
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+try:
+   import mysql.connector
+except ImportError:
+   mysql = None
+
+
+
+####################################################################################################
+# Constants
+
+# Sort modes for DbConnection.query_item_list(); same values as QL_DB_SORT_*. “STD” sorts
+# lexicographically, “NAT” in natural order (see natural_key()), both ignoring case.
+SORT_STD_ASC  = 0
+SORT_STD_DESC = 1
+SORT_NAT_ASC  = 2
+SORT_NAT_DESC = 3
+
+
+
+####################################################################################################
+# Functions
+
+def _compare_natural(s1, s2):
+   """Compares two strings in natural order; used as the “QL_NATURAL” SQLite collation.
+
+   str s1
+      First string.
+   str s2
+      Second string.
+   int return
+      Negative if s1 sorts before s2, positive if after, or 0 if they’re equivalent.
+   """
+
+   key1 = natural_key(s1)
+   key2 = natural_key(s2)
+   return (key1 > key2) - (key1 < key2)
+
+
+def _from_json_value(oValue):
+   """Decodes a value encoded by _to_json_value().
+
+   object oValue
+      Encoded value.
+   object return
+      Decoded value. Raises ValueError if oValue is not a valid encoded value.
+   """
+
+   if not isinstance(oValue, list):
+      return oValue
+   try:
+      sType, sValue = oValue
+      if sType == 'bytes':
+         return base64.b64decode(sValue.encode('ascii'), validate = True)
+      elif sType == 'date':
+         return datetime.date.fromisoformat(sValue)
+      elif sType == 'datetime':
+         return datetime.datetime.fromisoformat(sValue)
+      elif sType == 'decimal':
+         return decimal.Decimal(sValue)
+      elif sType == 'time':
+         return datetime.time.fromisoformat(sValue)
+   except (AttributeError, TypeError, ValueError, decimal.InvalidOperation):
+      pass
+   raise ValueError('Invalid encoded value: {!r}'.format(oValue))
+
+
+def natural_key(s):
+   """Returns a sort key for the natural order of a string, in the same way as PHP’s
+   strnatcasecmp(): case is ignored, and sequences of digits are compared by their numeric value, so
+   that e.g. “item9” sorts before “item10”.
+
+   str s
+      String.
+   list(tuple(int, int, str)) return
+      Sort key.
+   """
+
+   return [
+      (0, int(sPart), '') if sPart[0] in '0123456789' else (1, 0, sPart.casefold())
+      for sPart in _reDigits.split(s) if sPart
+   ]
+
+
+def _to_json_value(oValue):
+   """Encodes a value returned by the database so that it can be serialized as JSON and decoded back
+   to the same type by _from_json_value(): values of types that JSON lacks are encoded as a
+   [type, string] list.
+
+   object oValue
+      Value to encode. Raises TypeError if its type is not supported.
+   object return
+      Encoded value.
+   """
+
+   if oValue is None or isinstance(oValue, (bool, int, float, str)):
+      return oValue
+   elif isinstance(oValue, (bytes, bytearray)):
+      return ['bytes', base64.b64encode(oValue).decode('ascii')]
+   # Check for datetime first, since it’s a subclass of date.
+   elif isinstance(oValue, datetime.datetime):
+      return ['datetime', oValue.isoformat()]
+   elif isinstance(oValue, datetime.date):
+      return ['date', oValue.isoformat()]
+   elif isinstance(oValue, datetime.time):
+      return ['time', oValue.isoformat()]
+   elif isinstance(oValue, decimal.Decimal):
+      return ['decimal', str(oValue)]
+   raise TypeError('Values of type {} are not supported'.format(type(oValue).__name__))
+
+
+# Matches sequences of decimal digits, keeping them when splitting.
+_reDigits = re.compile(r'([0-9]+)')
+
+
+
+####################################################################################################
+# Classes
+
+
+class ConnectionPool(object):
+   """Pool of database connections of a worker process, so that connections are established once
+   and reused by many requests, instead of once per request as QlDb does.
+
+   Before being handed out, a connection that’s older than the maximum lifetime is closed and
+   replaced, and one that was idle for longer than the health check interval is checked, and
+   replaced if unusable. Connections inherited from a parent process are never reused, since the
+   parent (or a sibling) could be using them.
+   """
+
+   def __init__(
+      self, driver, cMaxIdle = 4, fMaxLifetime = 3600.0, fHealthCheckInterval = 30.0,
+      cMaxStatements = 64, fnObserveQuery = None
+   ):
+      """Constructor.
+
+      Driver driver
+         Database driver.
+      [int cMaxIdle]
+         Maximum number of idle connections to keep.
+      [float fMaxLifetime]
+         Time after which a connection is closed and replaced, in seconds.
+      [float fHealthCheckInterval]
+         Idle time after which a connection is checked before being reused, in seconds.
+      [int cMaxStatements]
+         Maximum number of prepared statements to keep for each connection.
+      [callable fnObserveQuery]
+         Called after each statement is executed with the SQL statement and its execution time, in
+         seconds; see Profile.Profiler.record_query().
+      """
+
+      self._m_driver = driver
+      self._m_cMaxIdle = cMaxIdle
+      self._m_fMaxLifetime = fMaxLifetime
+      self._m_fHealthCheckInterval = fHealthCheckInterval
+      self._m_cMaxStatements = cMaxStatements
+      self._m_fnObserveQuery = fnObserveQuery
+      # Idle connections, most recently used last.
+      self._m_listIdle = []
+      self._m_iPid = os.getpid()
+      self._m_cConnects = 0
+
+
+   def acquire(self):
+      """Returns a connection, reusing an idle one if possible. It must be returned to the pool
+      with release() when no longer needed; see also connection().
+
+      DbConnection return
+         Connection.
+      """
+
+      if self._m_iPid != os.getpid():
+         # This is a forked process: forget (without closing) the parent’s connections.
+         self._m_listIdle = []
+         self._m_iPid = os.getpid()
+      while self._m_listIdle:
+         db = self._m_listIdle.pop()
+         if db.age() >= self._m_fMaxLifetime or (
+            db.idle_time() >= self._m_fHealthCheckInterval and not db.is_healthy()
+         ):
+            self._discard(db)
+            continue
+         return db
+      try:
+         conn = self._m_driver.connect()
+      except Exception as x:
+         raise DatabaseUnavailable('Unable to connect to the database: {}'.format(x)) from x
+      self._m_cConnects += 1
+      return DbConnection(self._m_driver, conn, self._m_cMaxStatements, self._m_fnObserveQuery)
+
+
+   def close(self):
+      """Closes every idle connection."""
+
+      if self._m_iPid == os.getpid():
+         for db in self._m_listIdle:
+            self._discard(db)
+      self._m_listIdle = []
+
+
+   def connect_count(self):
+      """Returns the number of connections established by the pool.
+
+      int return
+         Count of connections established.
+      """
+
+      return self._m_cConnects
+
+
+   @contextlib.contextmanager
+   def connection(self):
+      """Context manager that acquires a connection, and releases it on exit.
+
+      DbConnection return
+         Connection.
+      """
+
+      db = self.acquire()
+      try:
+         yield db
+      finally:
+         self.release(db)
+
+
+   @staticmethod
+   def _discard(db):
+      """Closes a connection, ignoring errors (e.g. because the server already closed it).
+
+      DbConnection db
+         Connection to close.
+      """
+
+      try:
+         db.close()
+      except Exception:
+         pass
+
+
+   def release(self, db):
+      """Returns a connection acquired with acquire() to the pool. Any pending transaction is rolled
+      back.
+
+      DbConnection db
+         Connection to return.
+      """
+
+      db.close_cursor()
+      if db.in_transaction():
+         try:
+            db.end_transaction(False)
+         except Exception:
+            self._discard(db)
+            return
+      if len(self._m_listIdle) >= self._m_cMaxIdle or db.age() >= self._m_fMaxLifetime:
+         self._discard(db)
+      else:
+         self._m_listIdle.append(db)
+
+
+
+class Cursor(object):
+   """Result set of a query, returned by DbConnection.query(); Python port of QlQueryResult.
+
+   Unlike QlQueryResult, a cursor doesn’t buffer the whole result set: rows are fetched from the
+   database a few at a time, while the cursor is iterated over, so memory use doesn’t depend on the
+   size of the result set. As a consequence, a cursor can only be iterated over once, and can’t
+   seek.
+   """
+
+   def __init__(self, driver, dbcursor, cRowsPerFetch):
+      """Constructor. Use DbConnection.query() to get a cursor.
+
+      Driver driver
+         Database driver.
+      object dbcursor
+         DB-API cursor.
+      int cRowsPerFetch
+         Number of rows fetched from the database at a time.
+      """
+
+      self._m_driver = driver
+      self._m_dbcursor = dbcursor
+      self._m_cRowsPerFetch = cRowsPerFetch
+      self._m_iRow = 0
+
+
+   def __enter__(self):
+      return self
+
+
+   def __exit__(self, excType, exc, tb):
+      self.close()
+      return False
+
+
+   def __iter__(self):
+      """Fetches the rows in the result set. The cursor is closed after the last one.
+
+      tuple(object*) yield
+         Row.
+      """
+
+      try:
+         while self._m_dbcursor is not None:
+            listRows = self._m_dbcursor.fetchmany(self._m_cRowsPerFetch)
+            if not listRows:
+               break
+            for row in listRows:
+               self._m_iRow += 1
+               yield row
+      finally:
+         self.close()
+
+
+   def close(self):
+      """Releases the result set; any rows not read yet are discarded."""
+
+      if self._m_dbcursor is not None:
+         self._m_driver.close_cursor(self._m_dbcursor)
+         self._m_dbcursor = None
+
+
+   def columns(self):
+      """Returns the names of the columns of the result set; see QlQueryResult::get_columns().
+
+      list(str) return
+         Column names.
+      """
+
+      return [tplColumn[0] for tplColumn in self._m_dbcursor.description]
+
+
+   def is_open(self):
+      """Returns True if the cursor hasn’t been closed yet.
+
+      bool return
+         True if the cursor is open.
+      """
+
+      return self._m_dbcursor is not None
+
+
+   def tell(self):
+      """Returns the number of rows read so far; see QlQueryResult::tell().
+
+      int return
+         Count of rows read.
+      """
+
+      return self._m_iRow
+
+
+
+class DatabaseUnavailable(Exception):
+   """Raised when a connection to the database can’t be established; should result in a “503
+   Service Unavailable” response, like the QlErrorResponse thrown by QlDb::__construct().
+   """
+
+   pass
+
+
+
+class DbConnection(object):
+   """Database connection; Python port of QlDb.
+
+   Unlike QlDb, queries are never built by escaping and concatenating values (QlDb::escape(),
+   QlDb::sql_encode()): every query is a constant SQL string with “?” placeholders, and values are
+   passed separately. This allows each statement to be prepared once, and kept in a cache of
+   prepared statements (least recently used ones are discarded first) for as long as the connection
+   stays open, which with ConnectionPool means across many requests.
+   """
+
+   def __init__(self, driver, conn, cMaxStatements, fnObserveQuery = None):
+      """Constructor. Use ConnectionPool.acquire() to get a connection.
+
+      Driver driver
+         Database driver.
+      object conn
+         Connection object returned by driver.connect().
+      int cMaxStatements
+         Maximum number of prepared statements to keep.
+      [callable fnObserveQuery]
+         See ConnectionPool.__init__().
+      """
+
+      self._m_driver = driver
+      self._m_conn = conn
+      self._m_cMaxStatements = cMaxStatements
+      self._m_fnObserveQuery = fnObserveQuery
+      # Prepared statements, as {SQL: statement}, least recently used first.
+      self._m_odictStatements = collections.OrderedDict()
+      self._m_bInTransaction = False
+      # Last Cursor returned by query(), if still open.
+      self._m_cursor = None
+      # Time the connection was established, and last used.
+      self._m_fCreated = time.monotonic()
+      self._m_fLastUsed = self._m_fCreated
+      self._m_iLastInsertedId = None
+      self._m_fLastDuration = 0.0
+      self._m_fTotalDuration = 0.0
+      self._m_cQueries = 0
+
+
+   def age(self):
+      """Returns the time elapsed since the connection was established.
+
+      float return
+         Age of the connection, in seconds.
+      """
+
+      return time.monotonic() - self._m_fCreated
+
+
+   def begin_transaction(self):
+      """Begins a transaction; see QlDb::begin_transaction()."""
+
+      self._m_driver.begin(self._m_conn)
+      self._m_bInTransaction = True
+
+
+   def close(self):
+      """Closes the connection, and every prepared statement."""
+
+      for stmt in self._m_odictStatements.values():
+         stmt.close()
+      self._m_odictStatements.clear()
+      self._m_cursor = None
+      self._m_driver.close(self._m_conn)
+      self._m_conn = None
+
+
+   def close_cursor(self):
+      """Closes the Cursor last returned by query(), if still open."""
+
+      if self._m_cursor is not None:
+         self._m_cursor.close()
+         self._m_cursor = None
+
+
+   def end_transaction(self, bCommit = True):
+      """Ends the transaction started by begin_transaction(); see QlDb::end_transaction().
+
+      [bool bCommit]
+         If True, the transaction is committed; otherwise it’s rolled back.
+      """
+
+      self._m_bInTransaction = False
+      if bCommit:
+         self._m_driver.commit(self._m_conn)
+      else:
+         self._m_driver.rollback(self._m_conn)
+
+
+   def execute(self, sSql, tplParams = ()):
+      """Executes a statement that returns no rows (e.g. INSERT, UPDATE).
+
+      str sSql
+         SQL statement, with “?” in place of each value.
+      [tuple(object*) tplParams]
+         Values for the placeholders.
+      int return
+         Count of affected rows.
+      """
+
+      dbcursor = self._execute(sSql, tplParams)
+      if dbcursor.description is not None:
+         # Fetch any rows (e.g. from a RETURNING clause), so that the statement is completed.
+         dbcursor.fetchall()
+      self._m_iLastInsertedId = dbcursor.lastrowid
+      return dbcursor.rowcount
+
+
+   def _execute(self, sSql, tplParams):
+      """Executes a statement, preparing it first unless it’s in the prepared statements cache.
+
+      str sSql
+         SQL statement, with “?” in place of each value.
+      tuple(object*) tplParams
+         Values for the placeholders.
+      object return
+         DB-API cursor, positioned before the first row returned by the statement.
+      """
+
+      if self._m_cursor is not None and self._m_cursor.is_open():
+         raise Exception('Can’t execute a statement while the result of a query is being read')
+      stmt = self._m_odictStatements.get(sSql)
+      if stmt is None:
+         stmt = self._m_driver.prepare(self._m_conn, sSql)
+         self._m_odictStatements[sSql] = stmt
+         while len(self._m_odictStatements) > self._m_cMaxStatements:
+            self._m_odictStatements.popitem(last = False)[1].close()
+      else:
+         self._m_odictStatements.move_to_end(sSql)
+      fStart = time.perf_counter()
+      dbcursor = stmt.execute(tplParams)
+      self._m_fLastDuration = time.perf_counter() - fStart
+      self._m_fTotalDuration += self._m_fLastDuration
+      self._m_cQueries += 1
+      self._m_fLastUsed = time.monotonic()
+      if self._m_fnObserveQuery is not None:
+         self._m_fnObserveQuery(sSql, self._m_fLastDuration)
+      return dbcursor
+
+
+   def idle_time(self):
+      """Returns the time elapsed since the connection was last used.
+
+      float return
+         Idle time, in seconds.
+      """
+
+      return time.monotonic() - self._m_fLastUsed
+
+
+   def in_transaction(self):
+      """Returns True if a transaction started by begin_transaction() is pending.
+
+      bool return
+         True if a transaction is pending.
+      """
+
+      return self._m_bInTransaction
+
+
+   def is_healthy(self):
+      """Checks whether the connection is still usable, e.g. that the server didn’t close it.
+
+      bool return
+         True if the connection is usable.
+      """
+
+      return self._m_driver.ping(self._m_conn)
+
+
+   def last_duration(self):
+      """Returns the execution time of the last query run; see QlDb::get_last_duration().
+
+      float return
+         Execution time, in seconds.
+      """
+
+      return self._m_fLastDuration
+
+
+   def last_inserted_id(self):
+      """Returns the auto-generated ID used in the last INSERT statement; see
+      QlDb::get_last_inserted_id().
+
+      int return
+         Last ID generated.
+      """
+
+      return self._m_iLastInsertedId
+
+
+   def query(self, sSql, tplParams = (), cRowsPerFetch = 100):
+      """Executes a query, returning a Cursor that fetches the resulting rows while they’re iterated
+      over; see QlDb::query(). Until the cursor is closed (which happens automatically once all its
+      rows have been read), the connection can’t execute other statements.
+
+      str sSql
+         SQL query, with “?” in place of each value.
+      [tuple(object*) tplParams]
+         Values for the placeholders.
+      [int cRowsPerFetch]
+         Number of rows fetched from the database at a time.
+      Cursor return
+         Result set.
+      """
+
+      cursor = Cursor(self._m_driver, self._execute(sSql, tplParams), cRowsPerFetch)
+      self._m_cursor = cursor
+      return cursor
+
+
+   def query_all(self, sSql, tplParams = ()):
+      """Returns the full result set of a query; see QlDb::query_all().
+
+      str sSql
+         SQL query, with “?” in place of each value.
+      [tuple(object*) tplParams]
+         Values for the placeholders.
+      list(tuple(object*)) return
+         Rows.
+      """
+
+      return self._execute(sSql, tplParams).fetchall()
+
+
+   def query_count(self):
+      """Returns the count of queries executed on this connection; see QlDb::get_query_count().
+
+      int return
+         Count of queries executed.
+      """
+
+      return self._m_cQueries
+
+
+   def query_item_list(self, dictQ, sContinuation = None, cMaxCount = None):
+      """Returns a page of an item list; see QlDb::query_item_list().
+
+      Unlike QlDb::query_item_list(), every sort mode is applied by the database (see
+      Driver.sort_key()), and pages use keyset pagination: each page starts after the sort key
+      values of the last item of the previous page, which the database can seek to using an index,
+      instead of counting rows from the start of the list; whether more items follow is determined
+      by fetching one more item than the limit, rather than by counting every item (as
+      SQL_CALC_FOUND_ROWS does). The total count of items is only computed if requested, and only
+      up to a maximum, so the cost of a page doesn’t depend on the size of the list.
+
+      dict(str: object) dictQ
+         Query components, as returned by QlModule::get_table_list_items_q():
+         str “vlfields”
+            Fields to be returned, in SELECT syntax; the first two must be “ql_value” and
+            “ql_label”.
+         str “tables”
+            Tables to be used, in FROM syntax.
+         [str “where”]
+            WHERE clause conditions, with “?” in place of each value.
+         [tuple(object*) “params”]
+            Values for the placeholders in “where”.
+         [list(tuple(str, int)) “sort”]
+            Sort keys, as (SQL expression, SORT_* mode) tuples, most significant first. Expressions
+            must not evaluate to NULL.
+         str “mainalias”
+            Alias of the main table.
+         str “id”
+            Unique key column of the main table, used as the least significant sort key so that the
+            order of the items is always the same.
+         [int “limit”]
+            Maximum number of items in a page; if omitted, the whole list is returned.
+      [str sContinuation]
+         Continuation token returned with the previous page; if omitted, the first page is returned.
+         Raises ValueError if the token is not valid for this query.
+      [int cMaxCount]
+         If specified, the items in the whole list are counted, stopping at this many.
+      dict(str: object) return
+         Page of the item list:
+         list(tuple(object, object)) “items”
+            ql_value and ql_label of each item.
+         bool “partial”
+            True if more items follow this page.
+         str “continuation”
+            Token to pass back to get the next page, or None if this is the last page.
+         int “count”
+            Count of items in the list, up to cMaxCount; None if cMaxCount was not specified.
+         bool “count_capped”
+            True if the list has more items than cMaxCount.
+      """
+
+      # Sort keys, as (SQL expression, descending) tuples.
+      listKeys = [
+         (self._m_driver.sort_key(sExpr, iSortMode), iSortMode in (SORT_STD_DESC, SORT_NAT_DESC))
+         for sExpr, iSortMode in dictQ.get('sort', ())
+      ]
+      listKeys.append(('{}.{}'.format(dictQ['mainalias'], dictQ['id']), False))
+      sWhere = dictQ.get('where') or ''
+      tplParams = tuple(dictQ.get('params', ()))
+      cLimit = dictQ.get('limit')
+      sSelect = 'SELECT {}, {}\nFROM {}\n'.format(
+         dictQ['vlfields'], ', '.join(sKey for sKey, bDesc in listKeys), dictQ['tables']
+      )
+      sOrderBy = 'ORDER BY {}\n'.format(', '.join(
+         sKey + (' DESC' if bDesc else ' ASC') for sKey, bDesc in listKeys
+      ))
+      # Tokens are only valid for the query they were generated for, with the same parameters.
+      iQueryHash = zlib.crc32((sSelect + sWhere + sOrderBy + repr(tplParams)).encode('utf-8'))
+
+      listConditions = [sWhere] if sWhere else []
+      if sContinuation is not None:
+         try:
+            iTokenHash, listValues = json.loads(
+               base64.urlsafe_b64decode(sContinuation.encode('ascii')).decode('utf-8')
+            )
+            listValues = [_from_json_value(oValue) for oValue in listValues]
+         except (TypeError, ValueError):
+            raise ValueError('Invalid continuation token')
+         if iTokenHash != iQueryHash or len(listValues) != len(listKeys):
+            raise ValueError('Continuation token not valid for this query')
+         # Items following the last one: (k1 > v1) OR (k1 = v1 AND k2 > v2) OR …; the redundant
+         # k1 >= v1 lets the database seek to the first of them in an index, instead of scanning it.
+         sKey, bDesc = listKeys[0]
+         listConditions.append('{} {} ?'.format(sKey, '<=' if bDesc else '>='))
+         tplParams += (listValues[0], )
+         listSeek = []
+         for i, (sKey, bDesc) in enumerate(listKeys):
+            listSeek.append('(' + ' AND '.join(
+               ['{} = ?'.format(sPrevKey) for sPrevKey, bPrevDesc in listKeys[:i]] +
+               ['{} {} ?'.format(sKey, '<' if bDesc else '>')]
+            ) + ')')
+            tplParams += tuple(listValues[:i + 1])
+         listConditions.append('(' + ' OR '.join(listSeek) + ')')
+      sSql = sSelect
+      if listConditions:
+         sSql += 'WHERE ' + ' AND '.join(listConditions) + '\n'
+      sSql += sOrderBy
+      if cLimit:
+         sSql += 'LIMIT ?'
+         tplParams += (cLimit + 1, )
+
+      listItems = []
+      tplLastKeys = None
+      bPartial = False
+      cKeys = len(listKeys)
+      with self.query(sSql, tplParams) as cursor:
+         for row in cursor:
+            if cLimit and len(listItems) == cLimit:
+               bPartial = True
+               break
+            listItems.append((row[0], row[1]))
+            tplLastKeys = row[-cKeys:]
+      dictPage = {
+         'items'       : listItems,
+         'partial'     : bPartial,
+         'continuation': base64.urlsafe_b64encode(json.dumps(
+            [iQueryHash, [_to_json_value(oValue) for oValue in tplLastKeys]]
+         ).encode('utf-8')).decode('ascii') if bPartial else None,
+         'count'       : None,
+         'count_capped': False,
+      }
+
+      if cMaxCount is not None:
+         sSql = 'SELECT COUNT(*) FROM (\nSELECT 1\nFROM {}\n'.format(dictQ['tables'])
+         if sWhere:
+            sSql += 'WHERE {}\n'.format(sWhere)
+         sSql += 'LIMIT ?\n) AS ql_count'
+         cCount = self.query_value(sSql, tuple(dictQ.get('params', ())) + (cMaxCount + 1, ))
+         dictPage['count'] = min(cCount, cMaxCount)
+         dictPage['count_capped'] = cCount > cMaxCount
+      return dictPage
+
+
+   def query_row(self, sSql, tplParams = ()):
+      """Returns the first row returned by a query; see QlDb::query_row().
+
+      str sSql
+         SQL query, with “?” in place of each value.
+      [tuple(object*) tplParams]
+         Values for the placeholders.
+      tuple(object*) return
+         Row, or None if the query returned no rows.
+      """
+
+      listRows = self._execute(sSql, tplParams).fetchall()
+      return listRows[0] if listRows else None
+
+
+   def query_value(self, sSql, tplParams = ()):
+      """Returns the first column of the first row returned by a query; see QlDb::query_value().
+
+      str sSql
+         SQL query, with “?” in place of each value.
+      [tuple(object*) tplParams]
+         Values for the placeholders.
+      object return
+         Value, or None if the query returned no rows.
+      """
+
+      listRows = self._execute(sSql, tplParams).fetchall()
+      return listRows[0][0] if listRows else None
+
+
+   def statement_count(self):
+      """Returns the number of prepared statements currently cached.
+
+      int return
+         Count of prepared statements.
+      """
+
+      return len(self._m_odictStatements)
+
+
+   def total_duration(self):
+      """Returns the cumulative execution time of every query run; see
+      QlDb::get_total_duration().
+
+      float return
+         Cumulative execution time, in seconds.
+      """
+
+      return self._m_fTotalDuration
+
+
+
+class Driver(object):
+   """Base class for database drivers, which adapt a DB-API module to DbConnection. Drivers are
+   created by the application (see Application.db()), and read their settings from it.
+   """
+
+   def __init__(self, app):
+      """Constructor.
+
+      Application app
+         Application.
+      """
+
+      self._m_app = app
+
+
+   def begin(self, conn):
+      """Begins a transaction.
+
+      object conn
+         Connection.
+      """
+
+      raise NotImplementedError()
+
+
+   def close(self, conn):
+      """Closes a connection.
+
+      object conn
+         Connection.
+      """
+
+      conn.close()
+
+
+   def close_cursor(self, dbcursor):
+      """Releases a DB-API cursor returned by a prepared statement; see Cursor.close().
+
+      object dbcursor
+         DB-API cursor.
+      """
+
+      dbcursor.close()
+
+
+   def commit(self, conn):
+      """Commits the pending transaction.
+
+      object conn
+         Connection.
+      """
+
+      conn.commit()
+
+
+   def connect(self):
+      """Establishes a new connection, in autocommit mode.
+
+      object return
+         Connection.
+      """
+
+      raise NotImplementedError()
+
+
+   def ping(self, conn):
+      """Checks whether a connection is usable.
+
+      object conn
+         Connection.
+      bool return
+         True if the connection is usable.
+      """
+
+      raise NotImplementedError()
+
+
+   def prepare(self, conn, sSql):
+      """Prepares a statement.
+
+      object conn
+         Connection.
+      str sSql
+         SQL statement, with “?” in place of each value.
+      object return
+         Prepared statement; it must have an execute(tplParams) method returning a DB-API cursor
+         positioned before the first row of the result, and a close() method.
+      """
+
+      raise NotImplementedError()
+
+
+   def rollback(self, conn):
+      """Rolls back the pending transaction.
+
+      object conn
+         Connection.
+      """
+
+      conn.rollback()
+
+
+   def sort_key(self, sExpr, iSortMode):
+      """Returns an SQL expression that sorts and compares the values of another expression
+      according to a sort mode; see DbConnection.query_item_list().
+
+      str sExpr
+         SQL expression.
+      int iSortMode
+         One of the SORT_* constants.
+      str return
+         SQL expression.
+      """
+
+      raise NotImplementedError()
+
+
+
+class MysqlDriver(Driver):
+   """Driver for MySQL, using MySQL Connector/Python; connects with the same settings as QlDb
+   (“database_host”, “database_username”, “database_password”, “database_name”). Statements are
+   prepared on the server.
+
+   Natural sort modes require NATURAL_SORT_KEY(), available in MariaDB 10.7 and later.
+   """
+
+   def __init__(self, app):
+      """See Driver.__init__()."""
+
+      if mysql is None:
+         raise Exception('MySQL Connector/Python (mysql.connector) is not installed')
+      Driver.__init__(self, app)
+
+
+   def begin(self, conn):
+      """See Driver.begin()."""
+
+      conn.start_transaction()
+
+
+   def close_cursor(self, dbcursor):
+      """See Driver.close_cursor(). The cursor belongs to a prepared statement, and is reused by its
+      next execution; the rest of the result set must still be read, as required by the protocol.
+      """
+
+      if dbcursor.with_rows:
+         dbcursor.fetchall()
+
+
+   def connect(self):
+      """See Driver.connect()."""
+
+      dictCore = self._m_app.section('core')
+      # Same setup as QlDb::__construct().
+      return mysql.connector.connect(
+         host       = dictCore['database_host'],
+         user       = dictCore['database_username'],
+         password   = dictCore['database_password'],
+         database   = dictCore['database_name'],
+         autocommit = True,
+         charset    = 'utf8',
+         collation  = 'utf8_general_ci',
+         time_zone  = '+00:00'
+      )
+
+
+   def ping(self, conn):
+      """See Driver.ping()."""
+
+      return conn.is_connected()
+
+
+   def prepare(self, conn, sSql):
+      """See Driver.prepare()."""
+
+      return _MysqlStatement(conn, sSql)
+
+
+   def sort_key(self, sExpr, iSortMode):
+      """See Driver.sort_key(). The connection collation (utf8_general_ci) already ignores case."""
+
+      if iSortMode in (SORT_NAT_ASC, SORT_NAT_DESC):
+         return 'NATURAL_SORT_KEY({})'.format(sExpr)
+      return sExpr
+
+
+
+class _MysqlStatement(object):
+   """Statement prepared on a MySQL server; the server-side statement is created by the first
+   execution, and reused by the following ones.
+   """
+
+   def __init__(self, conn, sSql):
+      """Constructor.
+
+      mysql.connector.MySQLConnection conn
+         Connection.
+      str sSql
+         SQL statement, with “?” in place of each value.
+      """
+
+      self._m_cursor = conn.cursor(prepared = True)
+      self._m_sSql = sSql
+
+
+   def close(self):
+      """Deallocates the statement on the server."""
+
+      self._m_cursor.close()
+
+
+   def execute(self, tplParams):
+      """See Driver.prepare()."""
+
+      self._m_cursor.execute(self._m_sSql, tplParams)
+      return self._m_cursor
+
+
+
+class SqliteDriver(Driver):
+   """Driver for SQLite, meant as a stand-in for MySQL (e.g. for testing). The database is the file
+   specified by the “database_lpath” setting. Prepared statements are cached by the sqlite3 module,
+   so its cache is sized to match DbConnection’s. Natural sort modes use the “QL_NATURAL” collation,
+   defined for each connection.
+   """
+
+   def __init__(self, app):
+      """See Driver.__init__()."""
+
+      Driver.__init__(self, app)
+      dictCore = app.section('core')
+      self._m_sFileName = dictCore['database_lpath']
+      self._m_cMaxStatements = dictCore['database_statement_cache_size']
+
+
+   def begin(self, conn):
+      """See Driver.begin()."""
+
+      conn.execute('BEGIN')
+
+
+   def commit(self, conn):
+      """See Driver.commit()."""
+
+      conn.execute('COMMIT')
+
+
+   def connect(self):
+      """See Driver.connect()."""
+
+      conn = sqlite3.connect(
+         self._m_sFileName, isolation_level = None, cached_statements = self._m_cMaxStatements
+      )
+      conn.execute('PRAGMA journal_mode = WAL')
+      conn.execute('PRAGMA synchronous = NORMAL')
+      conn.create_collation('QL_NATURAL', _compare_natural)
+      return conn
+
+
+   def ping(self, conn):
+      """See Driver.ping()."""
+
+      try:
+         conn.execute('SELECT 1').fetchall()
+      except sqlite3.Error:
+         return False
+      return True
+
+
+   def prepare(self, conn, sSql):
+      """See Driver.prepare()."""
+
+      return _SqliteStatement(conn, sSql)
+
+
+   def rollback(self, conn):
+      """See Driver.rollback()."""
+
+      conn.execute('ROLLBACK')
+
+
+   def sort_key(self, sExpr, iSortMode):
+      """See Driver.sort_key()."""
+
+      if iSortMode in (SORT_NAT_ASC, SORT_NAT_DESC):
+         return '{} COLLATE QL_NATURAL'.format(sExpr)
+      return '{} COLLATE NOCASE'.format(sExpr)
+
+
+
+class _SqliteStatement(object):
+   """Statement for SQLite; preparing it is left to the sqlite3 module’s statement cache."""
+
+   def __init__(self, conn, sSql):
+      """Constructor.
+
+      sqlite3.Connection conn
+         Connection.
+      str sSql
+         SQL statement, with “?” in place of each value.
+      """
+
+      self._m_conn = conn
+      self._m_sSql = sSql
+
+
+   def close(self):
+      """See _MysqlStatement.close()."""
+
+      pass
+
+
+   def execute(self, tplParams):
+      """See Driver.prepare()."""
+
+      return self._m_conn.execute(self._m_sSql, tplParams)
+
@@ -0,0 +1,916 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Asynchronous HTTP client; Python port of ql_http_get() and ql_http_get_multi()."""
+
+import asyncio
+import codecs
+import inspect
+import re
+import time
+import urllib.parse
+import zlib
+
+
+
+####################################################################################################
+# Functions
+
+def detect_charset(sContentType, bytesHead):
+   """Determines the character set of an entity; see ql_http_detect_charset(). A BOM takes
+   precedence over everything else; then come the “charset” parameter of the Content-Type, a
+   <meta> element in HTML documents, and the encoding declaration in XML documents.
+
+   str sContentType
+      Value of the Content-Type header field, or None if missing.
+   bytes bytesHead
+      Beginning of the entity; a few kilobytes are enough.
+   str return
+      Lowercase character set name, or None if it could not be determined.
+   """
+
+   for sCharset, bytesBom in _tplBoms:
+      if bytesHead.startswith(bytesBom):
+         return sCharset
+   sMimeType, sCharset = _parse_media_type(sContentType)
+   if sCharset:
+      return sCharset
+   if sMimeType == 'text/html':
+      # Any ASCII-compatible encoding can be scanned as ISO-8859-1.
+      match = _reHtmlMetaCharset.search(bytesHead.decode('iso-8859-1'))
+      if match:
+         return match.group('charset').lower()
+      return None
+   if sMimeType in ('text/xml', 'application/xml') or sMimeType.endswith('+xml'):
+      match = _reXmlEncoding.match(bytesHead.decode('iso-8859-1'))
+      if match:
+         return match.group('charset').lower()
+      # Last-resort default according to XML 1.0.
+      return 'utf-8'
+   if sMimeType.startswith('text/'):
+      # Default according to RFC 2616 § 3.7.1 “Canonicalization and Text Defaults”.
+      return 'iso-8859-1'
+   return None
+
+
+def _escape_invalid_bytes(x):
+   """Codec error handler that escapes each invalid byte as a lone surrogate (U+DC00 to U+DCFF), to
+   be replaced later; unlike “surrogateescape”, it can escape any byte, as needed by UTF-16 and
+   UTF-32. No decoder can return these characters for valid input.
+
+   UnicodeDecodeError x
+      Decoding error.
+   tuple(str, int) return
+      Escaped bytes, and position at which decoding resumes.
+   """
+
+   return ''.join(chr(0xdc00 + iByte) for iByte in x.object[x.start:x.end]), x.end
+
+
+def _parse_media_type(sContentType):
+   """Parses a Content-Type header field value.
+
+   str sContentType
+      Field value, or None.
+   tuple(str, str) return
+      Lowercase MIME type (empty if sContentType is None) and “charset” parameter (None if
+      missing).
+   """
+
+   if not sContentType:
+      return '', None
+   listParams = sContentType.split(';')
+   sCharset = None
+   for sParam in listParams[1:]:
+      sName, _, sValue = sParam.partition('=')
+      if sName.strip().lower() == 'charset':
+         sCharset = sValue.strip().strip('"\'').lower() or None
+   return listParams[0].strip().lower(), sCharset
+
+
+def split_url(sUrl):
+   """Breaks down an absolute HTTP or HTTPS URL into the components needed to request it.
+
+   str sUrl
+      URL.
+   tuple(str, str, int, str) return
+      Scheme, host name, port, and request target (path and query).
+   """
+
+   try:
+      tplUrl = urllib.parse.urlsplit(sUrl)
+      sScheme = tplUrl.scheme.lower()
+      iPort = tplUrl.port
+   except ValueError as x:
+      raise HttpError('Invalid URL: {}: {}'.format(sUrl, x)) from x
+   if sScheme not in ('http', 'https') or not tplUrl.hostname:
+      raise HttpError('Unsupported URL: {}'.format(sUrl))
+   if iPort is None:
+      iPort = 443 if sScheme == 'https' else 80
+   sTarget = tplUrl.path or '/'
+   if tplUrl.query:
+      sTarget += '?' + tplUrl.query
+   return sScheme, tplUrl.hostname, iPort, sTarget
+
+
+# Character sets identified by a BOM, and their BOMs; UTF-32 must be checked before UTF-16.
+_tplBoms = (
+   ('utf-32le', codecs.BOM_UTF32_LE),
+   ('utf-32be', codecs.BOM_UTF32_BE),
+   ('utf-8'   , codecs.BOM_UTF8),
+   ('utf-16le', codecs.BOM_UTF16_LE),
+   ('utf-16be', codecs.BOM_UTF16_BE),
+)
+# Matches the character set specified by a <meta charset="…"> or <meta http-equiv="Content-Type"
+# content="…; charset=…"> element.
+_reHtmlMetaCharset = re.compile(
+   r'''<meta\s[^>]*?charset\s*=\s*["\']?\s*(?P<charset>[-\w.:]+)''', re.IGNORECASE
+)
+# Matches characters that escaped invalid bytes while decoding; see _escape_invalid_bytes().
+_reInvalidBytes = re.compile('[\udc00-\udcff]')
+# Matches the encoding declaration of an XML document.
+_reXmlEncoding = re.compile(
+   r'''<\?xml\s[^>]*?encoding\s*=\s*["\'](?P<charset>[-\w.:]+)["\']'''
+)
+
+codecs.register_error('quearl.escape_invalid_bytes', _escape_invalid_bytes)
+
+
+
+####################################################################################################
+# Classes
+
+
+class _Connection(object):
+   """Connection to an HTTP server, kept open between requests as long as the server allows it."""
+
+   def __init__(self, reader, writer):
+      """Constructor.
+
+      asyncio.StreamReader reader
+         Stream to read responses from.
+      asyncio.StreamWriter writer
+         Stream to write requests to.
+      """
+
+      self.reader = reader
+      self.writer = writer
+      self._m_fLastUsed = time.monotonic()
+
+
+   def close(self):
+      """Closes the connection."""
+
+      self.writer.close()
+
+
+   def is_reusable(self, fIdleTimeout):
+      """Checks whether the connection can be used for another request.
+
+      float fIdleTimeout
+         Time after which an idle connection is no longer used, in seconds, since the server may
+         close it at any time.
+      bool return
+         True if the connection can be reused.
+      """
+
+      return (
+         not self.reader.at_eof() and not self.writer.is_closing() and
+         time.monotonic() - self._m_fLastUsed < fIdleTimeout
+      )
+
+
+   def touch(self):
+      """Records that the connection was just used."""
+
+      self._m_fLastUsed = time.monotonic()
+
+
+
+class _ContentDecoder(object):
+   """Incremental decoder for a Content-Encoding; unlike gzdecode(), it never needs the whole
+   entity in memory.
+   """
+
+   # Maximum size of each piece of decoded data.
+   _smc_cbMaxPiece = 262144
+
+
+   def __init__(self, sEncoding):
+      """Constructor.
+
+      str sEncoding
+         Content-Encoding of the entity: “gzip”, “x-gzip” or “deflate”.
+      """
+
+      self._m_bDeflate = sEncoding == 'deflate'
+      if self._m_bDeflate:
+         # “deflate” should be a zlib stream, but some servers send a raw deflate stream.
+         self._m_decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+      else:
+         self._m_decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+      self._m_bStarted = False
+
+
+   def decode(self, bytesChunk):
+      """Decodes part of the entity. Highly compressed data is returned in multiple pieces, so that
+      a small chunk never needs to be decoded into a large buffer.
+
+      bytes bytesChunk
+         Encoded data.
+      bytes yield
+         Decoded data; never empty.
+      """
+
+      try:
+         if not self._m_bStarted and self._m_bDeflate:
+            try:
+               bytesDecoded = self._m_decompressor.decompress(bytesChunk, self._smc_cbMaxPiece)
+            except zlib.error:
+               self._m_decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+               bytesDecoded = self._m_decompressor.decompress(bytesChunk, self._smc_cbMaxPiece)
+         else:
+            bytesDecoded = self._m_decompressor.decompress(bytesChunk, self._smc_cbMaxPiece)
+         self._m_bStarted = True
+         while True:
+            if bytesDecoded:
+               yield bytesDecoded
+            bytesChunk = self._m_decompressor.unconsumed_tail
+            if not bytesChunk:
+               break
+            bytesDecoded = self._m_decompressor.decompress(bytesChunk, self._smc_cbMaxPiece)
+      except zlib.error as x:
+         raise HttpError('Invalid compressed entity: {}'.format(x)) from x
+
+
+   def flush(self):
+      """Returns any decoded data still buffered, once the whole entity has been decoded.
+
+      bytes return
+         Decoded data; may be empty.
+      """
+
+      return self._m_decompressor.flush()
+
+
+
+class HttpClient(object):
+   """Asynchronous HTTP/1.1 client for server-to-server requests, such as fetching feeds or checking
+   links, meant to handle many requests at once.
+
+   Connections are pooled per host (scheme, host name and port) and kept alive between requests, up
+   to a maximum number of connections per host. Responses are returned as soon as their header has
+   been received; their entity is then streamed, decoding any Content-Encoding incrementally (see
+   HttpResponse), so that large responses never need to be held in memory.
+   """
+
+   # Header fields sent with every request, unless overridden; same as ql_http_get().
+   _smc_dictDefaultHeaders = {
+      'Accept'         : '*/*',
+      'Accept-Charset' : 'utf-8;q=1,utf-16le;q=0.7,utf-16be;q=0.7,iso-8859-1;q=0.5',
+      'Accept-Encoding': 'gzip, deflate',
+      'User-Agent'     : 'Quearl',
+   }
+   # Status codes of redirects that are followed.
+   _smc_frozensetRedirectCodes = frozenset((301, 302, 303, 307, 308))
+
+
+   def __init__(
+      self, cMaxConnectionsPerHost = 4, fConnectTimeout = 10.0, fReadTimeout = 30.0,
+      fIdleTimeout = 15.0, cMaxRedirects = 5
+   ):
+      """Constructor.
+
+      [int cMaxConnectionsPerHost]
+         Maximum number of connections open to each host; further requests for the same host wait
+         for one of them to be available.
+      [float fConnectTimeout]
+         Time allowed to establish a connection, in seconds.
+      [float fReadTimeout]
+         Time allowed for each read from a connection, in seconds.
+      [float fIdleTimeout]
+         Time after which idle connections are not reused, in seconds.
+      [int cMaxRedirects]
+         Maximum number of redirects followed for each request.
+      """
+
+      self._m_cMaxConnectionsPerHost = cMaxConnectionsPerHost
+      self._m_fConnectTimeout = fConnectTimeout
+      self._m_fReadTimeout = fReadTimeout
+      self._m_fIdleTimeout = fIdleTimeout
+      self._m_cMaxRedirects = cMaxRedirects
+      # Idle connections and connection slots of each host, as {(scheme, host, port): list} and
+      # {(scheme, host, port): asyncio.Semaphore}.
+      self._m_dictIdle = {}
+      self._m_dictSlots = {}
+      self._m_cConnects = 0
+
+
+   async def _acquire(self, tplHost):
+      """Returns a connection to a host, reusing an idle one if possible. The connection must be
+      returned with _release().
+
+      tuple(str, str, int) tplHost
+         Scheme, host name and port.
+      tuple(_Connection, bool) return
+         Connection, and whether it was reused.
+      """
+
+      semaphore = self._m_dictSlots.get(tplHost)
+      if semaphore is None:
+         semaphore = asyncio.Semaphore(self._m_cMaxConnectionsPerHost)
+         self._m_dictSlots[tplHost] = semaphore
+      await semaphore.acquire()
+      try:
+         listIdle = self._m_dictIdle.get(tplHost)
+         while listIdle:
+            conn = listIdle.pop()
+            if conn.is_reusable(self._m_fIdleTimeout):
+               return conn, True
+            conn.close()
+         return await self._connect(tplHost), False
+      except BaseException:
+         semaphore.release()
+         raise
+
+
+   def close(self):
+      """Closes every idle connection. Connections in use are closed once released."""
+
+      for listIdle in self._m_dictIdle.values():
+         for conn in listIdle:
+            conn.close()
+      self._m_dictIdle.clear()
+
+
+   async def _connect(self, tplHost):
+      """Establishes a new connection to a host.
+
+      tuple(str, str, int) tplHost
+         Scheme, host name and port.
+      _Connection return
+         Connection.
+      """
+
+      sScheme, sHost, iPort = tplHost
+      try:
+         reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            sHost, iPort, ssl = True if sScheme == 'https' else None
+         ), self._m_fConnectTimeout)
+      except (OSError, asyncio.TimeoutError) as x:
+         raise HttpError('Unable to connect to {}:{}: {}'.format(sHost, iPort, x)) from x
+      self._m_cConnects += 1
+      return _Connection(reader, writer)
+
+
+   def connect_count(self):
+      """Returns the number of connections established by the client.
+
+      int return
+         Count of connections established.
+      """
+
+      return self._m_cConnects
+
+
+   async def get(self, sUrl, dictHeaders = None):
+      """Sends a GET request, following redirects; see ql_http_get(). The returned response must be
+      read in full or closed, to release its connection.
+
+      str sUrl
+         URL to request.
+      [dict(str: str) dictHeaders]
+         Additional header fields, overriding the default ones.
+      HttpResponse return
+         Response.
+      """
+
+      sRequestUrl = sUrl
+      cRedirects = 0
+      while True:
+         response = await self._request(sUrl, sRequestUrl, cRedirects, dictHeaders)
+         sLocation = response.header('Location')
+         if (
+            response.code() not in self._smc_frozensetRedirectCodes or not sLocation or
+            cRedirects == self._m_cMaxRedirects
+         ):
+            return response
+         # Read the redirect’s (usually tiny) entity, so that the connection can be reused.
+         await response.discard()
+         sUrl = urllib.parse.urljoin(sUrl, sLocation)
+         cRedirects += 1
+
+
+   async def get_multi(self, iterUrls, fnCallback, cMaxConcurrency = 10):
+      """Sends GET requests for multiple URLs, passing each response to a callback as soon as its
+      header is received; see ql_http_get_multi(). Unlike ql_http_get_multi(), requests are not
+      sent in fixed batches: a new request starts as soon as one completes, so slow hosts only delay
+      their own requests.
+
+      iterable(str) iterUrls
+         URLs to request; they’re only read as requests are started, so this can be a generator.
+      callable fnCallback
+         Called with each requested URL, its HttpResponse (None if the request failed) and the
+         HttpError that made it fail (None if it didn’t); if it returns an awaitable (e.g. it’s a
+         coroutine function), that’s awaited. The callback can stream the response entity by
+         iterating over the response; once the callback returns, the response is closed.
+      [int cMaxConcurrency]
+         Maximum number of requests in progress at any time.
+      """
+
+      iterUrls = iter(iterUrls)
+
+      async def worker():
+         for sUrl in iterUrls:
+            try:
+               response = await self.get(sUrl)
+            except HttpError as x:
+               oResult = fnCallback(sUrl, None, x)
+               if inspect.isawaitable(oResult):
+                  await oResult
+               continue
+            try:
+               oResult = fnCallback(sUrl, response, None)
+               if inspect.isawaitable(oResult):
+                  await oResult
+            finally:
+               response.close()
+
+      await asyncio.gather(*(worker() for i in range(cMaxConcurrency)))
+
+
+   def _release(self, tplHost, conn, bReusable):
+      """Returns a connection obtained with _acquire().
+
+      tuple(str, str, int) tplHost
+         Scheme, host name and port.
+      _Connection conn
+         Connection.
+      bool bReusable
+         If True, the connection can be used for another request; otherwise it’s closed.
+      """
+
+      if bReusable:
+         conn.touch()
+         self._m_dictIdle.setdefault(tplHost, []).append(conn)
+      else:
+         conn.close()
+      self._m_dictSlots[tplHost].release()
+
+
+   async def _request(self, sUrl, sRequestUrl, cRedirects, dictHeaders):
+      """Sends a single GET request, and reads the header of the response.
+
+      str sUrl
+         URL to request.
+      str sRequestUrl
+         URL originally requested, before following redirects.
+      int cRedirects
+         Number of redirects followed so far.
+      dict(str: str) dictHeaders
+         Additional header fields.
+      HttpResponse return
+         Response.
+      """
+
+      sScheme, sHost, iPort, sTarget = split_url(sUrl)
+      tplHost = (sScheme, sHost, iPort)
+      dictAllHeaders = dict(self._smc_dictDefaultHeaders)
+      if dictHeaders:
+         dictAllHeaders.update(dictHeaders)
+      sHostField = '[{}]'.format(sHost) if ':' in sHost else sHost
+      if iPort != (443 if sScheme == 'https' else 80):
+         sHostField += ':{}'.format(iPort)
+      bytesRequest = ('GET {} HTTP/1.1\r\nHost: {}\r\n{}\r\n'.format(sTarget, sHostField, ''.join(
+         '{}: {}\r\n'.format(sName, sValue) for sName, sValue in dictAllHeaders.items()
+      ))).encode('latin-1')
+
+      while True:
+         conn, bReused = await self._acquire(tplHost)
+         try:
+            conn.writer.write(bytesRequest)
+            await conn.writer.drain()
+            # Skip any 1xx responses.
+            while True:
+               bytesHeader = await asyncio.wait_for(
+                  conn.reader.readuntil(b'\r\n\r\n'), self._m_fReadTimeout
+               )
+               response = HttpResponse(
+                  self, tplHost, conn, sRequestUrl, sUrl, cRedirects, bytesHeader
+               )
+               if response.code() >= 200:
+                  return response
+         except (asyncio.IncompleteReadError, ConnectionError) as x:
+            self._release(tplHost, conn, False)
+            if bReused and not getattr(x, 'partial', b''):
+               # The server closed the idle connection before receiving the request; retry with a
+               # new connection.
+               continue
+            raise HttpError('Connection to {} closed: {}'.format(sHost, x)) from x
+         except (OSError, asyncio.TimeoutError, asyncio.LimitOverrunError) as x:
+            self._release(tplHost, conn, False)
+            raise HttpError('Request for {} failed: {!r}'.format(sUrl, x)) from x
+         except BaseException:
+            self._release(tplHost, conn, False)
+            raise
+
+
+
+class HttpError(Exception):
+   """Raised when a request fails: the URL is not valid, the server can’t be reached, or it sent an
+   invalid or incomplete response.
+   """
+
+   pass
+
+
+
+class HttpResponse(object):
+   """Response to a request sent by HttpClient. The entity is streamed by iterating asynchronously
+   over the response, which yields decoded chunks as they arrive; once the whole entity has been
+   read, the connection is returned to the client for reuse. If the entity is not needed (or not
+   in full), the response must be closed instead.
+   """
+
+   # Size of each read from the connection.
+   _smc_cbRead = 65536
+   # Amount of the entity examined by iter_text() to determine its character set.
+   _smc_cbSniff = 4096
+
+
+   def __init__(self, client, tplHost, conn, sRequestUrl, sUrl, cRedirects, bytesHeader):
+      """Constructor.
+
+      HttpClient client
+         Client that sent the request.
+      tuple(str, str, int) tplHost
+         Scheme, host name and port of the server.
+      _Connection conn
+         Connection the response is being read from.
+      str sRequestUrl
+         URL originally requested.
+      str sUrl
+         URL of this response, after following any redirects.
+      int cRedirects
+         Number of redirects followed.
+      bytes bytesHeader
+         Status line and header fields of the response, including the terminating empty line.
+      """
+
+      self._m_client = client
+      self._m_tplHost = tplHost
+      self._m_conn = conn
+      self._m_sRequestUrl = sRequestUrl
+      self._m_sUrl = sUrl
+      self._m_cRedirects = cRedirects
+      listLines = bytesHeader.decode('latin-1').split('\r\n')
+      listStatus = listLines[0].split(' ', 2)
+      try:
+         self._m_sProtocol = listStatus[0]
+         self._m_iCode = int(listStatus[1])
+      except (IndexError, ValueError):
+         raise HttpError('Invalid status line: {}'.format(listLines[0]))
+      if not self._m_sProtocol.startswith('HTTP/'):
+         raise HttpError('Invalid status line: {}'.format(listLines[0]))
+      self._m_sReason = listStatus[2] if len(listStatus) > 2 else ''
+      # Header fields, as (name, value) tuples, in the order they were received.
+      self._m_listHeaders = []
+      for sLine in listLines[1:]:
+         if not sLine:
+            continue
+         if sLine[0] in ' \t' and self._m_listHeaders:
+            # Obsolete line folding.
+            sName, sValue = self._m_listHeaders.pop()
+            self._m_listHeaders.append((sName, sValue + ' ' + sLine.strip()))
+         else:
+            sName, _, sValue = sLine.partition(':')
+            self._m_listHeaders.append((sName.strip(), sValue.strip()))
+
+      sConnection = (self.header('Connection') or '').lower()
+      if self._m_sProtocol == 'HTTP/1.0':
+         self._m_bKeepAlive = 'keep-alive' in sConnection
+      else:
+         self._m_bKeepAlive = 'close' not in sConnection
+      # Determine how the end of the entity is delimited.
+      if self._m_iCode < 200 or self._m_iCode in (204, 304):
+         self._m_cbRemaining = 0
+         self._m_bChunked = False
+      elif 'chunked' in (self.header('Transfer-Encoding') or '').lower():
+         self._m_cbRemaining = None
+         self._m_bChunked = True
+      else:
+         self._m_bChunked = False
+         sLength = self.header('Content-Length')
+         try:
+            self._m_cbRemaining = int(sLength) if sLength is not None else None
+         except ValueError:
+            raise HttpError('Invalid Content-Length: {}'.format(sLength))
+         if self._m_cbRemaining is None:
+            # The entity ends when the server closes the connection.
+            self._m_bKeepAlive = False
+      self._m_bDone = self._m_cbRemaining == 0 and not self._m_bChunked
+      if self._m_bDone and self._m_iCode >= 200:
+         self._finish()
+
+
+   async def __aenter__(self):
+      return self
+
+
+   async def __aexit__(self, excType, exc, tb):
+      self.close()
+      return False
+
+
+   async def __aiter__(self):
+      """Reads the entity, decoding it according to its Content-Encoding.
+
+      bytes yield
+         Chunk of the entity; never empty.
+      """
+
+      sEncoding = (self.header('Content-Encoding') or 'identity').lower()
+      decoder = _ContentDecoder(sEncoding) if sEncoding in ('gzip', 'x-gzip', 'deflate') else None
+      async for bytesChunk in self._iter_raw():
+         if decoder is None:
+            yield bytesChunk
+         else:
+            for bytesDecoded in decoder.decode(bytesChunk):
+               yield bytesDecoded
+      if decoder is not None:
+         bytesChunk = decoder.flush()
+         if bytesChunk:
+            yield bytesChunk
+
+
+   def close(self):
+      """Releases the connection. If the entity was not read in full, the connection is closed,
+      since the rest of the entity would still have to be read before reusing it.
+      """
+
+      if self._m_conn is not None:
+         self._m_client._release(self._m_tplHost, self._m_conn, False)
+         self._m_conn = None
+
+
+   def code(self):
+      """Returns the status code of the response.
+
+      int return
+         HTTP status code.
+      """
+
+      return self._m_iCode
+
+
+   async def discard(self):
+      """Reads and discards the entity, so that the connection can be reused."""
+
+      async for bytesChunk in self._iter_raw():
+         pass
+
+
+   def _finish(self):
+      """Returns the connection to the client, once the whole entity has been read."""
+
+      self._m_bDone = True
+      if self._m_conn is not None:
+         self._m_client._release(self._m_tplHost, self._m_conn, self._m_bKeepAlive)
+         self._m_conn = None
+
+
+   def header(self, sName, sDefault = None):
+      """Returns the value of a header field; multiple fields with the same name are combined, as
+      allowed by RFC 7230.
+
+      str sName
+         Name of the header field, in any case.
+      [str sDefault]
+         Value returned if the field is missing.
+      str return
+         Field value.
+      """
+
+      sName = sName.lower()
+      listValues = [sValue for sField, sValue in self._m_listHeaders if sField.lower() == sName]
+      return ', '.join(listValues) if listValues else sDefault
+
+
+   def headers(self):
+      """Returns every header field.
+
+      list(tuple(str, str)) return
+         Header fields, as (name, value) tuples, in the order they were received.
+      """
+
+      return self._m_listHeaders
+
+
+   async def _iter_raw(self):
+      """Reads the entity as sent by the server, removing the chunked transfer encoding if used.
+
+      bytes yield
+         Chunk of the entity; never empty.
+      """
+
+      if self._m_bDone:
+         return
+      if self._m_conn is None:
+         raise HttpError('The response was closed')
+      reader = self._m_conn.reader
+      fTimeout = self._m_client._m_fReadTimeout
+      try:
+         if self._m_bChunked:
+            while True:
+               bytesLine = await asyncio.wait_for(reader.readuntil(b'\r\n'), fTimeout)
+               try:
+                  cbChunk = int(bytesLine.split(b';', 1)[0].strip(), 16)
+               except ValueError:
+                  raise HttpError('Invalid chunk size: {!r}'.format(bytesLine))
+               if cbChunk == 0:
+                  break
+               while cbChunk:
+                  bytesChunk = await asyncio.wait_for(
+                     reader.read(min(cbChunk, self._smc_cbRead)), fTimeout
+                  )
+                  if not bytesChunk:
+                     raise HttpError('Truncated chunk')
+                  cbChunk -= len(bytesChunk)
+                  yield bytesChunk
+               await asyncio.wait_for(reader.readexactly(2), fTimeout)
+            # Skip any trailer fields.
+            while await asyncio.wait_for(reader.readuntil(b'\r\n'), fTimeout) != b'\r\n':
+               pass
+         elif self._m_cbRemaining is not None:
+            while self._m_cbRemaining:
+               bytesChunk = await asyncio.wait_for(
+                  reader.read(min(self._m_cbRemaining, self._smc_cbRead)), fTimeout
+               )
+               if not bytesChunk:
+                  raise HttpError('Truncated entity')
+               self._m_cbRemaining -= len(bytesChunk)
+               yield bytesChunk
+         else:
+            while True:
+               bytesChunk = await asyncio.wait_for(reader.read(self._smc_cbRead), fTimeout)
+               if not bytesChunk:
+                  break
+               yield bytesChunk
+      except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+         asyncio.LimitOverrunError
+      ) as x:
+         self.close()
+         raise HttpError('Error reading the entity from {}: {!r}'.format(self._m_sUrl, x)) from x
+      except HttpError:
+         self.close()
+         raise
+      self._finish()
+
+
+   async def iter_text(self, sDefaultCharset = 'utf-8', sReplace = ''):
+      """Reads the entity (see __aiter__()), transcoding it to Unicode as it arrives. The character
+      set is determined (see detect_charset()) from the first few kilobytes of the entity, or just
+      from its first bytes if the Content-Type specifies it. Invalid byte sequences are handled as
+      utf8_fix() does: each invalid byte is replaced with sReplace.
+
+      [str sDefaultCharset]
+         Character set assumed if it can’t be determined, or if it’s not supported.
+      [str sReplace]
+         Replacement for each invalid byte; defaults to an empty string, i.e. invalid bytes are
+         deleted.
+      str yield
+         Chunk of the entity; never empty.
+      """
+
+      cbSniff = self._smc_cbSniff
+      if _parse_media_type(self.header('Content-Type'))[1]:
+         # Only a BOM can override the character set; the longest is 4 bytes.
+         cbSniff = 4
+      listHead = []
+      cbHead = 0
+      decoder = None
+      async for bytesChunk in self:
+         if decoder is None:
+            listHead.append(bytesChunk)
+            cbHead += len(bytesChunk)
+            if cbHead < cbSniff:
+               continue
+            decoder, bytesChunk = self._text_decoder(b''.join(listHead), sDefaultCharset)
+            listHead = None
+         s = decoder.decode(bytesChunk)
+         if s:
+            s = _reInvalidBytes.sub(sReplace, s)
+            if s:
+               yield s
+      if decoder is None:
+         # The whole entity is shorter than the amount needed to determine its character set.
+         decoder, bytesChunk = self._text_decoder(b''.join(listHead), sDefaultCharset)
+      else:
+         bytesChunk = b''
+      s = _reInvalidBytes.sub(sReplace, decoder.decode(bytesChunk, True))
+      if s:
+         yield s
+
+
+   def protocol(self):
+      """Returns the protocol version of the response.
+
+      str return
+         Protocol and version, e.g. “HTTP/1.1”.
+      """
+
+      return self._m_sProtocol
+
+
+   async def read(self):
+      """Reads and decodes the whole entity; see ql_http_get(). Only meant for entities known to be
+      small: use asynchronous iteration otherwise.
+
+      bytes return
+         Entity.
+      """
+
+      return b''.join([bytesChunk async for bytesChunk in self])
+
+
+   def reason(self):
+      """Returns the reason phrase of the response.
+
+      str return
+         Reason phrase.
+      """
+
+      return self._m_sReason
+
+
+   def redirects(self):
+      """Returns the number of redirects followed before receiving this response.
+
+      int return
+         Count of redirects.
+      """
+
+      return self._m_cRedirects
+
+
+   def requested_url(self):
+      """Returns the URL originally requested.
+
+      str return
+         URL.
+      """
+
+      return self._m_sRequestUrl
+
+
+   def _text_decoder(self, bytesHead, sDefaultCharset):
+      """Returns an incremental decoder for the entity, based on its beginning.
+
+      bytes bytesHead
+         Beginning of the entity.
+      str sDefaultCharset
+         Character set assumed if it can’t be determined, or if it’s not supported.
+      tuple(codecs.IncrementalDecoder, bytes) return
+         Decoder, and bytesHead without any BOM.
+      """
+
+      sCharset = detect_charset(self.header('Content-Type'), bytesHead) or sDefaultCharset
+      try:
+         codecinfo = codecs.lookup(sCharset)
+      except LookupError:
+         codecinfo = codecs.lookup(sDefaultCharset)
+      for sBomCharset, bytesBom in _tplBoms:
+         if bytesHead.startswith(bytesBom):
+            if codecs.lookup(sBomCharset).name == codecinfo.name:
+               bytesHead = bytesHead[len(bytesBom):]
+            break
+      # Escape invalid bytes, to be replaced by iter_text().
+      return codecinfo.incrementaldecoder('quearl.escape_invalid_bytes'), bytesHead
+
+
+   def url(self):
+      """Returns the URL of this response, after following any redirects.
+
+      str return
+         URL.
+      """
+
+      return self._m_sUrl
+
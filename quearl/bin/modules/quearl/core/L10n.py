@@ -0,0 +1,286 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Localization classes."""
+
+import mmap
+import os
+import struct
+
+
+
+####################################################################################################
+# Classes
+
+
+class L10nCatalog(object):
+   """Read-only localization catalog, compiled from a .l10n file by l10n_generator (see
+   quearl/bin/localize.py), with any entries missing from it filled in from the default locale.
+
+   The catalog file is memory-mapped rather than read, so that opening it doesn’t depend on its size
+   and its pages are shared among all the processes using it; entries are looked up with a binary
+   search on a table of keys sorted by their UTF-8 encoding, only decoding the entry that’s found.
+
+   File layout (all integers are little endian):
+   •  Header: magic (4 bytes), format version (uint16), reserved (uint16), number of entries
+      (uint32);
+   •  Entry table: for each entry, offset of the key in the blob (uint32), key length (uint16),
+      value type (uint8, one of TYPE_*), reserved (uint8), offset of the value in the blob (uint32),
+      value length (uint32);
+   •  Blob: keys and values, encoded in UTF-8; integer values are stored as decimal digits, and
+      boolean values as “0” or “1”.
+   """
+
+   # Header of a catalog file.
+   _HEADER = struct.Struct('<4sHHI')
+   # Entry of the table of a catalog file.
+   _ENTRY = struct.Struct('<IHBxII')
+   # Catalog file magic number and format version.
+   _MAGIC = b'QLLC'
+   _VERSION = 1
+
+   # Value types.
+   TYPE_STR  = 0
+   TYPE_INT  = 1
+   TYPE_BOOL = 2
+
+
+   def __init__(self, sFileName):
+      """Constructor.
+
+      str sFileName
+         Path to the catalog file.
+      """
+
+      with open(sFileName, 'rb') as fileCatalog:
+         self._m_mm = mmap.mmap(fileCatalog.fileno(), 0, access = mmap.ACCESS_READ)
+      sMagic, iVersion, _, self._m_cEntries = self._HEADER.unpack_from(self._m_mm, 0)
+      if sMagic != self._MAGIC or iVersion != self._VERSION:
+         self._m_mm.close()
+         raise ValueError('{} is not a localization catalog (version {})'.format(
+            sFileName, self._VERSION
+         ))
+      self._m_ibBlob = self._HEADER.size + self._m_cEntries * self._ENTRY.size
+
+
+   def __contains__(self, sName):
+      return self._find(sName) is not None
+
+
+   def __getitem__(self, sName):
+      """Returns the value of an entry.
+
+      str sName
+         Name of the entry.
+      object return
+         Value of the entry.
+      """
+
+      tplEntry = self._find(sName)
+      if tplEntry is None:
+         raise KeyError(sName)
+      return self._value(tplEntry)
+
+
+   def __len__(self):
+      return self._m_cEntries
+
+
+   @classmethod
+   def build(cls, dictEntries):
+      """Compiles a catalog.
+
+      dict(str: object) dictEntries
+         Localized constants; values can be str, int or bool.
+      bytes return
+         Contents of the catalog file.
+      """
+
+      listKeys = sorted(sName.encode('utf-8') for sName in dictEntries.keys())
+      listTable = []
+      listBlob = []
+      ibBlob = 0
+      for bytesKey in listKeys:
+         oValue = dictEntries[bytesKey.decode('utf-8')]
+         if isinstance(oValue, bool):
+            iType = cls.TYPE_BOOL
+            bytesValue = b'1' if oValue else b'0'
+         elif isinstance(oValue, int):
+            iType = cls.TYPE_INT
+            bytesValue = str(oValue).encode('ascii')
+         else:
+            iType = cls.TYPE_STR
+            bytesValue = oValue.encode('utf-8')
+         listTable.append(cls._ENTRY.pack(
+            ibBlob, len(bytesKey), iType, ibBlob + len(bytesKey), len(bytesValue)
+         ))
+         listBlob.append(bytesKey)
+         listBlob.append(bytesValue)
+         ibBlob += len(bytesKey) + len(bytesValue)
+      return cls._HEADER.pack(cls._MAGIC, cls._VERSION, 0, len(listKeys)) + \
+         b''.join(listTable) + b''.join(listBlob)
+
+
+   def close(self):
+      """Unmaps the catalog file."""
+
+      self._m_mm.close()
+
+
+   def _find(self, sName):
+      """Finds an entry in the table.
+
+      str sName
+         Name of the entry.
+      tuple(int, int, int, int, int) return
+         Entry, as unpacked from the table, or None if not found.
+      """
+
+      bytesKey = sName.encode('utf-8')
+      mm = self._m_mm
+      ibBlob = self._m_ibBlob
+      iLow = 0
+      iHigh = self._m_cEntries
+      while iLow < iHigh:
+         iMid = (iLow + iHigh) >> 1
+         tplEntry = self._ENTRY.unpack_from(mm, self._HEADER.size + iMid * self._ENTRY.size)
+         ibKey = ibBlob + tplEntry[0]
+         bytesMidKey = mm[ibKey:ibKey + tplEntry[1]]
+         if bytesMidKey < bytesKey:
+            iLow = iMid + 1
+         elif bytesMidKey > bytesKey:
+            iHigh = iMid
+         else:
+            return tplEntry
+      return None
+
+
+   def get(self, sName, oDefault = None):
+      """Returns the value of an entry, or a default value if the entry doesn’t exist.
+
+      str sName
+         Name of the entry.
+      [object oDefault]
+         Value to return if the entry doesn’t exist.
+      object return
+         Value of the entry, or oDefault.
+      """
+
+      tplEntry = self._find(sName)
+      if tplEntry is None:
+         return oDefault
+      return self._value(tplEntry)
+
+
+   def _value(self, tplEntry):
+      """Decodes the value of an entry.
+
+      tuple(int, int, int, int, int) tplEntry
+         Entry, as unpacked from the table.
+      object return
+         Value of the entry.
+      """
+
+      ibValue = self._m_ibBlob + tplEntry[3]
+      bytesValue = self._m_mm[ibValue:ibValue + tplEntry[4]]
+      iType = tplEntry[2]
+      if iType == self.TYPE_STR:
+         return bytesValue.decode('utf-8')
+      elif iType == self.TYPE_INT:
+         return int(bytesValue)
+      else:
+         return bytesValue == b'1'
+
+
+
+class L10nCatalogs(object):
+   """Opens localization catalogs on demand, keeping them open until quearl_build.py rebuilds static
+   files, so that each catalog is only mapped once per build in each process (e.g. a server worker).
+   Catalogs are replaced (never modified in place) when they’re rebuilt, so a catalog mapped before
+   a rebuild can be used safely until it’s reopened.
+   """
+
+   def __init__(self, sRODataDir, sDefaultLocale, staticmanifest = None):
+      """Constructor.
+
+      str sRODataDir
+         Quearl-wide read-only data directory.
+      str sDefaultLocale
+         Locale to use for modules that are not localized for a requested locale.
+      [quearl.core.Static.StaticManifest staticmanifest]
+         Manifest of the static files in sRODataDir; when its generation changes, every catalog is
+         reopened. If omitted, catalogs are kept open until close() is called.
+      """
+
+      self._m_sRODataDir = sRODataDir
+      self._m_sDefaultLocale = sDefaultLocale
+      self._m_staticmanifest = staticmanifest
+      # Open catalogs, as {(module, locale): L10nCatalog}; None for catalogs that don’t exist. Valid
+      # for the static manifest generation _m_iGeneration.
+      self._m_dictCatalogs = {}
+      self._m_iGeneration = None
+
+
+   def catalog(self, sModuleAbbr, sLocale = None):
+      """Returns the catalog of a module for a locale.
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      [str sLocale]
+         Locale; defaults to the default locale. If the module is not localized for it, the catalog
+         for the default locale is returned instead.
+      L10nCatalog return
+         Catalog, or None if the module has no catalog for either locale.
+      """
+
+      if self._m_staticmanifest is not None:
+         iGeneration = self._m_staticmanifest.generation()
+         if iGeneration != self._m_iGeneration:
+            # Catalogs might have been rebuilt, or created.
+            self.close()
+            self._m_iGeneration = iGeneration
+      if sLocale is None:
+         sLocale = self._m_sDefaultLocale
+      tplKey = (sModuleAbbr, sLocale)
+      try:
+         return self._m_dictCatalogs[tplKey]
+      except KeyError:
+         pass
+      sFileName = os.path.join(self._m_sRODataDir, sModuleAbbr, 'l10n', 'cat', sLocale + '.cat')
+      if os.path.isfile(sFileName):
+         catalog = L10nCatalog(sFileName)
+      elif sLocale != self._m_sDefaultLocale:
+         catalog = self.catalog(sModuleAbbr, self._m_sDefaultLocale)
+      else:
+         catalog = None
+      self._m_dictCatalogs[tplKey] = catalog
+      return catalog
+
+
+   def close(self):
+      """Closes every open catalog."""
+
+      setClosed = set()
+      for catalog in self._m_dictCatalogs.values():
+         if catalog is not None and id(catalog) not in setClosed:
+            catalog.close()
+            setClosed.add(id(catalog))
+      self._m_dictCatalogs.clear()
+
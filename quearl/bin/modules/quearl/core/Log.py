@@ -18,12 +18,17 @@
 # not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------------------------------
 
-"""Definition of the log class."""
+"""Definition of the log classes."""
 
 import binascii
 import fcntl
 import io
+import json
+import os
+import queue
 import re
+import struct
+import threading
 import time
 from xml.sax.saxutils import escape as xml_escape
 
@@ -34,7 +39,26 @@ from xml.sax.saxutils import escape as xml_escape
 
 
 class Logger(object):
-   """Generator of rich XML-based log files."""
+   """Generator of rich XML-based log files.
+
+   By default every call to write() appends its entry to the log file right away, which means
+   opening, locking and rewriting the tail of the file for each entry. If the “log_batch_size” core
+   setting is non-zero, entries are instead queued and written by a background thread in batches
+   of up to that many entries, or whatever has been queued every “log_batch_interval” seconds,
+   whichever comes first; each batch costs a single lock and a single write per log file. The queue
+   holds up to “log_queue_size” entries; once it’s full, “log_queue_full” decides whether write()
+   blocks until there’s room (“block”) or discards the entry (“drop”); discarded entries are
+   counted, and the count is itself logged with the next batch.
+
+   If the “log_format” core setting is “jsonl”, entries are stored as compact JSON lines (in
+   “.log.jsonl” files) instead of XML: this skips escaping and timestamp formatting when writing,
+   and avoids rewriting the tail of the file; LogReader renders the entries as XML when they’re
+   read, so the log can still be viewed with log.xsl.
+   """
+
+   # Terminator of the root element, which is rewritten after each write.
+   _LOG_END = b'</log>\n'
+
 
    def __init__(self, app):
       """Constructor.
@@ -43,7 +67,27 @@ class Logger(object):
          Application instance.
       """
 
-      pass
+      dictCore = app.section('core')
+      self._m_sLogDir = dictCore['log_lpath']
+      # Path of the log-specific XSL file, relative to the directory containing the logs.
+      self._m_sXslPath = os.path.relpath(
+         os.path.join(app.root_dir(), 'module', 'core', 'log.xsl'), self._m_sLogDir
+      ).replace(os.sep, '/')
+      self._m_bCompact = dictCore.get('log_format', 'xml') == 'jsonl'
+      self._m_cBatchSize = int(dictCore.get('log_batch_size', 0))
+      self._m_fBatchInterval = float(dictCore.get('log_batch_interval', 0.5))
+      self._m_bDropWhenFull = dictCore.get('log_queue_full', 'block') == 'drop'
+      self._m_cDropped = 0
+      self._m_lockDropped = threading.Lock()
+      if self._m_cBatchSize > 0:
+         self._m_queue = queue.Queue(int(dictCore.get('log_queue_size', 10000)))
+         self._m_threadWriter = threading.Thread(
+            target = self._writer_thread_main, name = 'Logger writer', daemon = True
+         )
+         self._m_threadWriter.start()
+      else:
+         self._m_queue = None
+         self._m_threadWriter = None
 
 
    def __call__(self, *args, **kwargs):
@@ -52,6 +96,18 @@ class Logger(object):
       return self.write(*args, **kwargs)
 
 
+   def close(self):
+      """Writes any queued entries and stops the background writer, if any. Must be called before
+      the process exits, or queued entries will be lost.
+      """
+
+      if self._m_threadWriter is not None:
+         # None tells the writer thread to flush and terminate.
+         self._m_queue.put(None)
+         self._m_threadWriter.join()
+         self._m_threadWriter = None
+
+
    @staticmethod
    def enc(s):
       """Converts characters forbidden or deprecated in XML to XML entities. Similar to
@@ -70,12 +126,71 @@ class Logger(object):
       # Replace illegal characters with a special tag rendered by the XLST+JS code.
       s = re.sub(
          r'[^\u0009\u000a\u000d\u0020-\ud7ff\ue000-\ufffd]+',
-         lambda match: '<raw>' + binascii.hexlify(match.group(0)) + '</raw>',
+         lambda match: '<raw>' + binascii.hexlify(
+            match.group(0).encode('utf-8', 'surrogatepass')
+         ).decode('ascii') + '</raw>',
          s
       )
       return s
 
 
+   def flush(self):
+      """Blocks until every entry queued so far has been written. Does nothing if entries are not
+      being queued.
+      """
+
+      if self._m_threadWriter is not None:
+         self._m_queue.join()
+
+
+   def _log_file_name(self, fTS, sLogName):
+      """Returns the name of the log file an entry belongs to.
+
+      float fTS
+         Timestamp of the entry.
+      str sLogName
+         Log name.
+      str return
+         Full path to the log file.
+      """
+
+      return os.path.join(
+         self._m_sLogDir,
+         sLogName + time.strftime('%Y-%m-%d', time.gmtime(fTS)) +
+            (self._m_bCompact and '.log.jsonl' or '.log.xml')
+      )
+
+
+   @staticmethod
+   def render_entry(fTS, sCategory, sTitle, sContents):
+      """Generates the markup for a log entry.
+
+      float fTS
+         Timestamp of the entry.
+      str sCategory
+         Event category.
+      str sTitle
+         Event title.
+      str sContents
+         Markup to log, or None.
+      str return
+         <entry> element.
+      """
+
+      tmTS = time.gmtime(fTS)
+      s = '<entry ts="{ts}" time="{time}" timef="{timef}" cat="{cat}" title="{title}">'.format(
+         ts    = fTS,
+         time  = time.strftime('%H:%M:%S', tmTS),
+         timef = '{:06d}'.format(int((fTS % 1) * 1000000)),
+         cat   = sCategory,
+         title = xml_escape(sTitle, {'"': '&quot;'}),
+      )
+      if sContents:
+         s += '\n{}\n'.format(sContents)
+      s += '</entry>\n'
+      return s
+
+
    def write(self, sCategory, sTitle, sContents = None, sLogName = ''):
       """Appends markup to the log.
 
@@ -92,61 +207,463 @@ class Logger(object):
          argument.
       """
 
-      $fTS = microtime(true)
-      sFilePath = os.path.join(
-         _APP['core']['log_lpath'],
-         sLogName + ql_format_timestamp('%Y-%m-%d', $fTS, 'UTC') + '.log.xml'
+      fTS = time.time()
+      tplEntry = (fTS, sCategory, sTitle, sContents, sLogName)
+      if self._m_threadWriter is None:
+         self._write_entries(self._log_file_name(fTS, sLogName), [tplEntry])
+      elif self._m_bDropWhenFull:
+         try:
+            self._m_queue.put_nowait(tplEntry)
+         except queue.Full:
+            with self._m_lockDropped:
+               self._m_cDropped += 1
+      else:
+         # Apply backpressure: wait for the writer thread to make room.
+         self._m_queue.put(tplEntry)
+      return sTitle
+
+
+   def _write_batch(self, listEntries):
+      """Writes a batch of entries, grouping them by log file.
+
+      list(tuple) listEntries
+         Entries, as queued by write().
+      """
+
+      with self._m_lockDropped:
+         cDropped = self._m_cDropped
+         self._m_cDropped = 0
+      if cDropped:
+         listEntries.append((
+            time.time(), 'E_USER_WARNING',
+            '{} log entries dropped because the log queue was full'.format(cDropped), None, ''
+         ))
+      dictEntriesByFile = {}
+      for tplEntry in listEntries:
+         sFilePath = self._log_file_name(tplEntry[0], tplEntry[4])
+         dictEntriesByFile.setdefault(sFilePath, []).append(tplEntry)
+      for sFilePath, listFileEntries in dictEntriesByFile.items():
+         self._write_entries(sFilePath, listFileEntries)
+
+
+   def _write_compact_entries(self, sFilePath, listEntries):
+      """Compact version of _write_entries(): appends entries as JSON lines.
+
+      str sFilePath
+         Full path to the log file.
+      list(tuple) listEntries
+         Entries, as queued by write().
+      """
+
+      listRendered = [
+         (json.dumps(tplEntry[:4], ensure_ascii = False, separators = (',', ':')) + '\n').encode(
+            'utf-8'
+         ) for tplEntry in listEntries
+      ]
+      with open(os.open(sFilePath, os.O_WRONLY | os.O_CREAT, 0o666), 'wb') as fileLog:
+         fcntl.flock(fileLog, fcntl.LOCK_EX)
+         try:
+            # Nothing to rewrite: just append.
+            ibEntry = fileLog.seek(0, io.SEEK_END)
+            bNewFile = ibEntry == 0
+            listIndexRecords = []
+            for tplEntry, bytesEntry in zip(listEntries, listRendered):
+               listIndexRecords.append(LogIndex.pack_record(
+                  ibEntry, len(bytesEntry), tplEntry[0], tplEntry[1], tplEntry[4]
+               ))
+               ibEntry += len(bytesEntry)
+            fileLog.write(b''.join(listRendered))
+            fileLog.flush()
+            LogIndex.append_records(sFilePath, listIndexRecords, bTruncate = bNewFile)
+         finally:
+            fcntl.flock(fileLog, fcntl.LOCK_UN)
+
+
+   def _write_entries(self, sFilePath, listEntries):
+      """Appends one or more entries to a log file, locking it only once, and records them in the
+      log’s index.
+
+      str sFilePath
+         Full path to the log file.
+      list(tuple) listEntries
+         Entries, as queued by write().
+      """
+
+      if self._m_bCompact:
+         return self._write_compact_entries(sFilePath, listEntries)
+
+      # Render the entries before acquiring the lock, to keep it held as briefly as possible.
+      listRendered = [
+         self.render_entry(fTS, sCategory, sTitle, sContents).encode('utf-8')
+         for fTS, sCategory, sTitle, sContents, sLogName in listEntries
+      ]
+      # Opening with O_CREAT avoids having to retry for a file that doesn’t exist yet.
+      with open(os.open(sFilePath, os.O_RDWR | os.O_CREAT, 0o666), 'rb+') as fileLog:
+         fcntl.flock(fileLog, fcntl.LOCK_EX)
+         try:
+            # Rewind enough bytes to delete the trailing “</log>”, so we can add more entries and
+            # then terminate the root element back again.
+            cbFile = fileLog.seek(0, io.SEEK_END)
+            if cbFile >= len(self._LOG_END):
+               fileLog.seek(-len(self._LOG_END), io.SEEK_END)
+            else:
+               fileLog.seek(0)
+            # If the resulting file position is 0, we assume the file to be empty and…
+            ibEntry = fileLog.tell()
+            if ibEntry == 0:
+               # …add an XML prolog with a reference to the log-specific XSL file.
+               bytesProlog = (
+                  '<?xml version="1.0" encoding="utf-8"?>\n' +
+                  '<?xml-stylesheet type="text/xsl" href="{xslpath}"?>\n'.format(
+                     xslpath = self._m_sXslPath
+                  ) +
+                  '<log generator="Quearl Logger" date="{date}">\n'.format(
+                     date = time.strftime('%Y-%m-%d', time.gmtime(listEntries[0][0]))
+                  )
+               ).encode('utf-8')
+               ibEntry = len(bytesProlog)
+            else:
+               bytesProlog = b''
+            # Locate each entry in the file, for the index.
+            listIndexRecords = []
+            for tplEntry, bytesEntry in zip(listEntries, listRendered):
+               listIndexRecords.append(LogIndex.pack_record(
+                  ibEntry, len(bytesEntry), tplEntry[0], tplEntry[1], tplEntry[4]
+               ))
+               ibEntry += len(bytesEntry)
+            fileLog.write(bytesProlog + b''.join(listRendered) + self._LOG_END)
+            fileLog.truncate()
+            fileLog.flush()
+            # Update the index while still holding the lock, so that its records are in the same
+            # order as the entries in the log.
+            LogIndex.append_records(sFilePath, listIndexRecords, bTruncate = bool(bytesProlog))
+         finally:
+            fcntl.flock(fileLog, fcntl.LOCK_UN)
+
+
+   def _writer_thread_main(self):
+      """Main function of the background writer thread."""
+
+      bStop = False
+      while not bStop:
+         # Wait for the first entry of the next batch.
+         tplEntry = self._m_queue.get()
+         if tplEntry is None:
+            self._m_queue.task_done()
+            break
+         listEntries = [tplEntry]
+         # Collect more entries until the batch is full or its time is up.
+         fDeadline = time.monotonic() + self._m_fBatchInterval
+         while len(listEntries) < self._m_cBatchSize:
+            fTimeout = fDeadline - time.monotonic()
+            try:
+               if fTimeout > 0:
+                  tplEntry = self._m_queue.get(timeout = fTimeout)
+               else:
+                  tplEntry = self._m_queue.get_nowait()
+            except queue.Empty:
+               break
+            if tplEntry is None:
+               # Write this batch, then stop.
+               bStop = True
+               self._m_queue.task_done()
+               break
+            listEntries.append(tplEntry)
+         cEntries = len(listEntries)
+         try:
+            self._write_batch(listEntries)
+         except Exception:
+            # Nowhere to report this; the entries are lost, but the writer must keep running.
+            pass
+         for i in range(cEntries):
+            self._m_queue.task_done()
+
+
+
+class LogIndex(object):
+   """Sidecar index of a log file, stored next to it with an additional “.idx” extension. For each
+   entry in the log, it contains a fixed-size record with the byte offset and length of the entry
+   in the log file, its timestamp, category and log name; this allows locating entries without
+   reading or parsing the log itself.
+   """
+
+   # Record format: offset, length, timestamp, category, log name.
+   _RECORD = struct.Struct('<QId32s32s')
+
+
+   @classmethod
+   def append_records(cls, sLogFilePath, listRecords, bTruncate = False):
+      """Appends records to the index of a log file.
+
+      str sLogFilePath
+         Full path to the log file.
+      list(bytes) listRecords
+         Records, as returned by pack_record().
+      [bool bTruncate]
+         If True, any existing records will be discarded first.
+      """
+
+      iFlags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+      if bTruncate:
+         iFlags |= os.O_TRUNC
+      iFd = os.open(cls.file_name(sLogFilePath), iFlags, 0o666)
+      try:
+         os.write(iFd, b''.join(listRecords))
+      finally:
+         os.close(iFd)
+
+
+   @staticmethod
+   def file_name(sLogFilePath):
+      """Returns the name of the index for a log file.
+
+      str sLogFilePath
+         Full path to the log file.
+      str return
+         Full path to the index file.
+      """
+
+      return sLogFilePath + '.idx'
+
+
+   @classmethod
+   def pack_record(cls, ibEntry, cbEntry, fTS, sCategory, sLogName):
+      """Generates an index record.
+
+      int ibEntry
+         Offset of the entry in the log file.
+      int cbEntry
+         Length of the entry in the log file, in bytes.
+      float fTS
+         Timestamp of the entry.
+      str sCategory
+         Category of the entry.
+      str sLogName
+         Name of the log.
+      bytes return
+         Index record.
+      """
+
+      return cls._RECORD.pack(
+         ibEntry, cbEntry, fTS, sCategory.encode('utf-8')[:32], sLogName.encode('utf-8')[:32]
+      )
+
+
+   @classmethod
+   def read_records(cls, sLogFilePath):
+      """Reads every record in the index of a log file; if the index is missing or doesn’t cover the
+      whole log (e.g. for logs written before indexing was introduced), it’s rebuilt first.
+
+      str sLogFilePath
+         Full path to the log file.
+      iterable(tuple(int, int, float, str, str)) return
+         Offset, length, timestamp, category and log name of each entry.
+      """
+
+      sIndexFilePath = cls.file_name(sLogFilePath)
+      try:
+         bStale = os.path.getmtime(sIndexFilePath) < os.path.getmtime(sLogFilePath) - 1
+      except OSError:
+         bStale = True
+      if bStale:
+         cls.rebuild(sLogFilePath)
+      with open(sIndexFilePath, 'rb') as fileIndex:
+         bytesIndex = fileIndex.read()
+      # Ignore a partially-written trailing record.
+      bytesIndex = bytesIndex[:len(bytesIndex) - len(bytesIndex) % cls._RECORD.size]
+      return (
+         (ibEntry, cbEntry, fTS, bytesCat.rstrip(b'\0').decode('utf-8', 'replace'),
+            bytesLogName.rstrip(b'\0').decode('utf-8', 'replace'))
+         for ibEntry, cbEntry, fTS, bytesCat, bytesLogName in cls._RECORD.iter_unpack(bytesIndex)
       )
+
+
+   @classmethod
+   def rebuild(cls, sLogFilePath):
+      """Regenerates the index of a log file by scanning the log.
+
+      str sLogFilePath
+         Full path to the log file.
+      """
+
+      # The log name is the file name, minus the date and the extensions.
+      sLogName = re.sub(
+         r'\d{4}-\d{2}-\d{2}\.log\.(?:xml|jsonl)$', '', os.path.basename(sLogFilePath)
+      )
+      bCompact = sLogFilePath.endswith('.jsonl')
+      listRecords = []
+      with open(sLogFilePath, 'rb') as fileLog:
+         fcntl.flock(fileLog, fcntl.LOCK_SH)
+         try:
+            ibLine = 0
+            tplEntry = None
+            for bytesLine in fileLog:
+               if bCompact:
+                  if bytesLine.endswith(b'\n'):
+                     fTS, sCategory = json.loads(bytesLine.decode('utf-8'))[:2]
+                     listRecords.append(
+                        cls.pack_record(ibLine, len(bytesLine), fTS, sCategory, sLogName)
+                     )
+               elif bytesLine.startswith(b'<entry '):
+                  match = re.match(rb'<entry ts="([^"]*)".*? cat="([^"]*)"', bytesLine)
+                  tplEntry = (ibLine, float(match.group(1)), match.group(2).decode('utf-8'))
+               # Entries always end with a line of their own.
+               if tplEntry and bytesLine.endswith(b'</entry>\n'):
+                  ibEntry, fTS, sCategory = tplEntry
+                  listRecords.append(cls.pack_record(
+                     ibEntry, ibLine + len(bytesLine) - ibEntry, fTS, sCategory, sLogName
+                  ))
+                  tplEntry = None
+               ibLine += len(bytesLine)
+            cls.append_records(sLogFilePath, listRecords, bTruncate = True)
+         finally:
+            fcntl.flock(fileLog, fcntl.LOCK_UN)
+
+
+
+class LogReader(object):
+   """Reads entries from the logs in a directory, using their indices to only read the entries
+   matching a query.
+   """
+
+   def __init__(self, sLogDir):
+      """Constructor.
+
+      str sLogDir
+         Directory containing the logs.
+      """
+
+      self._m_sLogDir = sLogDir
+
+
+   def _log_file_names(self, sLogName, fFrom, fTo):
+      """Returns the names of the log files that may contain entries in a time range.
+
+      str sLogName
+         Log name.
+      float fFrom
+         Start of the time range, or None for no lower bound.
+      float fTo
+         End of the time range, or None for no upper bound.
+      list(str) return
+         Full paths to the log files, in chronological order.
+      """
+
+      sFrom = fFrom is not None and time.strftime('%Y-%m-%d', time.gmtime(fFrom)) or None
+      sTo   = fTo   is not None and time.strftime('%Y-%m-%d', time.gmtime(fTo  )) or None
+      reFileName = re.compile(re.escape(sLogName) + r'(\d{4}-\d{2}-\d{2})\.log\.(?:xml|jsonl)$')
+      listFileNames = []
+      for sFileName in os.listdir(self._m_sLogDir):
+         match = reFileName.match(sFileName)
+         if match:
+            sDate = match.group(1)
+            if (sFrom is None or sDate >= sFrom) and (sTo is None or sDate <= sTo):
+               listFileNames.append(sFileName)
+      listFileNames.sort()
+      return [os.path.join(self._m_sLogDir, sFileName) for sFileName in listFileNames]
+
+
+   def count(self, sLogName = '', fFrom = None, fTo = None, iterCategories = None):
+      """Counts the entries matching a query. See LogReader.query() for the meaning of the
+      arguments.
+
+      int return
+         Count of matching entries.
+      """
+
+      return sum(1 for tpl in self._matching_records(sLogName, fFrom, fTo, iterCategories))
+
+
+   def _matching_records(self, sLogName, fFrom, fTo, iterCategories):
+      """Yields the index records matching a query. See LogReader.query() for the meaning of the
+      arguments.
+
+      tuple(str, int, int) yield
+         Full path to the log file, offset and length of the matching entry.
+      """
+
+      setCategories = iterCategories and frozenset(iterCategories) or None
+      for sLogFilePath in self._log_file_names(sLogName, fFrom, fTo):
+         for ibEntry, cbEntry, fTS, sCategory, sEntryLogName in LogIndex.read_records(sLogFilePath):
+            if (
+               (fFrom is None or fTS >= fFrom) and (fTo is None or fTS < fTo) and
+               (setCategories is None or sCategory in setCategories)
+            ):
+               yield sLogFilePath, ibEntry, cbEntry
+
+
+   def query(
+      self, sLogName = '', fFrom = None, fTo = None, iterCategories = None, iOffset = 0,
+      cLimit = None
+   ):
+      """Yields the entries matching a query, reading only those entries from the logs. Entries
+      stored in compact logs are rendered as XML, just like entries stored in XML logs.
+
+      [str sLogName]
+         Log name; if omitted, defaults to the default log.
+      [float fFrom]
+         Only return entries logged at this time or later.
+      [float fTo]
+         Only return entries logged before this time.
+      [iterable(str) iterCategories]
+         Only return entries in one of these categories.
+      [int iOffset]
+         Number of matching entries to skip.
+      [int cLimit]
+         Maximum number of entries to return.
+      str yield
+         Markup of the <entry> element.
+      """
+
+      sOpenFilePath = None
       fileLog = None
       try:
-         cRetries = 15
-         while True:
-            try:
-               fileLog = open(sFilePath, 'rb+')
-            else:
+         for iMatch, (sLogFilePath, ibEntry, cbEntry) in enumerate(
+            self._matching_records(sLogName, fFrom, fTo, iterCategories)
+         ):
+            if iMatch < iOffset:
+               continue
+            if cLimit is not None and iMatch >= iOffset + cLimit:
                break
-            cRetries -= 1
-            if cRetries == 0:
-               # Number of attempts exhausted.
-               raise Exception('Unable to acquire log lock')
-            touch(sFilePath)
-            time.sleep(1)
-
-         fcntl.flock(fileLog, fcntl.LOCK_EX)
-         # Rewind enough bytes to delete the trailing “</log>”, so we can add another entry and then
-         # terminate the root element back again.
-         fileLog.seek(-len('</log>\n'), io.SEEK_END)
-         # If the resulting file position is 0, we assume the file to be empty and…
-         if fileLog.tell() == 0:
-            # …add an XML prolog with a reference to the log-specific XSL file.
-            # TODO: this path calculation is a little too unstable.
-            cDirs = _APP['core']['log_lpath'][0:len(_SERVER['LROOTDIR'])].count('/')
-            sXslPath = '../' * cDirs + 'module/core/log.xsl'
-            s = '<?xml version="1.0" encoding="utf-8"?>\n' +
-                '<?xml-stylesheet type="text/xsl" href="{xslpath}"?>\n'.format(
-                   xslpath = sXslPath
-                ) +
-                '<log generator="{ver}/{rev} Logger" date="{date}">\n'.format(
-                   ver  = QUEARL_VERSION,
-                   rev  = QUEARL_REV,
-                   date = ql_format_timestamp('%x', $fTS, 'UTC'),
-                )
-         else:
-            s = ''
-         s += '<entry ts="{ts}" time="{time}" timef="timef" cat="{cat}" title="{title}">'.format(
-            ts    = $fTS,
-            time  = ql_format_timestamp('%X', $fTS, 'UTC'),
-            timef = ql_format_timestamp('%F', $fTS, 'UTC'),
-            cat   = sCategory,
-            title = xml_escape(sTitle),
-         )
-         if sContents:
-            s += '\n{}\n'.format(sContents)
-         s += '</entry>\n</log>\n'
-         fileLog.write(s)
-         fcntl.flock(fileLog, fcntl.LOCK_UN)
+            if sLogFilePath != sOpenFilePath:
+               if fileLog:
+                  fileLog.close()
+               fileLog = open(sLogFilePath, 'rb')
+               sOpenFilePath = sLogFilePath
+            fileLog.seek(ibEntry)
+            sEntry = fileLog.read(cbEntry).decode('utf-8')
+            if sLogFilePath.endswith('.jsonl'):
+               sEntry = Logger.render_entry(*json.loads(sEntry))
+            yield sEntry
       finally:
          if fileLog:
             fileLog.close()
-      return sTitle
 
+
+   def query_page(
+      self, sXslPath, sLogName = '', fFrom = None, fTo = None, iterCategories = None, iOffset = 0,
+      cLimit = 100
+   ):
+      """Yields a self-contained XML log document containing only a page of the entries matching a
+      query, so that log.xsl only needs to render that page; with cLimit = None, this exports every
+      matching entry. See LogReader.query() for the meaning of the other arguments.
+
+      str sXslPath
+         URL of log.xsl, as seen from the location the document will be viewed from.
+      str yield
+         Chunk of the document.
+      """
+
+      cTotal = self.count(sLogName, fFrom, fTo, iterCategories)
+      yield '<?xml version="1.0" encoding="utf-8"?>\n' + \
+            '<?xml-stylesheet type="text/xsl" href="{}"?>\n'.format(xml_escape(sXslPath)) + \
+            '<log generator="Quearl LogReader" date="{date}" offset="{offset}" count="{count}" ' \
+               'total="{total}">\n'.format(
+                  date   = time.strftime('%Y-%m-%d', time.gmtime(fFrom or time.time())),
+                  offset = iOffset,
+                  count  = max(0, min(cLimit if cLimit is not None else cTotal, cTotal - iOffset)),
+                  total  = cTotal,
+               )
+      for sEntry in self.query(sLogName, fFrom, fTo, iterCategories, iOffset, cLimit):
+         yield sEntry
+      yield '</log>\n'
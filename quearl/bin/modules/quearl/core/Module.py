@@ -0,0 +1,434 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Module classes."""
+
+import importlib
+import json
+import os
+import re
+import time
+
+
+
+####################################################################################################
+# Functions
+
+def class_name(sAbbr):
+   """Returns the name of the Python class implementing a module, which is also the name of the
+   file (in bin/modules/quearl/<abbr>/) defining it; e.g. “CoreModule” for “core”.
+
+   str sAbbr
+      Abbreviated name of the module.
+   str return
+      Class name.
+   """
+
+   return ''.join(sPart.capitalize() for sPart in sAbbr.split('_')) + 'Module'
+
+
+def discover_modules(sRootDir, sRODataDir):
+   """Scans the module directory of an installation, collecting everything the runtime needs to know
+   about each module in order to route requests to it, without loading its code. This is slow, since
+   it reads every module’s main PHP files and imports its Python class; quearl_build.py stores the
+   result as a manifest (see ModuleRegistry), so the runtime doesn’t need to do this.
+
+   str sRootDir
+      Quearl installation directory.
+   str sRODataDir
+      Quearl-wide read-only data directory.
+   dict(str: dict(str: object)) return
+      Information about each module, as {abbreviation: {key: value}}; see ModuleRegistry.
+   """
+
+   dictModules = {}
+   sModulesDir = os.path.join(sRootDir, 'module')
+   for sDirName in sorted(os.listdir(sModulesDir)):
+      sBaseDir = os.path.join(sModulesDir, sDirName)
+      if not os.path.isdir(sBaseDir):
+         continue
+      sAbbr = read_abbr(sBaseDir)
+      dictModule = {
+         'base_dir'    : os.path.relpath(sBaseDir, sRootDir),
+         'class'       : None,
+         'rodata_dir'  : os.path.relpath(os.path.join(sRODataDir, sAbbr), sRootDir),
+         'static_types': [],
+         'url_prefixes': [],
+      }
+      for sDir in 'l10n', 'template':
+         sSubDir = os.path.join(sBaseDir, sDir)
+         dictModule[sDir + '_dir'] = (
+            os.path.relpath(sSubDir, sRootDir) if os.path.isdir(sSubDir) else None
+         )
+      sClassName = class_name(sAbbr)
+      if os.path.isfile(os.path.join(
+         sRootDir, 'bin', 'modules', 'quearl', sAbbr, sClassName + '.py'
+      )):
+         dictModule['class'] = 'modules.quearl.{}.{}.{}'.format(sAbbr, sClassName, sClassName)
+         cls = load_class(dictModule['class'])
+         dictModule['static_types'] = list(cls.STATIC_FILE_TYPES)
+         dictModule['url_prefixes'] = list(cls.URL_PREFIXES)
+      dictModules[sAbbr] = dictModule
+   return dictModules
+
+
+def load_class(sQualifiedName):
+   """Imports a class.
+
+   str sQualifiedName
+      Fully-qualified name of the class, e.g. “modules.quearl.core.CoreModule.CoreModule”.
+   type return
+      Class.
+   """
+
+   sModuleName, _, sClassName = sQualifiedName.rpartition('.')
+   return getattr(importlib.import_module(sModuleName), sClassName)
+
+
+def read_abbr(sBaseDir):
+   """Reads the abbreviated name of a module from its main PHP files, i.e. the value returned by the
+   abbr() method of its QlModule-derived class.
+
+   str sBaseDir
+      Base directory of the module.
+   str return
+      Abbreviated name; if it can’t be found, the name of the module’s directory is returned.
+   """
+
+   for sFileName in sorted(os.listdir(sBaseDir)):
+      if sFileName.startswith('main') and sFileName.endswith('.php'):
+         with open(os.path.join(sBaseDir, sFileName), 'r', encoding = 'utf-8') as filePhp:
+            match = _reAbbr.search(filePhp.read())
+         if match:
+            return match.group('abbr')
+   return os.path.basename(sBaseDir)
+
+
+# Matches the body of QlModule::abbr() overrides.
+_reAbbr = re.compile(
+   r'function\s+abbr\s*\(\s*\)\s*\{\s*return\s+([\'"])(?P<abbr>[_0-9a-z]+)\1\s*;\s*\}'
+)
+
+
+
+####################################################################################################
+# Classes
+
+
+class Module(object):
+   """Base class for the Python side of a Quearl module; see QlModule. Each module implementing one
+   defines it as the class named by class_name() in bin/modules/quearl/<abbr>/<class name>.py.
+
+   A module is only instantiated (and its code only imported) when a request is routed to it, based
+   on its URL_PREFIXES and STATIC_FILE_TYPES, which are recorded in the module manifest.
+   """
+
+   # Prefixes of the URLs of the (non-static) requests handled by the module.
+   URL_PREFIXES = ()
+   # File name extensions of the static files served by the module; see [DOC:5015 Static files].
+   STATIC_FILE_TYPES = ()
+
+
+   def __init__(self, app, sAbbr, dictInfo):
+      """Constructor.
+
+      Application app
+         Application.
+      str sAbbr
+         Abbreviated name of the module.
+      dict(str: object) dictInfo
+         Information about the module, from the module manifest.
+      """
+
+      self._m_app = app
+      self._m_sAbbr = sAbbr
+      self._m_sBaseDir = os.path.join(app.root_dir(), dictInfo['base_dir'])
+      self._m_sRODataDir = os.path.join(app.root_dir(), dictInfo['rodata_dir'])
+
+
+   def abbr(self):
+      """Returns the module’s abbreviated name.
+
+      str return
+         Abbreviation.
+      """
+
+      return self._m_sAbbr
+
+
+   def augment_response_head(self, request, entity):
+      """Gives the module the possibility to add to the <head> of an XHTML page, e.g. to link its
+      scripts and style sheets; see QlModule::augment_response_head().
+
+      Request.Request request
+         Request being processed.
+      Response.XhtmlResponseEntity entity
+         Page being generated.
+      """
+
+      pass
+
+
+   def base_dir(self):
+      """Returns the module’s base directory.
+
+      str return
+         Base directory.
+      """
+
+      return self._m_sBaseDir
+
+
+   def handle_request(self, request):
+      """Gives the module the possibility to respond to a request whose URL starts with one of
+      URL_PREFIXES; see QlModule::handle_request().
+
+      Request.Request request
+         Request being processed.
+      tuple(str, list(tuple(str, str)), iterable(bytes)) return
+         Status, header fields and entity of the response, or None if the module won’t handle the
+         request.
+      """
+
+      return None
+
+
+   def handle_static_request(self, request):
+      """Gives the module the possibility to respond to a request for a static file whose name ends
+      in one of STATIC_FILE_TYPES; see QlModule::handle_static_request().
+
+      Request.Request request
+         Request being processed.
+      tuple(str, list(tuple(str, str)), iterable(bytes)) return
+         Status, header fields and entity of the response, or None if the module won’t handle the
+         request.
+      """
+
+      return None
+
+
+   def rodata_dir(self):
+      """Returns the module’s read-only data directory.
+
+      str return
+         Directory.
+      """
+
+      return self._m_sRODataDir
+
+
+
+class ModuleRegistry(object):
+   """Routes requests to the modules listed in the “load_modules” setting, importing each module’s
+   code only when a request is first routed to it.
+
+   Modules are described by the module manifest, data.ro/modules.json, generated by quearl_build.py
+   (see quearl_inst.ModuleIndexer); it contains the result of discover_modules(), where each module
+   is described by:
+   •  “base_dir”, “rodata_dir”, “l10n_dir”, “template_dir”: module directories, relative to the
+      installation directory; the last two are None if missing;
+   •  “class”: fully-qualified name of the module’s Python class, or None if it has none;
+   •  “url_prefixes”, “static_types”: Module.URL_PREFIXES and Module.STATIC_FILE_TYPES of the class.
+   If the manifest is missing, the modules are discovered when the registry is created.
+   """
+
+   def __init__(self, app):
+      """Constructor.
+
+      Application app
+         Application.
+      """
+
+      self._m_app = app
+      dictCore = app.section('core')
+      try:
+         with open(
+            self.manifest_file_name(dictCore['rodata_lpath']), 'r', encoding = 'utf-8'
+         ) as fileManifest:
+            self._m_dictInfos = json.load(fileManifest)
+      except (OSError, ValueError):
+         self._m_dictInfos = discover_modules(app.root_dir(), dictCore['rodata_lpath'])
+      # Abbreviated names of every module, longest first; see abbrs().
+      self._m_listAbbrs = sorted(self._m_dictInfos.keys(), key = lambda sAbbr: -len(sAbbr))
+      # Instantiated modules, as {abbreviation: Module}.
+      self._m_dictModules = {}
+      # Modules that can handle requests, in the order they were loaded.
+      self._m_listLoadModules = [
+         sAbbr for sAbbr in dictCore['load_modules']
+         if sAbbr in self._m_dictInfos and self._m_dictInfos[sAbbr]['class']
+      ]
+      listLoadModules = self._m_listLoadModules
+      # Routing tables: (URL prefix, module) pairs, longest prefix first; and modules serving each
+      # static file type.
+      self._m_listUrlPrefixes = sorted((
+         (sPrefix, sAbbr)
+         for sAbbr in listLoadModules for sPrefix in self._m_dictInfos[sAbbr]['url_prefixes']
+      ), key = lambda tpl: -len(tpl[0]))
+      self._m_dictStaticTypes = {}
+      for sAbbr in listLoadModules:
+         for sType in self._m_dictInfos[sAbbr]['static_types']:
+            self._m_dictStaticTypes.setdefault(sType, []).append(sAbbr)
+
+
+   def abbrs(self):
+      """Returns the abbreviated names of every module, longest first, so that a name prefixed by a
+      module abbreviation can be matched against them in order even if abbreviations contain
+      underscores.
+
+      list(str) return
+         Module abbreviations.
+      """
+
+      return self._m_listAbbrs
+
+
+   def augment_response_head(self, request, entity):
+      """Lets every loaded module add to the <head> of an XHTML page. Basic modules add their
+      scripts before the modules depending on them, so modules are called in reverse load order, as
+      in QlCoreModule::handle_request().
+
+      Request.Request request
+         Request being processed.
+      Response.XhtmlResponseEntity entity
+         Page being generated.
+      """
+
+      for sAbbr in reversed(self._m_listLoadModules):
+         self.get(sAbbr).augment_response_head(request, entity)
+
+
+   def get(self, sAbbr):
+      """Returns a module, instantiating it if necessary.
+
+      str sAbbr
+         Abbreviated name of the module.
+      Module return
+         Module, or None if the module doesn’t exist or has no Python class.
+      """
+
+      module = self._m_dictModules.get(sAbbr)
+      if module is None:
+         dictInfo = self._m_dictInfos.get(sAbbr)
+         if dictInfo is None or dictInfo['class'] is None:
+            return None
+         fStart = time.perf_counter()
+         module = load_class(dictInfo['class'])(self._m_app, sAbbr, dictInfo)
+         profiler = self._m_app.profiler()
+         if profiler is not None:
+            profiler.record_phase('module_init', time.perf_counter() - fStart)
+         self._m_dictModules[sAbbr] = module
+      return module
+
+
+   def info(self, sAbbr):
+      """Returns the information about a module from the manifest, without instantiating it.
+
+      str sAbbr
+         Abbreviated name of the module.
+      dict(str: object) return
+         Information about the module, or None if the module doesn’t exist.
+      """
+
+      return self._m_dictInfos.get(sAbbr)
+
+
+   def instantiated(self):
+      """Returns the abbreviated names of the modules that were instantiated so far.
+
+      list(str) return
+         Module abbreviations.
+      """
+
+      return list(self._m_dictModules.keys())
+
+
+   @staticmethod
+   def manifest_file_name(sRODataDir):
+      """Returns the path to the module manifest.
+
+      str sRODataDir
+         Quearl-wide read-only data directory.
+      str return
+         Path to the manifest.
+      """
+
+      return os.path.join(sRODataDir, 'modules.json')
+
+
+   def route_request(self, request):
+      """Lets the modules handling the requested URL respond to a request.
+
+      Request.Request request
+         Request being processed.
+      tuple(str, list(tuple(str, str)), iterable(bytes)) return
+         Response, as returned by Module.handle_request(), or None if no module responded.
+      """
+
+      sUrl = request.url()
+      for sPrefix, sAbbr in self._m_listUrlPrefixes:
+         if sUrl.startswith(sPrefix):
+            tplResponse = self.get(sAbbr).handle_request(request)
+            if tplResponse is not None:
+               return tplResponse
+      return None
+
+
+   def route_static_request(self, request):
+      """Lets the modules serving the type of the requested static file respond to a request. Unlike
+      regular requests, static requests are handled in full by a single module.
+
+      Request.Request request
+         Request being processed.
+      tuple(str, list(tuple(str, str)), iterable(bytes)) return
+         Response, as returned by Module.handle_static_request(), or None if no module responded.
+      """
+
+      for sAbbr in self._m_dictStaticTypes.get(self._static_type(request.url()), ()):
+         tplResponse = self.get(sAbbr).handle_static_request(request)
+         if tplResponse is not None:
+            return tplResponse
+      return None
+
+
+   def serves_static_file(self, sUrl):
+      """Checks whether any module serves static files of the type of a URL, without instantiating
+      any module.
+
+      str sUrl
+         URL of the static file, relative to the static root.
+      bool return
+         True if a module serves files of this type.
+      """
+
+      return self._static_type(sUrl) in self._m_dictStaticTypes
+
+
+   @staticmethod
+   def _static_type(sUrl):
+      """Returns the type of a static file, i.e. its file name extension.
+
+      str sUrl
+         URL of the static file.
+      str return
+         File name extension, without the dot; empty if the file name has none.
+      """
+
+      return sUrl.rpartition('.')[2] if '.' in sUrl.rpartition('/')[2] else ''
+
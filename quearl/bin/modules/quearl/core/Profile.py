@@ -0,0 +1,437 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Request profiling classes."""
+
+import json
+import math
+import os
+import random
+import re
+import time
+
+
+
+####################################################################################################
+# Functions
+
+def fingerprint(sSql):
+   """Normalizes an SQL statement, so that statements differing only in their literal values or
+   formatting are aggregated together: literals are replaced with “?”, lists of values with “(?+)”,
+   and any whitespace with a single space.
+
+   str sSql
+      SQL statement.
+   str return
+      Fingerprint of the statement.
+   """
+
+   sSql = _reLiteral.sub('?', sSql)
+   sSql = _reValueList.sub('(?+)', sSql)
+   return _reWhitespace.sub(' ', sSql).strip()
+
+
+def load_worker_files(sDir):
+   """Loads and merges the histograms written by Profiler.flush() by every worker process.
+
+   str sDir
+      Directory containing the profiling data files.
+   tuple(dict(str: Histogram), dict(str: Histogram)) return
+      Histograms of the duration of each request phase, and of each query fingerprint.
+   """
+
+   dictPhases = {}
+   dictQueries = {}
+   try:
+      listFileNames = sorted(os.listdir(sDir))
+   except FileNotFoundError:
+      listFileNames = []
+   for sFileName in listFileNames:
+      if not sFileName.endswith('.json'):
+         continue
+      try:
+         with open(os.path.join(sDir, sFileName), 'r', encoding = 'utf-8') as fileWorker:
+            dictWorker = json.load(fileWorker)
+      except (OSError, ValueError):
+         # The file was deleted, or is not a profiling data file.
+         continue
+      for sSection, dictMerged in ('phases', dictPhases), ('queries', dictQueries):
+         for sName, dictHistogram in dictWorker.get(sSection, {}).items():
+            histogram = dictMerged.get(sName)
+            if histogram is None:
+               histogram = Histogram()
+               dictMerged[sName] = histogram
+            histogram.merge(Histogram.from_dict(dictHistogram))
+   return dictPhases, dictQueries
+
+
+# Matches string and numeric literals in SQL statements.
+_reLiteral = re.compile(r'\'(?:[^\'\\]|\\.|\'\')*\'|"(?:[^"\\]|\\.|"")*"|\b[0-9]+(?:\.[0-9]+)?\b')
+# Matches lists of values, after literals have been replaced.
+_reValueList = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+# Matches sequences of whitespace.
+_reWhitespace = re.compile(r'\s+')
+
+
+
+####################################################################################################
+# Classes
+
+
+class Histogram(object):
+   """Distribution of durations, with bounded relative error and constant memory: durations are
+   counted in logarithmic buckets, each 2^(1/4) (about 19%) wider than the previous one, starting
+   from 1 µs. Histograms can be merged by adding up their buckets, so those of different processes
+   can be aggregated without losing precision.
+   """
+
+   # Buckets per doubling of the duration.
+   _smc_cBucketsPerOctave = 4
+
+
+   def __init__(self):
+      """Constructor."""
+
+      # Counts for each non-empty bucket, as {bucket index: count}.
+      self._m_dictBuckets = {}
+      self._m_cSamples = 0
+      self._m_fTotal = 0.0
+      self._m_fMin = None
+      self._m_fMax = None
+
+
+   def count(self):
+      """Returns the number of durations recorded.
+
+      int return
+         Count of durations.
+      """
+
+      return self._m_cSamples
+
+
+   @classmethod
+   def from_dict(cls, dictHistogram):
+      """Creates a histogram from the result of to_dict().
+
+      dict(str: object) dictHistogram
+         Histogram, as returned by to_dict().
+      Histogram return
+         New histogram.
+      """
+
+      histogram = cls()
+      histogram._m_dictBuckets = {
+         int(sBucket): cSamples for sBucket, cSamples in dictHistogram['buckets'].items()
+      }
+      histogram._m_cSamples = dictHistogram['count']
+      histogram._m_fTotal = dictHistogram['total']
+      histogram._m_fMin = dictHistogram['min']
+      histogram._m_fMax = dictHistogram['max']
+      return histogram
+
+
+   def max(self):
+      """Returns the longest duration recorded.
+
+      float return
+         Longest duration, in seconds, or None if no durations were recorded.
+      """
+
+      return self._m_fMax
+
+
+   def mean(self):
+      """Returns the mean of the durations recorded.
+
+      float return
+         Mean duration, in seconds, or None if no durations were recorded.
+      """
+
+      return self._m_fTotal / self._m_cSamples if self._m_cSamples else None
+
+
+   def merge(self, histogram):
+      """Adds the durations recorded by another histogram to this one.
+
+      Histogram histogram
+         Histogram to merge.
+      """
+
+      for iBucket, cSamples in histogram._m_dictBuckets.items():
+         self._m_dictBuckets[iBucket] = self._m_dictBuckets.get(iBucket, 0) + cSamples
+      self._m_cSamples += histogram._m_cSamples
+      self._m_fTotal += histogram._m_fTotal
+      if histogram._m_fMin is not None and (
+         self._m_fMin is None or histogram._m_fMin < self._m_fMin
+      ):
+         self._m_fMin = histogram._m_fMin
+      if histogram._m_fMax is not None and (
+         self._m_fMax is None or histogram._m_fMax > self._m_fMax
+      ):
+         self._m_fMax = histogram._m_fMax
+
+
+   def min(self):
+      """Returns the shortest duration recorded.
+
+      float return
+         Shortest duration, in seconds, or None if no durations were recorded.
+      """
+
+      return self._m_fMin
+
+
+   def percentile(self, fPercentile):
+      """Returns an approximation of a percentile of the durations recorded: the upper bound of the
+      bucket containing it, which is at most 19% higher than the actual value.
+
+      float fPercentile
+         Percentile, from 0 to 100.
+      float return
+         Duration, in seconds, or None if no durations were recorded.
+      """
+
+      if not self._m_cSamples:
+         return None
+      cRank = max(1, math.ceil(self._m_cSamples * fPercentile / 100))
+      cSamples = 0
+      for iBucket in sorted(self._m_dictBuckets.keys()):
+         cSamples += self._m_dictBuckets[iBucket]
+         if cSamples >= cRank:
+            break
+      fUpper = 2 ** ((iBucket + 1) / self._smc_cBucketsPerOctave) / 1000000
+      return min(max(fUpper, self._m_fMin), self._m_fMax)
+
+
+   def record(self, fDuration):
+      """Records a duration.
+
+      float fDuration
+         Duration, in seconds.
+      """
+
+      fMicroseconds = fDuration * 1000000
+      iBucket = (
+         int(math.log2(fMicroseconds) * self._smc_cBucketsPerOctave) if fMicroseconds > 1 else 0
+      )
+      self._m_dictBuckets[iBucket] = self._m_dictBuckets.get(iBucket, 0) + 1
+      self._m_cSamples += 1
+      self._m_fTotal += fDuration
+      if self._m_fMin is None or fDuration < self._m_fMin:
+         self._m_fMin = fDuration
+      if self._m_fMax is None or fDuration > self._m_fMax:
+         self._m_fMax = fDuration
+
+
+   def to_dict(self):
+      """Returns the histogram in a JSON-serializable form.
+
+      dict(str: object) return
+         Histogram.
+      """
+
+      return {
+         'buckets': {str(iBucket): cSamples for iBucket, cSamples in self._m_dictBuckets.items()},
+         'count'  : self._m_cSamples,
+         'total'  : self._m_fTotal,
+         'min'    : self._m_fMin,
+         'max'    : self._m_fMax,
+      }
+
+
+   def total(self):
+      """Returns the sum of the durations recorded.
+
+      float return
+         Total duration, in seconds.
+      """
+
+      return self._m_fTotal
+
+
+
+class Profiler(object):
+   """Collects the durations of the phases of a sample of the requests handled by a worker process,
+   and of the database queries they execute, as histograms; unlike QlDb’s performance debugging,
+   which logs each query, this is cheap enough to be left on in production.
+
+   Request phases are “request” (the whole request), “handler” (routing the request to a module
+   and running its handler), “session_load”, “render” (template rendering) and “send” (generating
+   and sending the response entity); phases that happen once per worker, “bootstrap” (creating the
+   application) and “module_init” (instantiating a module), are always recorded. Queries are
+   aggregated by fingerprint().
+
+   Histograms are periodically written to a file of this process in the profiling data directory,
+   and load_worker_files() merges those of every process (see quearl_profile.py). Profiling can be
+   disabled altogether by not creating a Profiler, which is what Application does when the sample
+   rate is 0.
+   """
+
+   # Maximum number of cached statement fingerprints, and of query histograms.
+   _smc_cMaxFingerprints = 1024
+
+
+   def __init__(self, sDir, fSampleRate, fFlushInterval):
+      """Constructor.
+
+      str sDir
+         Profiling data directory.
+      float fSampleRate
+         Fraction of requests to profile, from 0 to 1.
+      float fFlushInterval
+         Minimum time between writes of the histograms to the data file, in seconds.
+      """
+
+      self._m_sFileName = os.path.join(sDir, '{}-{}.json'.format(os.getpid(), time.time_ns()))
+      self._m_fSampleRate = fSampleRate
+      self._m_fFlushInterval = fFlushInterval
+      self._m_fNextFlush = time.monotonic() + fFlushInterval
+      # Histograms, as {phase: Histogram} and {fingerprint: Histogram}.
+      self._m_dictPhases = {}
+      self._m_dictQueries = {}
+      # Fingerprint of each statement seen, as {SQL: fingerprint}.
+      self._m_dictFingerprints = {}
+      # Start time of the request being sampled, or None if the current request is not sampled.
+      self._m_fRequestStart = None
+      self._m_bChanged = False
+      # True once this process starts handling requests; processes that never do (e.g. command line
+      # tools) don’t write a data file.
+      self._m_bHandlesRequests = False
+
+
+   def begin_request(self):
+      """Decides whether to profile the request that’s starting.
+
+      bool return
+         True if the request will be profiled.
+      """
+
+      self._m_bHandlesRequests = True
+      if self._m_fSampleRate >= 1 or random.random() < self._m_fSampleRate:
+         self._m_fRequestStart = time.perf_counter()
+         return True
+      self._m_fRequestStart = None
+      return False
+
+
+   def end_request(self):
+      """Records the duration of the request being profiled, if any, and writes the histograms to
+      the data file if enough time passed since they were last written.
+      """
+
+      if self._m_fRequestStart is not None:
+         self.record_phase('request', time.perf_counter() - self._m_fRequestStart)
+         self._m_fRequestStart = None
+      if self._m_bChanged and time.monotonic() >= self._m_fNextFlush:
+         self.flush()
+
+
+   def file_name(self):
+      """Returns the path to the data file of this process.
+
+      str return
+         Path to the data file.
+      """
+
+      return self._m_sFileName
+
+
+   def flush(self):
+      """Writes the histograms to the data file, if anything was recorded since the last write."""
+
+      self._m_fNextFlush = time.monotonic() + self._m_fFlushInterval
+      if not self._m_bChanged or not self._m_bHandlesRequests:
+         return
+      os.makedirs(os.path.dirname(self._m_sFileName), exist_ok = True)
+      # Write the whole file under a temporary name, so that readers never see it incomplete.
+      with open(self._m_sFileName + '.tmp', 'w', encoding = 'utf-8') as fileWorker:
+         json.dump({
+            'phases' : {
+               sPhase: histogram.to_dict() for sPhase, histogram in self._m_dictPhases.items()
+            },
+            'queries': {
+               sQuery: histogram.to_dict() for sQuery, histogram in self._m_dictQueries.items()
+            },
+         }, fileWorker)
+      os.replace(self._m_sFileName + '.tmp', self._m_sFileName)
+      self._m_bChanged = False
+
+
+   def is_sampling(self):
+      """Returns True if the current request is being profiled.
+
+      bool return
+         True if the request is being profiled.
+      """
+
+      return self._m_fRequestStart is not None
+
+
+   def record_phase(self, sPhase, fDuration):
+      """Records the duration of a request phase. Unlike record_query(), this doesn’t check whether
+      the current request is being profiled: callers timing per-request phases should check
+      is_sampling() before taking the time.
+
+      str sPhase
+         Name of the phase.
+      float fDuration
+         Duration, in seconds.
+      """
+
+      histogram = self._m_dictPhases.get(sPhase)
+      if histogram is None:
+         histogram = Histogram()
+         self._m_dictPhases[sPhase] = histogram
+      histogram.record(fDuration)
+      self._m_bChanged = True
+
+
+   def record_query(self, sSql, fDuration):
+      """Records the execution time of a query, if the current request is being profiled; meant to
+      be used as the query observer of a Db.ConnectionPool.
+
+      str sSql
+         SQL statement.
+      float fDuration
+         Execution time, in seconds.
+      """
+
+      if self._m_fRequestStart is None:
+         return
+      sFingerprint = self._m_dictFingerprints.get(sSql)
+      if sFingerprint is None:
+         if len(self._m_dictFingerprints) >= self._smc_cMaxFingerprints:
+            self._m_dictFingerprints.clear()
+         sFingerprint = fingerprint(sSql)
+         self._m_dictFingerprints[sSql] = sFingerprint
+      histogram = self._m_dictQueries.get(sFingerprint)
+      if histogram is None:
+         if len(self._m_dictQueries) >= self._smc_cMaxFingerprints:
+            # Don’t let queries built with literals (which fingerprint() can’t always normalize)
+            # grow the histograms without bounds.
+            sFingerprint = '(other)'
+            histogram = self._m_dictQueries.get(sFingerprint)
+      if histogram is None:
+         histogram = Histogram()
+         self._m_dictQueries[sFingerprint] = histogram
+      histogram.record(fDuration)
+      self._m_bChanged = True
+
@@ -0,0 +1,234 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""HTTP request classes."""
+
+import tempfile
+
+
+
+####################################################################################################
+# Classes
+
+
+class Request(object):
+   """Stores all the data provided by the HTTP client for a request."""
+
+   def __init__(self, dictEnv, cbSpoolThreshold, sStaticHost = '', sStaticRoot = None):
+      """Constructor.
+
+      dict(str: object) dictEnv
+         WSGI environment.
+      int cbSpoolThreshold
+         Size above which the request entity will be spooled to a temporary file instead of being
+         kept in memory.
+      [str sStaticHost]
+         Host serving static files (see [DOC:5015 Static files]); if empty, this server is assumed
+         to serve them.
+      [str sStaticRoot]
+         Path at which static files can be accessed on sStaticHost; if omitted, no request is
+         considered to be for a static file.
+      """
+
+      self._m_dictEnv = dictEnv
+      self._m_dictAcceptedEncodings = None
+      # Requested URL, without the query string; same as QlRequest::get_url().
+      if 'REQUEST_URI' in dictEnv:
+         self._m_sUrl = dictEnv['REQUEST_URI'].partition('?')[0]
+      else:
+         self._m_sUrl = dictEnv.get('SCRIPT_NAME', '') + dictEnv.get('PATH_INFO', '')
+      self._m_bStaticUrl = False
+      # If this server is also serving static files and the requested URL is in the static files
+      # directory, strip the static root, but remember that this is a request for a static file.
+      if sStaticRoot and (not sStaticHost or sStaticHost == dictEnv.get('HTTP_HOST')):
+         if self._m_sUrl.startswith(sStaticRoot):
+            self._m_sUrl = self._m_sUrl[len(sStaticRoot):]
+            self._m_bStaticUrl = True
+      try:
+         cbBody = int(dictEnv.get('CONTENT_LENGTH') or 0)
+      except ValueError:
+         cbBody = 0
+      self._m_body = RequestBody(dictEnv['wsgi.input'], cbBody, cbSpoolThreshold)
+
+
+   def accepted_encodings(self):
+      """Returns the content encodings accepted by the client, with their q-value; see
+      QlRequest::get_accepted_encodings().
+
+      dict(str: float) return
+         Q-value of each encoding listed in Accept-Encoding, by lowercase encoding name. If the
+         client didn’t send Accept-Encoding, only “identity” is acceptable; since that’s always
+         acceptable, it’s not included.
+      """
+
+      if self._m_dictAcceptedEncodings is None:
+         self._m_dictAcceptedEncodings = {}
+         for sItem in self._m_dictEnv.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            listParams = sItem.split(';')
+            sEncoding = listParams[0].strip().lower()
+            if not sEncoding:
+               continue
+            fQ = 1.0
+            for sParam in listParams[1:]:
+               sName, _, sValue = sParam.partition('=')
+               if sName.strip().lower() == 'q':
+                  try:
+                     fQ = float(sValue)
+                  except ValueError:
+                     fQ = 0.0
+            self._m_dictAcceptedEncodings[sEncoding] = fQ
+      return self._m_dictAcceptedEncodings
+
+
+   def body(self):
+      """Returns the request entity.
+
+      RequestBody return
+         Request entity.
+      """
+
+      return self._m_body
+
+
+   def close(self):
+      """Releases any resources associated to the request, such as a spooled request entity."""
+
+      self._m_body.close()
+
+
+   def environ(self):
+      """Returns the WSGI environment for the request.
+
+      dict(str: object) return
+         WSGI environment.
+      """
+
+      return self._m_dictEnv
+
+
+   def is_url_static_file(self):
+      """Returns True if the request is for a static file (see [DOC:5015 Static files]).
+
+      bool return
+         True if the request is for a static file.
+      """
+
+      return self._m_bStaticUrl
+
+
+   def url(self):
+      """Returns the requested URL, without the query string. For static files, the URL is relative
+      to the static root.
+
+      str return
+         URL.
+      """
+
+      return self._m_sUrl
+
+
+
+class RequestBody(object):
+   """Request entity. It’s read incrementally from the WSGI input stream, and spooled to a temporary
+   file once it grows past a size threshold, so that memory usage doesn’t depend on its size.
+   """
+
+   # Size of each read from the WSGI input stream or from the spooled entity.
+   CHUNK_SIZE = 64 * 1024
+
+
+   def __init__(self, fileInput, cbLength, cbSpoolThreshold):
+      """Constructor.
+
+      file fileInput
+         WSGI input stream.
+      int cbLength
+         Size of the entity, as declared by the remote client.
+      int cbSpoolThreshold
+         Size above which the entity will be spooled to a temporary file.
+      """
+
+      self._m_fileInput = fileInput
+      self._m_cbLength = cbLength
+      self._m_cbSpoolThreshold = cbSpoolThreshold
+      # Created by file() on first use.
+      self._m_fileSpool = None
+
+
+   def __iter__(self):
+      """Iterates over the entity in chunks of up to CHUNK_SIZE bytes; can be called any number of
+      times.
+
+      bytes yield
+         Chunk of the entity.
+      """
+
+      fileSpool = self.file()
+      fileSpool.seek(0)
+      while True:
+         bytesChunk = fileSpool.read(self.CHUNK_SIZE)
+         if not bytesChunk:
+            break
+         yield bytesChunk
+
+
+   def __len__(self):
+      """Returns the size of the entity.
+
+      int return
+         Size of the entity, in bytes.
+      """
+
+      return self._m_cbLength
+
+
+   def close(self):
+      """Discards the spooled entity, deleting its temporary file, if any."""
+
+      if self._m_fileSpool is not None:
+         self._m_fileSpool.close()
+         self._m_fileSpool = None
+
+
+   def file(self):
+      """Returns a seekable file containing the entity, reading it from the WSGI input stream if
+      that hasn’t happened yet.
+
+      file return
+         Binary file object positioned at the start of the entity.
+      """
+
+      if self._m_fileSpool is None:
+         fileSpool = tempfile.SpooledTemporaryFile(
+            max_size = self._m_cbSpoolThreshold, prefix = 'quearl-body-'
+         )
+         cbLeft = self._m_cbLength
+         while cbLeft > 0:
+            bytesChunk = self._m_fileInput.read(min(cbLeft, self.CHUNK_SIZE))
+            if not bytesChunk:
+               # The remote client sent less data than it declared; keep what we got.
+               self._m_cbLength -= cbLeft
+               break
+            fileSpool.write(bytesChunk)
+            cbLeft -= len(bytesChunk)
+         fileSpool.seek(0)
+         self._m_fileSpool = fileSpool
+      return self._m_fileSpool
+
@@ -0,0 +1,386 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Response entity classes."""
+
+import collections
+import re
+import urllib.parse
+from xml.sax.saxutils import escape as xml_escape
+
+from modules.quearl.core import Template
+
+
+
+####################################################################################################
+# Functions
+
+def accepts_xhtml(sAccept):
+   """Checks whether a client accepts XHTML documents served as such, as opposed to text/html.
+
+   str sAccept
+      Value of the Accept header field.
+   bool return
+      True if the client accepts application/xhtml+xml.
+   """
+
+   for sItem in sAccept.split(','):
+      if sItem.partition(';')[0].strip().lower() == 'application/xhtml+xml':
+         return True
+   return False
+
+
+# Matches the start of every non-empty line, except the first one.
+_reLineStart = re.compile(r'(?<=\n)(?=[^\r\n])')
+
+# Matches an XHTML tag.
+_reTag = re.compile(r'<[^>]*>')
+
+
+
+####################################################################################################
+# Classes
+
+
+class XhtmlResponseEntity(object):
+   """XHTML document response entity; see QlXhtmlResponseEntity.
+
+   Unlike QlXhtmlResponseEntity, which sends nothing until send_close(), the document is streamed:
+   once the handler has added all the <head> contents and returned the entity, the <head> section
+   is sent by itself, so the client can start fetching style sheets and scripts while the <body> is
+   being generated. Body fragments can be generators, which are only run as the body is sent, so the
+   memory needed doesn’t grow with the size of the page.
+
+   Body fragments are collected into buffers of “response_buffer_size” characters before being
+   written, to avoid a write (and a chunk) for each small fragment; a fragment bigger than that is
+   written on its own, rather than being copied into a buffer.
+   """
+
+   def __init__(self, app, request, sLocale = None, session = None):
+      """Constructor.
+
+      Application app
+         Application.
+      Request request
+         Request being processed.
+      [str sLocale]
+         Document locale; defaults to the session’s locale, or to the default locale.
+      [Session.Session session]
+         Session of the client, if any; the requested page is recorded in it as the last page
+         visited.
+      """
+
+      self._m_app = app
+      self._m_request = request
+      dictCore = app.section('core')
+      if sLocale is None and session is not None:
+         sLocale = session.get('ql_locale')
+      self._m_sLocale = sLocale or dictCore['default_locale']
+      self._m_cchBuffer = dictCore['response_buffer_size']
+      self._m_sTitle = dictCore.get('site_short_name', '')
+      self._m_sSubtitle = None
+      self._m_bHeadSent = False
+      dictEnv = request.environ()
+      if session is not None:
+         # If this class is being instantiated, this request will get a visible page (as opposed to
+         # this being e.g. an asynchronous request), so keep track of it.
+         session.set('ql_lastpage', urllib.parse.unquote(request.url()))
+         sSid = session.id()
+      else:
+         sSid = ''
+
+      # IE5.5 bug, IE6 bug, IE7 bug, IE8 bug: always want text/html, even for XHTML.
+      if accepts_xhtml(dictEnv.get('HTTP_ACCEPT', '')):
+         sContentType = 'application/xhtml+xml; charset=utf-8'
+      else:
+         sContentType = 'text/html; charset=utf-8'
+      self._m_listHeaders = [
+         ('Content-Type', sContentType),
+         ('Content-Language', self._m_sLocale),
+      ]
+
+      # Contents of the <head> element.
+      self._m_listHead = [
+         '<meta http-equiv="Content-Type" content="application/xhtml+xml; charset=utf-8"/>\n'
+         '<meta http-equiv="Content-Script-Type" content="text/javascript"/>\n'
+         '<meta http-equiv="Content-Language" content="' + self._m_sLocale + '"/>\n'
+         '<meta http-equiv="X-UA-Compatible" content="IE=8"/>\n'
+         '<script type="text/javascript">/*<![CDATA[*/\n'
+         '\tlocation.SID = "' + sSid + '";\n'
+         '\tlocation.SSID = "";\n'
+         '\tlocation.RROOTDIR = "' + self._url_scheme() + dictEnv.get('HTTP_HOST', '') +
+            dictCore['root_rpath'] + '";\n'
+         '\tvar Ql = {};\n'
+         '\tQl._mapXhtmlTemplates = {};\n'
+         '\tvar L10n = {};\n'
+         '/*]]>*/</script>\n'
+      ]
+      # Fragments of the <body> element not yet sent: strings, or iterables of strings.
+      self._m_dequeBody = collections.deque()
+
+
+   def __iter__(self):
+      """Sends the document: the <head> section right away, then the <body> section as it’s
+      generated.
+
+      bytes yield
+         Chunk of the response entity.
+      """
+
+      yield self._head().encode('utf-8')
+      listBuffer = []
+      cchBuffer = 0
+      for s in self._iter_body():
+         cch = len(s)
+         if cch >= self._m_cchBuffer:
+            # Write big fragments as they are, after anything that precedes them.
+            if listBuffer:
+               yield ''.join(listBuffer).encode('utf-8')
+               listBuffer = []
+               cchBuffer = 0
+            yield s.encode('utf-8')
+            continue
+         listBuffer.append(s)
+         cchBuffer += cch
+         if cchBuffer >= self._m_cchBuffer:
+            yield ''.join(listBuffer).encode('utf-8')
+            listBuffer = []
+            cchBuffer = 0
+      if listBuffer:
+         yield ''.join(listBuffer).encode('utf-8')
+
+
+   def add_body(self, oFragment):
+      """Adds content to the document’s <body> element. Can be called while the body is being
+      sent, e.g. by a generator added with this method.
+
+      str|iterable(str) oFragment
+         Markup to be added, or an iterable (e.g. a generator) yielding it; an iterable is only
+         iterated over as the body is sent.
+      """
+
+      self._m_dequeBody.append(oFragment)
+
+
+   def add_head(self, s):
+      """Adds content to the document’s <head> element.
+
+      str s
+         Markup to be added.
+      """
+
+      self._check_head_not_sent()
+      self._m_listHead.append(s)
+
+
+   def _check_head_not_sent(self):
+      """Raises an exception if the <head> section was already sent."""
+
+      if self._m_bHeadSent:
+         raise Exception('The document’s <head> has already been sent')
+
+
+   def close(self):
+      """Releases any body fragments not sent, closing any generators among them."""
+
+      while self._m_dequeBody:
+         oFragment = self._m_dequeBody.popleft()
+         if hasattr(oFragment, 'close'):
+            oFragment.close()
+
+
+   def _head(self):
+      """Generates the document up to the end of the <head> section; after this, the <head> can no
+      longer be changed.
+
+      str return
+         Markup.
+      """
+
+      self._m_bHeadSent = True
+      if self._m_sSubtitle is not None:
+         sTitle = xml_escape(self._m_sSubtitle) + ' - '
+      else:
+         sTitle = ''
+      sTitle += _reTag.sub('', self._m_sTitle)
+      return (
+         '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" '
+            '"http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="' + self._m_sLocale + '">\n'
+         '<head>\n' +
+            Template.indent(1, ''.join(self._m_listHead)) +
+         '\t<title>' + sTitle + '</title>\n'
+         '</head>\n'
+      )
+
+
+   def headers(self):
+      """Returns the header fields of the response.
+
+      list(tuple(str, str)) return
+         Header fields.
+      """
+
+      return self._m_listHeaders
+
+
+   def include_css(self, sFileName, bIEOnly = False):
+      """Links a pre-processed style sheet to the document.
+
+      str sFileName
+         Style sheet file name, relative to the static root.
+      [bool bIEOnly]
+         If True, the style sheet will only be loaded in Internet Explorer.
+      """
+
+      s = '<link rel="stylesheet" type="text/css" href="' + self._static_url(sFileName) + '"/>'
+      if bIEOnly:
+         s = '<!--[if IE]>' + s + '<![endif]-->'
+      self.add_head(s + '\n')
+
+
+   def include_js(self, sFileName, bIEOnly = False):
+      """Links a pre-processed JavaScript file from the document.
+
+      str sFileName
+         Script file name, relative to the static root.
+      [bool bIEOnly]
+         If True, the script will only be loaded in Internet Explorer.
+      """
+
+      s = (
+         '<script type="text/javascript" charset="utf-8" src="' + self._static_url(sFileName) +
+         '"></script>'
+      )
+      if bIEOnly:
+         s = '<!--[if IE]>' + s + '<![endif]-->'
+      self.add_head(s + '\n')
+
+
+   def include_js_bundle(self, sModuleAbbr):
+      """Links the pre-processed JavaScript bundle of a module from the document, preferring the
+      bundle that includes the module’s localization for the document locale, if there is one; see
+      Application.js_bundle_file_name().
+
+      str sModuleAbbr
+         Abbreviated name of the module.
+      """
+
+      sFileName = self._m_app.js_bundle_file_name(sModuleAbbr, self._m_sLocale)
+      if sFileName is None:
+         # Most likely, quearl_build.py was not run.
+         self._m_app.logger().write(
+            'E_USER_WARNING', 'No JS bundle found for module “{}”'.format(sModuleAbbr)
+         )
+         return
+      self.include_js(sFileName)
+
+
+   def _iter_body(self):
+      """Generates the <body> section, indenting the fragments added with add_body() as they’re
+      generated.
+
+      str yield
+         Markup.
+      """
+
+      # Yes, it is ugly. But it’s the only way to do it without remote or local scripts or user
+      # agent sniffing.
+      yield (
+         '<!--[if gte IE 8]><body class="css_ie80"><![endif]-->\n'
+         '<!--[if gte IE 7]><![if lt IE 8]><body class="css_ie70"><![endif]><![endif]-->\n'
+         '<!--[if gte IE 6]><![if lt IE 7]><body class="css_ie60"><![endif]><![endif]-->\n'
+         '<!--[if gte IE 5]><![if lt IE 6]><body class="css_ie55"><![endif]><![endif]-->\n'
+         '<!--[if !IE]><!--><body class="css_w3c"><!--><![endif]-->\n'
+      )
+      # Fragments can span lines, so whether a fragment starts a line depends on the previous one.
+      bLineStart = True
+      dequeBody = self._m_dequeBody
+      while dequeBody:
+         oFragment = dequeBody[0]
+         if isinstance(oFragment, str):
+            iterParts = (oFragment,)
+         else:
+            iterParts = oFragment
+         for s in iterParts:
+            if not s:
+               continue
+            s = _reLineStart.sub('\t', s)
+            if bLineStart and s[0] not in '\r\n':
+               s = '\t' + s
+            bLineStart = s[-1] == '\n'
+            yield s
+         # Only remove the fragment once it’s been sent, so close() can close it if interrupted.
+         dequeBody.popleft()
+      if not bLineStart:
+         yield '\n'
+      yield '</body>\n</html>'
+
+
+   def set_subtitle(self, sSubtitle):
+      """Sets a subtitle for the page.
+
+      str sSubtitle
+         New page subtitle (text).
+      """
+
+      self._check_head_not_sent()
+      self._m_sSubtitle = sSubtitle
+
+
+   def set_title(self, sTitle):
+      """Sets a title for the page. The string is XHTML, which means that it must be escaped
+      appropriately, and it may include tags.
+
+      str sTitle
+         New page title.
+      """
+
+      self._check_head_not_sent()
+      self._m_sTitle = sTitle
+
+
+   def _static_url(self, sFileName):
+      """Generates a URL for a static file; see QlXhtmlResponseEntity::make_static_url().
+
+      str sFileName
+         Path to the file, relative to the static root.
+      str return
+         URL for the file, escaped for use in an XML attribute.
+      """
+
+      dictCore = self._m_app.section('core')
+      if dictCore['static_host']:
+         sUrl = self._url_scheme() + dictCore['static_host']
+      else:
+         sUrl = ''
+      sUrl += dictCore['static_root_rpath'] + sFileName
+      return xml_escape(sUrl, {'"': '&quot;'})
+
+
+   def _url_scheme(self):
+      """Returns the scheme of the requested URL, like QlRequest::get_url_scheme().
+
+      str return
+         “http://” or “https://”.
+      """
+
+      return self._m_request.environ().get('wsgi.url_scheme', 'http') + '://'
+
@@ -0,0 +1,524 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Pre-forking HTTP server for the Quearl WSGI application."""
+
+import errno
+import os
+import signal
+import socket
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+from modules.quearl.core import Static
+
+
+
+####################################################################################################
+# Classes
+
+
+class _ChunkedServerHandler(ServerHandler):
+   """WSGI handler that streams responses of unknown length to HTTP/1.1 clients using chunked
+   transfer encoding, instead of buffering them to calculate a Content-Length, and sends file
+   entities (see Static.FileEntity) with os.sendfile(), without copying them through user space.
+
+   Responses to HEAD requests only consist of the header, including any Content-Length: the entity
+   generated by the application is discarded.
+   """
+
+   # Necessary to be allowed to use chunked transfer encoding.
+   http_version = '1.1'
+
+
+   def cleanup_headers(self):
+      """See wsgiref.handlers.BaseHandler.cleanup_headers()."""
+
+      ServerHandler.cleanup_headers(self)
+      iStatus = int(self.status[:3])
+      self._m_bChunked = (
+         'Content-Length' not in self.headers and
+         self.environ.get('SERVER_PROTOCOL') == 'HTTP/1.1' and
+         self.environ.get('REQUEST_METHOD') != 'HEAD' and
+         iStatus >= 200 and iStatus != 204 and iStatus != 304
+      )
+      if self._m_bChunked:
+         self.headers['Transfer-Encoding'] = 'chunked'
+      # Each connection only carries one request.
+      self.headers['Connection'] = 'close'
+
+
+   def finish_content(self):
+      """See wsgiref.handlers.BaseHandler.finish_content()."""
+
+      if not self.headers_sent and self.status[:3] in ('204', '304'):
+         # Send the header without the “Content-Length: 0” the base class would add: in a 304
+         # response, it would claim the cached entity is empty.
+         self.send_headers()
+         return
+      ServerHandler.finish_content(self)
+      if self._m_bChunked:
+         # Terminate the entity with a zero-length chunk.
+         self._write(b'0\r\n\r\n')
+         self._flush()
+
+
+   def result_is_file(self):
+      """See wsgiref.handlers.BaseHandler.result_is_file()."""
+
+      return isinstance(self.result, Static.FileEntity)
+
+
+   def sendfile(self):
+      """See wsgiref.handlers.BaseHandler.sendfile()."""
+
+      if self.environ.get('REQUEST_METHOD') == 'HEAD':
+         if not self.headers_sent:
+            self.send_headers()
+         return True
+      sock = getattr(self.request_handler, 'connection', None)
+      # os.sendfile() needs a blocking socket; a socket with a timeout is non-blocking internally.
+      if not hasattr(os, 'sendfile') or sock is None or sock.gettimeout() is not None:
+         return False
+      if not self.headers_sent:
+         self.send_headers()
+      if self._m_bChunked:
+         return False
+      self._flush()
+      entity = self.result
+      fdSocket = sock.fileno()
+      ib = 0
+      cb = entity.size()
+      while ib < cb:
+         cbSent = os.sendfile(fdSocket, entity.fileno(), ib, cb - ib)
+         if cbSent == 0:
+            # The file was truncated; the client will notice the entity is shorter than announced.
+            break
+         ib += cbSent
+      self.bytes_sent += ib
+      return True
+
+
+   def write(self, bytesData):
+      """See wsgiref.handlers.BaseHandler.write()."""
+
+      if self.environ.get('REQUEST_METHOD') == 'HEAD':
+         if not self.headers_sent:
+            # Send the header as the base class would (counting the first block, in case it’s the
+            # only one and its size becomes the Content-Length), but not the entity.
+            self.bytes_sent = len(bytesData)
+            self.send_headers()
+            self._flush()
+         return
+      if not self.headers_sent:
+         # Let the base class send the header, so we know whether we’ll use chunked encoding.
+         ServerHandler.write(self, b'')
+      if not self._m_bChunked:
+         ServerHandler.write(self, bytesData)
+      elif bytesData:
+         # Empty chunks must be skipped, since a zero-length chunk marks the end of the entity.
+         ServerHandler.write(self, b'%x\r\n%b\r\n' % (len(bytesData), bytesData))
+
+
+
+class _RequestHandler(WSGIRequestHandler):
+   """Handles a single request on a connection, streaming the response."""
+
+   def handle(self):
+      """See wsgiref.simple_server.WSGIRequestHandler.handle()."""
+
+      self.raw_requestline = self.rfile.readline(65537)
+      if len(self.raw_requestline) > 65536:
+         self.requestline = ''
+         self.request_version = ''
+         self.command = ''
+         self.send_error(414)
+         return
+      if not self.parse_request():
+         # An error code has already been sent.
+         return
+      handler = _ChunkedServerHandler(
+         self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread = False
+      )
+      handler.request_handler = self
+      handler.run(self.server.get_app())
+
+
+   def log_message(self, sFormat, *args):
+      """See http.server.BaseHTTPRequestHandler.log_message(). Doesn’t log every request to stderr.
+      """
+
+      pass
+
+
+
+class _WorkerWSGIServer(WSGIServer):
+   """WSGI server running in a worker process, on a listening socket shared with other workers."""
+
+   def __init__(self, sock, sServerName, iPort, app):
+      """Constructor.
+
+      socket.socket sock
+         Listening socket, already bound.
+      str sServerName
+         Server name to report in the WSGI environment.
+      int iPort
+         Port the socket is bound to.
+      callable app
+         WSGI application.
+      """
+
+      WSGIServer.__init__(
+         self, sock.getsockname(), _RequestHandler, bind_and_activate = False
+      )
+      # Replace the socket created by the base class with the shared one.
+      self.socket.close()
+      self.socket = sock
+      self.server_name = sServerName
+      self.server_port = iPort
+      self.setup_environ()
+      self.set_app(app)
+      # Wake up periodically to give the worker a chance to check whether it’s been asked to stop.
+      self.timeout = 1
+      self._m_cRequests = 0
+
+
+   def finish_request(self, request, tplClientAddress):
+      """See socketserver.BaseServer.finish_request()."""
+
+      self._m_cRequests += 1
+      WSGIServer.finish_request(self, request, tplClientAddress)
+
+
+   def handle_timeout(self):
+      """See socketserver.BaseServer.handle_timeout()."""
+
+      pass
+
+
+   def requests_handled(self):
+      """Returns the number of requests handled so far.
+
+      int return
+         Count of requests.
+      """
+
+      return self._m_cRequests
+
+
+
+class PreforkServer(object):
+   """Long-running HTTP server that pre-forks a pool of worker processes, each of which creates its
+   own Application instance once and then handles requests for it until recycled.
+
+   The master process never handles requests; it only keeps the pool at the configured size,
+   replacing workers that exit after serving their quota of requests, and gracefully restarts the
+   whole pool when any of the watched files (configuration files, Python modules) change or when it
+   receives SIGHUP. Workers asked to stop always finish the request they’re handling first.
+
+   Optionally, the master also keeps a background process running, for periodic tasks that must not
+   be performed while handling requests (e.g. deleting expired sessions); it’s restarted along with
+   the workers.
+   """
+
+   def __init__(
+      self, fnAppFactory, sHost = '', iPort = 8008, cWorkers = 4, cMaxRequests = 1000,
+      iterWatchedPaths = (), fnBackgroundTask = None
+   ):
+      """Constructor.
+
+      callable fnAppFactory
+         Callable returning a WSGI application; called once in each worker process.
+      [str sHost]
+         Address to listen on; defaults to all addresses.
+      [int iPort]
+         Port to listen on.
+      [int cWorkers]
+         Number of worker processes.
+      [int cMaxRequests]
+         Number of requests a worker handles before being recycled; 0 means unlimited.
+      [iterable(str) iterWatchedPaths]
+         Files or directories whose contents will be checked for changes; a change will cause a
+         graceful restart of every worker.
+      [callable fnBackgroundTask]
+         Function to run in the background process; it receives a function that waits for the
+         number of seconds passed as its argument, returning False if the background process must
+         exit instead. If omitted, no background process is started.
+      """
+
+      self._m_fnAppFactory = fnAppFactory
+      self._m_sHost = sHost
+      self._m_iPort = iPort
+      self._m_cWorkers = cWorkers
+      self._m_cMaxRequests = cMaxRequests
+      self._m_listWatchedPaths = list(iterWatchedPaths)
+      self._m_sock = None
+      self._m_sServerName = None
+      # Maps the PID of each worker to its generation.
+      self._m_dictWorkers = {}
+      # Incremented for every graceful restart; workers of older generations are stopped.
+      self._m_iGeneration = 0
+      self._m_fnBackgroundTask = fnBackgroundTask
+      # PID of the background process, if running.
+      self._m_iBackgroundPid = None
+      self._m_bRestart = False
+      self._m_bStop = False
+
+
+   def _background_main(self):
+      """Background process main function.
+
+      int return
+         Exit code for the background process.
+      """
+
+      signal.signal(signal.SIGHUP, signal.SIG_IGN)
+      signal.signal(signal.SIGINT, signal.SIG_IGN)
+      # SIGTERM is only collected via sigtimedwait(), so that waiting ends as soon as it arrives.
+      signal.pthread_sigmask(signal.SIG_BLOCK, (signal.SIGTERM, ))
+      signal.pthread_sigmask(signal.SIG_UNBLOCK, (signal.SIGCHLD, ))
+      # This process never accepts connections.
+      self._m_sock.close()
+
+      def wait(fTimeout):
+         return signal.sigtimedwait((signal.SIGTERM, ), fTimeout) is None
+
+      self._m_fnBackgroundTask(wait)
+      return 0
+
+
+   def bind(self):
+      """Creates the listening socket, shared by every worker.
+
+      tuple(str, int) return
+         Address the server is listening on.
+      """
+
+      self._m_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      self._m_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      self._m_sock.bind((self._m_sHost, self._m_iPort))
+      self._m_sock.listen(socket.SOMAXCONN)
+      # Every worker waits on the same socket, but only one will get each connection; the others
+      # must not block in accept().
+      self._m_sock.setblocking(False)
+      self._m_iPort = self._m_sock.getsockname()[1]
+      self._m_sServerName = socket.getfqdn(self._m_sHost or 'localhost')
+      return self._m_sock.getsockname()
+
+
+   def _fork_background(self):
+      """Starts the background process."""
+
+      iPid = os.fork()
+      if iPid == 0:
+         iExitCode = 1
+         try:
+            iExitCode = self._background_main()
+         finally:
+            # Never return into the master’s code.
+            os._exit(iExitCode)
+      self._m_iBackgroundPid = iPid
+
+
+   def _fork_worker(self):
+      """Starts a new worker process of the current generation."""
+
+      iPid = os.fork()
+      if iPid == 0:
+         iExitCode = 1
+         try:
+            iExitCode = self._worker_main()
+         finally:
+            # Never return into the master’s code.
+            os._exit(iExitCode)
+      self._m_dictWorkers[iPid] = self._m_iGeneration
+
+
+   def _on_sighup(self, iSignal, frame):
+      """Handles SIGHUP in the master process by scheduling a graceful restart."""
+
+      self._m_bRestart = True
+
+
+   def _on_sigterm(self, iSignal, frame):
+      """Handles SIGTERM and SIGINT in the master process by scheduling a shutdown."""
+
+      self._m_bStop = True
+
+
+   def _reap_workers(self):
+      """Collects the exit status of every terminated worker, without blocking."""
+
+      while self._m_dictWorkers or self._m_iBackgroundPid is not None:
+         try:
+            iPid, iStatus = os.waitpid(-1, os.WNOHANG)
+         except ChildProcessError:
+            break
+         if iPid == 0:
+            break
+         if iPid == self._m_iBackgroundPid:
+            # It will be started again.
+            self._m_iBackgroundPid = None
+         self._m_dictWorkers.pop(iPid, None)
+
+
+   def _restart_workers(self):
+      """Starts a new generation of workers, and asks every worker of older generations to exit
+      after completing its current request.
+      """
+
+      self._m_iGeneration += 1
+      for iPid, iGeneration in list(self._m_dictWorkers.items()):
+         if iGeneration < self._m_iGeneration:
+            self._signal_worker(iPid, signal.SIGTERM)
+      # The background process is started again once it exits.
+      if self._m_iBackgroundPid is not None:
+         self._signal_worker(self._m_iBackgroundPid, signal.SIGTERM)
+
+
+   def serve_forever(self):
+      """Runs the master process loop. Returns after receiving SIGTERM or SIGINT, once every worker
+      has exited.
+      """
+
+      if self._m_sock is None:
+         self.bind()
+      signal.signal(signal.SIGHUP,  self._on_sighup)
+      signal.signal(signal.SIGTERM, self._on_sigterm)
+      signal.signal(signal.SIGINT,  self._on_sigterm)
+      # SIGCHLD is only collected via sigtimedwait(), to respawn exited workers right away.
+      signal.pthread_sigmask(signal.SIG_BLOCK, (signal.SIGCHLD, ))
+
+      dictMTimes = self._snapshot_watched_paths()
+      while not self._m_bStop:
+         self._reap_workers()
+         # Top up the pool with workers of the current generation.
+         cCurrWorkers = sum(
+            1 for iGeneration in self._m_dictWorkers.values() if iGeneration == self._m_iGeneration
+         )
+         for i in range(cCurrWorkers, self._m_cWorkers):
+            self._fork_worker()
+         if self._m_fnBackgroundTask is not None and self._m_iBackgroundPid is None:
+            self._fork_background()
+         # Wait for a worker to exit, but not so long that file changes go unnoticed.
+         signal.sigtimedwait((signal.SIGCHLD, ), 1)
+         # Check for changes to any watched files.
+         dictNewMTimes = self._snapshot_watched_paths()
+         if dictNewMTimes != dictMTimes:
+            dictMTimes = dictNewMTimes
+            self._m_bRestart = True
+         if self._m_bRestart:
+            self._m_bRestart = False
+            self._restart_workers()
+
+      # Stop every worker (and the background process) and wait for them to finish their current
+      # request.
+      for iPid in list(self._m_dictWorkers.keys()):
+         self._signal_worker(iPid, signal.SIGTERM)
+      if self._m_iBackgroundPid is not None:
+         self._signal_worker(self._m_iBackgroundPid, signal.SIGTERM)
+      while self._m_dictWorkers or self._m_iBackgroundPid is not None:
+         try:
+            iPid, iStatus = os.wait()
+         except ChildProcessError:
+            break
+         if iPid == self._m_iBackgroundPid:
+            self._m_iBackgroundPid = None
+         self._m_dictWorkers.pop(iPid, None)
+      self._m_sock.close()
+
+
+   def _signal_worker(self, iPid, iSignal):
+      """Sends a signal to a worker, ignoring workers that already exited.
+
+      int iPid
+         Process ID of the worker.
+      int iSignal
+         Signal to send.
+      """
+
+      try:
+         os.kill(iPid, iSignal)
+      except OSError as x:
+         if x.errno != errno.ESRCH:
+            raise
+
+
+   def _snapshot_watched_paths(self):
+      """Collects the last modification time of every file in the watched paths.
+
+      dict(str: float) return
+         Last modification time of each watched file.
+      """
+
+      dictMTimes = {}
+      for sPath in self._m_listWatchedPaths:
+         if os.path.isdir(sPath):
+            for sDirPath, listDirNames, listFileNames in os.walk(sPath):
+               # Skip compiled Python files, which are written by the workers themselves.
+               if '__pycache__' in listDirNames:
+                  listDirNames.remove('__pycache__')
+               for sFileName in listFileNames:
+                  sFilePath = os.path.join(sDirPath, sFileName)
+                  try:
+                     dictMTimes[sFilePath] = os.path.getmtime(sFilePath)
+                  except OSError:
+                     # The file was deleted while we were walking the directory.
+                     pass
+         else:
+            try:
+               dictMTimes[sPath] = os.path.getmtime(sPath)
+            except OSError:
+               dictMTimes[sPath] = None
+      return dictMTimes
+
+
+   def _worker_main(self):
+      """Worker process main loop.
+
+      int return
+         Exit code for the worker process.
+      """
+
+      bStop = False
+
+      def on_sigterm(iSignal, frame):
+         nonlocal bStop
+         bStop = True
+
+      signal.signal(signal.SIGHUP,  signal.SIG_IGN)
+      signal.signal(signal.SIGINT,  signal.SIG_IGN)
+      signal.signal(signal.SIGTERM, on_sigterm)
+      signal.pthread_sigmask(signal.SIG_UNBLOCK, (signal.SIGCHLD, ))
+
+      # Load the application only once for the whole life of this worker.
+      app = self._m_fnAppFactory()
+      server = _WorkerWSGIServer(self._m_sock, self._m_sServerName, self._m_iPort, app)
+      try:
+         while not bStop:
+            server.handle_request()
+            if self._m_cMaxRequests and server.requests_handled() >= self._m_cMaxRequests:
+               # Recycle this worker.
+               break
+      finally:
+         # Give the application a chance to flush anything it buffered (e.g. queued log entries).
+         fnClose = getattr(app, 'close', None)
+         if fnClose is not None:
+            fnClose()
+      return 0
@@ -0,0 +1,891 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Session classes."""
+
+import base64
+import collections
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import time
+import types
+import zlib
+
+from modules.quearl.core import Config
+
+
+
+####################################################################################################
+# Functions
+
+def is_valid_id(sSid):
+   """Checks whether a string is a syntactically valid session ID (SID), as generated by new_id().
+
+   str sSid
+      String to check.
+   bool return
+      True if sSid is a valid SID.
+   """
+
+   return bool(_reSid.match(sSid))
+
+
+def new_id():
+   """Generates a new, random session ID (SID); like ql_str_uid(32), it’s 32 characters long, using
+   only characters that need no escaping in URLs and cookies.
+
+   str return
+      New SID.
+   """
+
+   return base64.urlsafe_b64encode(os.urandom(24)).decode('ascii')
+
+
+# Matches a valid SID.
+_reSid = re.compile(r'^[-_0-9A-Za-z]{32}$')
+
+
+
+####################################################################################################
+# Classes
+
+
+class Session(object):
+   """Session opened by a SessionStore; see QlSession. The session is locked until
+   write_and_close() is called.
+
+   Session data is read-only, as loaded (or cached) by the store, until set() is called; only then
+   is a mutable copy made, and only if the data actually changed will it be written back.
+   """
+
+   def __init__(self, store, sSid, iVersion, sData, mapData):
+      """Constructor. Use SessionStore.create() or SessionStore.open() to get a session.
+
+      SessionStore store
+         Store the session was opened from.
+      str sSid
+         Session ID.
+      int iVersion
+         Version of the session data, as stored by the backend.
+      str sData
+         Serialized session data.
+      mapping(str: object) mapData
+         Read-only session data.
+      """
+
+      self._m_store = store
+      self._m_sSid = sSid
+      self._m_iVersion = iVersion
+      self._m_sData = sData
+      self._m_mapData = mapData
+      # Mutable copy of the data, created by set().
+      self._m_dictData = None
+      self._m_bLocked = True
+
+
+   def changed_data(self):
+      """Returns the session data in the format stored by the backend, if it changed since it was
+      loaded or last stored.
+
+      str return
+         Serialized session data, or None if the data didn’t change.
+      """
+
+      if self._m_dictData is None:
+         return None
+      sData = json.dumps(Config.thaw(types.MappingProxyType(self._m_dictData)), sort_keys = True)
+      return sData if sData != self._m_sData else None
+
+
+   def data(self):
+      """Returns the session data.
+
+      mapping(str: object) return
+         Read-only session data.
+      """
+
+      if self._m_dictData is not None:
+         return types.MappingProxyType(self._m_dictData)
+      return self._m_mapData
+
+
+   def get(self, sKey, oDefault = None):
+      """Returns an entry of the session data.
+
+      str sKey
+         Entry name.
+      [object oDefault]
+         Value to return if the entry doesn’t exist.
+      object return
+         Read-only value of the entry.
+      """
+
+      return self.data().get(sKey, oDefault)
+
+
+   def id(self):
+      """Returns the session ID (SID).
+
+      str return
+         Session ID.
+      """
+
+      return self._m_sSid
+
+
+   def is_locked(self):
+      """Returns True if write_and_close() still needs to be called.
+
+      bool return
+         True if the session is locked.
+      """
+
+      return self._m_bLocked
+
+
+   def set(self, sKey, oValue):
+      """Changes an entry of the session data.
+
+      str sKey
+         Entry name.
+      object oValue
+         New value for the entry; if None, the entry is removed.
+      """
+
+      if self._m_dictData is None:
+         self._m_dictData = dict(self._m_mapData)
+      if oValue is None:
+         self._m_dictData.pop(sKey, None)
+      else:
+         self._m_dictData[sKey] = Config.freeze(oValue)
+
+
+   def version(self):
+      """Returns the version of the session data, as last loaded or stored.
+
+      int return
+         Version.
+      """
+
+      return self._m_iVersion
+
+
+   def write_and_close(self):
+      """Saves the session data if it changed, then unlocks the session; see
+      SessionStore.write_and_close().
+      """
+
+      if not self._m_bLocked:
+         raise Exception('Session {} already closed'.format(self._m_sSid))
+      try:
+         self._m_store.write_and_close(self)
+      finally:
+         self._m_bLocked = False
+
+
+   def _written(self, iVersion, sData):
+      """Records that the session data was stored by the backend. Only for use by SessionStore.
+
+      int iVersion
+         New version of the session data.
+      str sData
+         Serialized session data, as stored.
+      """
+
+      if self._m_dictData is not None:
+         self._m_mapData = types.MappingProxyType(self._m_dictData)
+         self._m_dictData = None
+      self._m_iVersion = iVersion
+      self._m_sData = sData
+
+
+
+class SessionBackend(object):
+   """Base class for session storage backends. A backend stores, for each session: its ID, the ID of
+   the logged in user (if any), the time of the first and last hits, a version number incremented
+   each time the data is saved, and the serialized data.
+
+   Sessions are locked by a process for the duration of a request, like QlSession does. Backends
+   must implement waiting for a session lock as a blocking wait, not by polling.
+   """
+
+   def __init__(self, app):
+      """Constructor.
+
+      Application app
+         Application.
+      """
+
+      self._m_app = app
+
+
+   def close(self):
+      """Releases any resources held by the backend."""
+
+      pass
+
+
+   def count(self):
+      """Returns the number of stored sessions.
+
+      int return
+         Number of sessions.
+      """
+
+      raise NotImplementedError()
+
+
+   def create(self, sSid, iTS, sData):
+      """Creates a new session, locked by the caller.
+
+      str sSid
+         Session ID.
+      int iTS
+         Timestamp of the first hit.
+      str sData
+         Serialized session data.
+      bool return
+         True if the session was created, or False if a session with the same ID already exists.
+      """
+
+      raise NotImplementedError()
+
+
+   def delete(self, sSid):
+      """Deletes a session. The session must be locked by the caller.
+
+      str sSid
+         Session ID.
+      """
+
+      raise NotImplementedError()
+
+
+   def delete_expired(self, iBefore, cMaxRows):
+      """Deletes a limited number of expired sessions, oldest first, in a single short transaction.
+      This should use an index on the last hit, so that its cost only depends on cMaxRows, and not
+      on the number of sessions.
+
+      int iBefore
+         Sessions whose last hit is older than this timestamp are expired.
+      int cMaxRows
+         Maximum number of sessions to delete.
+      int return
+         Number of sessions deleted.
+      """
+
+      raise NotImplementedError()
+
+
+   def load(self, sSid, iTS, iCachedVersion):
+      """Updates the last hit of a session and returns its data, in a single round trip. The session
+      must be locked by the caller.
+
+      str sSid
+         Session ID.
+      int iTS
+         Timestamp of the hit.
+      int iCachedVersion
+         Version of the session data the caller already has; if it matches the stored one, the data
+         is not returned. Use 0 if the caller has no data for the session.
+      tuple(int, str) return
+         Version and serialized data of the session (None if the version is iCachedVersion), or None
+         if the session doesn’t exist.
+      """
+
+      raise NotImplementedError()
+
+
+   def lock(self, sSid):
+      """Locks a session, waiting for any other process holding its lock to release it. This can be
+      called even for sessions that don’t exist.
+
+      str sSid
+         Session ID.
+      """
+
+      raise NotImplementedError()
+
+
+   def save(self, sSid, iTS, iUserId, sData):
+      """Stores new data for a session. The session must be locked by the caller.
+
+      str sSid
+         Session ID.
+      int iTS
+         Timestamp of the hit.
+      int iUserId
+         ID of the logged in user, or None.
+      str sData
+         Serialized session data.
+      int return
+         New version of the session data, or None if the session doesn’t exist any more.
+      """
+
+      raise NotImplementedError()
+
+
+   def unlock(self, sSid):
+      """Releases the lock on a session acquired with lock().
+
+      str sSid
+         Session ID.
+      """
+
+      raise NotImplementedError()
+
+
+
+class SessionCollector(object):
+   """Deletes expired sessions; replaces QlSession::gc(), which runs a single unbounded DELETE on
+   whichever request triggers it, stalling that request and locking out session lookups while it
+   runs.
+
+   The collector is meant to run periodically outside of any request (see
+   Application.collect_sessions()). Each pass deletes expired sessions in batches of bounded size,
+   each in its own short transaction, so that session lookups are never locked out for long; a pass
+   stops after a maximum number of batches, leaving any backlog to the next pass.
+
+   The time between passes adapts to the observed expiry volume: the collector estimates how many
+   sessions expire per second, and schedules the next pass for when about one batch of sessions will
+   have expired; while there’s a backlog, passes run at the shortest interval.
+   """
+
+   # Weight of the latest pass in the estimated expiry rate.
+   _smc_fRateWeight = 0.3
+
+
+   def __init__(
+      self, backend, iMaxIdle, cBatchRows = 500, cMaxBatches = 20, fMinInterval = 5.0,
+      fMaxInterval = 900.0
+   ):
+      """Constructor.
+
+      SessionBackend backend
+         Storage backend.
+      int iMaxIdle
+         Time after its last hit after which a session expires, in seconds.
+      [int cBatchRows]
+         Maximum number of sessions deleted by each batch.
+      [int cMaxBatches]
+         Maximum number of batches in each pass.
+      [float fMinInterval]
+         Shortest time between passes, in seconds.
+      [float fMaxInterval]
+         Longest time between passes, in seconds.
+      """
+
+      self._m_backend = backend
+      self._m_iMaxIdle = iMaxIdle
+      self._m_cBatchRows = cBatchRows
+      self._m_cMaxBatches = cMaxBatches
+      self._m_fMinInterval = fMinInterval
+      self._m_fMaxInterval = fMaxInterval
+      self._m_fInterval = fMinInterval
+      # Time of the last pass, and estimated sessions expiring per second.
+      self._m_fLastPass = None
+      self._m_fExpiryRate = None
+      self._m_cPasses = 0
+      self._m_cRowsDeleted = 0
+      self._m_cLastPassRows = 0
+      self._m_cBatches = 0
+      self._m_fLastBatchTime = 0.0
+      self._m_fMaxBatchTime = 0.0
+      self._m_fTotalBatchTime = 0.0
+      self._m_cTableSize = None
+
+
+   def collect(self):
+      """Runs a pass, deleting expired sessions.
+
+      float return
+         Time to wait before the next pass, in seconds.
+      """
+
+      fNow = time.time()
+      iBefore = int(fNow) - self._m_iMaxIdle
+      cPassRows = 0
+      bBacklog = True
+      for i in range(self._m_cMaxBatches):
+         fStart = time.perf_counter()
+         cRows = self._m_backend.delete_expired(iBefore, self._m_cBatchRows)
+         fBatchTime = time.perf_counter() - fStart
+         self._m_cBatches += 1
+         self._m_fLastBatchTime = fBatchTime
+         self._m_fMaxBatchTime = max(self._m_fMaxBatchTime, fBatchTime)
+         self._m_fTotalBatchTime += fBatchTime
+         cPassRows += cRows
+         if cRows < self._m_cBatchRows:
+            bBacklog = False
+            break
+      self._m_cPasses += 1
+      self._m_cRowsDeleted += cPassRows
+      self._m_cLastPassRows = cPassRows
+      self._m_cTableSize = self._m_backend.count()
+
+      # Update the estimated expiry rate; the first pass deletes whatever expired before the
+      # collector started, so it says nothing about the rate.
+      if self._m_fLastPass is not None and not bBacklog:
+         fRate = cPassRows / max(fNow - self._m_fLastPass, 1.0)
+         if self._m_fExpiryRate is None:
+            self._m_fExpiryRate = fRate
+         else:
+            self._m_fExpiryRate += (fRate - self._m_fExpiryRate) * self._smc_fRateWeight
+      self._m_fLastPass = fNow
+
+      if bBacklog:
+         self._m_fInterval = self._m_fMinInterval
+      elif self._m_fExpiryRate:
+         self._m_fInterval = min(max(
+            self._m_cBatchRows / self._m_fExpiryRate, self._m_fMinInterval
+         ), self._m_fMaxInterval)
+      else:
+         # Nothing is expiring (or there’s no estimate yet): back off.
+         self._m_fInterval = min(self._m_fInterval * 2, self._m_fMaxInterval)
+      return self._m_fInterval
+
+
+   def metrics(self):
+      """Returns statistics about the collector’s work.
+
+      dict(str: object) return
+         Statistics:
+         •  “passes”: number of passes run;
+         •  “rows_deleted”: total number of sessions deleted;
+         •  “last_pass_rows”: number of sessions deleted by the last pass;
+         •  “batches”: number of batches run;
+         •  “batch_latency_last”, “batch_latency_avg”, “batch_latency_max”: time taken by the last
+            batch, average and maximum, in seconds;
+         •  “table_size”: number of sessions after the last pass, or None before the first;
+         •  “expiry_rate”: estimated number of sessions expiring per second, or None if unknown;
+         •  “interval”: time until the next pass, in seconds.
+      """
+
+      fAvgBatchTime = self._m_fTotalBatchTime / self._m_cBatches if self._m_cBatches else 0.0
+      return {
+         'passes'            : self._m_cPasses,
+         'rows_deleted'      : self._m_cRowsDeleted,
+         'last_pass_rows'    : self._m_cLastPassRows,
+         'batches'           : self._m_cBatches,
+         'batch_latency_last': self._m_fLastBatchTime,
+         'batch_latency_avg' : fAvgBatchTime,
+         'batch_latency_max' : self._m_fMaxBatchTime,
+         'table_size'        : self._m_cTableSize,
+         'expiry_rate'       : self._m_fExpiryRate,
+         'interval'          : self._m_fInterval,
+      }
+
+
+   def run(self, fnWait, fnReport = None):
+      """Runs passes until told to stop.
+
+      callable fnWait
+         Waits for the number of seconds passed as its argument; returns False if the collector
+         must stop instead of running another pass.
+      [callable fnReport]
+         Called after each pass with the result of metrics().
+      """
+
+      while True:
+         fInterval = self.collect()
+         if fnReport is not None:
+            fnReport(self.metrics())
+         if not fnWait(fInterval):
+            break
+
+
+
+class SessionLocks(object):
+   """Per-session locks shared by every process, implemented as byte-range locks on a lock file.
+
+   Waiting for a lock is a blocking wait in the kernel, which wakes the waiting process as soon as
+   the lock is released, and locks held by a process are released if it terminates, so a crashed
+   process can’t leave a session locked (unlike QlSession’s “locked” column). Each session is mapped
+   to a byte of the lock file by hashing its ID; collisions only cause unrelated sessions to be
+   serialized, and are rare over 2^32 bytes.
+
+   Locks are held by the process, not by the thread, so they don’t exclude threads of the same
+   process from each other.
+   """
+
+   def __init__(self, sFileName):
+      """Constructor.
+
+      str sFileName
+         Path to the lock file; it’s created if missing, and stays empty.
+      """
+
+      self._m_fileLock = open(sFileName, 'a')
+
+
+   def acquire(self, sSid):
+      """Locks a session, waiting for another process to release it if necessary.
+
+      str sSid
+         Session ID.
+      """
+
+      fcntl.lockf(self._m_fileLock, fcntl.LOCK_EX, 1, self._offset(sSid))
+
+
+   def close(self):
+      """Closes the lock file, releasing every lock held by the process."""
+
+      self._m_fileLock.close()
+
+
+   @staticmethod
+   def _offset(sSid):
+      """Returns the offset of the byte of the lock file for a session.
+
+      str sSid
+         Session ID.
+      int return
+         Offset.
+      """
+
+      return zlib.crc32(sSid.encode('ascii'))
+
+
+   def release(self, sSid):
+      """Unlocks a session.
+
+      str sSid
+         Session ID.
+      """
+
+      fcntl.lockf(self._m_fileLock, fcntl.LOCK_UN, 1, self._offset(sSid))
+
+
+
+class SessionStore(object):
+   """Opens, creates and saves sessions using a SessionBackend, keeping a small per-process cache of
+   session data.
+
+   Compared with QlSession, opening a session takes a single round trip to the backend, after
+   waiting for the session lock with a blocking wait instead of retrying every second. If this
+   process already has the current version of the session data, the backend doesn’t return it and
+   the cached (read-only) data is used, so it doesn’t need to be deserialized again; closing a
+   session whose data didn’t change takes no round trips at all.
+   """
+
+   def __init__(self, backend, cMaxCached, profiler = None):
+      """Constructor.
+
+      SessionBackend backend
+         Storage backend.
+      int cMaxCached
+         Maximum number of sessions whose data is cached; the least recently used ones are
+         discarded first.
+      [Profile.Profiler profiler]
+         Profiler to record the time taken to open sessions (as the “session_load” phase) with.
+      """
+
+      self._m_backend = backend
+      self._m_cMaxCached = cMaxCached
+      self._m_profiler = profiler
+      # Cached session data, as {SID: (version, serialized data, read-only data)}, least recently
+      # used first.
+      self._m_odictCache = collections.OrderedDict()
+
+
+   def backend(self):
+      """Returns the storage backend.
+
+      SessionBackend return
+         Backend.
+      """
+
+      return self._m_backend
+
+
+   def _cache(self, sSid, iVersion, sData, mapData):
+      """Adds or updates session data in the cache.
+
+      str sSid
+         Session ID.
+      int iVersion
+         Version of the session data.
+      str sData
+         Serialized session data.
+      mapping(str: object) mapData
+         Read-only session data.
+      """
+
+      if self._m_cMaxCached <= 0:
+         return
+      self._m_odictCache[sSid] = (iVersion, sData, mapData)
+      self._m_odictCache.move_to_end(sSid)
+      while len(self._m_odictCache) > self._m_cMaxCached:
+         self._m_odictCache.popitem(last = False)
+
+
+   def close(self):
+      """Closes the backend."""
+
+      self._m_odictCache.clear()
+      self._m_backend.close()
+
+
+   def create(self, dictData):
+      """Creates a new session with a new ID, locked.
+
+      dict(str: object) dictData
+         Initial session data.
+      Session return
+         New session.
+      """
+
+      sData = json.dumps(dictData, sort_keys = True)
+      iTS = int(time.time())
+      while True:
+         sSid = new_id()
+         self._m_backend.lock(sSid)
+         if self._m_backend.create(sSid, iTS, sData):
+            break
+         # Extremely unlikely: the ID is already in use.
+         self._m_backend.unlock(sSid)
+      mapData = Config.freeze(json.loads(sData))
+      self._cache(sSid, 1, sData, mapData)
+      return Session(self, sSid, 1, sData, mapData)
+
+
+   def open(self, sSid, sIPAddr = None):
+      """Opens and locks an existing session, in the same way as QlSession::load().
+
+      str sSid
+         Session ID, as provided by the remote client.
+      [str sIPAddr]
+         Address of the remote client; if provided, it must match the address the session was
+         started from (the “ql_ipaddr” entry of the session data).
+      Session return
+         Session, or None if sSid is not a valid session ID, or if the session can’t be used.
+      """
+
+      if not is_valid_id(sSid):
+         return None
+      bProfile = self._m_profiler is not None and self._m_profiler.is_sampling()
+      if bProfile:
+         fStart = time.perf_counter()
+      tplCached = self._m_odictCache.get(sSid)
+      self._m_backend.lock(sSid)
+      # Unless a Session is returned, the lock must be released.
+      session = None
+      try:
+         tplLoaded = self._m_backend.load(
+            sSid, int(time.time()), tplCached[0] if tplCached else 0
+         )
+         if tplLoaded is None:
+            # The session does not exist (any more).
+            self._m_odictCache.pop(sSid, None)
+            return None
+         iVersion, sData = tplLoaded
+         if sData is None:
+            # The cached data is current.
+            sData, mapData = tplCached[1:]
+            self._m_odictCache.move_to_end(sSid)
+         else:
+            try:
+               mapData = Config.freeze(json.loads(sData))
+               if not isinstance(mapData, types.MappingProxyType):
+                  raise ValueError('Session data is not an object')
+            except ValueError:
+               # There was some problem with loading the session, discard it.
+               self._m_odictCache.pop(sSid, None)
+               self._m_backend.delete(sSid)
+               return None
+            self._cache(sSid, iVersion, sData, mapData)
+         if sIPAddr is not None and mapData.get('ql_ipaddr') != sIPAddr:
+            # The session wasn’t started from the same IP address as the one originating this
+            # request: pretend we didn’t see it.
+            return None
+         session = Session(self, sSid, iVersion, sData, mapData)
+      finally:
+         if session is None:
+            self._m_backend.unlock(sSid)
+         if bProfile:
+            self._m_profiler.record_phase('session_load', time.perf_counter() - fStart)
+      return session
+
+
+   def write_and_close(self, session):
+      """Saves the data of a session, unless it didn’t change, then unlocks the session. Called by
+      Session.write_and_close().
+
+      Session session
+         Session to close.
+      """
+
+      sSid = session.id()
+      try:
+         sData = session.changed_data()
+         if sData is not None:
+            iVersion = self._m_backend.save(
+               sSid, int(time.time()), session.get('ql_user_id'), sData
+            )
+            if iVersion is None:
+               # The session was deleted while locked, e.g. by a logout from another process.
+               self._m_odictCache.pop(sSid, None)
+               return
+            session._written(iVersion, sData)
+            self._cache(sSid, iVersion, sData, session.data())
+      finally:
+         self._m_backend.unlock(sSid)
+
+
+
+class SqliteSessionBackend(SessionBackend):
+   """Session backend storing sessions in an SQLite database, in the read/write data directory;
+   meant as a stand-in for the database used by QlSession, e.g. for testing. Session locks are
+   SessionLocks on a file in the locks directory.
+   """
+
+   def __init__(self, app, sFileName = None, sLockFileName = None):
+      """See SessionBackend.__init__().
+
+      [str sFileName]
+         Path to the database; defaults to core/sessions.sqlite in the read/write data directory.
+      [str sLockFileName]
+         Path to the lock file; defaults to sessions.lock in the locks directory.
+      """
+
+      SessionBackend.__init__(self, app)
+      dictCore = app.section('core')
+      if sFileName is None:
+         sFileName = os.path.join(dictCore['rwdata_lpath'], 'core', 'sessions.sqlite')
+      if sLockFileName is None:
+         sLockFileName = os.path.join(dictCore['lock_lpath'], 'sessions.lock')
+      # Autocommit mode: every statement is its own transaction.
+      self._m_db = sqlite3.connect(sFileName, timeout = 10, isolation_level = None)
+      # Let readers proceed while another process writes; in WAL mode, syncing only at checkpoints
+      # can’t corrupt the database, and makes commits much cheaper.
+      self._m_db.execute('PRAGMA journal_mode = WAL')
+      self._m_db.execute('PRAGMA synchronous = NORMAL')
+      self._m_db.execute('''
+         CREATE TABLE IF NOT EXISTS sessions (
+            id       TEXT    NOT NULL PRIMARY KEY,
+            iduser   INTEGER,
+            firsthit INTEGER NOT NULL,
+            lasthit  INTEGER NOT NULL,
+            version  INTEGER NOT NULL,
+            data     TEXT    NOT NULL
+         )
+      ''')
+      # Used by delete_expired().
+      self._m_db.execute('CREATE INDEX IF NOT EXISTS sessions_lasthit ON sessions(lasthit)')
+      self._m_locks = SessionLocks(sLockFileName)
+
+
+   def close(self):
+      """See SessionBackend.close()."""
+
+      self._m_locks.close()
+      self._m_db.close()
+
+
+   def count(self):
+      """See SessionBackend.count()."""
+
+      return self._m_db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+   def create(self, sSid, iTS, sData):
+      """See SessionBackend.create()."""
+
+      try:
+         self._m_db.execute('''
+            INSERT INTO sessions(id, firsthit, lasthit, version, data)
+            VALUES (?, ?, ?, 1, ?)
+         ''', (sSid, iTS, iTS, sData))
+      except sqlite3.IntegrityError:
+         return False
+      return True
+
+
+   def database(self):
+      """Returns the connection to the database.
+
+      sqlite3.Connection return
+         Connection.
+      """
+
+      return self._m_db
+
+
+   def delete(self, sSid):
+      """See SessionBackend.delete()."""
+
+      self._m_db.execute('DELETE FROM sessions WHERE id = ?', (sSid, ))
+
+
+   def delete_expired(self, iBefore, cMaxRows):
+      """See SessionBackend.delete_expired()."""
+
+      return self._m_db.execute('''
+         DELETE FROM sessions
+         WHERE rowid IN (
+            SELECT rowid
+            FROM sessions INDEXED BY sessions_lasthit
+            WHERE lasthit < ?
+            ORDER BY lasthit
+            LIMIT ?
+         )
+      ''', (iBefore, cMaxRows)).rowcount
+
+
+   def load(self, sSid, iTS, iCachedVersion):
+      """See SessionBackend.load()."""
+
+      # Fetch every row, so that the statement (and its transaction) is completed.
+      listRows = self._m_db.execute('''
+         UPDATE sessions
+         SET lasthit = ?
+         WHERE id = ?
+         RETURNING version, CASE WHEN version = ? THEN NULL ELSE data END
+      ''', (iTS, sSid, iCachedVersion)).fetchall()
+      return tuple(listRows[0]) if listRows else None
+
+
+   def lock(self, sSid):
+      """See SessionBackend.lock()."""
+
+      self._m_locks.acquire(sSid)
+
+
+   def save(self, sSid, iTS, iUserId, sData):
+      """See SessionBackend.save()."""
+
+      listRows = self._m_db.execute('''
+         UPDATE sessions
+         SET iduser = ?, lasthit = ?, version = version + 1, data = ?
+         WHERE id = ?
+         RETURNING version
+      ''', (iUserId, iTS, sData, sSid)).fetchall()
+      return listRows[0][0] if listRows else None
+
+
+   def unlock(self, sSid):
+      """See SessionBackend.unlock()."""
+
+      self._m_locks.release(sSid)
+
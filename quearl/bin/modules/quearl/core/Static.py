@@ -0,0 +1,663 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Static file serving classes."""
+
+import collections
+import email.utils
+import json
+import os
+import re
+import stat
+import time
+
+
+
+####################################################################################################
+# Functions
+
+def cache_control(sUrl):
+   """Returns the Cache-Control header field value to send with a static file.
+
+   str sUrl
+      URL of the file, relative to the static root.
+   str return
+      Cache-Control value, or None if the default caching behavior is fine.
+   """
+
+   if _reBundleUrl.search(sUrl):
+      # Bundles never change: let them be cached for a year, without revalidation.
+      return 'public, max-age=31536000, immutable'
+   return None
+
+
+def etag_matches(sIfNoneMatch, sETag):
+   """Checks whether an entity tag matches an If-None-Match header field, using the weak comparison
+   function of RFC 7232.
+
+   str sIfNoneMatch
+      Value of the If-None-Match header field.
+   str sETag
+      Entity tag of the current representation, including quotes.
+   bool return
+      True if the client’s cached representation is current.
+   """
+
+   if sIfNoneMatch.strip() == '*':
+      return True
+   if sETag.startswith('W/'):
+      sETag = sETag[2:]
+   for sTag in sIfNoneMatch.split(','):
+      sTag = sTag.strip()
+      if sTag.startswith('W/'):
+         sTag = sTag[2:]
+      if sTag == sETag:
+         return True
+   return False
+
+
+def negotiate_encoding(dictAcceptedEncodings, dictSizes):
+   """Selects the variant of a static file best suited for the client; see
+   QlStaticResponseEntity::set_file().
+
+   dict(str: float) dictAcceptedEncodings
+      Content encodings accepted by the client, with their q-value; see
+      Request.accepted_encodings().
+   dict(str: int) dictSizes
+      Size of each available variant, by content encoding; the unencoded file is stored with a None
+      encoding.
+   str return
+      Content encoding of the selected variant, or None for the unencoded file.
+   """
+
+   # The unencoded file is acceptable unless explicitly excluded, and is preferred over any
+   # encoding with a lower q-value.
+   if 'identity' in dictAcceptedEncodings:
+      fBestQ = dictAcceptedEncodings['identity']
+   elif '*' in dictAcceptedEncodings:
+      fBestQ = min(dictAcceptedEncodings['*'], 1.0)
+   else:
+      fBestQ = 1.0
+   sBestEncoding = None
+   cbBest = dictSizes[None]
+   for sEncoding, sSuffix in _tplEncodings:
+      cb = dictSizes.get(sEncoding)
+      if cb is None:
+         continue
+      if sEncoding in dictAcceptedEncodings:
+         fQ = dictAcceptedEncodings[sEncoding]
+      elif '*' in dictAcceptedEncodings and sEncoding != 'x-gzip':
+         fQ = dictAcceptedEncodings['*']
+      else:
+         continue
+      if fQ <= 0 or fQ < fBestQ:
+         # Not acceptable, or less preferable than the best version found so far.
+         continue
+      # Among versions with the same q-value, prefer the smallest.
+      if fQ > fBestQ or cb < cbBest:
+         fBestQ = fQ
+         sBestEncoding = sEncoding
+         cbBest = cb
+   return sBestEncoding
+
+
+def not_modified_headers(sUrl, sETag, bVary):
+   """Returns the header fields of a 304 response for a static file: those that RFC 7232 requires to
+   be the same as in a 200 response. Other metadata (e.g. Last-Modified) is not needed, since the
+   response has an entity tag, so this needs no access to the file.
+
+   str sUrl
+      URL of the file, relative to the static root.
+   str sETag
+      Entity tag of the variant of the file.
+   bool bVary
+      True if the file has any precompressed variants, i.e. the response varies with
+      Accept-Encoding.
+   list(tuple(str, str)) return
+      Header fields.
+   """
+
+   listHeaders = [('ETag', sETag)]
+   sCacheControl = cache_control(sUrl)
+   if sCacheControl:
+      listHeaders.append(('Cache-Control', sCacheControl))
+   if bVary:
+      listHeaders.append(('Vary', 'Accept-Encoding'))
+   return listHeaders
+
+
+# Matches bundles generated by JsPreproc, which are named after a hash of their contents.
+_reBundleUrl = re.compile(r'/bundle(?:-[a-z]{2}-[a-z]{2})?\.[0-9a-f]{16}\.js$')
+
+# Precompressed variants of a static file, as (Content-Encoding, file name suffix); see
+# STATIC_ENCODINGS in quearl/bin/quearl_build.py and QlStaticResponseEntity::set_file().
+_tplEncodings = (
+   ('br'     , '.br'),
+   ('deflate', '.z'),
+   ('gzip'   , '.gz'),
+   ('x-gzip' , '.gz'),
+)
+
+
+
+####################################################################################################
+# Classes
+
+
+class FileEntity(object):
+   """Response entity consisting of a whole file, from a StaticFile. The server sends it with
+   os.sendfile() where the transport allows it (see Server); otherwise it’s iterated, reading the
+   file with os.pread(), which doesn’t change the offset of the (shared) file descriptor.
+   """
+
+   # Size of each read from the file, when iterated.
+   _smc_cbChunk = 64 * 1024
+
+
+   def __init__(self, staticfile, sEncoding, fd, cb, sETag):
+      """Constructor.
+
+      StaticFile staticfile
+         File the entity comes from; it’s kept open until the entity is closed.
+      str sEncoding
+         Content-Encoding of the variant of the file being sent, or None.
+      int fd
+         File descriptor of the variant.
+      int cb
+         Size of the variant, in bytes.
+      str sETag
+         Entity tag of the variant.
+      """
+
+      self._m_staticfile = staticfile
+      self._m_sEncoding = sEncoding
+      self._m_fd = fd
+      self._m_cb = cb
+      self._m_sETag = sETag
+      self._m_fnOnClose = None
+      staticfile.acquire()
+
+
+   def __iter__(self):
+      """Reads the file.
+
+      bytes yield
+         Chunk of the file.
+      """
+
+      ib = 0
+      while ib < self._m_cb:
+         bytesChunk = os.pread(self._m_fd, min(self._smc_cbChunk, self._m_cb - ib), ib)
+         if not bytesChunk:
+            # The file was truncated; the client will notice the entity is shorter than announced.
+            break
+         ib += len(bytesChunk)
+         yield bytesChunk
+
+
+   def close(self):
+      """Releases the file, and invokes the callback set with set_close_callback(), if any."""
+
+      if self._m_staticfile is not None:
+         self._m_staticfile.release()
+         self._m_staticfile = None
+         if self._m_fnOnClose is not None:
+            self._m_fnOnClose()
+
+
+   def encoding(self):
+      """Returns the Content-Encoding of the variant of the file being sent.
+
+      str return
+         Encoding, or None if the file is sent unencoded.
+      """
+
+      return self._m_sEncoding
+
+
+   def etag(self):
+      """Returns the entity tag of the variant of the file being sent.
+
+      str return
+         Entity tag, including quotes.
+      """
+
+      return self._m_sETag
+
+
+   def fileno(self):
+      """Returns the file descriptor to send, e.g. with os.sendfile(). It must not be closed, and
+      only used with functions that don’t change its offset.
+
+      int return
+         File descriptor.
+      """
+
+      return self._m_fd
+
+
+   def set_close_callback(self, fnOnClose):
+      """Sets a function to be called once the entity has been sent, when it’s closed.
+
+      callable fnOnClose
+         Function to call, without arguments.
+      """
+
+      self._m_fnOnClose = fnOnClose
+
+
+   def size(self):
+      """Returns the size of the entity.
+
+      int return
+         Size of the entity, in bytes.
+      """
+
+      return self._m_cb
+
+
+
+class StaticFile(object):
+   """Open file descriptors and precomputed metadata (size, modification time, available encodings,
+   entity tags, response header fields) of a static file and of its precompressed variants, which
+   are generated by quearl/bin/quearl_build.py.
+
+   Entity tags come from the StaticManifest, so they only depend on the contents of each variant;
+   for files missing from it (or changed since it was written), they’re derived from the size and
+   modification time of the variant instead.
+
+   The file descriptors are closed by close(), or if any FileEntity is still being sent, once the
+   last one is closed.
+   """
+
+   def __init__(self, sFileName, listHeaders, dictManifestVariants = None):
+      """Constructor. Opens the file and its precompressed variants.
+
+      str sFileName
+         Path to the file.
+      list(tuple(str, str)) listHeaders
+         Header fields to send with the file, in addition to those generated by StaticFile.
+      [dict(str: tuple(str, int)) dictManifestVariants]
+         Variants of the file recorded in the StaticManifest; see StaticManifest.variants().
+      """
+
+      fd = os.open(sFileName, os.O_RDONLY)
+      try:
+         st = os.fstat(fd)
+         if not stat.S_ISREG(st.st_mode):
+            raise OSError('Not a regular file: {}'.format(sFileName))
+      except BaseException:
+         os.close(fd)
+         raise
+      if dictManifestVariants is None:
+         dictManifestVariants = {}
+      self._m_cUsers = 0
+      self._m_bClosed = False
+      self._m_fMTime = st.st_mtime
+      # File descriptor, size and entity tag of each variant, as {encoding: (fd, size, ETag)}; the
+      # file itself is stored with a None encoding.
+      self._m_dictVariants = {None: self._variant(fd, st, dictManifestVariants.get(None))}
+      dictSuffixVariants = {}
+      for sEncoding, sSuffix in _tplEncodings:
+         tplVariant = dictSuffixVariants.get(sSuffix)
+         if tplVariant is None:
+            try:
+               fdVariant = os.open(sFileName + sSuffix, os.O_RDONLY)
+            except OSError:
+               # The file doesn’t have a version in this encoding.
+               continue
+            tplVariant = self._variant(
+               fdVariant, os.fstat(fdVariant), dictManifestVariants.get(sEncoding)
+            )
+            dictSuffixVariants[sSuffix] = tplVariant
+         self._m_dictVariants[sEncoding] = tplVariant
+      # Size of each variant, for negotiate_encoding().
+      self._m_dictSizes = {
+         sEncoding: tplVariant[1] for sEncoding, tplVariant in self._m_dictVariants.items()
+      }
+      self._m_listHeaders = list(listHeaders)
+      self._m_listHeaders.append(
+         ('Last-Modified', email.utils.formatdate(st.st_mtime, usegmt = True))
+      )
+      if len(self._m_dictVariants) > 1:
+         # The response depends on Accept-Encoding, even if an unencoded file is being sent.
+         self._m_listHeaders.append(('Vary', 'Accept-Encoding'))
+
+
+   def acquire(self):
+      """Prevents the file descriptors from being closed until release() is called."""
+
+      self._m_cUsers += 1
+
+
+   def close(self):
+      """Closes the file descriptors, or marks them to be closed once the last user releases them.
+      """
+
+      self._m_bClosed = True
+      if self._m_cUsers == 0:
+         for fd in set(tplVariant[0] for tplVariant in self._m_dictVariants.values()):
+            os.close(fd)
+         self._m_dictVariants = {}
+
+
+   def encodings(self):
+      """Returns the content encodings for which the file has a precompressed variant.
+
+      list(str) return
+         Content encodings.
+      """
+
+      return [sEncoding for sEncoding in self._m_dictVariants if sEncoding is not None]
+
+
+   def entity(self, dictAcceptedEncodings):
+      """Returns a response entity for the variant of the file best suited for the client.
+
+      dict(str: float) dictAcceptedEncodings
+         Content encodings accepted by the client, with their q-value; see
+         Request.accepted_encodings().
+      FileEntity return
+         Response entity.
+      """
+
+      sEncoding = negotiate_encoding(dictAcceptedEncodings, self._m_dictSizes)
+      fd, cb, sETag = self._m_dictVariants[sEncoding]
+      return FileEntity(self, sEncoding, fd, cb, sETag)
+
+
+   def headers(self):
+      """Returns the header fields to send with the file, other than Content-Length,
+      Content-Encoding and ETag, which depend on the variant sent.
+
+      list(tuple(str, str)) return
+         Header fields.
+      """
+
+      return self._m_listHeaders
+
+
+   def mtime(self):
+      """Returns the modification time of the file.
+
+      float return
+         Modification time, as a Unix timestamp.
+      """
+
+      return self._m_fMTime
+
+
+   def release(self):
+      """Undoes a call to acquire(), closing the file descriptors if close() was called meanwhile.
+      """
+
+      self._m_cUsers -= 1
+      if self._m_bClosed:
+         self.close()
+
+
+   def size(self):
+      """Returns the size of the file.
+
+      int return
+         Size of the (unencoded) file, in bytes.
+      """
+
+      return self._m_dictVariants[None][1]
+
+
+   @staticmethod
+   def _variant(fd, st, tplManifestVariant):
+      """Returns the information stored for a variant of the file.
+
+      int fd
+         File descriptor of the variant.
+      os.stat_result st
+         Status of the variant.
+      tuple(str, int) tplManifestVariant
+         Entity tag and size of the variant according to the StaticManifest, or None if missing.
+      tuple(int, int, str) return
+         File descriptor, size and entity tag of the variant.
+      """
+
+      if tplManifestVariant is not None and tplManifestVariant[1] == st.st_size:
+         sETag = tplManifestVariant[0]
+      else:
+         sETag = '"{:x}-{:x}"'.format(st.st_size, st.st_mtime_ns)
+      return fd, st.st_size, sETag
+
+
+
+class StaticFileCache(object):
+   """Cache of StaticFile instances, so that serving a static file requires no file system access
+   other than sending it. The least recently used files are closed first.
+
+   Static files are only written by quearl/bin/quearl_build.py, which always rewrites the
+   StaticManifest; the whole cache is discarded whenever the manifest changes.
+   """
+
+   def __init__(self, manifest, cMaxFiles):
+      """Constructor.
+
+      StaticManifest manifest
+         Manifest of the static files.
+      int cMaxFiles
+         Maximum number of files kept open; if 0, files are never cached.
+      """
+
+      self._m_manifest = manifest
+      self._m_cMaxFiles = cMaxFiles
+      # Cached files, as {key: StaticFile}, from least to most recently used.
+      self._m_odictFiles = collections.OrderedDict()
+      self._m_iGeneration = manifest.generation()
+
+
+   def __len__(self):
+      """Returns the number of cached files.
+
+      int return
+         Count of files.
+      """
+
+      return len(self._m_odictFiles)
+
+
+   def add(self, sKey, staticfile):
+      """Adds a file to the cache, closing the least recently used one if the cache is full. If the
+      cache is disabled, the file will be closed as soon as it has been sent.
+
+      str sKey
+         Key of the file, e.g. its URL.
+      StaticFile staticfile
+         File to add.
+      """
+
+      staticfileOld = self._m_odictFiles.pop(sKey, None)
+      if staticfileOld is not None:
+         staticfileOld.close()
+      if self._m_cMaxFiles == 0:
+         staticfile.close()
+         return
+      self._m_odictFiles[sKey] = staticfile
+      if len(self._m_odictFiles) > self._m_cMaxFiles:
+         self._m_odictFiles.popitem(last = False)[1].close()
+
+
+   def clear(self):
+      """Closes every cached file."""
+
+      for staticfile in self._m_odictFiles.values():
+         staticfile.close()
+      self._m_odictFiles.clear()
+
+
+   def get(self, sKey):
+      """Returns a cached file.
+
+      str sKey
+         Key of the file.
+      StaticFile return
+         File, or None if not cached.
+      """
+
+      iGeneration = self._m_manifest.generation()
+      if iGeneration != self._m_iGeneration:
+         self._m_iGeneration = iGeneration
+         self.clear()
+         return None
+      staticfile = self._m_odictFiles.get(sKey)
+      if staticfile is not None:
+         self._m_odictFiles.move_to_end(sKey)
+      return staticfile
+
+
+
+class StaticManifest(object):
+   """Entity tag and size of every file generated by quearl/bin/quearl_build.py in the read-only
+   data directory, including the precompressed variants of static files, as recorded by the build.
+   Entity tags are derived from the contents of each file, so they’re the same on every server,
+   regardless of modification times.
+
+   The manifest is loaded on first use, and reloaded whenever a build rewrites it, which is checked
+   at most once per check interval.
+   """
+
+   def __init__(self, sRODataDir, fCheckInterval = 1.0):
+      """Constructor.
+
+      str sRODataDir
+         Quearl-wide read-only data directory.
+      [float fCheckInterval]
+         Minimum time between checks for changes to the manifest, in seconds.
+      """
+
+      self._m_sFileName = self.file_name(sRODataDir)
+      self._m_fCheckInterval = fCheckInterval
+      # Entity tag and size of each file, as {path: (ETag, size)}, with paths relative to the
+      # read-only data directory; None until loaded.
+      self._m_dictFiles = None
+      self._m_tplStat = self._stat()
+      self._m_fNextCheck = time.monotonic() + fCheckInterval
+      # Incremented every time the manifest changes.
+      self._m_iGeneration = 0
+
+
+   def etag(self, sPath, dictAcceptedEncodings):
+      """Returns the entity tag of the variant of a static file that would be sent to the client,
+      without accessing the file; see StaticFile.entity().
+
+      str sPath
+         Path to the file, relative to the read-only data directory.
+      dict(str: float) dictAcceptedEncodings
+         Content encodings accepted by the client, with their q-value; see
+         Request.accepted_encodings().
+      tuple(str, bool) return
+         Entity tag of the variant, and whether the file has any precompressed variants (i.e. the
+         response varies with Accept-Encoding); None if the file is not in the manifest.
+      """
+
+      dictVariants = self.variants(sPath)
+      if not dictVariants:
+         return None
+      sEncoding = negotiate_encoding(dictAcceptedEncodings, {
+         sEncoding: tplVariant[1] for sEncoding, tplVariant in dictVariants.items()
+      })
+      return dictVariants[sEncoding][0], len(dictVariants) > 1
+
+
+   @staticmethod
+   def file_name(sRODataDir):
+      """Returns the path to the static files manifest.
+
+      str sRODataDir
+         Quearl-wide read-only data directory.
+      str return
+         Path to the manifest.
+      """
+
+      return os.path.join(sRODataDir, 'static.manifest')
+
+
+   def generation(self):
+      """Checks whether the manifest changed (at most once per check interval), and returns a number
+      that changes every time it does.
+
+      int return
+         Generation of the manifest.
+      """
+
+      fNow = time.monotonic()
+      if fNow >= self._m_fNextCheck:
+         self._m_fNextCheck = fNow + self._m_fCheckInterval
+         tplStat = self._stat()
+         if tplStat != self._m_tplStat:
+            self._m_tplStat = tplStat
+            self._m_dictFiles = None
+            self._m_iGeneration += 1
+      return self._m_iGeneration
+
+
+   def _stat(self):
+      """Returns the identity of the current manifest file.
+
+      tuple(int, int, int) return
+         Inode number, size and modification time of the manifest, or None if it doesn’t exist.
+      """
+
+      try:
+         st = os.stat(self._m_sFileName)
+      except OSError:
+         return None
+      return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+   def variants(self, sPath):
+      """Returns the variants of a static file recorded in the manifest.
+
+      str sPath
+         Path to the file, relative to the read-only data directory.
+      dict(str: tuple(str, int)) return
+         Entity tag and size of each variant, by content encoding; the file itself is stored with a
+         None encoding. None if the file is not in the manifest.
+      """
+
+      self.generation()
+      dictFiles = self._m_dictFiles
+      if dictFiles is None:
+         try:
+            with open(self._m_sFileName, 'r', encoding = 'utf-8') as fileManifest:
+               dictFiles = {
+                  sFilePath: ('"{}"'.format(sHash), cb)
+                  for sFilePath, (sHash, cb) in json.load(fileManifest).items()
+               }
+         except (OSError, ValueError):
+            # Missing or unreadable manifest: entity tags will be derived from the files.
+            dictFiles = {}
+         self._m_dictFiles = dictFiles
+      tplVariant = dictFiles.get(sPath)
+      if tplVariant is None:
+         return None
+      dictVariants = {None: tplVariant}
+      for sEncoding, sSuffix in _tplEncodings:
+         tplVariant = dictFiles.get(sPath + sSuffix)
+         if tplVariant is not None:
+            dictVariants[sEncoding] = tplVariant
+      return dictVariants
+
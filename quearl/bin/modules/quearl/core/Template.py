@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3; indent-tabs-mode: nil -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Template classes."""
+
+import collections
+import hashlib
+import os
+import re
+
+
+
+####################################################################################################
+# Functions
+
+def indent(cTabs, s):
+   """Indents every non-empty line of a string, like ql_indent().
+
+   int cTabs
+      Number of tabs to prepend to each line.
+   str s
+      String to indent.
+   str return
+      Indented string.
+   """
+
+   sIndent = '\t' * cTabs
+   return ''.join(
+      sIndent + sLine if sLine.strip('\r\n') else sLine for sLine in s.splitlines(True)
+   )
+
+
+
+####################################################################################################
+# Classes
+
+
+class CompiledTemplate(object):
+   """Template parsed into a list of segments, so that rendering it only takes a single pass over
+   its segments and a single string join, instead of a regex search over the whole template and a
+   string copy for each substitution as in QlModule::template_subst().
+
+   Substitutions are specified as in QlModule::template_subst():
+   •  “$$Var_Name$$”: a double-dollar-enclosed string containing lowercase letters is replaced with
+      the value of the corresponding variable;
+   •  “$$CONST_NAME$$”: a double-dollar-enclosed uppercase string is replaced with the value of the
+      corresponding constant (e.g. a localized constant);
+   •  Either can be followed by “:N” before the closing “$$”, to indent every line of the
+      replacement by N tabs.
+   Substitutions for which no value is available are left in the output as they are.
+   """
+
+   # Matches a substitution.
+   _smc_reSubst = re.compile(r'\$\$(?P<name>[_0-9A-Za-z]+?)(?::(?P<indent>\d+))?\$\$')
+   # Matches names of variables, as opposed to constants.
+   _smc_reVariable = re.compile(r'[a-z]')
+
+   # Segment types.
+   SEGMENT_LITERAL  = 0
+   SEGMENT_VARIABLE = 1
+   SEGMENT_CONSTANT = 2
+
+
+   def __init__(self, s):
+      """Constructor.
+
+      str s
+         Template contents.
+      """
+
+      # Segments, as (type, literal text or substitution name, indentation, original text).
+      self._m_listSegments = []
+      ich = 0
+      for match in self._smc_reSubst.finditer(s):
+         if match.start() > ich:
+            sLiteral = s[ich:match.start()]
+            self._m_listSegments.append((self.SEGMENT_LITERAL, sLiteral, 0, sLiteral))
+         sName = match.group('name')
+         if self._smc_reVariable.search(sName):
+            iType = self.SEGMENT_VARIABLE
+         else:
+            iType = self.SEGMENT_CONSTANT
+         self._m_listSegments.append((iType, sName, int(match.group('indent') or 0), match.group()))
+         ich = match.end()
+      if ich < len(s):
+         self._m_listSegments.append((self.SEGMENT_LITERAL, s[ich:], 0, s[ich:]))
+
+
+   def render(self, listVars, fnConstant):
+      """Renders the template.
+
+      list(dict(str: object)) listVars
+         Variable => value mappings; for each variable, the first mapping containing it is used.
+      callable fnConstant
+         Returns the value of the constant with the name passed as its argument, or None if no such
+         constant is defined.
+      str return
+         Resulting string.
+      """
+
+      listParts = []
+      for iType, sName, cIndent, sSource in self._m_listSegments:
+         if iType == self.SEGMENT_LITERAL:
+            listParts.append(sName)
+            continue
+         oValue = None
+         if iType == self.SEGMENT_VARIABLE:
+            for dictVars in listVars:
+               oValue = dictVars.get(sName)
+               if oValue is not None:
+                  break
+         else:
+            oValue = fnConstant(sName)
+         if oValue is None:
+            listParts.append(sSource)
+         elif cIndent:
+            listParts.append(indent(cIndent, '{}\n'.format(oValue)).rstrip(' \t\n\r\0\x0b'))
+         else:
+            listParts.append(str(oValue))
+      return ''.join(listParts)
+
+
+   def segments(self):
+      """Returns the segments of the template.
+
+      list(tuple(int, str, int, str)) return
+         Segments, as (type, literal text or substitution name, indentation, original text); type is
+         one of SEGMENT_*.
+      """
+
+      return self._m_listSegments
+
+
+
+class TemplateCache(object):
+   """Keeps the most recently used compiled templates, so that each template file is normally only
+   read and compiled once per process.
+
+   Each cached template is validated against the size and modification time of its file; if either
+   changed, the file is read again, but only compiled again if its contents actually changed.
+   """
+
+   def __init__(self, cMaxTemplates):
+      """Constructor.
+
+      int cMaxTemplates
+         Maximum number of compiled templates to keep; the least recently used ones are discarded
+         first.
+      """
+
+      self._m_cMaxTemplates = cMaxTemplates
+      # Cached templates, as {file name: (size, mtime_ns, hash, CompiledTemplate)}, least recently
+      # used first.
+      self._m_odictTemplates = collections.OrderedDict()
+
+
+   def __len__(self):
+      return len(self._m_odictTemplates)
+
+
+   def clear(self):
+      """Discards every cached template."""
+
+      self._m_odictTemplates.clear()
+
+
+   def get(self, sFileName):
+      """Returns the compiled version of a template file.
+
+      str sFileName
+         Path to the template file.
+      CompiledTemplate return
+         Compiled template.
+      """
+
+      st = os.stat(sFileName)
+      tplEntry = self._m_odictTemplates.get(sFileName)
+      if tplEntry is not None and tplEntry[0] == st.st_size and tplEntry[1] == st.st_mtime_ns:
+         self._m_odictTemplates.move_to_end(sFileName)
+         return tplEntry[3]
+
+      with open(sFileName, 'rb') as fileTemplate:
+         bytesTemplate = fileTemplate.read()
+      sHash = hashlib.sha1(bytesTemplate).hexdigest()
+      if tplEntry is not None and tplEntry[2] == sHash:
+         # Only the modification time changed (e.g. the file was copied or checked out again).
+         template = tplEntry[3]
+      else:
+         s = bytesTemplate.decode('utf-8')
+         # Strip the BOM, if present.
+         if s.startswith('\ufeff'):
+            s = s[1:]
+         template = CompiledTemplate(s)
+      self._m_odictTemplates[sFileName] = (st.st_size, st.st_mtime_ns, sHash, template)
+      self._m_odictTemplates.move_to_end(sFileName)
+      while len(self._m_odictTemplates) > self._m_cMaxTemplates:
+         self._m_odictTemplates.popitem(last = False)
+      return template
+
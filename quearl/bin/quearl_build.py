@@ -0,0 +1,650 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Incremental build engine shared by the generators of read-only data (JS preprocessor, l10n
+generator, …). When run as a script, it updates every generated file in every module.
+"""
+
+import argparse
+import concurrent.futures
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+
+from modules.quearl.core import Static
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+try:
+	import zopfli.gzip
+	import zopfli.zopfli
+except ImportError:
+	zopfli = None
+
+
+
+####################################################################################################
+# Globals
+
+# Content encodings of the precompressed variants of static files, with the suffix appended to the
+# name of the file for each of them; QlStaticResponseEntity::set_file() uses the same suffixes. Note
+# that “deflate” variants contain a raw deflate stream, which is what most clients expect despite
+# RFC 2616 specifying a zlib stream.
+STATIC_ENCODINGS = (
+	('br',      '.br'),
+	('gzip',    '.gz'),
+	('deflate', '.z'),
+)
+
+
+
+####################################################################################################
+# Functions
+
+def compressed_file_names(sFileName):
+	"""Returns the names of the precompressed variants of a static file; see write_static_file().
+
+	str sFileName
+		Path to the static file.
+	list(str) return
+		Paths to its precompressed variants.
+	"""
+
+	return [sFileName + sSuffix for sEncoding, sSuffix in STATIC_ENCODINGS]
+
+
+def compressors_version():
+	"""Returns a description of the compressors used by write_static_file(), which changes whenever a
+	compressor is installed or removed. Use it as the version of tasks calling write_static_file().
+
+	str return
+		Description of the available compressors.
+	"""
+
+	return 'brotli {}, zopfli {}'.format(
+		getattr(brotli, '__version__', '?') if brotli else None,
+		getattr(zopfli, '__version__', '?') if zopfli else None
+	)
+
+
+def hash_file(sFileName):
+	"""Computes the hash of a file’s contents.
+
+	str sFileName
+		Path to the file.
+	str return
+		Hexadecimal hash.
+	"""
+
+	hasher = hashlib.sha1()
+	with open(sFileName, 'rb') as file:
+		while True:
+			bytesChunk = file.read(256 * 1024)
+			if not bytesChunk:
+				break
+			hasher.update(bytesChunk)
+	return hasher.hexdigest()
+
+
+def makedirs_for(sFileName):
+	"""Makes sure the directory that will contain a file exists.
+
+	str sFileName
+		Path to the file.
+	"""
+
+	try:
+		os.makedirs(os.path.dirname(sFileName), 0o755, True)
+	except OSError:
+		# The subdirectory was already there, or couldn’t be created. In the latter case, opening the
+		# file will fail, so an exception will be raised in any case.
+		pass
+
+
+def replace_file(sFileName, oContents):
+	"""Writes a file atomically: the contents are written to a temporary file in the same directory,
+	which is then renamed over the file, so that readers (e.g. a server worker, or a process that
+	memory-mapped the file) see either the old or the new file, but never a partially written one.
+
+	str sFileName
+		Path to the file.
+	object oContents
+		Contents of the file, as str (which will be encoded in UTF-8) or bytes.
+	"""
+
+	if isinstance(oContents, str):
+		oContents = oContents.encode('utf-8')
+	makedirs_for(sFileName)
+	# Make the name of the temporary file unique, in case more than one process is building.
+	sTempFileName = '{}.{}.tmp'.format(sFileName, os.getpid())
+	try:
+		with open(sTempFileName, 'wb') as fileOutput:
+			fileOutput.write(oContents)
+		os.replace(sTempFileName, sFileName)
+	except:
+		try:
+			os.remove(sTempFileName)
+		except OSError:
+			pass
+		raise
+
+
+def _run_task(fnBuild, tplArgs, listOutputs):
+	"""Runs a build task, possibly in a worker process.
+
+	callable fnBuild
+		Function that generates the outputs of the task.
+	tuple(object*) tplArgs
+		Arguments for fnBuild.
+	list(str) listOutputs
+		Files generated by fnBuild.
+	tuple(float, dict(str: str), list(str)) return
+		Time spent in the task, in seconds; hashes of its outputs, including any additional outputs
+		returned by fnBuild (None for outputs that were not generated); report returned by fnBuild,
+		if any.
+	"""
+
+	fStart = time.perf_counter()
+	oResult = fnBuild(*tplArgs)
+	if isinstance(oResult, tuple):
+		listReport, listGenerated = oResult
+		listOutputs = listOutputs + listGenerated
+	else:
+		listReport = oResult
+	dictHashes = {}
+	for sOutput in listOutputs:
+		if os.path.exists(sOutput):
+			dictHashes[sOutput] = hash_file(sOutput)
+		else:
+			dictHashes[sOutput] = None
+	return time.perf_counter() - fStart, dictHashes, listReport
+
+
+def write_static_file(sFileName, sContents):
+	"""Writes a static file, along with a precompressed variant for each of STATIC_ENCODINGS; each
+	variant is compressed as tightly as possible (using zopfli for gzip and deflate, if available),
+	and is only kept if it’s actually smaller than the file itself. Every file is replaced
+	atomically; see replace_file().
+
+	str sFileName
+		Path to the file.
+	str sContents
+		Contents of the file.
+	list(str) return
+		Report on the size of each variant and the time taken to generate it.
+	"""
+
+	bytesContents = sContents.encode('utf-8')
+	cb = len(bytesContents)
+	replace_file(sFileName, bytesContents)
+	listReport = ['  Wrote {}: {} bytes'.format(sFileName, cb)]
+	for sEncoding, sSuffix in STATIC_ENCODINGS:
+		fStart = time.perf_counter()
+		if sEncoding == 'br':
+			bytesEncoded = brotli and brotli.compress(
+				bytesContents, mode = brotli.MODE_TEXT, quality = 11
+			)
+		elif sEncoding == 'gzip':
+			if zopfli:
+				bytesEncoded = zopfli.gzip.compress(bytesContents)
+			else:
+				# Use a fixed time stamp, so that the output only depends on the input.
+				bytesEncoded = gzip.compress(bytesContents, 9, mtime = 0)
+		elif sEncoding == 'deflate':
+			if zopfli:
+				# Strip the zlib header and trailer from the output.
+				bytesEncoded = zopfli.zopfli.compress(bytesContents)[2:-4]
+			else:
+				compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 9)
+				bytesEncoded = compressor.compress(bytesContents) + compressor.flush()
+		fElapsed = time.perf_counter() - fStart
+		if bytesEncoded and len(bytesEncoded) < cb:
+			replace_file(sFileName + sSuffix, bytesEncoded)
+			listReport.append('  Wrote {}{}: {} bytes ({:.1%}) in {:.3f} s'.format(
+				sFileName, sSuffix, len(bytesEncoded), len(bytesEncoded) / cb, fElapsed
+			))
+		else:
+			# Make sure no stale variant is left behind.
+			try:
+				os.remove(sFileName + sSuffix)
+			except FileNotFoundError:
+				pass
+			if bytesEncoded is None:
+				listReport.append('  Skipped {}{}: no compressor available'.format(sFileName, sSuffix))
+			else:
+				listReport.append('  Skipped {}{}: not smaller than the file'.format(
+					sFileName, sSuffix
+				))
+	return listReport
+
+
+
+####################################################################################################
+# BuildManifest
+
+class BuildManifest(object):
+	"""Records the hashes of the inputs and outputs of every build task, so that a task is only run
+	again if the contents of its inputs changed, or if its outputs were modified or deleted; changes
+	to modification times only (e.g. caused by a checkout or a copy) don’t cause rebuilds.
+
+	To avoid reading every file on every build, the size and modification time of each file are
+	stored along with its hash, which is only computed again if either of them changed.
+
+	Along with the manifest, a static files manifest can be written, with the hash and size of every
+	output in its directory; the server uses it to generate entity tags that only depend on the
+	contents of each file (see Static.StaticManifest).
+	"""
+
+	def __init__(self, sFileName, sBaseDir, sStaticFileName = None):
+		"""Constructor.
+
+		str sFileName
+			Path to the manifest file.
+		str sBaseDir
+			Directory to which paths stored in the manifest are relative, so that the installation
+			can be moved without invalidating it.
+		[str sStaticFileName]
+			Path to the static files manifest to write in save(); if omitted, none is written.
+		"""
+
+		self._m_sFileName = sFileName
+		self._m_sBaseDir = sBaseDir
+		self._m_sStaticFileName = sStaticFileName
+		# Stat information and hash for each file, as {path: [size, mtime_ns, hash]}.
+		self._m_dictFiles = {}
+		# Inputs and outputs of each task, as {key: {'inputs': {path: hash}, 'outputs': {…}}}.
+		self._m_dictTasks = {}
+		# Keys of the tasks that changed since the manifest was loaded.
+		self._m_setChangedTasks = set()
+		try:
+			with open(sFileName, 'r', encoding = 'utf-8') as fileManifest:
+				dictManifest = json.load(fileManifest)
+			self._m_dictFiles = dictManifest['files']
+			self._m_dictTasks = dictManifest['tasks']
+		except (OSError, ValueError, KeyError):
+			# Missing or unreadable manifest: everything will be rebuilt.
+			pass
+
+
+	def file_hash(self, sFileName):
+		"""Returns the hash of a file, avoiding reading it if its size and modification time didn’t
+		change since its hash was last computed.
+
+		str sFileName
+			Path to the file.
+		str return
+			Hexadecimal hash, or None if the file doesn’t exist.
+		"""
+
+		sPath = self._relpath(sFileName)
+		try:
+			st = os.stat(sFileName)
+		except OSError:
+			self._m_dictFiles.pop(sPath, None)
+			return None
+		listEntry = self._m_dictFiles.get(sPath)
+		if listEntry and listEntry[0] == st.st_size and listEntry[1] == st.st_mtime_ns:
+			return listEntry[2]
+		sHash = hash_file(sFileName)
+		self._m_dictFiles[sPath] = [st.st_size, st.st_mtime_ns, sHash]
+		return sHash
+
+
+	def is_up_to_date(self, sKey, sVersion, dictInputs, listOutputs):
+		"""Checks whether a task needs to be run.
+
+		str sKey
+			Task key.
+		str sVersion
+			Version of the task.
+		dict(str: str) dictInputs
+			Hash of each input file of the task.
+		iterable(str) listOutputs
+			Output files of the task.
+		bool return
+			True if the task was run with the same inputs and its outputs are unchanged, or False
+			otherwise.
+		"""
+
+		dictTask = self._m_dictTasks.get(sKey)
+		if not dictTask or dictTask.get('version', '') != sVersion:
+			return False
+		if dictTask['inputs'] != {
+			self._relpath(sInput): sHash for sInput, sHash in dictInputs.items()
+		}:
+			return False
+		dictOutputs = dictTask['outputs']
+		for sOutput in listOutputs:
+			if self._relpath(sOutput) not in dictOutputs:
+				return False
+		# Check every recorded output, including any additional outputs returned by the task.
+		for sPath, sHash in dictOutputs.items():
+			# Outputs that were not generated are recorded with a None hash, which matches the hash
+			# file_hash() returns for a missing file.
+			if sHash != self.file_hash(os.path.join(self._m_sBaseDir, sPath)):
+				return False
+		return True
+
+
+	def _relpath(self, sFileName):
+		"""Returns a path as stored in the manifest.
+
+		str sFileName
+			Path to a file.
+		str return
+			Path relative to the manifest base directory.
+		"""
+
+		return os.path.relpath(sFileName, self._m_sBaseDir)
+
+
+	def save(self):
+		"""Writes the manifest back to its file, merging in any tasks recorded in the meantime by
+		another process.
+		"""
+
+		makedirs_for(self._m_sFileName)
+		with open(self._m_sFileName + '.lock', 'w') as fileLock:
+			fcntl.flock(fileLock, fcntl.LOCK_EX)
+			try:
+				with open(self._m_sFileName, 'r', encoding = 'utf-8') as fileManifest:
+					dictManifest = json.load(fileManifest)
+				dictFiles = dictManifest['files']
+				dictTasks = dictManifest['tasks']
+			except (OSError, ValueError, KeyError):
+				dictFiles = {}
+				dictTasks = {}
+			dictFiles.update(self._m_dictFiles)
+			for sKey in self._m_setChangedTasks:
+				dictTasks[sKey] = self._m_dictTasks[sKey]
+			# Replace the file, so that readers never see a partial manifest.
+			replace_file(
+				self._m_sFileName,
+				json.dumps({'files': dictFiles, 'tasks': dictTasks}, sort_keys = True)
+			)
+			if self._m_sStaticFileName:
+				replace_file(self._m_sStaticFileName, json.dumps(
+					self._static_files(dictFiles, dictTasks), sort_keys = True
+				))
+		self._m_dictFiles = dictFiles
+		self._m_dictTasks = dictTasks
+		self._m_setChangedTasks.clear()
+
+
+	def _static_files(self, dictFiles, dictTasks):
+		"""Returns the contents of the static files manifest: the hash and size of every output in
+		the directory of the static files manifest, and its subdirectories.
+
+		dict(str: list(int, int, str)) dictFiles
+			Stat information and hash of each file, as stored in the manifest.
+		dict(str: dict(str: object)) dictTasks
+			Inputs and outputs of each task, as stored in the manifest.
+		dict(str: list(str, int)) return
+			Hash and size of each output, by path relative to the static files manifest’s directory.
+		"""
+
+		sStaticDir = os.path.dirname(self._m_sStaticFileName)
+		dictStatic = {}
+		for dictTask in dictTasks.values():
+			for sPath, sHash in dictTask['outputs'].items():
+				listEntry = dictFiles.get(sPath)
+				# Skip outputs that were not generated.
+				if sHash is None or not listEntry or listEntry[2] != sHash:
+					continue
+				sStaticPath = os.path.relpath(os.path.join(self._m_sBaseDir, sPath), sStaticDir)
+				if sStaticPath.startswith(os.pardir + os.sep):
+					continue
+				dictStatic[sStaticPath] = [sHash, listEntry[0]]
+		return dictStatic
+
+
+	def set_task(self, sKey, sVersion, dictInputs, dictOutputs):
+		"""Records the inputs and outputs of a task that was just run.
+
+		str sKey
+			Task key.
+		str sVersion
+			Version of the task.
+		dict(str: str) dictInputs
+			Hash of each input file of the task.
+		dict(str: str) dictOutputs
+			Hash of each output file of the task, or None for outputs that were not generated.
+		"""
+
+		for sOutput, sHash in dictOutputs.items():
+			if sHash is not None:
+				# Record the stat information of the output, so its hash won’t be computed again.
+				st = os.stat(sOutput)
+				self._m_dictFiles[self._relpath(sOutput)] = [st.st_size, st.st_mtime_ns, sHash]
+		self._m_dictTasks[sKey] = {
+			'version': sVersion,
+			'inputs' : {self._relpath(s): sHash for s, sHash in dictInputs.items()},
+			'outputs': {self._relpath(s): sHash for s, sHash in dictOutputs.items()},
+		}
+		self._m_setChangedTasks.add(sKey)
+
+
+
+####################################################################################################
+# BuildEngine
+
+class BuildEngine(object):
+	"""Runs build tasks across a pool of processes, skipping those whose inputs and outputs are
+	unchanged according to a BuildManifest, and reports how long each part of the build took.
+	"""
+
+	def __init__(self, qinst, cJobs = None):
+		"""Constructor.
+
+		QuearlInst qinst
+			Quearl installation to build.
+		[int cJobs]
+			Number of concurrent build processes; defaults to the number of CPUs.
+		"""
+
+		self._m_qinst = qinst
+		self._m_cJobs = cJobs or os.cpu_count() or 1
+		self._m_manifest = BuildManifest(
+			os.path.join(qinst.rodata_dir(), 'build.manifest'), qinst.root_dir(),
+			Static.StaticManifest.file_name(qinst.rodata_dir())
+		)
+		# Tasks added with add_task(), as (description, version, inputs, outputs, function,
+		# arguments).
+		self._m_listTasks = []
+
+
+	def add_task(self, sDescription, listInputs, listOutputs, fnBuild, *tplArgs, sVersion = ''):
+		"""Adds a task to the build. fnBuild and its arguments must be picklable, i.e. fnBuild must be
+		a module-level function or a method of a module-level class.
+
+		str sDescription
+			Description of the task, used in the output.
+		list(str) listInputs
+			Files read by fnBuild; the source file of the module containing fnBuild should be included,
+			so that changes to the generator cause a rebuild.
+		list(str) listOutputs
+			Files that can be generated by fnBuild; the first one is used to identify the task.
+		callable fnBuild
+			Function that generates the outputs; it can return a list of lines to be written as a
+			report in place of the list of outputs, or a tuple of such a list (or None) and a list of
+			additional outputs whose names could not be known in advance, e.g. because they contain
+			a hash of their contents; these are recorded in the manifest like any other output.
+		object* tplArgs
+			Arguments for fnBuild.
+		[str sVersion]
+			Version of any tools used by fnBuild that are not among listInputs; if it changes, the task
+			is run again.
+		"""
+
+		self._m_listTasks.append(
+			(sDescription, sVersion, listInputs, listOutputs, fnBuild, tplArgs)
+		)
+
+
+	def qinst(self):
+		"""Returns the Quearl installation being built.
+
+		QuearlInst return
+			Quearl installation.
+		"""
+
+		return self._m_qinst
+
+
+	def run(self):
+		"""Runs every task that needs to, then writes a timing report to stdout.
+
+		bool return
+			True if every task succeeded, or False otherwise.
+		"""
+
+		fStart = time.perf_counter()
+		cUpToDate = 0
+		cFailed = 0
+		# Time spent by each task that was run, as (time, description).
+		listTimes = []
+		# Find out which tasks need to be run.
+		listPending = []
+		for sDescription, sVersion, listInputs, listOutputs, fnBuild, tplArgs in self._m_listTasks:
+			dictInputs = {sInput: self._m_manifest.file_hash(sInput) for sInput in listInputs}
+			sKey = os.path.relpath(listOutputs[0], self._m_qinst.root_dir())
+			if self._m_manifest.is_up_to_date(sKey, sVersion, dictInputs, listOutputs):
+				cUpToDate += 1
+			else:
+				listPending.append(
+					(sKey, sDescription, sVersion, dictInputs, listOutputs, fnBuild, tplArgs)
+				)
+		fCheckTime = time.perf_counter() - fStart
+
+		if listPending:
+			if self._m_cJobs > 1 and len(listPending) > 1:
+				executor = concurrent.futures.ProcessPoolExecutor(self._m_cJobs)
+			else:
+				# Not worth starting any processes.
+				executor = _InlineExecutor()
+			with executor:
+				dictFutures = {}
+				for tplPending in listPending:
+					listOutputs, fnBuild, tplArgs = tplPending[-3:]
+					future = executor.submit(_run_task, fnBuild, tplArgs, listOutputs)
+					dictFutures[future] = tplPending
+				for future in concurrent.futures.as_completed(dictFutures):
+					sKey, sDescription, sVersion, dictInputs, listOutputs = dictFutures[future][:5]
+					try:
+						fElapsed, dictOutputs, listReport = future.result()
+					except Exception as x:
+						sys.stderr.write('{}: failed: {}\n'.format(sDescription, x))
+						cFailed += 1
+						continue
+					sys.stdout.write('{}\n'.format(sDescription))
+					if listReport is None:
+						listReport = ['  Wrote {}'.format(sOutput) for sOutput in listOutputs]
+					for sLine in listReport:
+						sys.stdout.write(sLine + '\n')
+					self._m_manifest.set_task(sKey, sVersion, dictInputs, dictOutputs)
+					listTimes.append((fElapsed, sDescription))
+		self._m_manifest.save()
+		fElapsed = time.perf_counter() - fStart
+
+		# Write the timing report.
+		sys.stdout.write(
+			'Build with --jobs {}: {} tasks, {} up to date, {} run, {} failed\n'.format(
+				self._m_cJobs, len(self._m_listTasks), cUpToDate, len(listTimes), cFailed
+			) +
+			'  Checking manifest: {:8.3f} s\n'.format(fCheckTime) +
+			'  Running tasks:     {:8.3f} s ({:.3f} s of work)\n'.format(
+				fElapsed - fCheckTime, sum(fTime for fTime, sDescription in listTimes)
+			) +
+			'  Total:             {:8.3f} s\n'.format(fElapsed)
+		)
+		listTimes.sort(reverse = True)
+		if listTimes:
+			sys.stdout.write('  Slowest tasks:\n')
+			for fTime, sDescription in listTimes[:5]:
+				sys.stdout.write('    {:8.3f} s  {}\n'.format(fTime, sDescription))
+		self._m_listTasks = []
+		return cFailed == 0
+
+
+	@staticmethod
+	def add_arguments(argparser):
+		"""Adds the command-line options that control a build to an argument parser.
+
+		argparse.ArgumentParser argparser
+			Argument parser.
+		"""
+
+		argparser.add_argument(
+			'--jobs', '-j', type = int, default = None,
+			help = 'Number of concurrent build processes (default: number of CPUs)'
+		)
+
+
+
+####################################################################################################
+# _InlineExecutor
+
+class _InlineExecutor(concurrent.futures.Executor):
+	"""Executor that runs each task as soon as it’s submitted, in the calling process."""
+
+	def submit(self, fn, *args, **kwargs):
+		future = concurrent.futures.Future()
+		try:
+			future.set_result(fn(*args, **kwargs))
+		except Exception as x:
+			future.set_exception(x)
+		return future
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load quearl_inst and the generators.
+	sys.path.append(sDir)
+	import js_preproc
+	import localize
+	import quearl_inst
+
+	argparser = argparse.ArgumentParser(description = __doc__)
+	BuildEngine.add_arguments(argparser)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory and instantiate a QuearlInst for it.
+	qinst = quearl_inst.QuearlInst(os.path.normpath(os.path.join(sDir, '..')))
+	# Update all modules, running every generator in the same pool.
+	engine = BuildEngine(qinst, args.jobs)
+	quearl_inst.ModuleIndexer.update_inst(qinst, engine)
+	for module in qinst.modules():
+		js_preproc.JsPreproc.update_module(module, engine)
+		localize.l10n_generator.update_module(module, engine)
+		quearl_inst.TemplateIndexer.update_module(module, engine)
+
+	sys.exit(0 if engine.run() else 1)
@@ -21,8 +21,12 @@
 """Classes to manage a Quearl installation."""
 
 from configparser import ConfigParser
+import json
 import os
 
+from modules.quearl.core import Module
+import quearl_build
+
 
 
 ####################################################################################################
@@ -49,6 +53,20 @@ class QuearlInst(object):
 		self._m_sConfigsDir = os.path.join(sQuearlDir, 'config')
 		self.load_conf('core', 'core/bootstrap.conf')
 		self._m_sRODataDir = os.path.join(sQuearlDir, self._m_conf['core']['rodata_lpath'])
+		self._m_sLogDir = os.path.join(sQuearlDir, self._m_conf['core']['log_lpath'])
+		self._m_sQuearlDir = sQuearlDir
+		# Cached by modules().
+		self._m_listModules = None
+
+
+	def default_locale(self):
+		"""Returns the default locale, used for anything that’s not localized for a requested locale.
+
+		str return
+			Locale.
+		"""
+
+		return self._m_conf['core'].get('default_locale', 'en-us')
 
 
 	def load_conf(self, sSectionName, sConfFileName):
@@ -68,13 +86,30 @@ class QuearlInst(object):
 		self._m_conf.read_string('[{}]\n{}'.format(sSectionName, sConf))
 
 
+	def log_dir(self):
+		"""Returns the directory containing the logs.
+
+		str return
+			Directory.
+		"""
+
+		return self._m_sLogDir
+
+
 	def modules(self):
-		"""Iterates over every module."""
+		"""Returns every module. The module directory is only scanned the first time.
+
+		list(QuearlModule) return
+			Modules, sorted by directory name.
+		"""
 
-		for sFileName in os.listdir(self._m_sModulesDir):
-			sFileName = os.path.join(self._m_sModulesDir, sFileName)
-			if os.path.isdir(sFileName):
-				yield QuearlModule(self, sFileName)
+		if self._m_listModules is None:
+			self._m_listModules = []
+			for sFileName in sorted(os.listdir(self._m_sModulesDir)):
+				sFileName = os.path.join(self._m_sModulesDir, sFileName)
+				if os.path.isdir(sFileName):
+					self._m_listModules.append(QuearlModule(self, sFileName))
+		return self._m_listModules
 
 
 	def rodata_dir(self):
@@ -87,6 +122,84 @@ class QuearlInst(object):
 		return self._m_sRODataDir
 
 
+	def root_dir(self):
+		"""Returns the Quearl installation subdirectory.
+
+		str return
+			Directory.
+		"""
+
+		return self._m_sQuearlDir
+
+
+
+####################################################################################################
+# ModuleIndexer
+
+class ModuleIndexer(object):
+	"""Generates the module manifest, which describes every module of the installation (see
+	Module.discover_modules()), so that the runtime can route requests to modules without scanning
+	the module directory or importing the code of modules that won’t handle them.
+	"""
+
+	@classmethod
+	def update_inst(cls, qinst, engine):
+		"""Adds a task to update the module manifest to a build.
+
+		QuearlInst qinst
+			Quearl installation.
+		quearl_build.BuildEngine engine
+			Build to add the task to.
+		"""
+
+		# The manifest depends on the main PHP file and the Python class of each module; the list of
+		# modules and of their l10n and template directories is part of the version, so that adding
+		# or removing a module or one of those directories makes the task run.
+		listInputs = []
+		listVersion = []
+		for module in qinst.modules():
+			listVersion.append(module.abbr())
+			for sDir in 'l10n', 'template':
+				if os.path.isdir(os.path.join(module.base_dir(), sDir)):
+					listVersion.append(module.abbr() + '/' + sDir)
+			for sFileName in sorted(os.listdir(module.base_dir())):
+				if sFileName.startswith('main') and sFileName.endswith('.php'):
+					listInputs.append(os.path.join(module.base_dir(), sFileName))
+			sClassFileName = os.path.join(
+				qinst.root_dir(), 'bin', 'modules', 'quearl', module.abbr(),
+				Module.class_name(module.abbr()) + '.py'
+			)
+			if os.path.isfile(sClassFileName):
+				listInputs.append(sClassFileName)
+				listVersion.append(Module.class_name(module.abbr()))
+		listInputs.append(os.path.abspath(__file__))
+		listInputs.append(os.path.abspath(Module.__file__))
+		engine.add_task(
+			'Indexing modules',
+			listInputs,
+			[Module.ModuleRegistry.manifest_file_name(qinst.rodata_dir())],
+			cls.write_manifest, qinst.root_dir(), qinst.rodata_dir(),
+			sVersion = ' '.join(listVersion)
+		)
+
+
+	@staticmethod
+	def write_manifest(sRootDir, sRODataDir):
+		"""Generates the module manifest.
+
+		str sRootDir
+			Quearl installation subdirectory.
+		str sRODataDir
+			Quearl-wide read-only data directory.
+		"""
+
+		quearl_build.replace_file(
+			Module.ModuleRegistry.manifest_file_name(sRODataDir), json.dumps(
+				Module.discover_modules(sRootDir, sRODataDir), indent = '\t', sort_keys = True
+			)
+		)
+
+
 
 ####################################################################################################
 # QuearlModule
@@ -104,14 +217,17 @@ class QuearlModule(object):
 		"""
 
 		# _m_sAbbr like “core”, “ecomm”, …
-		# TODO: FIXME: read this by parsing the module’s main.php!
-		self._m_sAbbr = os.path.basename(sBaseDir)
+		self._m_sAbbr = Module.read_abbr(sBaseDir)
 		self._m_sBaseDir = sBaseDir
 		self._m_sL10nDir = os.path.join(sBaseDir, 'l10n')
 		if not os.path.isdir(self._m_sL10nDir):
 			# Maybe this module has no localization.
 			self._m_sL10nDir = None
 		self._m_sRODataDir = os.path.join(qinst.rodata_dir(), self._m_sAbbr)
+		self._m_sTemplateDir = os.path.join(sBaseDir, 'template')
+		if not os.path.isdir(self._m_sTemplateDir):
+			# This module has no templates.
+			self._m_sTemplateDir = None
 
 
 	def abbr(self):
@@ -154,6 +270,134 @@ class QuearlModule(object):
 		return self._m_sRODataDir
 
 
+	def template_dir(self):
+		"""Returns the module’s templates directory.
+
+		str return
+			Templates directory, or None if non-existent.
+		"""
+
+		return self._m_sTemplateDir
+
+
+
+####################################################################################################
+# TemplateIndexer
+
+class TemplateIndexer(object):
+	"""Generates the template resolution index of a module, which maps each template (type, name
+	and locale) to the file QlModule::get_template_filename() would pick for it, so that the runtime
+	can resolve templates without checking for the existence of up to three files every time.
+
+	The index is a JSON object with these keys:
+	•  “default_locale”: default locale used to apply fallbacks; if the installation’s default locale
+	   changes, the index must be ignored;
+	•  “dirs”: modification time (in ns) of the templates directory and each of its subdirectories,
+	   relative to the templates directory; if any of them changed, e.g. because a template was
+	   added or removed without updating the index, the index must be ignored;
+	•  “templates”: {type: {name: {locale: file name}}}, with file names relative to the templates
+	   directory; the empty locale maps to the file to use for any locale not listed.
+	"""
+
+	@classmethod
+	def update_module(cls, module, engine):
+		"""Adds a task to update the template resolution index of a given module to a build.
+
+		QuearlModule module
+			Module for which to update the index.
+		quearl_build.BuildEngine engine
+			Build to add the task to.
+		"""
+
+		sTemplateDir = module.template_dir()
+		if sTemplateDir is None:
+			# This module has no templates.
+			return
+
+		# The index depends on which files exist, so every file is an input: adding or removing one
+		# changes the inputs of the task. Changes to the modification times of the directories would
+		# make the runtime ignore the index, so they also require generating it again.
+		listInputs = []
+		listDirMTimes = []
+		for sDirPath, listDirNames, listFileNames in os.walk(sTemplateDir):
+			listDirNames.sort()
+			listDirMTimes.append(str(os.stat(sDirPath).st_mtime_ns))
+			for sFileName in sorted(listFileNames):
+				listInputs.append(os.path.join(sDirPath, sFileName))
+		listInputs.append(os.path.abspath(__file__))
+		sDefaultLocale = engine.qinst().default_locale()
+		engine.add_task(
+			'Indexing templates for module {}'.format(module.abbr()),
+			listInputs,
+			[cls.index_file_name(module.rodata_dir())],
+			cls.write_index, sTemplateDir, module.rodata_dir(), sDefaultLocale,
+			sVersion = '{} {}'.format(sDefaultLocale, ' '.join(listDirMTimes))
+		)
+
+
+	@staticmethod
+	def index_file_name(sRODataDir):
+		"""Returns the path to the template resolution index of a module.
+
+		str sRODataDir
+			Read-only data directory of the module.
+		str return
+			Path to the index.
+		"""
+
+		return os.path.join(sRODataDir, 'template', 'index.json')
+
+
+	@classmethod
+	def write_index(cls, sTemplateDir, sRODataDir, sDefaultLocale):
+		"""Generates the template resolution index of a module.
+
+		str sTemplateDir
+			Templates directory of the module.
+		str sRODataDir
+			Read-only data directory of the module.
+		str sDefaultLocale
+			Default locale.
+		"""
+
+		dictDirs = {}
+		# Files found for each template, as {type: {name: {locale: file name}}}; the empty locale is
+		# for locale-neutral templates.
+		dictTemplates = {}
+		for sDirPath, listDirNames, listFileNames in os.walk(sTemplateDir):
+			sRelDir = os.path.relpath(sDirPath, sTemplateDir)
+			dictDirs[sRelDir.replace(os.sep, '/')] = os.stat(sDirPath).st_mtime_ns
+			for sFileName in listFileNames:
+				sBaseName, sDot, sType = sFileName.rpartition('.')
+				if not sDot or not sBaseName or sFileName.startswith('.'):
+					continue
+				sName, sL10n, sLocale = sBaseName.rpartition('.l10n_')
+				if not sL10n:
+					sName = sBaseName
+					sLocale = ''
+				sRelFileName = os.path.normpath(os.path.join(sRelDir, sFileName))
+				sName = os.path.normpath(os.path.join(sRelDir, sName))
+				dictTemplates.setdefault(sType, {}).setdefault(sName.replace(os.sep, '/'), {})[
+					sLocale
+				] = sRelFileName.replace(os.sep, '/')
+
+		# Apply the fallbacks: any locale without its own file uses the one for the default locale
+		# or, if missing, the locale-neutral one.
+		for dictNames in dictTemplates.values():
+			for sName, dictLocales in dictNames.items():
+				sFallbackFileName = dictLocales.get(sDefaultLocale) or dictLocales.get('')
+				if sFallbackFileName:
+					dictLocales[''] = sFallbackFileName
+				else:
+					dictLocales.pop('', None)
+
+		quearl_build.replace_file(cls.index_file_name(sRODataDir), json.dumps({
+			'default_locale': sDefaultLocale,
+			'dirs'          : dictDirs,
+			'templates'     : dictTemplates,
+		}, indent = '\t', sort_keys = True))
+
+
 
 ####################################################################################################
 # __main__
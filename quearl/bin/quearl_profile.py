@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+
+"""Merges the profiling histograms written by every server process (see Profile.Profiler), and
+displays percentiles of the duration of each request phase, and of the queries that took the most
+time overall.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+
+####################################################################################################
+# Functions
+
+def format_histogram(sName, histogram, cchName):
+	"""Formats the statistics of a histogram as a table row.
+
+	str sName
+		Name of the phase or query.
+	Profile.Histogram histogram
+		Histogram.
+	int cchName
+		Width of the name column.
+	str return
+		Table row.
+	"""
+
+	return '{:{}} {:>9} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}\n'.format(
+		sName[:cchName], cchName, histogram.count(), histogram.total() * 1000,
+		histogram.percentile(50) * 1000, histogram.percentile(95) * 1000,
+		histogram.percentile(99) * 1000, histogram.max() * 1000
+	)
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load the Quearl Python modules.
+	sys.path.append(sDir)
+	from modules.quearl.core import Application
+	from modules.quearl.core import Profile
+
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--queries', type = int, default = 20,
+		help = 'Number of queries to display, by total time (default: 20)'
+	)
+	argparser.add_argument(
+		'--json', action = 'store_true', help = 'Output the merged histograms as JSON'
+	)
+	argparser.add_argument(
+		'--reset', action = 'store_true',
+		help = 'Delete the histograms after reading them; processes that are still running will ' +
+			'write theirs again'
+	)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory and instantiate an Application for it.
+	app = Application.Application(os.path.normpath(os.path.join(sDir, '..')))
+	sProfileDir = app.section('core')['profile_lpath']
+	app.close()
+	dictPhases, dictQueries = Profile.load_worker_files(sProfileDir)
+	listQueries = sorted(
+		dictQueries.items(), key = lambda tpl: tpl[1].total(), reverse = True
+	)[:args.queries]
+
+	if args.json:
+		json.dump({
+			'phases' : {sName: histogram.to_dict() for sName, histogram in dictPhases.items()},
+			'queries': {sName: histogram.to_dict() for sName, histogram in listQueries},
+		}, sys.stdout, indent = '\t', sort_keys = True)
+		sys.stdout.write('\n')
+	else:
+		sHeader = '{:{}} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}\n'
+		sys.stdout.write(sHeader.format(
+			'Phase', 20, 'Count', 'Total ms', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms'
+		))
+		for sName in sorted(dictPhases.keys()):
+			sys.stdout.write(format_histogram(sName, dictPhases[sName], 20))
+		sys.stdout.write('\n' + sHeader.format(
+			'Query', 60, 'Count', 'Total ms', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms'
+		))
+		for sName, histogram in listQueries:
+			sys.stdout.write(format_histogram(sName, histogram, 60))
+
+	if args.reset and os.path.isdir(sProfileDir):
+		for sFileName in os.listdir(sProfileDir):
+			if sFileName.endswith('.json'):
+				os.remove(os.path.join(sProfileDir, sFileName))
+
+	sys.exit(0)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Runs Quearl as a long-running, pre-forking HTTP server."""
+
+import argparse
+import os
+import sys
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load the Quearl Python modules.
+	sys.path.append(sDir)
+	from modules.quearl.core import Application
+	from modules.quearl.core import Server
+
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--host', default = '', help = 'Address to listen on (default: all addresses)'
+	)
+	argparser.add_argument(
+		'--port', type = int, default = 8008, help = 'Port to listen on (default: 8008)'
+	)
+	argparser.add_argument(
+		'--workers', type = int, default = 4, help = 'Number of worker processes (default: 4)'
+	)
+	argparser.add_argument(
+		'--max-requests', type = int, default = 1000,
+		help = 'Requests handled by a worker before it’s recycled; 0 = unlimited (default: 1000)'
+	)
+	argparser.add_argument(
+		'--no-session-gc', action = 'store_true',
+		help = 'Don’t delete expired sessions in a background process (e.g. if ' +
+			'quearl_session_gc.py is run separately)'
+	)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory.
+	sRootDir = os.path.normpath(os.path.join(sDir, '..'))
+
+	def collect_sessions(fnWait):
+		app = Application.Application(sRootDir)
+		try:
+			app.collect_sessions(fnWait)
+		finally:
+			app.close()
+
+	server = Server.PreforkServer(
+		lambda: Application.Application(sRootDir),
+		sHost            = args.host,
+		iPort            = args.port,
+		cWorkers         = args.workers,
+		cMaxRequests     = args.max_requests,
+		# Restart the workers whenever the configuration or the Python modules change.
+		iterWatchedPaths = (
+			os.path.join(sRootDir, 'config'),
+			os.path.join(sDir, 'modules'),
+		),
+		fnBackgroundTask = None if args.no_session_gc else collect_sessions
+	)
+	server.bind()
+	server.serve_forever()
+
+	sys.exit(0)
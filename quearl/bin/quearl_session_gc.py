@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Deletes expired sessions, in bounded batches and at a rate adapted to how many sessions expire;
+see Session.SessionCollector. quearl_server.py already does this in a background process, so this is
+only needed when Quearl is not run by it (e.g. as CGI), either as a daemon or from cron.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load the Quearl Python modules.
+	sys.path.append(sDir)
+	from modules.quearl.core import Application
+
+	argparser = argparse.ArgumentParser(description = __doc__)
+	argparser.add_argument(
+		'--once', action = 'store_true',
+		help = 'Run a single pass and print its metrics, instead of running until interrupted'
+	)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory and instantiate an Application for it.
+	app = Application.Application(os.path.normpath(os.path.join(sDir, '..')))
+	try:
+		if args.once:
+			app.collect_sessions(lambda fTimeout: False)
+			json.dump(dict(app.section('session_gc')), sys.stdout, indent = '\t', sort_keys = True)
+			sys.stdout.write('\n')
+		else:
+			app.collect_sessions(lambda fTimeout: time.sleep(fTimeout) or True)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		app.close()
+
+	sys.exit(0)
+
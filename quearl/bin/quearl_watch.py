@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*- coding: utf-8; mode: python; tab-width: 3 -*-
+#
+# Copyright 2013
+# Raffaello D. Di Napoli
+#
+# This file is part of Quearl.
+#
+# Quearl is free software: you can redistribute it and/or modify it under the terms of the GNU
+# Affero General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# Quearl is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Quearl. If
+# not, see <http://www.gnu.org/licenses/>.
+#---------------------------------------------------------------------------------------------------
+
+"""Watches the base, js, l10n and template directories of every module, and regenerates the
+read-only data derived from the files in them (including the module manifest) as soon as they
+change. Uses inotify where available, falling back to periodically checking the directories
+otherwise.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import quearl_build
+
+
+
+####################################################################################################
+# Functions
+
+def is_source_file(sFileName):
+	"""Checks whether a file can be one of those that read-only data is generated from, as opposed to
+	e.g. an editor’s temporary or backup file.
+
+	str sFileName
+		Name of the file.
+	bool return
+		True if changes to the file require a build, or False otherwise.
+	"""
+
+	return not (
+		sFileName.startswith('.') or sFileName.endswith('~') or sFileName.endswith('.tmp')
+	)
+
+
+
+####################################################################################################
+# InotifyWatcher
+
+class InotifyWatcher(object):
+	"""Watches directories using the Linux inotify API, via ctypes."""
+
+	# Events that can indicate a change to a file in a watched directory: files being written (only
+	# reported when they’re closed, to avoid reacting to partial writes), moved in or out (e.g. by
+	# editors that save by renaming a temporary file), or deleted.
+	_smc_iEventMask = 0x00000008 | 0x00000040 | 0x00000080 | 0x00000200
+	# IN_NONBLOCK | IN_CLOEXEC.
+	_smc_iInitFlags = 0o4000 | 0o2000000
+	# struct inotify_event, not including the variable-length name that follows it.
+	_smc_structEvent = struct.Struct('iIII')
+
+
+	def __init__(self, iterDirs):
+		"""Constructor.
+
+		iterable(str) iterDirs
+			Directories to watch.
+		"""
+
+		sLibC = ctypes.util.find_library('c')
+		self._m_libc = ctypes.CDLL(sLibC, use_errno = True)
+		# Raises AttributeError if the C library has no inotify support.
+		self._m_libc.inotify_init1.argtypes = (ctypes.c_int, )
+		self._m_libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+		self._m_fd = self._m_libc.inotify_init1(self._smc_iInitFlags)
+		if self._m_fd < 0:
+			iErrNo = ctypes.get_errno()
+			raise OSError(iErrNo, os.strerror(iErrNo))
+		# Watched directories, as {watch descriptor: directory}.
+		self._m_dictDirs = {}
+		try:
+			for sDir in iterDirs:
+				iWd = self._m_libc.inotify_add_watch(
+					self._m_fd, os.fsencode(sDir), self._smc_iEventMask
+				)
+				if iWd < 0:
+					iErrNo = ctypes.get_errno()
+					raise OSError(iErrNo, os.strerror(iErrNo), sDir)
+				self._m_dictDirs[iWd] = sDir
+		except:
+			os.close(self._m_fd)
+			raise
+
+
+	def close(self):
+		"""Stops watching, releasing the inotify instance."""
+
+		os.close(self._m_fd)
+
+
+	def wait(self, fTimeout = None):
+		"""Waits for changes to the watched directories.
+
+		[float fTimeout]
+			Maximum time to wait, in seconds; if omitted, waits until something changes.
+		set(str) return
+			Paths to the files that changed; empty if fTimeout elapsed before anything changed.
+		"""
+
+		setChanged = set()
+		while not setChanged:
+			try:
+				listReadable = select.select((self._m_fd, ), (), (), fTimeout)[0]
+			except InterruptedError:
+				continue
+			if not listReadable:
+				break
+			try:
+				bytesEvents = os.read(self._m_fd, 64 * 1024)
+			except BlockingIOError:
+				continue
+			ib = 0
+			while ib < len(bytesEvents):
+				iWd, iMask, iCookie, cbName = self._smc_structEvent.unpack_from(bytesEvents, ib)
+				ib += self._smc_structEvent.size
+				sFileName = os.fsdecode(bytesEvents[ib:ib + cbName].rstrip(b'\0'))
+				ib += cbName
+				sDir = self._m_dictDirs.get(iWd)
+				if sDir is not None and is_source_file(sFileName):
+					setChanged.add(os.path.join(sDir, sFileName))
+		return setChanged
+
+
+
+####################################################################################################
+# PollingWatcher
+
+class PollingWatcher(object):
+	"""Watches directories by periodically comparing the size and modification time of their
+	files; used where inotify is not available.
+	"""
+
+	def __init__(self, iterDirs, fInterval):
+		"""Constructor.
+
+		iterable(str) iterDirs
+			Directories to watch.
+		float fInterval
+			Time between checks, in seconds.
+		"""
+
+		self._m_fInterval = fInterval
+		# Last seen state of the watched files, as {path: (size, mtime_ns)}.
+		self._m_dictFiles = {}
+		self._m_listDirs = list(iterDirs)
+		self._scan()
+
+
+	def close(self):
+		"""Stops watching."""
+
+		pass
+
+
+	def _scan(self):
+		"""Checks the watched directories for changes.
+
+		set(str) return
+			Paths to the files that changed since the last check.
+		"""
+
+		dictFiles = {}
+		for sDir in self._m_listDirs:
+			try:
+				listFileNames = os.listdir(sDir)
+			except OSError:
+				continue
+			for sFileName in listFileNames:
+				if is_source_file(sFileName):
+					sFilePath = os.path.join(sDir, sFileName)
+					try:
+						st = os.stat(sFilePath)
+					except OSError:
+						continue
+					dictFiles[sFilePath] = (st.st_size, st.st_mtime_ns)
+		setChanged = set(
+			sFilePath for sFilePath, tplStat in dictFiles.items()
+			if self._m_dictFiles.get(sFilePath) != tplStat
+		)
+		# Deleted files are changes too.
+		setChanged.update(self._m_dictFiles.keys() - dictFiles.keys())
+		self._m_dictFiles = dictFiles
+		return setChanged
+
+
+	def wait(self, fTimeout = None):
+		"""See InotifyWatcher.wait()."""
+
+		fEnd = None if fTimeout is None else time.monotonic() + fTimeout
+		while True:
+			if fEnd is None:
+				time.sleep(self._m_fInterval)
+			else:
+				fRemaining = fEnd - time.monotonic()
+				if fRemaining > 0:
+					time.sleep(min(self._m_fInterval, fRemaining))
+			setChanged = self._scan()
+			if setChanged or (fEnd is not None and time.monotonic() >= fEnd):
+				return setChanged
+
+
+
+####################################################################################################
+# __main__
+
+if __name__ == '__main__':
+	# Get the full path of this script.
+	sDir = os.path.dirname(os.path.abspath(sys.argv[0]))
+	# Setup the PATH environment variable to load quearl_inst and the generators.
+	sys.path.append(sDir)
+	import js_preproc
+	import localize
+	import quearl_inst
+
+	argparser = argparse.ArgumentParser(description = __doc__)
+	quearl_build.BuildEngine.add_arguments(argparser)
+	argparser.add_argument(
+		'--debounce', type = float, default = 0.25,
+		help = 'Seconds without further changes to wait for before building (default: 0.25)'
+	)
+	argparser.add_argument(
+		'--poll', type = float, metavar = 'INTERVAL',
+		help = 'Check for changes every INTERVAL seconds, instead of using inotify'
+	)
+	args = argparser.parse_args()
+
+	# Obtain the Quearl installation subdirectory and instantiate a QuearlInst for it.
+	qinst = quearl_inst.QuearlInst(os.path.normpath(os.path.join(sDir, '..')))
+	engine = quearl_build.BuildEngine(qinst, args.jobs)
+	# Modules to which each watched directory belongs, as {directory: QuearlModule}.
+	dictDirModules = {}
+	for module in qinst.modules():
+		for sWatchDir in (
+			module.base_dir(), os.path.join(module.base_dir(), 'js'), module.l10n_dir(),
+			module.template_dir()
+		):
+			if sWatchDir and os.path.isdir(sWatchDir):
+				dictDirModules[sWatchDir] = module
+
+	# Start watching before the initial build, so that no changes can be missed.
+	watcher = None
+	if args.poll is None:
+		try:
+			watcher = InotifyWatcher(sorted(dictDirModules.keys()))
+		except (AttributeError, OSError) as x:
+			sys.stderr.write('inotify not available ({}), polling for changes\n'.format(x))
+	if watcher is None:
+		watcher = PollingWatcher(sorted(dictDirModules.keys()), args.poll or 1.0)
+
+	try:
+		listModules = dictDirModules.values()
+		while True:
+			# Update the modules that changed; the manifest will skip any tasks whose inputs didn’t.
+			quearl_inst.ModuleIndexer.update_inst(qinst, engine)
+			setModuleDirs = set()
+			for module in listModules:
+				if module.base_dir() not in setModuleDirs:
+					setModuleDirs.add(module.base_dir())
+					js_preproc.JsPreproc.update_module(module, engine)
+					localize.l10n_generator.update_module(module, engine)
+					quearl_inst.TemplateIndexer.update_module(module, engine)
+			engine.run()
+			sys.stdout.write('Watching {} directories for changes…\n'.format(len(dictDirModules)))
+			sys.stdout.flush()
+
+			setChanged = watcher.wait()
+			# Wait for a burst of changes (e.g. a checkout) to end before building.
+			while True:
+				setMoreChanged = watcher.wait(args.debounce)
+				if not setMoreChanged:
+					break
+				setChanged |= setMoreChanged
+			for sFilePath in sorted(setChanged):
+				sys.stdout.write('Changed: {}\n'.format(sFilePath))
+			listModules = [dictDirModules[os.path.dirname(sFilePath)] for sFilePath in setChanged]
+	except KeyboardInterrupt:
+		pass
+	finally:
+		watcher.close()
+
+	sys.exit(0)
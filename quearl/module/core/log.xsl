@@ -262,6 +262,13 @@ see <http://www.gnu.org/licenses/>.
 			]]></script>
 		</head>
 		<body>
+			<xsl:if test="@total">
+				<!-- Page of a larger log, generated by LogReader. -->
+				<p class="page">
+					Entries <xsl:value-of select="@offset + 1"/>–<xsl:value-of select="@offset + @count"/>
+					of <xsl:value-of select="@total"/>
+				</p>
+			</xsl:if>
 			<xsl:apply-templates/>
 		</body>
 	</html>
@@ -52,6 +52,9 @@ class QlCoreModule extends QlModule {
 	public function augment_response_head(
 		QlRequest $request, QlResponse $response, QlXhtmlResponseEntity $ent
 	) {
+		# A single bundle, cached forever by the client, instead of each of the core JS files.
+		$ent->include_js_bundle('core');
+		$ent->include_js('core/js/main-iefixes.js', true);
 	}
 
 
@@ -327,8 +330,20 @@ class QlCoreModule extends QlModule {
 			'js'  => 'text/javascript; charset=utf-8',
 		);
 
+		# Bundles generated by JsPreproc are named after a hash of their contents, so they never
+		# change: let them be cached for a year, without revalidation.
+		if (preg_match(
+			'/\/bundle(?:-[a-z]{2}-[a-z]{2})?\.[0-9a-f]{16}\.js$/D', $request->get_url()
+		)) {
+			$iExpiresAfter = 365 * 24 * 60 * 60;
+			$bImmutable = true;
+		} else {
+			$iExpiresAfter = null;
+			$bImmutable = false;
+		}
+
 		# Respond to the request. First, check if the client already has a cached version of the file.
-		if ($response->use_cache(filemtime($sFileName))) {
+		if ($response->use_cache(filemtime($sFileName), null, $iExpiresAfter, $bImmutable)) {
 			# No need for a response entity.
 			$ent = new QlNullResponseEntity($request, $response);
 		} else {
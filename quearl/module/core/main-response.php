@@ -380,11 +380,17 @@ class QlResponse {
 		Time that the response will be valid for, in seconds. Before this interval has elapsed, no
 		requests for the same resource will be made by the remote client. If omitted, the response
 		will have no expiration date, and caching will be controlled only by the other arguments.
+	[bool $bImmutable]
+		If true, the entity will never change, so it can be cached by shared caches as well, and
+		remote clients should never revalidate it before $iExpiresAfter has elapsed, not even when the
+		user reloads the page; see RFC 8246 “HTTP Immutable Responses”. Requires $iExpiresAfter.
 	bool return
 		true if the file has been setup for sending, or false if the remote client has a valid cached
 		copy of the file.
 	*/
-	public function use_cache($mTS = null, $sETag = null, $iExpiresAfter = null) {
+	public function use_cache(
+		$mTS = null, $sETag = null, $iExpiresAfter = null, $bImmutable = false
+	) {
 		if ($sETag === null && $mTS === null) {
 			trigger_error('The arguments $sETag and $mTS cannot both be null', E_USER_WARNING);
 			# Go ahead anyway; we can still add the “Expired” and “Cache-Control” header fields.
@@ -443,9 +449,15 @@ class QlResponse {
 			$this->set_header_field(
 				'Expires', ql_format_timestamp('%P', $ql_fScriptStart + $iExpiresAfter, 'UTC')
 			);
-			$this->set_header_field(
-				'Cache-Control', 'private, maxage=' . $iExpiresAfter . ', must-revalidate'
-			);
+			if ($bImmutable) {
+				$this->set_header_field(
+					'Cache-Control', 'public, max-age=' . $iExpiresAfter . ', immutable'
+				);
+			} else {
+				$this->set_header_field(
+					'Cache-Control', 'private, maxage=' . $iExpiresAfter . ', must-revalidate'
+				);
+			}
 		} else {
 			# Tell the remote client to always revalidate this response (see RFC 2616 § 14.9.4 “Cache
 			# Revalidation and Reload Controls”). Note that this does not disallow caching.
@@ -600,9 +612,10 @@ class QlStaticResponseEntity extends QlResponseEntity {
 	string $sContentType
 		MIME content type of the file.
 	[bool $bHasCompressedVersion]
-		If true, the remote client will be served with a compressed version of the file, provided that
-		the client accepts one of the supported compression encodings, and that such version of the
-		file exists.
+		If true, the remote client will be served with a precompressed version of the file, provided
+		that the client accepts one of the supported compression encodings, and that such version of
+		the file exists; the versions are generated by quearl/bin/quearl_build.py, and each of them
+		only exists if it’s smaller than the file itself.
 	*/
 	public function set_file($sFileName, $sContentType, $bHasCompressedVersion = false) {
 		if (!is_file($sFileName) || !is_readable($sFileName)) {
@@ -611,34 +624,63 @@ class QlStaticResponseEntity extends QlResponseEntity {
 
 		$this->m_sFileName = $sFileName;
 		if ($bHasCompressedVersion) {
-			# Check if we have a compressed version of this file matching the encodings accepted by the
-			# remote client.
+			# Suffix of the file name of the precompressed version of a file, for each encoding; see
+			# STATIC_ENCODINGS in quearl/bin/quearl_build.py. Note that .z files contain a raw deflate
+			# stream, which is what most clients expect despite RFC 2616 specifying a zlib stream.
 			# TODO: investigate these links:
 			#    <http://support.microsoft.com/default.aspx?scid=kb;en-us;Q313712>
 			#    <http://support.microsoft.com/default.aspx?scid=kb;en-us;Q312496>
 			#    <http://www.vervestudios.co/projects/compression-tests/results>
 			#
-			foreach ($this->m_request->get_accepted_encodings() as $sEncoding => $fQ) {
-				switch ($sEncoding) {
-					case 'gzip':
-					case 'x-gzip':
-						$sEncodedFileName = $sFileName . '.gz';
-						break;
-#					case 'deflate':
-#						$sEncodedFileName = $sFileName . '.z';
-#						break;
-					default:
-						# Unknown encoding type, skip it.
-						continue(2);
+			static $arrEncodingSuffixes = array(
+				'br'      => '.br',
+				'deflate' => '.z',
+				'gzip'    => '.gz',
+				'x-gzip'  => '.gz',
+			);
+			$arrAcceptedEncodings =& $this->m_request->get_accepted_encodings();
+			# The unencoded file is acceptable unless explicitly excluded, and is preferred over any
+			# encoding with a lower q-value.
+			if (isset($arrAcceptedEncodings['identity'])) {
+				$fBestQ = $arrAcceptedEncodings['identity'];
+			} elseif (isset($arrAcceptedEncodings['*'])) {
+				$fBestQ = min($arrAcceptedEncodings['*'], 1.0);
+			} else {
+				$fBestQ = 1.0;
+			}
+			$sBestEncoding = null;
+			$cbBest = filesize($sFileName);
+			foreach ($arrEncodingSuffixes as $sEncoding => $sSuffix) {
+				if (isset($arrAcceptedEncodings[$sEncoding])) {
+					$fQ = $arrAcceptedEncodings[$sEncoding];
+				} elseif (isset($arrAcceptedEncodings['*']) && $sEncoding != 'x-gzip') {
+					$fQ = $arrAcceptedEncodings['*'];
+				} else {
+					continue;
 				}
-				if (is_file($sEncodedFileName) && is_readable($sEncodedFileName)) {
-					# A copy of the file in this encoding exists, use it.
-					$this->m_response->set_header_field('Content-Encoding', $sEncoding);
-					$this->m_response->set_header_field('Vary', 'Accept-Encoding');
+				if ($fQ <= 0 || $fQ < $fBestQ) {
+					# Not acceptable, or less preferable than the best version found so far.
+					continue;
+				}
+				$sEncodedFileName = $sFileName . $sSuffix;
+				if (!is_file($sEncodedFileName) || !is_readable($sEncodedFileName)) {
+					# The file doesn’t have a version in this encoding.
+					continue;
+				}
+				$cbEncoded = filesize($sEncodedFileName);
+				# Among versions with the same q-value, prefer the smallest.
+				if ($fQ > $fBestQ || $cbEncoded < $cbBest) {
+					$fBestQ = $fQ;
+					$sBestEncoding = $sEncoding;
+					$cbBest = $cbEncoded;
 					$this->m_sFileName = $sEncodedFileName;
-					break;
 				}
 			}
+			if ($sBestEncoding !== null) {
+				$this->m_response->set_header_field('Content-Encoding', $sBestEncoding);
+			}
+			# The response depends on Accept-Encoding, even if an unencoded file is being sent.
+			$this->m_response->set_header_field('Vary', 'Accept-Encoding');
 		}
 		$this->m_response->set_header_field('Content-Type', $sContentType);
 		$this->m_response->set_header_field('Content-Length', filesize($this->m_sFileName));
@@ -771,6 +813,25 @@ class QlXhtmlResponseEntity extends QlResponseEntity {
 	}
 
 
+	/** Links the pre-processed JavaScript bundle of a module from the document, preferring the
+	bundle that includes the module’s localization for the document locale, if there is one. See
+	JsPreproc in quearl/bin/js_preproc.py.
+
+	string $sModuleAbbr
+		Abbreviated name of the module.
+	*/
+	public function include_js_bundle($sModuleAbbr) {
+		global $_APP;
+		$sDir = $_APP['core']['rodata_lpath'] . $sModuleAbbr . '/js/';
+		# Each of these files evaluates to the current file name of the corresponding bundle.
+		$sBundleFileName = $sDir . 'bundle-' . $this->m_sLocale . '.php';
+		if (!is_file($sBundleFileName)) {
+			$sBundleFileName = $sDir . 'bundle.php';
+		}
+		$this->include_js($sModuleAbbr . '/js/' . (include $sBundleFileName));
+	}
+
+
 	/** Links a pre-processed style sheet to the document.
 
 	string $sFileName